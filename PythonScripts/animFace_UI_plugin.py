@@ -14,27 +14,22 @@ import sys
 import maya.api.OpenMaya as om 
 import maya.cmds as cmds
 from functools import partial
-
-'''
-Load all the plugins needed to run this program.
-'''
-def loadPlugins():
-    cmds.loadPlugin("createMarkers_plugin.py")
-    cmds.loadPlugin("groupMarkers_plugin.py")
-    cmds.loadPlugin("transferMoCap_plugin.py")
-    cmds.loadPlugin("calculateDistanceMatrix_plugin.py")
-    cmds.loadPlugin("animateMesh_plugin.py")
+from animface.layout import getActiveLayout
+from animface.core import requirePlugin
 
 '''
 Entry function to create markers. 
 ''' 
 def createMarkers(self):
     #If markers don't exist in scene:
-    if not (cmds.objExists("Markers")):
+    rootGroup = getActiveLayout().rootGroup
+    if not (cmds.objExists(rootGroup)):
+        requirePlugin("createMarkers_plugin.py")
+        requirePlugin("groupMarkers_plugin.py")
         cmds.pyCreateMarkers()
         cmds.pyGroupMarkers()
     else:
-        print("Markers already exists in the scene")
+        print(rootGroup + " already exists in the scene")
 
 '''
 Entry function to transfer mocap. 
@@ -42,72 +37,284 @@ Entry function to transfer mocap.
 def transferMoCap(firstFrame, lastFrame, *args):
     extrFirstFrame = cmds.intField(firstFrame, q=1, v=1)
     extrLastFrame = cmds.intField(lastFrame, q=1, v=1)
+    requirePlugin("transferMoCap_plugin.py")
     cmds.pyTransferMoCap(ff=extrFirstFrame, lf=extrLastFrame)
 
 '''
-Entry function to choose the animation method
+Queue of the jobs started from the window, created on first use
+'''
+_jobQueue = None
+_jobsUI = {}
+_refreshPending = [False]
+
+'''
+Get the job queue of the window
 '''
-def animateMesh(firstFrame, lastFrame, steps, meshName, radioButton, distMatrixFolder, stiffnessUIList, *args):
+def getJobQueue():
 
-    stiffnessValuesString = str(cmds.intField(stiffnessUIList[0], q=1, v=1)) 
-    for i in range(1, len(stiffnessUIList)):
-        stiffnessValuesString += "," + str(cmds.intField(stiffnessUIList[i], q=1, v=1)) 
+    global _jobQueue
 
-    selected = cmds.radioButtonGrp(radioButton, q=1, sl=1)
+    if (_jobQueue == None):
+        from animface.jobqueue import JobQueue
+        _jobQueue = JobQueue(workers=1, onChange=jobChanged)
 
-    if (selected == 1):
-        euclideanRBF(firstFrame, lastFrame, steps, meshName, distMatrixFolder, stiffnessValuesString, *args)
-    elif (selected == 2):
-        geodesicsRBF(firstFrame, lastFrame, steps, meshName, distMatrixFolder,stiffnessValuesString, *args)
-    else:
-        hybridRBF(firstFrame, lastFrame, steps, meshName, distMatrixFolder,stiffnessValuesString, *args)
+    return _jobQueue
 
 '''
-Animate mesh with Euclidean RBF, called by animateMesh.
+Called by the queue (from any thread) when a job changes. Refreshes of the
+jobs panel are coalesced into one deferred call on the main thread.
 '''
-def euclideanRBF(firstFrame, lastFrame, steps, meshName, distMatrixFolder, stiffnessValuesString, *args):
-    
+def jobChanged(job):
+
+    from animface import tasks
+
+    if _refreshPending[0]:
+        return
+
+    _refreshPending[0] = True
+    tasks.deferToMainThread(refreshJobsPanel)
+
+'''
+Show the state of the jobs in the window: one line per job, and the progress of
+the running job in the progress bar
+'''
+def refreshJobsPanel():
+
+    _refreshPending[0] = False
+
+    jobList = _jobsUI.get("list")
+    if (jobList == None or not cmds.textScrollList(jobList, exists=True)):
+        return
+
+    jobs = getJobQueue().jobs()
+    selected = cmds.textScrollList(jobList, q=True, sii=True) or []
+
+    cmds.textScrollList(jobList, edit=True, removeAll=True)
+    for job in jobs:
+        cmds.textScrollList(jobList, edit=True, append=job.describe())
+    for index in selected:
+        if (index <= len(jobs)):
+            cmds.textScrollList(jobList, edit=True, sii=index)
+
+    progress = 0
+    for job in jobs:
+        if (job.status in ("running", "applying") and job.progress() != None):
+            progress = int(100 * job.progress())
+            break
+
+    cmds.progressBar(_jobsUI["progress"], edit=True, progress=progress)
+
+'''
+Queue a job and show it in the window. Errors reading the scene are printed,
+nothing is queued then.
+'''
+def submitJob(builder, *args, **kwargs):
+
+    try:
+        job = builder(*args, **kwargs)
+    except ValueError as exc:
+        print(str(exc))
+        return None
+
+    getJobQueue().submit(job)
+
+    return job
+
+'''
+Cancel the jobs selected in the jobs panel
+'''
+def cancelSelectedJobs(*args):
+
+    jobs = getJobQueue().jobs()
+
+    for index in cmds.textScrollList(_jobsUI["list"], q=True, sii=True) or []:
+        if (index <= len(jobs)):
+            getJobQueue().cancel(jobs[index-1])
+
+    refreshJobsPanel()
+
+'''
+Remove the finished jobs from the jobs panel
+'''
+def clearFinishedJobs(*args):
+    getJobQueue().clearFinished()
+    refreshJobsPanel()
+
+'''
+Stop the scrub preview shown, if any, so a job reads and keys the rest pose of
+the mesh instead of the previewed frame
+'''
+def stopTakePreview():
+
+    if not "animface.mayapreview" in sys.modules:
+        return
+
+    mayapreview = sys.modules["animface.mayapreview"]
+    if (mayapreview.isPreviewActive()):
+        mayapreview.stopPreview()
+        previewButton = _jobsUI.get("previewButton")
+        if (previewButton != None and cmds.button(previewButton, exists=True)):
+            cmds.button(previewButton, e=1, label="Preview Take")
+
+'''
+Get the stiffness values from the fields of the window
+'''
+def getStiffnessValues(stiffnessUIList):
+    return [cmds.intField(field, q=1, v=1) for field in stiffnessUIList]
+
+'''
+Entry function to queue the animation of the mesh with the chosen method (a
+preview bake on a proxy of the mesh if the preview box is checked)
+'''
+def animateMesh(firstFrame, lastFrame, steps, meshName, radioButton, distMatrixFolder, stiffnessUIList, previewCheck, *args):
+
+    from animface import mayajobs
+    from animface import proxy
+
+    selected = cmds.radioButtonGrp(radioButton, q=1, sl=1)
+    method = ["Euclidean", "Geodesics", "Hybrid"][selected-1]
+
     extrFirstFrame = cmds.intField(firstFrame, q=1, v=1)
     extrLastFrame = cmds.intField(lastFrame, q=1, v=1)
     extrSteps = cmds.intField(steps, q=1, v=1)
     extrMeshName = cmds.textField(meshName, q=1, tx=1)
     extrdistMatrixFolder = cmds.textField(distMatrixFolder, q=1, tx=1)
-    
-    cmds.pyAnimMesh(ff=extrFirstFrame, lf=extrLastFrame, st=extrSteps, mn=extrMeshName, ss = stiffnessValuesString, of=extrdistMatrixFolder, mt="Euclidean")
+
+    preview = proxy.kPreviewUpsampled if cmds.checkBox(previewCheck, q=1, v=1) else None
+
+    stopTakePreview()
+    submitJob(mayajobs.animateMeshJob, extrMeshName, extrFirstFrame, extrLastFrame, extrSteps, method, getStiffnessValues(stiffnessUIList), extrdistMatrixFolder, getActiveLayout(), preview=preview)
 
 '''
-Animate mesh with Geodesics RBF, called by animateMesh.
+Entry function to queue a sweep of stiffness configurations around the values
+of the fields; the best configuration is written back into the fields
 '''
-def geodesicsRBF(firstFrame, lastFrame, steps, meshName, distMatrixFolder, stiffnessValuesString, *args):
-    
+def sweepStiffness(firstFrame, lastFrame, steps, meshName, radioButton, distMatrixFolder, stiffnessUIList, *args):
+
+    from animface import mayajobs
+
+    selected = cmds.radioButtonGrp(radioButton, q=1, sl=1)
+    method = ["Euclidean", "Geodesics", "Hybrid"][selected-1]
+
     extrFirstFrame = cmds.intField(firstFrame, q=1, v=1)
     extrLastFrame = cmds.intField(lastFrame, q=1, v=1)
     extrSteps = cmds.intField(steps, q=1, v=1)
     extrMeshName = cmds.textField(meshName, q=1, tx=1)
     extrdistMatrixFolder = cmds.textField(distMatrixFolder, q=1, tx=1)
-    
-    cmds.pyAnimMesh(ff=extrFirstFrame, lf=extrLastFrame, st=extrSteps, mn=extrMeshName, ss = stiffnessValuesString, of=extrdistMatrixFolder, mt="Geodesics")
+
+    def setStiffnessValues(values):
+        for field, value in zip(stiffnessUIList, values):
+            cmds.intField(field, e=1, v=value)
+        print("Stiffness fields set to the best configuration: " + ",".join([str(v) for v in values]))
+
+    stopTakePreview()
+    submitJob(mayajobs.stiffnessSweepJob, extrMeshName, extrFirstFrame, extrLastFrame, extrSteps, method, getStiffnessValues(stiffnessUIList), extrdistMatrixFolder, getActiveLayout(), onBest=setStiffnessValues)
 
 '''
-Animate mesh with Hybrid RBF, called by animateMesh.
+Entry function to queue the calculation of the distance matrices
 '''
-def hybridRBF(firstFrame, lastFrame, steps, meshName, distMatrixFolder, stiffnessValuesString, *args):
-    
-    extrFirstFrame = cmds.intField(firstFrame, q=1, v=1)
-    extrLastFrame = cmds.intField(lastFrame, q=1, v=1)
-    extrSteps = cmds.intField(steps, q=1, v=1)
+def calculateDistMatrix(meshName, distMatrixFolder, *args):
+
+    from animface import mayajobs
+
     extrMeshName = cmds.textField(meshName, q=1, tx=1)
     extrdistMatrixFolder = cmds.textField(distMatrixFolder, q=1, tx=1)
-    
-    cmds.pyAnimMesh(ff=extrFirstFrame, lf=extrLastFrame, st=extrSteps, mn=extrMeshName, ss = stiffnessValuesString, of=extrdistMatrixFolder, mt="Hybrid")
+
+    stopTakePreview()
+    submitJob(mayajobs.distanceMatrixJob, extrMeshName, extrdistMatrixFolder, getActiveLayout())
 
 '''
-Entry function to calculate distance matrix.
+Entry function to queue the bake of MoCap takes (separated by semicolons)
+into bake caches, over their whole frame range
 '''
-def calculateDistMatrix(meshName, distMatrixFolder, *args):
+def bakeTakes(meshName, radioButton, distMatrixFolder, stiffnessUIList, takesField, bakeFolder, *args):
+
+    from animface import mayajobs
+
+    selected = cmds.radioButtonGrp(radioButton, q=1, sl=1)
+    method = ["Euclidean", "Geodesics", "Hybrid"][selected-1]
+
+    takesString = cmds.textField(takesField, q=1, tx=1)
+    takes = [take.strip() for take in takesString.split(";") if take.strip() != ""]
+    if (len(takes) == 0):
+        print("No MoCap takes given")
+        return
+
+    extrMeshName = cmds.textField(meshName, q=1, tx=1)
+    extrdistMatrixFolder = cmds.textField(distMatrixFolder, q=1, tx=1)
+    extrBakeFolder = cmds.textField(bakeFolder, q=1, tx=1)
+
+    stopTakePreview()
+    submitJob(mayajobs.takeBakeJob, extrMeshName, takes, extrBakeFolder, method, getStiffnessValues(stiffnessUIList), extrdistMatrixFolder, getActiveLayout())
+
+'''
+Entry function to start the scrub preview of the first MoCap take of the
+field on the mesh, or to stop the preview shown
+'''
+def previewTake(meshName, radioButton, distMatrixFolder, stiffnessUIList, takesField, previewButton, *args):
+
+    from animface import mayajobs
+    from animface import mayapreview
+
+    if (mayapreview.isPreviewActive()):
+        stopTakePreview()
+        return
+
+    selected = cmds.radioButtonGrp(radioButton, q=1, sl=1)
+    method = ["Euclidean", "Geodesics", "Hybrid"][selected-1]
+
+    takes = [take.strip() for take in cmds.textField(takesField, q=1, tx=1).split(";") if take.strip() != ""]
+    if (len(takes) == 0):
+        print("No MoCap takes given")
+        return
+
     extrMeshName = cmds.textField(meshName, q=1, tx=1)
     extrdistMatrixFolder = cmds.textField(distMatrixFolder, q=1, tx=1)
-    cmds.pyCalculateDistMatrix(mn=extrMeshName, of=extrdistMatrixFolder)
+
+    def onStart():
+        cmds.button(previewButton, e=1, label="Stop Preview")
+
+    submitJob(mayajobs.takePreviewJob, extrMeshName, takes[0], method, getStiffnessValues(stiffnessUIList), extrdistMatrixFolder, getActiveLayout(), onStart=onStart)
+
+'''
+Create one stiffness field per marker of the layout. Layouts that place every
+marker on the face image are drawn over it, any other layout (e.g. dense capture
+rigs) gets a scrollable list of fields.
+'''
+def createStiffnessFields(form, layout):
+    
+    stiffnessUIList = []
+    
+    if (layout.hasUIPositions()):
+    
+        #=========================================
+        # Creating Element Face_Image IMAGE
+        ws = cmds.workspace(q=True, rd=True )
+        iPath = str(ws) + "/sourceimages/FrontFaceImage.PNG"    
+        object = cmds.image(image=iPath, w=272, h=272)
+        cmds.formLayout( form, edit=True, attachForm=[( object, 'top', 30), ( object, 'left', 204)] )
+        
+        for marker in layout.markers:
+            ui = marker["ui"]
+            field = cmds.intField(backgroundColor=ui.get("colour", (0.5,0.5,0.5)), w=20, h=16, minValue=0, maxValue=9, value=marker.get("stiffness", layout.defaultStiffness), ann=marker["name"])
+            cmds.formLayout( form, edit=True, attachForm=[( field, 'top', ui["top"]), ( field, 'left', ui["left"])] )
+            stiffnessUIList.append(field)
+        
+        return stiffnessUIList
+    
+    scroll = cmds.scrollLayout(w=276, h=262, childResizable=True)
+    cmds.formLayout( form, edit=True, attachForm=[( scroll, 'top', 50), ( scroll, 'left', 204)] )
+    cmds.rowColumnLayout(numberOfColumns=3, columnWidth=[(1, 150), (2, 30), (3, 70)])
+    
+    for marker in layout.markers:
+        cmds.text(label=marker["name"], al="left", h=18)
+        field = cmds.intField(w=30, h=16, minValue=0, maxValue=9, value=marker.get("stiffness", layout.defaultStiffness))
+        cmds.text(label=layout.groupOf(marker["name"]), al="left", h=18)
+        stiffnessUIList.append(field)
+    
+    cmds.setParent(form)
+    
+    return stiffnessUIList
 
 '''
 Main entry of the program 
@@ -120,8 +327,7 @@ def main():
     if (cmds.window(winID, exists=True)):
         cmds.deleteUI(winID)
     
-    #Load the plugins needed to run the program
-    loadPlugins()
+    #The plugins of every step are loaded when the step is first used
     
     window = cmds.window(winID, title = "AnimFace - by Miguel R. C.")
     form = cmds.formLayout(numberOfDivisions=100)
@@ -172,238 +378,18 @@ def main():
     object = cmds.button( backgroundColor=(1,0.690196,0.690196), label="Calculate Dist. Matrix", w=134, h=23, c=partial(calculateDistMatrix, meshName, distMatrixFolder))
     cmds.formLayout( form, edit=True, attachForm=[( object, 'top', 401), ( object, 'left', 343)] )
     #=========================================
-    # Creating Element Face_Image IMAGE
-    ws = cmds.workspace(q=True, rd=True )
-    iPath = str(ws) + "/sourceimages/FrontFaceImage.PNG"    
-    object = cmds.image(image=iPath, w=272, h=272)
-    cmds.formLayout( form, edit=True, attachForm=[( object, 'top', 30), ( object, 'left', 204)] )
-    #=========================================
     # Creating Element Markers_stiffness LABEL
     object = cmds.text(label="Markers stiffness:", w=273, h=34, al="left")
     cmds.formLayout( form, edit=True, attachForm=[( object, 'top', 20), ( object, 'left', 205)] )    
     
-    
-    stiffnessUIList = []
-    
-    #=========================================
-    # Creating Element S1: Eyebrow_Center
-    S1 = cmds.intField(backgroundColor=(0,1,0), w=20, h=16, minValue=0, maxValue=9, value=2)
-    cmds.formLayout( form, edit=True, attachForm=[( S1, 'top', 113), ( S1, 'left', 328)] )
-    stiffnessUIList.append(S1)
-    #=========================================
-    # Creating Element S2: Forehead_L
-    S2 = cmds.intField(backgroundColor=(0.262745,1,0.639216), w=20, h=16, minValue=0, maxValue=9, value=3)
-    cmds.formLayout( form, edit=True, attachForm=[( S2, 'top', 70), ( S2, 'left', 371)] )
-    stiffnessUIList.append(S2)
-    #=========================================
-    # Creating Element S3: Forehead_M
-    S3 = cmds.intField(backgroundColor=(0.262745,1,0.639216), w=20, h=16, minValue=0, maxValue=9, value=3)
-    cmds.formLayout( form, edit=True, attachForm=[( S3, 'top', 70), ( S3, 'left', 329)] )
-    stiffnessUIList.append(S3)
-    #=========================================
-    # Creating Element S4: Forehead_R
-    S4 = cmds.intField(backgroundColor=(0.262745,1,0.639216), w=20, h=16, minValue=0, maxValue=9, value=3)
-    cmds.formLayout( form, edit=True, attachForm=[( S4, 'top', 69), ( S4, 'left', 286)] )
-    stiffnessUIList.append(S4)
-    #=========================================
-    # Creating Element S5: Leye_Up
-    S5 = cmds.intField(backgroundColor=(1,1,0.388235), w=20, h=16, minValue=0, maxValue=9, value=2)
-    cmds.formLayout( form, edit=True, attachForm=[( S5, 'top', 133), ( S5, 'left', 369)] )
-    stiffnessUIList.append(S5)
-    #=========================================
-    # Creating Element S6: Leyebrow_Inside
-    S6 = cmds.intField(backgroundColor=(0,1,0), w=20, h=16, minValue=0, maxValue=9, value=2)
-    cmds.formLayout( form, edit=True, attachForm=[( S6, 'top', 109), ( S6, 'left', 349)] )
-    stiffnessUIList.append(S6)
-    #=========================================
-    # Creating Element S7: Leyebrow_M
-    S7 = cmds.intField(backgroundColor=(0,1,0), w=20, h=16, minValue=0, maxValue=9, value=2)
-    cmds.formLayout( form, edit=True, attachForm=[( S7, 'top', 104), ( S7, 'left', 377)] )
-    stiffnessUIList.append(S7)
-    #=========================================
-    # Creating Element S8: Leyebrow_Outside
-    S8 = cmds.intField(backgroundColor=(0,1,0), w=20, h=16, minValue=0, maxValue=9, value=2)
-    cmds.formLayout( form, edit=True, attachForm=[( S8, 'top', 118), ( S8, 'left', 399)] )
-    stiffnessUIList.append(S8)
-    #=========================================
-    # Creating Element S9: Reye_Up
-    S9 = cmds.intField(backgroundColor=(1,1,0.388235), w=20, h=16, minValue=0, maxValue=9, value=2)
-    cmds.formLayout( form, edit=True, attachForm=[( S9, 'top', 132), ( S9, 'left', 290)] )
-    stiffnessUIList.append(S9)
-    #=========================================
-    # Creating Element S10: Reyebrow_Inside
-    S10 = cmds.intField(backgroundColor=(0,1,0), w=20, h=16, minValue=0, maxValue=9, value=2)
-    cmds.formLayout( form, edit=True, attachForm=[( S10, 'top', 110), ( S10, 'left', 306)] )
-    stiffnessUIList.append(S10)
-    #=========================================
-    # Creating Element S11: Reyebrow_M
-    S11 = cmds.intField(backgroundColor=(0,1,0), w=20, h=16, minValue=0, maxValue=9, value=2)
-    cmds.formLayout( form, edit=True, attachForm=[( S11, 'top', 105), ( S11, 'left', 281)] )
-    stiffnessUIList.append(S11)
-    #=========================================
-    # Creating Element S12: Reyebrow_Outside
-    S12 = cmds.intField(backgroundColor=(0,1,0), w=20, h=16, minValue=0, maxValue=9, value=2)
-    cmds.formLayout( form, edit=True, attachForm=[( S12, 'top', 120), ( S12, 'left', 256)] )
-    stiffnessUIList.append(S12)
-    
-    
-    #=========================================
-    # Creating Element S13: Leye_Inside
-    S13 = cmds.intField(backgroundColor=(1,1,0.388235), w=20, h=16, minValue=0, maxValue=9, value=2)
-    cmds.formLayout( form, edit=True, attachForm=[( S13, 'top', 148), ( S13, 'left', 348)] )
-    stiffnessUIList.append(S13)
-    #=========================================
-    # Creating Element S14: Leye_Outside
-    S14 = cmds.intField(backgroundColor=(1,1,0.388235), w=20, h=16, minValue=0, maxValue=9, value=2)
-    cmds.formLayout( form, edit=True, attachForm=[( S14, 'top', 149), ( S14, 'left', 394)] )
-    stiffnessUIList.append(S14)
-    #=========================================
-    # Creating Element S15: Reye_Inside
-    S15 = cmds.intField(backgroundColor=(1,1,0.388235), w=20, h=16, minValue=0, maxValue=9, value=2)
-    cmds.formLayout( form, edit=True, attachForm=[( S15, 'top', 147), ( S15, 'left', 311)] )
-    stiffnessUIList.append(S15)
-    #=========================================
-    # Creating Element S16: Reye_Outside
-    S16 = cmds.intField(backgroundColor=(1,1,0.388235), w=20, h=16, minValue=0, maxValue=9, value=2)
-    cmds.formLayout( form, edit=True, attachForm=[( S16, 'top', 148), ( S16, 'left', 267)] )
-    stiffnessUIList.append(S16)
-    
-    
-    #=========================================
-    # Creating Element S17: Lcheek_Up
-    S17 = cmds.intField(backgroundColor=(0.472,0.39,0.20), w=20, h=16, minValue=0, maxValue=9, value=2)
-    cmds.formLayout( form, edit=True, attachForm=[( S17, 'top', 181), ( S17, 'left', 395)] )
-    stiffnessUIList.append(S17)
-    #=========================================
-    # Creating Element S18: Leye_Down
-    S18 = cmds.intField(backgroundColor=(1,1,0.388235), w=20, h=16, minValue=0, maxValue=9, value=2)
-    cmds.formLayout( form, edit=True, attachForm=[( S18, 'top', 164), ( S18, 'left', 371)] )
-    stiffnessUIList.append(S18)
-    #=========================================
-    # Creating Element S19: Mouth_Up
-    S19 = cmds.intField(backgroundColor=(1,0.35,0.35), w=20, h=16, minValue=0, maxValue=9, value=2)
-    cmds.formLayout( form, edit=True, attachForm=[( S19, 'top', 216), ( S19, 'left', 331)] )
-    stiffnessUIList.append(S19)
-    #=========================================
-    # Creating Element S20: Mouth_UpLone
-    S20 = cmds.intField(backgroundColor=(1,0.35,0.35), w=20, h=16, minValue=0, maxValue=9, value=2)
-    cmds.formLayout( form, edit=True, attachForm=[( S20, 'top', 218), ( S20, 'left', 354)] )
-    stiffnessUIList.append(S20)
-    #=========================================
-    # Creating Element S21: Mouth_UpRone
-    S21 = cmds.intField(backgroundColor=(1,0.35,0.35), w=20, h=16, minValue=0, maxValue=9, value=2)
-    cmds.formLayout( form, edit=True, attachForm=[( S21, 'top', 218), ( S21, 'left', 309)] )
-    stiffnessUIList.append(S21)
-    #=========================================
-    # Creating Element S22: NoseHead
-    S22 = cmds.intField(backgroundColor=(1,0.690196,0.690196), w=20, h=16, minValue=0, maxValue=9, value=3)
-    cmds.formLayout( form, edit=True, attachForm=[( S22, 'top', 186), ( S22, 'left', 330)] )
-    stiffnessUIList.append(S22)
-    #=========================================
-    # Creating Element S23: NoseHead_L
-    S23 = cmds.intField(backgroundColor=(1,0.690196,0.690196), w=20, h=16, minValue=0, maxValue=9, value=3)
-    cmds.formLayout( form, edit=True, attachForm=[( S23, 'top', 194), ( S23, 'left', 356)] )
-    stiffnessUIList.append(S23)
-    #=========================================
-    # Creating Element S24: NoseHead_R
-    S24 = cmds.intField(backgroundColor=(1,0.690196,0.690196), w=20, h=16, minValue=0, maxValue=9, value=3)
-    cmds.formLayout( form, edit=True, attachForm=[( S24, 'top', 194), ( S24, 'left', 305)] )
-    stiffnessUIList.append(S24)
-    #=========================================
-    # Creating Element S25: NoseTop
-    S25 = cmds.intField(backgroundColor=(1,0.690196,0.690196), w=20, h=16, minValue=0, maxValue=9, value=4)
-    cmds.formLayout( form, edit=True, attachForm=[( S25, 'top', 166), ( S25, 'left', 330)] )
-    stiffnessUIList.append(S25)
-    #=========================================
-    # Creating Element S26: Rcheek_Up
-    S26 = cmds.intField(backgroundColor=(0.472,0.39,0.20), w=20, h=16, minValue=0, maxValue=9, value=2)
-    cmds.formLayout( form, edit=True, attachForm=[( S26, 'top', 182), ( S26, 'left', 263)] )
-    stiffnessUIList.append(S26)
-    #=========================================
-    # Creating Element S27: Reye_down
-    S27 = cmds.intField(backgroundColor=(1,1,0.388235), w=20, h=16, minValue=0, maxValue=9, value=2)
-    cmds.formLayout( form, edit=True, attachForm=[( S27, 'top', 167), ( S27, 'left', 289)] )
-    stiffnessUIList.append(S27)
-    
-    
-    #=========================================
-    # Creating Element S28: Lcheek_Down
-    S28 = cmds.intField(backgroundColor=(0.472,0.39,0.20), w=20, h=16, minValue=0, maxValue=9, value=2)
-    cmds.formLayout( form, edit=True, attachForm=[( S28, 'top', 206), ( S28, 'left', 398)] )
-    stiffnessUIList.append(S28)
-    #=========================================
-    # Creating Element S29: Lcheek_Outside
-    S29 = cmds.intField(backgroundColor=(0.472,0.39,0.20), w=20, h=16, minValue=0, maxValue=9, value=2)
-    cmds.formLayout( form, edit=True, attachForm=[( S29, 'top', 195), ( S29, 'left', 419)] )
-    stiffnessUIList.append(S29)
-    #=========================================
-    # Creating Element S30: Mouth_Lend
-    S30 = cmds.intField(backgroundColor=(1,0.35,0.35), w=20, h=16, minValue=0, maxValue=9, value=2)
-    cmds.formLayout( form, edit=True, attachForm=[( S30, 'top', 226), ( S30, 'left', 376)] )
-    stiffnessUIList.append(S30)
-    #=========================================
-    # Creating Element S31: Mouth_Rend
-    S31 = cmds.intField(backgroundColor=(1,0.35,0.35), w=20, h=16, minValue=0, maxValue=9, value=2)
-    cmds.formLayout( form, edit=True, attachForm=[( S31, 'top', 226), ( S31, 'left', 287)] )
-    stiffnessUIList.append(S31)
-    #=========================================
-    # Creating Element S32: Rcheek_Down
-    S32 = cmds.intField(backgroundColor=(0.472,0.39,0.20), w=20, h=16, minValue=0, maxValue=9, value=2)
-    cmds.formLayout( form, edit=True, attachForm=[( S32, 'top', 209), ( S32, 'left', 261)] )
-    stiffnessUIList.append(S32)
-    #=========================================
-    # Creating Element S33: Rcheek_Outside
-    S33 = cmds.intField(backgroundColor=(0.472,0.39,0.20), w=20, h=16, minValue=0, maxValue=9, value=2)
-    cmds.formLayout( form, edit=True, attachForm=[( S33, 'top', 196), ( S33, 'left', 240)] )
-    stiffnessUIList.append(S33)
-    
     #=========================================
-    # Creating Element S34: Chin
-    S34 = cmds.intField(backgroundColor=(0.4,0.6,0.4), w=20, h=16, minValue=0, maxValue=9, value=3)
-    cmds.formLayout( form, edit=True, attachForm=[( S34, 'top', 272), ( S34, 'left', 331)] )
-    stiffnessUIList.append(S34)
-    #=========================================
-    # Creating Element S35: Chin_Lone
-    S35 = cmds.intField(backgroundColor=(0.4,0.6,0.4), w=20, h=16, minValue=0, maxValue=9, value=3)
-    cmds.formLayout( form, edit=True, attachForm=[( S35, 'top', 261), ( S35, 'left', 366)] )
-    stiffnessUIList.append(S35)
-    #=========================================
-    # Creating Element S36: Chin_Ltwo
-    S36 = cmds.intField(backgroundColor=(0.4,0.6,0.4), w=20, h=16, minValue=0, maxValue=9, value=3)
-    cmds.formLayout( form, edit=True, attachForm=[( S36, 'top', 246), ( S36, 'left', 392)] )
-    stiffnessUIList.append(S36)
-    #=========================================
-    # Creating Element S37: Chin_Rone
-    S37 = cmds.intField(backgroundColor=(0.4,0.6,0.4), w=20, h=16, minValue=0, maxValue=9, value=3)
-    cmds.formLayout( form, edit=True, attachForm=[( S37, 'top', 263), ( S37, 'left', 294)] )
-    stiffnessUIList.append(S37)
-    #=========================================
-    # Creating Element S38: Chin_Rtwo
-    S38 = cmds.intField(backgroundColor=(0.4,0.6,0.4), w=20, h=16, minValue=0, maxValue=9, value=3)
-    cmds.formLayout( form, edit=True, attachForm=[( S38, 'top', 246), ( S38, 'left', 269)] )
-    stiffnessUIList.append(S38)
-    #=========================================
-    # Creating Element S39: Mouth_Down
-    S39 = cmds.intField(backgroundColor=(1,0.35,0.35), w=20, h=16, minValue=0, maxValue=9, value=3)
-    cmds.formLayout( form, edit=True, attachForm=[( S39, 'top', 246), ( S39, 'left', 330)] )
-    stiffnessUIList.append(S39)
-    #=========================================
-    # Creating Element S40: Mouth_DownL
-    S40 = cmds.intField(backgroundColor=(1,0.35,0.35), w=20, h=16, minValue=0, maxValue=9, value=3)
-    cmds.formLayout( form, edit=True, attachForm=[( S40, 'top', 240), ( S40, 'left', 353)] )
-    stiffnessUIList.append(S40)
-    #=========================================
-    # Creating Element S41: Mouth_DownR
-    S41 = cmds.intField(backgroundColor=(1,0.35,0.35), w=20, h=16, minValue=0, maxValue=9, value=3)
-    cmds.formLayout( form, edit=True, attachForm=[( S41, 'top', 242), ( S41, 'left', 309)] )
-    stiffnessUIList.append(S41)
-    #=========================================
-
+    # Creating Elements for the stiffness of every marker of the layout
+    stiffnessUIList = createStiffnessFields(form, getActiveLayout())
     
     #=========================================
     # Creating Element Create_Markers LABEL
     object = cmds.text( label="1. Create facial markers for the 3D model:", w=140, h=64, al="left", ww=True)
-    cmds.formLayout( form, edit=True, attachForm=[( object, 'top', 06), ( object, 'left', 30)] )
+    cmds.formLayout( form, edit=True, attachForm=[( object, 'top', 6), ( object, 'left', 30)] )
     #=========================================
     # Creating Element Create_Markers BUTTON
     object = cmds.button( backgroundColor=(0,1,0), label="Create Markers", w=136, h=34, c=createMarkers)
@@ -437,18 +423,84 @@ def main():
     radioButtonRBFMethod = cmds.radioButtonGrp(labelArray3=["Euc", "Geo", "Hyb"], numberOfRadioButtons = 3, columnWidth1 = (75), columnWidth2 = [75, 75], columnWidth3= [50, 50, 50], columnWidth4 = [75, 75, 75, 75], w=150, h=34, sl=1)
     cmds.formLayout( form, edit=True, attachForm=[( radioButtonRBFMethod, 'top', 230), ( radioButtonRBFMethod, 'left', 28)] )
     #=========================================
+    # Creating Element Preview CHECK BOX
+    previewCheck = cmds.checkBox(label="Preview", v=0, ann="Solve on a decimated proxy of the mesh and upsample the animation, uncheck for the final bake")
+    cmds.formLayout( form, edit=True, attachForm=[( previewCheck, 'top', 238), ( previewCheck, 'left', 182)] )
+    #=========================================
     # Creating Element Animate_Mesh BUTTON
-    object = cmds.button( backgroundColor=(0.262745,1,0.639216), label="Animate Mesh", w=136, h=34, command=partial(animateMesh, firstFrame_Anim, lastFrame_Anim, steps_Anim, meshName, radioButtonRBFMethod, distMatrixFolder, stiffnessUIList))
+    object = cmds.button( backgroundColor=(0.262745,1,0.639216), label="Animate Mesh", w=100, h=34, command=partial(animateMesh, firstFrame_Anim, lastFrame_Anim, steps_Anim, meshName, radioButtonRBFMethod, distMatrixFolder, stiffnessUIList, previewCheck))
     cmds.formLayout( form, edit=True, attachForm=[( object, 'top', 269), ( object, 'left', 34)] )
+    #=========================================
+    # Creating Element Sweep_Stiffness BUTTON
+    object = cmds.button( backgroundColor=(0.690196,0.839216,1), label="Sweep", w=64, h=34, ann="Score stiffness configurations around the current values and keep the best one", command=partial(sweepStiffness, firstFrame_Anim, lastFrame_Anim, steps_Anim, meshName, radioButtonRBFMethod, distMatrixFolder, stiffnessUIList))
+    cmds.formLayout( form, edit=True, attachForm=[( object, 'top', 269), ( object, 'left', 136)] )
     
     #=========================================
     # Creating Element Sep_3
     object = cmds.separator( w=460, h=34)
     cmds.formLayout( form, edit=True, attachForm=[( object, 'top', 306), ( object, 'left', 20)] )
     
+    #=========================================
+    # Creating Element Sep_4
+    object = cmds.separator( w=460, h=20)
+    cmds.formLayout( form, edit=True, attachForm=[( object, 'top', 430), ( object, 'left', 20)] )
+    #=========================================
+    # Creating Element MoCap_Takes LABEL
+    object = cmds.text( label="MoCap takes:", w=80, h=25, al="left")
+    cmds.formLayout( form, edit=True, attachForm=[( object, 'top', 452), ( object, 'left', 34)] )
+    #=========================================
+    # Creating Element MoCap_Takes TEXTFIELD
+    takesField = cmds.textField(w=220, h=25, text="", ann="MoCap take files (.ma), separated by semicolons")
+    cmds.formLayout( form, edit=True, attachForm=[( takesField, 'top', 452), ( takesField, 'left', 119)] )
+    #=========================================
+    # Creating Element Bake_Folder LABEL
+    object = cmds.text( label="Bake folder:", w=80, h=25, al="left")
+    cmds.formLayout( form, edit=True, attachForm=[( object, 'top', 483), ( object, 'left', 34)] )
+    #=========================================
+    # Creating Element Bake_Folder TEXTFIELD
+    bakeFolder = cmds.textField(w=220, h=25, text=str(cmds.workspace(q=True, rd=True)) + "cache/animface")
+    cmds.formLayout( form, edit=True, attachForm=[( bakeFolder, 'top', 483), ( bakeFolder, 'left', 119)] )
+    #=========================================
+    # Creating Element Bake_Takes BUTTON
+    object = cmds.button( backgroundColor=(0.690196,0.839216,1), label="Queue Take Bake", w=134, h=23, c=partial(bakeTakes, meshName, radioButtonRBFMethod, distMatrixFolder, stiffnessUIList, takesField, bakeFolder))
+    cmds.formLayout( form, edit=True, attachForm=[( object, 'top', 484), ( object, 'left', 343)] )
+    #=========================================
+    # Creating Element Preview_Take BUTTON
+    previewButton = cmds.button( backgroundColor=(0.690196,0.839216,1), label="Preview Take", w=134, h=23, ann="Scrub the first take on the mesh without baking it")
+    _jobsUI["previewButton"] = previewButton
+    cmds.button( previewButton, e=1, c=partial(previewTake, meshName, radioButtonRBFMethod, distMatrixFolder, stiffnessUIList, takesField, previewButton))
+    cmds.formLayout( form, edit=True, attachForm=[( previewButton, 'top', 453), ( previewButton, 'left', 343)] )
+    
+    #=========================================
+    # Creating Element Sep_5
+    object = cmds.separator( w=460, h=20)
+    cmds.formLayout( form, edit=True, attachForm=[( object, 'top', 512), ( object, 'left', 20)] )
+    #=========================================
+    # Creating Element Jobs LABEL
+    object = cmds.text( label="Jobs:", w=80, h=25, al="left")
+    cmds.formLayout( form, edit=True, attachForm=[( object, 'top', 530), ( object, 'left', 34)] )
+    #=========================================
+    # Creating Element Jobs TEXTSCROLLLIST
+    _jobsUI["list"] = cmds.textScrollList(w=444, h=100, allowMultiSelection=True)
+    cmds.formLayout( form, edit=True, attachForm=[( _jobsUI["list"], 'top', 555), ( _jobsUI["list"], 'left', 34)] )
+    #=========================================
+    # Creating Element Jobs PROGRESSBAR
+    _jobsUI["progress"] = cmds.progressBar(w=200, h=23, maxValue=100)
+    cmds.formLayout( form, edit=True, attachForm=[( _jobsUI["progress"], 'top', 663), ( _jobsUI["progress"], 'left', 34)] )
+    #=========================================
+    # Creating Element Cancel_Job BUTTON
+    object = cmds.button( label="Cancel", w=100, h=23, c=cancelSelectedJobs)
+    cmds.formLayout( form, edit=True, attachForm=[( object, 'top', 663), ( object, 'left', 240)] )
+    #=========================================
+    # Creating Element Clear_Jobs BUTTON
+    object = cmds.button( label="Clear finished", w=134, h=23, c=clearFinishedJobs)
+    cmds.formLayout( form, edit=True, attachForm=[( object, 'top', 663), ( object, 'left', 343)] )
+    
     cmds.setParent( '..' )
     cmds.showWindow( window )
-    cmds.window(winID, edit=True, widthHeight=(500.0, 450.0))
+    cmds.window(winID, edit=True, widthHeight=(500.0, 700.0))
+    
+    refreshJobsPanel()
 
 ###
 
@@ -491,6 +543,10 @@ def initializePlugin(plugin):
 # Uninitialize the plug-in
 def uninitializePlugin(plugin):
     pluginFn = om.MFnPlugin(plugin)
+    if (_jobQueue != None):
+        _jobQueue.shutdown()
+    if ("animface.mayapreview" in sys.modules):
+        sys.modules["animface.mayapreview"].stopPreview()
     try:
         pluginFn.deregisterCommand(PyAnimFaceUICmd.kPluginCmdName)
     except:
@@ -0,0 +1,12 @@
+'''
+
+Miguel Ramos Carretero
+Bournemouth University 2018
+
+Python package:
+Shared building blocks of AnimFace used by the Maya plugins and the command
+line. core, mayascene and mayajobs talk to Maya; every other module is
+Maya-free. Importing the package imports nothing: the plugins import core
+(which only needs maya.cmds) and the NumPy engines are imported on first use.
+
+'''
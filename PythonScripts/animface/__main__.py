@@ -0,0 +1,5 @@
+import sys
+
+from animface.cli import main
+
+sys.exit(main())
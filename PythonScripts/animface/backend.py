@@ -0,0 +1,215 @@
+'''
+
+Miguel Ramos Carretero
+Bournemouth University 2018
+
+Python module:
+Scene backends: the only way the pipeline reads from and writes into a scene.
+Every operation works on whole arrays (all the points of a mesh, the
+trajectories of all the markers, the animation of all the vertices), so a
+backend does a few bulk calls per operation instead of one call per vertex
+or per channel.
+
+    MemoryBackend   in-memory scene (tests, benchmarks, headless runs)
+    MayaBackend     Maya scene through OpenMaya API 2.0 (animface.mayascene)
+
+'''
+
+import numpy as np
+
+'''
+Interface of a scene backend. Points and trajectories are float64 arrays;
+frames are lists of frame numbers.
+'''
+class SceneBackend(object):
+
+    def meshExists(self, meshName):
+        raise NotImplementedError()
+
+    def getMeshData(self, meshName, frame=None):
+        ''' Points at a frame (the current one if None) and connectivity of a mesh (MeshData). '''
+        raise NotImplementedError()
+
+    def getPoints(self, meshName):
+        ''' Current points of a mesh (V x 3). '''
+        return self.getMeshData(meshName).points
+
+    def setPoints(self, meshName, points):
+        ''' Moves every vertex of a mesh (V x 3). '''
+        raise NotImplementedError()
+
+    def createMesh(self, meshName, mesh):
+        ''' Adds a mesh (MeshData) to the scene, replacing the mesh of the same name. Returns its name. '''
+        raise NotImplementedError()
+
+    def getObjectPoints(self, names, frame=None):
+        ''' Translation of a list of objects at a frame (the current one if None), N x 3. '''
+        raise NotImplementedError()
+
+    def getTrajectories(self, names, frames):
+        ''' Translation of a list of objects at every frame, F x N x 3. '''
+        return np.array([self.getObjectPoints(names, frame) for frame in frames], dtype=np.float64).reshape(len(frames), len(names), 3)
+
+    def getVertexSet(self, setName):
+        ''' Vertex indices of a vertex set (empty if it does not exist). '''
+        raise NotImplementedError()
+
+    def getVertexSets(self, setNames):
+        indices = [self.getVertexSet(setName) for setName in setNames]
+        if len(indices) == 0:
+            return np.zeros(0, dtype=np.int64)
+        return np.concatenate(indices).astype(np.int64)
+
+    def writeObjectAnimation(self, names, frames, positions):
+        ''' Keys the translation of a list of objects at every frame (F x N x 3). '''
+        raise NotImplementedError()
+
+    def writeVertexAnimation(self, meshName, frames, displacements, vertices=None):
+        '''
+        Keys the displacement from the rest pose of the vertices of a mesh at
+        every frame (F x V x 3). With vertices, only those vertices are keyed
+        and displacements is F x len(vertices) x 3.
+        '''
+        raise NotImplementedError()
+
+'''
+Linear interpolation of keyed values (K x ...) at the given frames, holding
+the first and last keys outside the keyed range
+'''
+def interpolateKeys(keyFrames, keyValues, frames):
+
+    keyFrames = np.asarray(keyFrames, dtype=np.float64)
+    keyValues = np.asarray(keyValues, dtype=np.float64)
+    frames = np.asarray(frames, dtype=np.float64)
+
+    flat = keyValues.reshape(keyValues.shape[0], -1)
+    result = np.empty((frames.shape[0], flat.shape[1]), dtype=np.float64)
+
+    for column in range(flat.shape[1]):
+        result[:, column] = np.interp(frames, keyFrames, flat[:, column])
+
+    return result.reshape((frames.shape[0],) + keyValues.shape[1:])
+
+'''
+Scene held in memory: meshes, animated objects (keys per frame) and vertex
+sets. The animation written into it is kept as arrays, so the output of the
+pipeline can be checked or timed without Maya.
+'''
+class MemoryBackend(SceneBackend):
+
+    def __init__(self):
+        self.meshes = {}
+        self.points = {}
+        self.objects = {}
+        self.vertexSets = {}
+        self.vertexAnimation = {}
+        self.currentFrame = 0
+
+    def addMesh(self, mesh, name=None):
+        name = name or mesh.name
+        self.meshes[name] = mesh
+        self.points[name] = np.array(mesh.points, dtype=np.float64)
+        return name
+
+    def addObject(self, name, position=None, keyFrames=None, keyPositions=None):
+        ''' Adds a static (position) or animated (keyFrames, keyPositions K x 3) object. '''
+
+        if keyFrames is None:
+            keyFrames = [0]
+            keyPositions = [position if position is not None else (0.0, 0.0, 0.0)]
+
+        order = np.argsort(np.asarray(keyFrames, dtype=np.float64))
+        self.objects[name] = (np.asarray(keyFrames, dtype=np.float64)[order], np.asarray(keyPositions, dtype=np.float64).reshape(-1, 3)[order])
+
+    def addVertexSet(self, setName, indices):
+        self.vertexSets[setName] = np.asarray(indices, dtype=np.int64)
+
+    def meshExists(self, meshName):
+        return meshName in self.meshes
+
+    def getMeshData(self, meshName, frame=None):
+        #The meshes of the scene are not animated, their animation is kept apart
+        if not meshName in self.meshes:
+            raise ValueError("Mesh name does not match any object: " + meshName)
+        return self.meshes[meshName]
+
+    def getPoints(self, meshName):
+        return self.points[meshName]
+
+    def setPoints(self, meshName, points):
+        self.points[meshName] = np.array(points, dtype=np.float64).reshape(-1, 3)
+
+    def createMesh(self, meshName, mesh):
+        self.vertexAnimation.pop(meshName, None)
+        return self.addMesh(mesh, meshName)
+
+    def getObjectPoints(self, names, frame=None):
+        return self.getTrajectories(names, [self.currentFrame if frame is None else frame])[0]
+
+    def getTrajectories(self, names, frames):
+
+        trajectories = np.empty((len(frames), len(names), 3), dtype=np.float64)
+
+        for i in range(len(names)):
+            if not names[i] in self.objects:
+                raise ValueError("Object does not exist: " + names[i])
+            keyFrames, keyPositions = self.objects[names[i]]
+            trajectories[:, i, :] = interpolateKeys(keyFrames, keyPositions, frames)
+
+        return trajectories
+
+    def getVertexSet(self, setName):
+        return self.vertexSets.get(setName, np.zeros(0, dtype=np.int64))
+
+    def writeObjectAnimation(self, names, frames, positions):
+        positions = np.asarray(positions, dtype=np.float64)
+        for i in range(len(names)):
+            self.addObject(names[i], keyFrames=list(frames), keyPositions=positions[:, i, :])
+
+    def writeVertexAnimation(self, meshName, frames, displacements, vertices=None):
+
+        mesh = self.getMeshData(meshName)
+
+        animation = self.vertexAnimation.get(meshName)
+        if animation is None or animation[0] != list(frames):
+            animation = (list(frames), np.zeros((len(frames), mesh.nVert, 3), dtype=np.float64))
+            self.vertexAnimation[meshName] = animation
+
+        if vertices is None:
+            animation[1][:] = displacements
+        else:
+            animation[1][:, vertices, :] = displacements
+
+    def getVertexAnimation(self, meshName):
+        ''' Frames and displacements (F x V x 3) written for a mesh, None if nothing was written. '''
+        return self.vertexAnimation.get(meshName)
+
+'''
+Build an in-memory scene from a mesh and a MoCap take: the mesh, one animated
+object per marker joint of the layout (its MoCap node animation moved to the
+rest position of the marker) and the geodesic sets given as vertex indices.
+'''
+def createMemoryScene(mesh, layout, take=None, frames=None, geodesicSets=None):
+
+    backend = MemoryBackend()
+    backend.addMesh(mesh, mesh.name or "Head")
+
+    restPoints = np.asarray(layout.positions(), dtype=np.float64).reshape(-1, 3)
+    jointNames = layout.jointNames()
+
+    if take is None:
+        for i in range(len(jointNames)):
+            backend.addObject(jointNames[i], restPoints[i])
+    else:
+        if frames is None:
+            first, last = take.frameRange()
+            frames = list(range(int(np.ceil(first)), int(np.floor(last)) + 1))
+        keyFrames = [0] + [frame for frame in frames if frame != 0]
+        displacements = take.displacements(keyFrames, layout.mocapNames(), 0)
+        for i in range(len(jointNames)):
+            backend.addObject(jointNames[i], keyFrames=keyFrames, keyPositions=restPoints[i][None, :] + displacements[:, i, :])
+
+    for setName, indices in (geodesicSets or {}).items():
+        backend.addVertexSet(setName, indices)
+
+    return backend
@@ -0,0 +1,85 @@
+'''
+
+Miguel Ramos Carretero
+Bournemouth University 2018
+
+Python module:
+Baked output of a retargeting run. A bake cache is a folder with the vertex
+displacements of every baked frame (displacements.npy, F x V x 3 float32,
+relative to the rest pose) and a meta.json file describing the run.
+
+'''
+
+import os
+import json
+import numpy as np
+
+from animface.profiler import profiled
+from animface.outofcore import ArrayFile
+
+kDisplacementsFile = "displacements.npy"
+kMetaFile = "meta.json"
+
+'''
+Writer of a bake cache. Frames can be written in any order and in chunks of
+frames or of vertices; the data goes straight to the file, nothing of the
+cache is kept in memory.
+'''
+class BakeCacheWriter(object):
+
+    def __init__(self, folder, frames, nVert, meta=None):
+
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+
+        self.folder = folder
+        self.frames = [float(f) for f in frames]
+        self.nVert = nVert
+
+        self.meta = dict(meta or {})
+        self.meta["frames"] = self.frames
+        self.meta["nVert"] = nVert
+
+        self.data = ArrayFile(os.path.join(folder, kDisplacementsFile), (len(self.frames), nVert, 3), np.float32)
+
+    @profiled("bake.write")
+    def writeFrames(self, start, displacements):
+        ''' Writes a chunk of frames (F x V x 3) starting at frame index start. '''
+        self.data.writeRows(start, displacements)
+
+    @profiled("bake.write")
+    def writeBlock(self, frameStart, vertexStart, displacements):
+        ''' Writes a block of vertices of a chunk of frames (F x rows x 3). '''
+        self.data.writeBlock(frameStart, vertexStart, displacements)
+
+    def close(self):
+
+        self.data.close()
+        self.data = None
+
+        with open(os.path.join(self.folder, kMetaFile), 'w') as metaFile:
+            json.dump(self.meta, metaFile, indent=4)
+
+'''
+Read a bake cache, returns the frames, the displacements and the meta data
+'''
+def readBakeCache(folder, mmap=True):
+
+    with open(os.path.join(folder, kMetaFile), 'r') as metaFile:
+        meta = json.load(metaFile)
+
+    displacements = np.load(os.path.join(folder, kDisplacementsFile), mmap_mode='r' if mmap else None)
+
+    return meta["frames"], displacements, meta
+
+'''
+Read the displacements of a block of vertices at every frame of a bake cache
+(F x rows x 3) without mapping the whole cache
+'''
+def readBakeBlock(folder, vertexStart, vertexStop):
+
+    data = ArrayFile(os.path.join(folder, kDisplacementsFile))
+    try:
+        return data.readBlock(0, data.shape[0], vertexStart, vertexStop)
+    finally:
+        data.close()
@@ -0,0 +1,480 @@
+'''
+
+Miguel Ramos Carretero
+Bournemouth University 2018
+
+Python module:
+Batch retargeting of many MoCap takes onto the same mesh. The matching of the
+markers, the distance matrix and the RBF kernel only depend on the mesh, so
+they are built once and every take is streamed through the same solver.
+
+'''
+
+import os
+import copy
+import time
+import numpy as np
+
+from animface import distances
+from animface import fastgauss
+from animface import session
+from animface import outofcore
+from animface import proxy
+from animface import reduced
+from animface import regions as regional
+from animface import precision as storage
+from animface.rbf import RBFSolver, kNormalized, kExact
+from animface.mocap import readMoCapTake
+from animface.bakecache import BakeCacheWriter
+from animface.tasks import getContext
+from animface.session import getSession
+
+kFrameChunk = 64
+
+#Largest fraction of the markers changed for a solver to be updated instead of built again
+kMaxUpdatedMarkers = 0.25
+
+'''
+Get the list of frames from firstFrame to lastFrame every steps frames
+'''
+def getFrames(firstFrame, lastFrame, steps):
+    return list(range(int(firstFrame), int(lastFrame)+1, max(1, int(steps))))
+
+'''
+Weights of the geodesic distances of the hybrid technique for a mesh, kept in
+the session cache (the updates of a solver need them again)
+'''
+def hybridWeights(mesh, geodesicVertices, context=None):
+
+    geodesicKey = tuple(int(v) for v in (geodesicVertices if geodesicVertices is not None else []))
+
+    return getSession().getOrCreate(session.kGraph, (mesh.signature(), "hybridWeights", geodesicKey), lambda: distances.hybridWeights(mesh.points, geodesicKey, context=context))
+
+'''
+Get the distance matrix of a mesh for the given marker vertices: from the
+session cache, else from the matrix folder, else calculated (and written into
+the matrix folder with saveMatrix). The matrix is kept in the session cache.
+'''
+def prepareMatrix(mesh, vertexMarkers, method, matrixFolder=None, geodesicVertices=None, processes=1, saveMatrix=False, context=None, precision=storage.kFloat64):
+
+    cache = getSession()
+    methodCode = distances.getMethodCode(method)
+    precision = storage.getPrecision(precision)
+    matrixKey = session.matrixKey(mesh.signature(), vertexMarkers, methodCode, precision)
+
+    matrix = cache.get(session.kMatrix, matrixKey)
+    if matrix is None and matrixFolder:
+        matrix = storage.loadMatrix(matrixFolder, methodCode, mesh.nVert, len(vertexMarkers), precision)
+    if matrix is None:
+        weights = hybridWeights(mesh, geodesicVertices, context) if methodCode == distances.kHybrid else None
+        matrix = storage.storeMatrix(distances.distanceMatrix(mesh, vertexMarkers, methodCode, geodesicVertices, processes, context, weights), precision)
+        if matrixFolder and saveMatrix:
+            storage.saveMatrix(matrixFolder, methodCode, matrix)
+
+    return cache.put(session.kMatrix, matrixKey, matrix)
+
+'''
+Update a solver for new stiffness values and marker vertices instead of
+building it again: a changed stiffness replaces one column of phi and one row
+and column of the kernel, a moved marker also gets its distance column
+calculated (one Dijkstra run for the geodesics). Returns an updated copy (the
+given solver may be in use by another job), or None if the solver cannot be
+updated or too many markers changed for the updates to pay off.
+'''
+def updateSolver(solver, mesh, method, stiffnessValues, vertexMarkers, geodesicVertices=None, context=None):
+
+    stiffness = np.asarray(stiffnessValues, dtype=np.float64)
+    vertexMarkers = np.asarray(vertexMarkers, dtype=np.int64)
+
+    #Out-of-core solvers keep phi in files shared by every solver with the same stiffness
+    if type(solver) is not RBFSolver or solver.nVert != mesh.nVert or solver.vertexMarkers.shape != vertexMarkers.shape:
+        return None
+
+    moved = np.nonzero(vertexMarkers != solver.vertexMarkers)[0]
+    changed = np.nonzero(stiffness != solver.stiffness)[0]
+
+    if np.union1d(moved, changed).shape[0] > max(1, int(kMaxUpdatedMarkers * solver.nMarkers)):
+        return None
+
+    context = getContext(context)
+    context.stage("update", moved.shape[0] + changed.shape[0], "Updating the RBF solver")
+
+    methodCode = distances.getMethodCode(method)
+    solver = solver.copy()
+
+    for c in changed:
+        solver.setStiffness(c, stiffness[c])
+        context.advance()
+
+    if moved.shape[0] > 0:
+
+        graph, weights = None, None
+        if methodCode != distances.kEuclidean:
+            graph = getSession().getOrCreate(session.kGraph, (mesh.signature(), "edges"), lambda: distances.buildEdgeGraph(mesh))
+        if methodCode == distances.kHybrid:
+            weights = hybridWeights(mesh, geodesicVertices, context)
+
+        columns = np.stack([distances.distanceColumn(mesh, vertexMarkers[c], methodCode, geodesicVertices, graph, weights) for c in moved], axis=1)
+        matrix = storage.replaceColumns(solver.distances, moved, columns)
+
+        for c in moved:
+            solver.moveMarker(c, vertexMarkers[c], matrix)
+            context.advance()
+
+    return solver
+
+'''
+Build the RBF solver of a mesh: match the markers with the mesh, load (or
+calculate) the distance matrix of the technique and build the kernel. Returns
+the solver and the time spent in every stage. With saveMatrix, a calculated
+matrix is written into the matrix folder. Matrices and solvers are kept in the
+session cache, so the next calls with the same mesh reuse them; when only a
+few stiffness values or markers changed since the last solver of the mesh,
+that solver is updated (updateSolver) instead of built again. With outOfCore, the matrices live in files of the matrix folder (a temporary folder
+without one) and the solver streams blocks of vertices within memoryBudget MB.
+The matrices are stored in the given precision (float64, float32 or uint16).
+With reducedTolerance or reducedRank, the solver is the truncated low-rank
+basis of the full one (animface.reduced). With gaussTolerance (Euclidean
+only), the solver sums truncated Gaussians found with a k-d tree of the
+vertices (animface.fastgauss) and no distance matrix is built. With
+kernelRank or kernelTolerance, the exact mode solves a low-rank approximation
+of the kernel (animface.lowrank). With regions, a list of (name, marker
+indices) tuples such as the groups of the layout, every region is solved on
+its own and the regions are blended over the vertices (animface.regions).
+'''
+def prepareSolver(mesh, markerPoints, method, stiffnessValues, matrixFolder=None, geodesicVertices=None, mode=kNormalized, vertexMarkers=None, processes=1, saveMatrix=False, context=None, outOfCore=False, memoryBudget=None, precision=storage.kFloat64, reducedTolerance=None, reducedRank=None, gaussTolerance=None, kernelRank=None, kernelTolerance=None, regions=None, regionOverlap=None, regionWorkers=1):
+
+    times = {}
+    cache = getSession()
+    methodCode = distances.getMethodCode(method)
+
+    start = time.time()
+    if vertexMarkers is None:
+        vertexMarkers = distances.matchMarkersWithMesh(mesh.points, markerPoints, context=context)
+    times["matching"] = time.time() - start
+
+    precision = storage.getPrecision(precision)
+    matrixKey = session.matrixKey(mesh.signature(), vertexMarkers, methodCode, precision)
+    solverKey = session.solverKey(matrixKey, stiffnessValues, mode)
+    if outOfCore:
+        solverKey += ("outOfCore",)
+    if gaussTolerance is not None:
+        if methodCode != distances.kEuclidean:
+            raise ValueError("Truncated Gaussian sums need the Euclidean technique")
+        solverKey += ("tree", float(gaussTolerance))
+
+    #Regions of markers solved on their own, from the distance matrix in memory
+    if regions is not None:
+        if outOfCore or gaussTolerance is not None or kernelRank is not None or kernelTolerance is not None or reducedTolerance is not None or reducedRank is not None:
+            raise ValueError("Region solves need the distance matrix in memory and no other approximation")
+
+        regionKey = solverKey + ("regions", tuple(tuple(int(i) for i in indices) for name, indices in regions), regionOverlap)
+        solver = cache.get(session.kSolver, regionKey)
+        if solver is not None:
+            times["distances"] = 0.0
+            times["kernel"] = 0.0
+            return solver, times
+
+        start = time.time()
+        matrix = prepareMatrix(mesh, vertexMarkers, methodCode, matrixFolder, geodesicVertices, processes, saveMatrix, context, precision)
+        times["distances"] = time.time() - start
+
+        start = time.time()
+        solver = regional.RegionSolver(matrix, vertexMarkers, stiffnessValues, [indices for name, indices in regions], mode, regionOverlap, precision, regionWorkers, [name for name, indices in regions], context)
+        times["kernel"] = time.time() - start
+
+        return cache.put(session.kSolver, regionKey, solver), times
+
+    #Reduced basis of the full solver, which is prepared (or reused) first
+    if reducedTolerance is not None or reducedRank is not None:
+        reducedKey = solverKey + ("reduced", reducedTolerance, reducedRank)
+        solver = cache.get(session.kSolver, reducedKey)
+        if solver is not None:
+            times.update({"distances": 0.0, "kernel": 0.0, "reduction": 0.0})
+            return solver, times
+
+        full, fullTimes = prepareSolver(mesh, markerPoints, method, stiffnessValues, matrixFolder, geodesicVertices, mode, vertexMarkers, processes, saveMatrix, context, outOfCore, memoryBudget, precision, gaussTolerance=gaussTolerance, kernelRank=kernelRank, kernelTolerance=kernelTolerance)
+        times["distances"] = fullTimes["distances"]
+        times["kernel"] = fullTimes["kernel"]
+
+        start = time.time()
+        solver = cache.put(session.kSolver, reducedKey, reduced.ReducedSolver(full, reducedTolerance, reducedRank, context))
+        times["reduction"] = time.time() - start
+
+        return solver, times
+
+    #Low-rank kernel of the exact mode, on a shallow copy of the solver (phi is shared)
+    if mode == kExact and (kernelRank is not None or kernelTolerance is not None):
+        approximatedKey = solverKey + ("lowRank", kernelRank, kernelTolerance)
+        solver = cache.get(session.kSolver, approximatedKey)
+        if solver is not None:
+            times["distances"] = 0.0
+            times["kernel"] = 0.0
+            return solver, times
+
+        full, fullTimes = prepareSolver(mesh, markerPoints, method, stiffnessValues, matrixFolder, geodesicVertices, mode, vertexMarkers, processes, saveMatrix, context, outOfCore, memoryBudget, precision, gaussTolerance=gaussTolerance)
+        times["distances"] = fullTimes["distances"]
+
+        start = time.time()
+        solver = copy.copy(full)
+        solver.setKernelApproximation(kernelRank, kernelTolerance)
+        times["kernel"] = fullTimes["kernel"] + time.time() - start
+
+        return cache.put(session.kSolver, approximatedKey, solver), times
+
+    solver = cache.get(session.kSolver, solverKey)
+    if solver is not None:
+        times["distances"] = 0.0
+        times["kernel"] = 0.0
+        return solver, times
+
+    #Gaussian sums on a k-d tree of the vertices, no distance matrix
+    if gaussTolerance is not None:
+        times["distances"] = 0.0
+
+        start = time.time()
+        solver = cache.put(session.kSolver, solverKey, fastgauss.TreeSolver(mesh.points, vertexMarkers, stiffnessValues, mode, gaussTolerance, precision, context))
+        times["kernel"] = time.time() - start
+
+        return solver, times
+
+    if outOfCore:
+        budgetBytes = outofcore.getMemoryBudget(memoryBudget)
+        folder = matrixFolder or outofcore.workFolder(mesh)
+
+        start = time.time()
+        matrix = outofcore.distanceFile(mesh, vertexMarkers, methodCode, folder, geodesicVertices, processes, budgetBytes, context, precision)
+        times["distances"] = time.time() - start
+
+        start = time.time()
+        solver = cache.put(session.kSolver, solverKey, outofcore.OutOfCoreSolver(matrix, vertexMarkers, stiffnessValues, mode, folder, budgetBytes, context, precision))
+        times["kernel"] = time.time() - start
+
+        return solver, times
+
+    tuningKey = session.tuningKey(mesh.signature(), methodCode, mode, precision)
+    baseKey = cache.get(session.kTuning, tuningKey)
+    base = cache.get(session.kSolver, baseKey) if baseKey is not None else None
+
+    start = time.time()
+    solver = updateSolver(base, mesh, methodCode, stiffnessValues, vertexMarkers, geodesicVertices, context) if base is not None else None
+
+    if solver is not None:
+        times["distances"] = 0.0
+        times["kernel"] = time.time() - start
+        cache.put(session.kMatrix, matrixKey, solver.distances)
+    else:
+        start = time.time()
+        matrix = prepareMatrix(mesh, vertexMarkers, methodCode, matrixFolder, geodesicVertices, processes, saveMatrix, context, precision)
+        times["distances"] = time.time() - start
+
+        start = time.time()
+        solver = RBFSolver(matrix, vertexMarkers, stiffnessValues, mode, precision)
+        times["kernel"] = time.time() - start
+
+    cache.put(session.kTuning, tuningKey, solverKey)
+
+    return cache.put(session.kSolver, solverKey, solver), times
+
+'''
+Build the solver of a preview bake: the RBF is solved and evaluated on a
+decimated proxy of the mesh of about proxyVertices vertices (animface.proxy),
+which keeps the marker vertices, and the displacements are upsampled to the
+mesh (ProxySolver). The proxy is kept in the session cache, and so are its
+matrices and solvers, so the next previews with other stiffness values or
+another technique only build the solver of the proxy. Returns the solver and
+the time spent in every stage.
+'''
+def preparePreviewSolver(mesh, markerPoints, method, stiffnessValues, proxyVertices=None, geodesicVertices=None, mode=kNormalized, vertexMarkers=None, processes=1, context=None):
+
+    times = {}
+    cache = getSession()
+
+    start = time.time()
+    if vertexMarkers is None:
+        vertexMarkers = distances.matchMarkersWithMesh(mesh.points, markerPoints, context=context)
+    times["matching"] = time.time() - start
+
+    start = time.time()
+    proxyKey = ("proxy", mesh.signature(), proxyVertices, tuple(int(v) for v in vertexMarkers))
+    proxyMesh = cache.get(session.kSolver, proxyKey)
+    if proxyMesh is None:
+        proxyMesh = cache.put(session.kSolver, proxyKey, proxy.ProxyMesh(mesh, proxyVertices, vertexMarkers, context=context))
+    times["proxy"] = time.time() - start
+
+    #Proxy vertices of the geodesic areas
+    proxyGeodesicVertices = None
+    if geodesicVertices is not None:
+        proxyGeodesicVertices = np.flatnonzero(np.isin(proxyMesh.vertices, geodesicVertices))
+
+    solver, solverTimes = prepareSolver(proxyMesh.mesh, markerPoints, method, stiffnessValues, None, proxyGeodesicVertices, mode, proxyMesh.proxyIndices(vertexMarkers), processes, context=context)
+    times["distances"] = solverTimes["distances"]
+    times["kernel"] = solverTimes["kernel"]
+
+    return proxy.ProxySolver(solver, proxyMesh), times
+
+'''
+Everything the pipeline reads from a scene to animate a mesh: the rest pose of
+the mesh and of the markers, the trajectories of the markers and the vertices
+of the geodesic areas
+'''
+class SceneInputs(object):
+
+    def __init__(self, mesh, markerPoints, frames, trajectories, geodesicVertices=None):
+        self.mesh = mesh
+        self.markerPoints = markerPoints
+        self.frames = list(frames)
+        self.trajectories = trajectories
+        self.geodesicVertices = geodesicVertices
+
+    def displacements(self, start=0, stop=None):
+        ''' Displacements of the markers from their rest position (F x M x 3). '''
+        return self.trajectories[start:stop] - self.markerPoints[None, :, :]
+
+'''
+Read the inputs of an animation from a scene backend in a few bulk calls
+'''
+def readSceneInputs(backend, meshName, markerNames, frames, geodesicSets=None, restFrame=0):
+
+    mesh = backend.getMeshData(meshName, restFrame)
+    markerPoints = backend.getObjectPoints(markerNames, restFrame)
+    trajectories = backend.getTrajectories(markerNames, frames)
+
+    geodesicVertices = None
+    if geodesicSets:
+        geodesicVertices = backend.getVertexSets(geodesicSets)
+
+    return SceneInputs(mesh, markerPoints, frames, trajectories, geodesicVertices)
+
+'''
+Displacements of the vertices at every frame of the inputs (F x V x 3, single
+precision, the precision of the keys)
+'''
+def animateVertices(solver, inputs, chunkSize=kFrameChunk, context=None):
+
+    context = getContext(context)
+
+    vertexDisplacements = np.empty((len(inputs.frames), solver.nVert, 3), dtype=np.float32)
+
+    context.stage("frames", len(inputs.frames), "Calculating mesh deformations")
+
+    for start in range(0, len(inputs.frames), chunkSize):
+        displacements = inputs.displacements(start, start+chunkSize)
+        vertexDisplacements[start:start+displacements.shape[0]] = solver.deform(displacements)
+        context.advance(displacements.shape[0])
+
+    return vertexDisplacements
+
+'''
+Displacements of the vertices at every frame of the inputs by blocks of
+vertices, (vertexStart, F x rows x 3 single precision) tuples. All the frames
+go through the solver at once, so an out-of-core solver reads phi once.
+'''
+def streamVertices(solver, inputs, context=None):
+
+    context = getContext(context)
+    context.stage("frames", solver.nVert, "Calculating mesh deformations")
+
+    for start, stop, block in solver.deformBlocks(inputs.displacements()):
+        yield start, block.astype(np.float32)
+        context.advance(stop - start)
+
+'''
+Animate a mesh of a scene with the markers of a layout: read the scene, build
+(or reuse) the solver and write the animation of the vertices. Works the same
+on any scene backend. Out of core, the animation is written by blocks of
+vertices as they are deformed. Returns the time spent in every stage.
+'''
+def animateScene(backend, meshName, layout, frames, method, stiffnessValues, matrixFolder=None, mode=kNormalized, processes=1, context=None, outOfCore=False, memoryBudget=None, precision=storage.kFloat64, preview=None, proxyVertices=None):
+
+    times = {}
+
+    start = time.time()
+    geodesicSets = layout.geodesicAreas if distances.getMethodCode(method) == distances.kHybrid else None
+    inputs = readSceneInputs(backend, meshName, layout.jointNames(), frames, geodesicSets)
+    times["read"] = time.time() - start
+
+    if preview is not None:
+        solver, solverTimes = preparePreviewSolver(inputs.mesh, inputs.markerPoints, method, stiffnessValues, proxyVertices, inputs.geodesicVertices, mode, processes=processes, context=context)
+        outOfCore = False
+        if preview == proxy.kPreviewProxy:
+            meshName = backend.createMesh(meshName + proxy.kProxySuffix, solver.proxy.mesh)
+            solver = solver.solver
+    else:
+        solver, solverTimes = prepareSolver(inputs.mesh, inputs.markerPoints, method, stiffnessValues, matrixFolder, inputs.geodesicVertices, mode, processes=processes, context=context, outOfCore=outOfCore, memoryBudget=memoryBudget, precision=precision)
+    times.update(solverTimes)
+
+    if outOfCore:
+        start = time.time()
+        times["write"] = 0.0
+        for vertexStart, block in streamVertices(solver, inputs, context):
+            writeStart = time.time()
+            backend.writeVertexAnimation(meshName, inputs.frames, block, np.arange(vertexStart, vertexStart + block.shape[1]))
+            times["write"] += time.time() - writeStart
+        times["deformation"] = time.time() - start - times["write"]
+        return times
+
+    start = time.time()
+    vertexDisplacements = animateVertices(solver, inputs, context=context)
+    times["deformation"] = time.time() - start
+
+    start = time.time()
+    backend.writeVertexAnimation(meshName, inputs.frames, vertexDisplacements)
+    times["write"] = time.time() - start
+
+    return times
+
+'''
+Stream the frames of one take through the solver into a bake cache writer,
+by chunks of frames and, out of core, by blocks of vertices
+'''
+def retargetTake(solver, take, mocapNames, frames, writer, restFrame=0, chunkSize=kFrameChunk, context=None):
+
+    context = getContext(context)
+    context.stage("bake", len(frames) * solver.nVert, "Baking take " + take.name)
+
+    chunkSize = solver.frameChunk(chunkSize)
+
+    for start in range(0, len(frames), chunkSize):
+        displacements = take.displacements(frames[start:start+chunkSize], mocapNames, restFrame)
+        for vertexStart, vertexStop, block in solver.deformBlocks(displacements):
+            writer.writeBlock(start, vertexStart, block)
+            context.advance(displacements.shape[0] * (vertexStop - vertexStart))
+
+'''
+Retarget a list of takes with the same solver, one bake cache per take in the
+output folder. Without frames, every take is baked over its whole range.
+'''
+def retargetTakes(solver, takePaths, mocapNames, outputFolder, frames=None, steps=1, restFrame=0, meta=None, context=None):
+
+    results = []
+
+    for path in takePaths:
+
+        start = time.time()
+
+        take = readMoCapTake(path)
+        parseTime = time.time() - start
+
+        takeFrames = frames
+        if takeFrames is None:
+            first, last = take.frameRange()
+            takeFrames = getFrames(np.ceil(first), np.floor(last), steps)
+
+        takeMeta = dict(meta or {})
+        takeMeta["take"] = os.path.abspath(path)
+        takeMeta["restFrame"] = restFrame
+
+        folder = os.path.join(outputFolder, take.name)
+        writer = BakeCacheWriter(folder, takeFrames, solver.nVert, takeMeta)
+        try:
+            retargetTake(solver, take, mocapNames, takeFrames, writer, restFrame, context=context)
+        finally:
+            writer.close()
+
+        totalTime = time.time() - start
+        results.append({"take": take.name, "cache": folder, "frames": len(takeFrames), "parseTime": parseTime, "time": totalTime})
+
+        print("Take " + take.name + ": " + str(len(takeFrames)) + " frames in " + str(totalTime) + " s (" + str(parseTime) + " s parsing)")
+
+    return results
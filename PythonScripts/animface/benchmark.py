@@ -0,0 +1,430 @@
+'''
+
+Miguel Ramos Carretero
+Bournemouth University 2018
+
+Python module:
+Benchmark suite of the retargeting pipeline. Every case builds a synthetic head
+mesh (number of vertices and markers given by the case), streams the MoCap
+takes of the MoCapData folder through it and times every stage separately:
+snapping of the markers, Euclidean, geodesic and hybrid matrices, kernel build,
+solve, evaluation and output. Results are saved as JSON and can be compared
+against a stored baseline to detect slowdowns.
+
+    python -m animface bench --suite standard --out results.json
+    python -m animface bench --suite standard --compare baseline.json
+
+'''
+
+import os
+import sys
+import glob
+import json
+import time
+import shutil
+import platform
+import tempfile
+
+import numpy as np
+
+from animface import distances
+from animface import profiler
+from animface.mesh import MeshData
+from animface.rbf import RBFSolver, kNormalized
+from animface.layout import loadLayout
+from animface.mocap import readMoCapTake
+from animface.bakecache import BakeCacheWriter
+
+kResultsVersion = 1
+
+kStages = ["snapping", "euclidean", "geodesic", "hybrid", "kernel", "solve", "evaluation", "output"]
+
+#Cases of every suite as (vertices, markers)
+kSuites = {
+    "quick": [(1000, 41), (5000, 100)],
+    "standard": [(1000, 41), (10000, 41), (10000, 300), (50000, 100)],
+    "full": [(1000, 41), (10000, 41), (10000, 300), (50000, 100), (200000, 41), (200000, 300)]
+}
+
+#Centre and radii of the synthetic head, around the rest pose of the default layout
+kHeadCentre = (0.0, 14.0, -4.0)
+kHeadRadii = (8.0, 11.0, 7.5)
+
+#Radius of the synthetic geodesic areas around the mouth and eye markers
+kAreaRadius = 1.5
+kAreaMarkers = ("Mouth", "Leye", "Reye")
+
+'''
+Default MoCap takes of the benchmark (the MoCapData folder of the repository)
+'''
+def getDefaultTakes():
+    folder = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "MoCapData")
+    return sorted(glob.glob(os.path.join(os.path.normpath(folder), "*.ma")))
+
+'''
+Create a closed quad mesh shaped as an ellipsoid head with about nVert vertices
+(latitude rings plus one vertex at each pole)
+'''
+def createHeadMesh(nVert, name=None):
+
+    nRings = max(3, int(round(np.sqrt(nVert / 2.0))))
+    nSegments = max(4, int(round((nVert - 2) / float(nRings))))
+
+    theta = np.linspace(0, np.pi, nRings + 2)[1:-1]
+    phi = np.linspace(0, 2 * np.pi, nSegments, endpoint=False)
+    theta, phi = np.meshgrid(theta, phi, indexing='ij')
+
+    ring = np.stack([np.sin(theta) * np.sin(phi), np.cos(theta), np.sin(theta) * np.cos(phi)], axis=2).reshape(-1, 3)
+    poles = np.array([[0.0, 1.0, 0.0], [0.0, -1.0, 0.0]])
+    points = np.concatenate([ring, poles]) * np.array(kHeadRadii) + np.array(kHeadCentre)
+
+    top = nRings * nSegments
+    bottom = top + 1
+    grid = np.arange(top).reshape(nRings, nSegments)
+    nextSegment = np.roll(grid, -1, axis=1)
+
+    quads = np.stack([grid[:-1], grid[1:], nextSegment[1:], nextSegment[:-1]], axis=2).reshape(-1, 4)
+    topFan = np.stack([np.full(nSegments, top), grid[0], nextSegment[0]], axis=1)
+    bottomFan = np.stack([np.full(nSegments, bottom), nextSegment[-1], grid[-1]], axis=1)
+
+    faceCounts = np.concatenate([np.full(quads.shape[0], 4), np.full(2 * nSegments, 3)])
+    faceIndices = np.concatenate([quads.reshape(-1), topFan.reshape(-1), bottomFan.reshape(-1)])
+
+    return MeshData(points, faceCounts, faceIndices, name or "head" + str(points.shape[0]))
+
+'''
+Rest pose of the markers of a case: the markers of the layout first, then
+extra markers spread over the front of the head (fixed seed). The extra
+markers take distinct vertices, none of the ones the layout markers match, so
+every marker has its own vertex and the exact kernel stays invertible.
+'''
+def createMarkerPoints(mesh, nMarkers, layout, seed=0):
+
+    points = np.asarray(layout.positions(), dtype=np.float64)[:nMarkers]
+
+    if nMarkers > points.shape[0]:
+        nExtra = nMarkers - points.shape[0]
+        taken = np.zeros(mesh.nVert, dtype=bool)
+        taken[distances.matchMarkersWithMesh(mesh.points, points)] = True
+
+        isFront = mesh.points[:, 2] > kHeadCentre[2] + kHeadRadii[2] * 0.3
+        front = np.nonzero(isFront & ~taken)[0]
+        random = np.random.RandomState(seed)
+
+        if front.shape[0] >= nExtra:
+            extra = random.choice(front, nExtra, replace=False)
+        else:
+            #Not enough front vertices: the rest of the head too
+            back = np.nonzero(~isFront & ~taken)[0]
+            if front.shape[0] + back.shape[0] < nExtra:
+                raise ValueError("Not enough vertices for " + str(nMarkers) + " markers: " + str(mesh.nVert))
+            extra = np.concatenate([front, random.choice(back, nExtra - front.shape[0], replace=False)])
+
+        points = np.concatenate([points, mesh.points[extra]])
+
+    return points
+
+'''
+Vertices of the synthetic geodesic areas (around the mouth and eye markers)
+'''
+def createGeodesicVertices(mesh, markerPoints, layout):
+
+    centres = [markerPoints[i] for i, name in enumerate(layout.markerNames()[:len(markerPoints)]) if name.startswith(kAreaMarkers)]
+
+    if len(centres) == 0:
+        return []
+
+    inArea = np.zeros(mesh.nVert, dtype=bool)
+    for centre in centres:
+        inArea |= ((mesh.points - centre)**2).sum(axis=1) < kAreaRadius**2
+
+    return np.nonzero(inArea)[0]
+
+'''
+Marker displacements (F x M x 3) of a take for a case with nMarkers markers.
+The markers beyond the layout reuse the trajectories of the layout markers.
+'''
+def takeDisplacements(take, layout, nMarkers, nFrames):
+
+    first, last = take.frameRange()
+    frames = np.arange(np.ceil(first), np.floor(last) + 1)[:nFrames]
+
+    displacements = take.displacements(frames, layout.mocapNames())
+    columns = np.arange(nMarkers) % displacements.shape[1]
+
+    return np.ascontiguousarray(displacements[:, columns])
+
+'''
+Synthetic displacements, used when no MoCap take is available
+'''
+def syntheticDisplacements(nMarkers, nFrames, seed=0):
+
+    random = np.random.RandomState(seed)
+    phase = random.uniform(0, 2 * np.pi, (1, nMarkers, 3))
+    amplitude = random.uniform(0.05, 0.5, (1, nMarkers, 3))
+    t = np.arange(nFrames, dtype=np.float64)[:, None, None]
+
+    return amplitude * np.sin(t * 0.2 + phase)
+
+'''
+Run a function repeat times, returns its last result and the wall times
+'''
+def timeStage(function, repeat):
+
+    times = []
+    result = None
+
+    for r in range(max(1, repeat)):
+        start = time.perf_counter()
+        result = function()
+        times.append(time.perf_counter() - start)
+
+    return result, times
+
+'''
+Summary of the wall times of a stage
+'''
+def stageSummary(times):
+    return {"best": min(times), "median": float(np.median(times)), "runs": times}
+
+'''
+Run one benchmark case. Takes is a list of (name, displacements) pairs; the
+output stage writes bake caches into a temporary folder.
+'''
+def runCase(nVert, nMarkers, layout, takes, repeat=3, processes=1, mode=kNormalized):
+
+    mesh = createHeadMesh(nVert)
+    markerPoints = createMarkerPoints(mesh, nMarkers, layout)
+    geodesicVertices = createGeodesicVertices(mesh, markerPoints, layout)
+    stiffnessValues = np.full(nMarkers, float(np.median(layout.stiffnessValues())))
+
+    stages = {}
+
+    vertexMarkers, times = timeStage(lambda: distances.matchMarkersWithMesh(mesh.points, markerPoints), repeat)
+    stages["snapping"] = stageSummary(times)
+
+    euc, times = timeStage(lambda: distances.euclideanDistanceMatrix(mesh.points, vertexMarkers), repeat)
+    stages["euclidean"] = stageSummary(times)
+
+    #Geodesics are by far the slowest stage, a single run is enough
+    geo, times = timeStage(lambda: distances.geodesicDistanceMatrix(mesh, vertexMarkers, processes=processes), 1)
+    stages["geodesic"] = stageSummary(times)
+
+    hyb, times = timeStage(lambda: distances.hybridDistanceMatrix(mesh.points, euc, geo, geodesicVertices), repeat)
+    stages["hybrid"] = stageSummary(times)
+
+    solver, times = timeStage(lambda: RBFSolver(hyb, vertexMarkers, stiffnessValues, mode), repeat)
+    stages["kernel"] = stageSummary(times)
+
+    nFrames = sum([displacements.shape[0] for name, displacements in takes])
+    outputFolder = tempfile.mkdtemp(prefix="animface_bench_")
+
+    try:
+        solveTimes = []
+        evaluationTimes = []
+        outputTimes = []
+
+        for r in range(max(1, repeat)):
+
+            solveTime = 0
+            evaluationTime = 0
+            outputTime = 0
+
+            for name, displacements in takes:
+
+                start = time.perf_counter()
+                weights = solver.solve(displacements)
+                solveTime += time.perf_counter() - start
+
+                start = time.perf_counter()
+                vertexDisplacements = solver.evaluate(weights)
+                evaluationTime += time.perf_counter() - start
+
+                start = time.perf_counter()
+                writer = BakeCacheWriter(os.path.join(outputFolder, name), range(displacements.shape[0]), solver.nVert)
+                writer.writeFrames(0, vertexDisplacements)
+                writer.close()
+                outputTime += time.perf_counter() - start
+
+            solveTimes.append(solveTime)
+            evaluationTimes.append(evaluationTime)
+            outputTimes.append(outputTime)
+
+        stages["solve"] = stageSummary(solveTimes)
+        stages["evaluation"] = stageSummary(evaluationTimes)
+        stages["output"] = stageSummary(outputTimes)
+
+    finally:
+        shutil.rmtree(outputFolder, ignore_errors=True)
+
+    return {"name": caseName(nVert, nMarkers), "nVert": mesh.nVert, "nMarkers": nMarkers, "nGeodesicVertices": len(geodesicVertices), "frames": nFrames, "stages": stages}
+
+'''
+Name of a case, used to match the cases of two result files
+'''
+def caseName(nVert, nMarkers):
+    return "v" + str(nVert) + "_m" + str(nMarkers)
+
+'''
+Description of the machine running the benchmark
+'''
+def machineInfo():
+    return {"platform": platform.platform(), "processor": platform.processor(), "cpus": os.cpu_count(), "python": platform.python_version(), "numpy": np.__version__, "scipy": distances._hasScipy}
+
+'''
+Run a list of cases, returns the results (JSON serializable). Without take
+paths the MoCapData takes are used, or synthetic displacements if there are none.
+With profile, the profiler report (with peak memory) of every case is added.
+'''
+def runBenchmark(cases, takePaths=None, nFrames=100, repeat=3, processes=1, layout=None, mode=kNormalized, profile=False):
+
+    layout = layout or loadLayout()
+
+    if takePaths is None:
+        takePaths = getDefaultTakes()
+
+    takes = [readMoCapTake(path) for path in takePaths]
+
+    results = {"version": kResultsVersion, "date": time.strftime("%Y-%m-%d %H:%M:%S"), "machine": machineInfo(),
+               "takes": [take.name for take in takes], "frames": nFrames, "repeat": repeat, "mode": mode, "cases": []}
+
+    for nVert, nMarkers in cases:
+
+        if len(takes) > 0:
+            displacements = [(take.name, takeDisplacements(take, layout, nMarkers, nFrames)) for take in takes]
+        else:
+            displacements = [("synthetic", syntheticDisplacements(nMarkers, nFrames))]
+
+        caseProfiler = profiler.enable("bench " + caseName(nVert, nMarkers), trackMemory=True) if profile else None
+
+        start = time.time()
+        try:
+            case = runCase(nVert, nMarkers, layout, displacements, repeat, processes, mode)
+        finally:
+            if caseProfiler is not None:
+                profiler.disable()
+
+        if caseProfiler is not None:
+            case["profile"] = caseProfiler.report()
+
+        results["cases"].append(case)
+
+        print("Case " + case["name"] + " (" + str(case["nVert"]) + " vertices, " + str(nMarkers) + " markers, " + str(case["frames"]) + " frames) done in " + str(time.time() - start) + " s")
+        sys.stdout.flush()
+
+    return results
+
+'''
+Save the results of a benchmark into a JSON file
+'''
+def writeResults(path, results):
+
+    folder = os.path.dirname(path)
+    if folder and not os.path.exists(folder):
+        os.makedirs(folder)
+
+    with open(path, 'w') as resultsFile:
+        json.dump(results, resultsFile, indent=4)
+
+'''
+Read the results of a benchmark from a JSON file
+'''
+def readResults(path):
+    with open(path, 'r') as resultsFile:
+        return json.load(resultsFile)
+
+'''
+Compare the best times of two benchmark results. A stage is flagged as slower
+when it takes more than (1 + tolerance) times the baseline; stages faster than
+minTime seconds in both runs are too noisy to be flagged. Returns one row per
+stage: (case, stage, baseline, current, ratio, status).
+'''
+def compareResults(current, baseline, tolerance=0.1, minTime=0.005):
+
+    baselineCases = dict([(case["name"], case) for case in baseline["cases"]])
+    rows = []
+
+    for case in current["cases"]:
+
+        if not case["name"] in baselineCases:
+            for stage in kStages:
+                rows.append((case["name"], stage, None, case["stages"][stage]["best"], None, "new"))
+            continue
+
+        reference = baselineCases[case["name"]]
+
+        for stage in kStages:
+
+            currentTime = case["stages"][stage]["best"]
+
+            if not stage in reference["stages"]:
+                rows.append((case["name"], stage, None, currentTime, None, "new"))
+                continue
+
+            baselineTime = reference["stages"][stage]["best"]
+            ratio = currentTime / baselineTime if baselineTime > 0 else float("inf")
+
+            if max(currentTime, baselineTime) < minTime:
+                status = "ok"
+            elif ratio > 1 + tolerance:
+                status = "slower"
+            elif ratio < 1 - tolerance:
+                status = "faster"
+            else:
+                status = "ok"
+
+            rows.append((case["name"], stage, baselineTime, currentTime, ratio, status))
+
+    return rows
+
+'''
+Print the stage times of a benchmark, one line per case
+'''
+def printResults(results):
+
+    print("------------------------------")
+    print("Benchmark (" + str(results["frames"]) + " frames per take, best of " + str(results["repeat"]) + ")")
+    print("case".ljust(16) + "".join([stage.rjust(12) for stage in kStages]))
+
+    for case in results["cases"]:
+        print(case["name"].ljust(16) + "".join([("%.4f" % case["stages"][stage]["best"]).rjust(12) for stage in kStages]))
+
+    print("------------------------------")
+
+'''
+Print a comparison against a baseline, returns the number of slower stages
+'''
+def printComparison(rows):
+
+    slower = 0
+
+    print("------------------------------")
+    print("case".ljust(16) + "stage".ljust(12) + "baseline".rjust(12) + "current".rjust(12) + "ratio".rjust(8) + "  status")
+
+    for name, stage, baselineTime, currentTime, ratio, status in rows:
+        baselineText = "-" if baselineTime is None else "%.4f" % baselineTime
+        ratioText = "-" if ratio is None else "%.2f" % ratio
+        if status == "slower":
+            slower += 1
+            status = status.upper()
+        print(name.ljust(16) + stage.ljust(12) + baselineText.rjust(12) + ("%.4f" % currentTime).rjust(12) + ratioText.rjust(8) + "  " + status)
+
+    print("------------------------------")
+    print(str(slower) + " stage(s) slower than the baseline")
+
+    return slower
+
+'''
+Parse a list of cases given as VERTICESxMARKERS (e.g. 10000x41)
+'''
+def parseCases(cases):
+
+    result = []
+
+    for case in cases:
+        tokens = case.lower().split("x")
+        if len(tokens) != 2:
+            raise ValueError("Benchmark cases are given as VERTICESxMARKERS, got: " + case)
+        result.append((int(tokens[0]), int(tokens[1])))
+
+    return result
@@ -0,0 +1,810 @@
+'''
+
+Miguel Ramos Carretero
+Bournemouth University 2018
+
+Python module:
+Headless command line entry point of AnimFace. Runs the pipeline (markers
+matching, distance matrices, RBF solve and bake) with the Maya-free engines,
+so retargeting jobs can run on farm nodes without a Maya session.
+
+    python -m animface matrices --mesh Head.obj --out Matrices
+    python -m animface matrices --mesh Scan.ply --out Matrices --proxy-vertices 20000
+    python -m animface matrices --mesh Head.obj --out Matrices --symmetry
+    python -m animface matrices --mesh Scan.ply --out Matrices --queue /farm/queues/scan
+    python -m animface worker --queue /farm/queues/scan
+    python -m animface merge --queue /farm/queues/scan
+    python -m animface run --mesh Head.obj --take Jaw.ma --method Hybrid --geodesic-vertices GeodesicAreas.txt --out Bakes
+    python -m animface run --mesh Scan.ply --take Jaw.ma --out Bakes --out-of-core --memory-budget 1024
+    python -m animface accuracy --mesh Head.obj --method Hybrid --geodesic-vertices GeodesicAreas.txt --take Jaw.ma
+    python -m animface sweep --mesh Head.obj --take Jaw.ma --random 200 --out sweep.json
+    python -m animface serve --mesh Head.obj --method Hybrid --matrices Matrices --reduced-tolerance 1e-3
+    python -m animface run --mesh Head.obj --take Jaw.ma --out Bakes --regions --region-overlap 3
+    python -m animface replay --take Jaw.ma --subscribe displacements
+    python -m animface bench --suite quick --out bench.json
+
+'''
+
+import os
+import sys
+import time
+import argparse
+
+kThreadEnvVars = ["OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS", "VECLIB_MAXIMUM_THREADS", "NUMEXPR_NUM_THREADS"]
+
+'''
+Limit the threads of the numerical libraries. Must run before NumPy is imported.
+'''
+def setThreadCount(threads):
+
+    if threads and threads > 0:
+        for var in kThreadEnvVars:
+            os.environ[var] = str(threads)
+
+'''
+Read a list of vertex indices (whitespace or comma separated) from a text file
+'''
+def readVertexIndices(path):
+
+    if not path:
+        return None
+
+    with open(path, 'r') as indicesFile:
+        return [int(token) for token in indicesFile.read().replace(",", " ").split()]
+
+'''
+Whether a matrix folder holds the distance matrix of the RBF technique (.mtx
+or .npy file of any precision)
+'''
+def hasStoredMatrix(folder, method):
+
+    from animface import distances
+
+    if not folder:
+        return False
+
+    name = os.path.splitext(distances.kMatrixFileNames[distances.getMethodCode(method)])[0]
+    return any(fileName.startswith(name + ".") for fileName in os.listdir(folder)) if os.path.isdir(folder) else False
+
+'''
+Task context of a command: a progress line on the terminal, unless disabled
+or the output is not a terminal
+'''
+def createContext(args):
+
+    from animface.tasks import TaskContext, ProgressReporter, ConsoleProgressSink
+
+    if args.no_progress or not sys.stderr.isatty():
+        return None
+
+    return TaskContext(progress=ProgressReporter(ConsoleProgressSink()))
+
+'''
+Load the mesh, the layout and the vertices matched with the markers
+'''
+def loadInputs(args, context=None):
+
+    from animface import distances
+    from animface.layout import loadLayout
+    from animface.meshio import readMesh
+
+    start = time.time()
+    mesh = readMesh(args.mesh, not args.no_mesh_cache)
+    layout = loadLayout(args.layout)
+    print("Mesh " + mesh.name + ": " + str(mesh.nVert) + " vertices, " + str(mesh.nFaces) + " faces (" + str(time.time() - start) + " s)")
+
+    start = time.time()
+    vertexMarkers = distances.matchMarkersWithMesh(mesh.points, layout.positions(), context=context)
+    print("Markers matched with the mesh: " + str(len(layout)) + " markers (" + str(time.time() - start) + " s)")
+
+    return mesh, layout, vertexMarkers
+
+'''
+Displacements of the markers of a layout at frames evenly spread over a MoCap
+take (F x M x 3)
+'''
+def sampleTakeDisplacements(path, layout, restFrame=0, count=20):
+
+    import numpy as np
+    from animface.mocap import readMoCapTake
+
+    take = readMoCapTake(path)
+    first, last = take.frameRange()
+    frames = np.linspace(first, last, count)
+
+    return take.displacements(frames, layout.mocapNames(), restFrame)
+
+'''
+Random marker displacements of about 1% of the size of a mesh (F x M x 3)
+'''
+def randomDisplacements(mesh, nMarkers, count=20):
+
+    import numpy as np
+
+    size = np.ptp(mesh.points, axis=0).max()
+    return np.random.default_rng(0).normal(0.0, size * 0.01, (count, nMarkers, 3))
+
+'''
+Regions of the solve of a command: the groups of the layout as (name, marker
+indices) tuples with --regions, None otherwise
+'''
+def layoutRegions(args, layout):
+
+    if not args.regions:
+        return None
+
+    return [(layout.groups[i][0], indices) for i, indices in enumerate(layout.groupIndices())]
+
+'''
+Print the reports of the fast evaluations of a command: how the Gaussian sums
+are evaluated, the residuals of a low-rank kernel, the error of a reduced
+basis and the difference of the regions with the global solve.
+prepare(None, None) returns the solver without the reduced basis or the
+regions (from the session cache), sample() the marker displacements of the
+reports.
+'''
+def reportEvaluation(args, prepare, solver, times, sample):
+
+    from animface import fastgauss
+    from animface import lowrank
+    from animface import reduced
+    from animface import regions
+
+    if args.gauss_tolerance is not None:
+        fastgauss.printTreeSolver(prepare(None, None)[0])
+
+    if args.regions:
+        regions.printRegionReport(regions.regionReport(prepare(None, None)[0], solver, sample()))
+        return
+
+    lowRank = args.kernel_rank is not None or args.kernel_tolerance is not None
+    reduction = args.reduced_tolerance is not None or args.reduced_rank is not None
+    if not (lowRank or reduction):
+        return
+
+    full = prepare(None, None)[0]
+    displacements = sample()
+
+    if lowRank:
+        lowrank.printKernelReport(lowrank.kernelReport(full, displacements))
+
+    if reduction:
+        print("Reduced basis: " + str(times["reduction"]) + " s")
+        reduced.printReductionReport(reduced.reductionReport(full, solver, displacements))
+
+'''
+Calculate the distance matrices of a mesh into a folder (as pyCalculateDistMatrix),
+.mtx files in double precision and .npy files otherwise
+'''
+def runMatrices(args):
+
+    from animface import distances
+    from animface import proxy
+    from animface import symmetry
+    from animface import precision as storage
+
+    context = createContext(args)
+
+    mesh, layout, vertexMarkers = loadInputs(args, context)
+    geodesicVertices = readVertexIndices(args.geodesic_vertices) or []
+
+    if args.out_of_core:
+        return runOutOfCoreMatrices(args, mesh, vertexMarkers, geodesicVertices, context)
+
+    if args.queue:
+        return runPublishQueue(args, mesh, layout, vertexMarkers, geodesicVertices)
+
+    start = time.time()
+    euc = distances.euclideanDistanceMatrix(mesh.points, vertexMarkers, context)
+    storage.saveMatrix(args.out, distances.kEuclidean, storage.storeMatrix(euc, args.precision))
+    print("Time for calculating Euclidean dist. matrix: " + str(time.time() - start))
+
+    start = time.time()
+    if args.proxy_vertices:
+        proxyMesh = proxy.ProxyMesh(mesh, args.proxy_vertices, vertexMarkers, context=context)
+        geo = proxy.proxyGeodesicMatrix(mesh, vertexMarkers, proxyMesh, args.processes, context, euc)
+    elif args.symmetry or args.mirror_map:
+        meshSymmetry = symmetry.MeshSymmetry(mesh, vertexMarkers, readVertexIndices(args.mirror_map), symmetry.layoutMarkerMirror(layout.positions(), args.symmetry_axis), axis=args.symmetry_axis)
+        symmetry.printSymmetryReport(meshSymmetry)
+        geo = symmetry.symmetricGeodesicMatrix(mesh, vertexMarkers, meshSymmetry, args.processes, context)
+    else:
+        geo = distances.geodesicDistanceMatrix(mesh, vertexMarkers, processes=args.processes, context=context)
+    geoTime = time.time() - start
+    storage.saveMatrix(args.out, distances.kGeodesics, storage.storeMatrix(geo, args.precision))
+    print("Time for calculating Geodesic dist. matrix: " + str(time.time() - start))
+
+    if args.proxy_vertices and args.proxy_samples > 0:
+        proxy.printProxyReport(proxy.proxyReport(mesh, vertexMarkers, geo, distances.kGeodesics, proxyMesh, samples=args.proxy_samples), geoTime)
+
+    start = time.time()
+    hyb = distances.hybridDistanceMatrix(mesh.points, euc, geo, geodesicVertices, context=context)
+    storage.saveMatrix(args.out, distances.kHybrid, storage.storeMatrix(hyb, args.precision))
+    print("Time for calculating Hybrid dist. matrix: " + str(time.time() - start))
+
+    print("Matrix calculations completed. Files created at: " + args.out)
+
+    return 0
+
+'''
+Calculate the distance matrices of a mesh into .npy files of a folder, by
+blocks of vertices within the memory budget
+'''
+def runOutOfCoreMatrices(args, mesh, vertexMarkers, geodesicVertices, context=None):
+
+    from animface import distances
+    from animface import outofcore
+
+    budgetBytes = outofcore.getMemoryBudget(args.memory_budget)
+
+    for method, name in ((distances.kEuclidean, "Euclidean"), (distances.kGeodesics, "Geodesic"), (distances.kHybrid, "Hybrid")):
+        start = time.time()
+        outofcore.distanceFile(mesh, vertexMarkers, method, args.out, geodesicVertices, args.processes, budgetBytes, context, args.precision).close()
+        print("Time for calculating " + name + " dist. matrix: " + str(time.time() - start))
+
+    print("Matrix calculations completed. Files created at: " + args.out)
+
+    return 0
+
+'''
+Publish the geodesic columns of a mesh as work items of a queue on shared
+storage, for the worker and merge commands
+'''
+def runPublishQueue(args, mesh, layout, vertexMarkers, geodesicVertices):
+
+    from animface import farmqueue
+    from animface import symmetry
+
+    meshSymmetry = None
+    if args.symmetry or args.mirror_map:
+        meshSymmetry = symmetry.MeshSymmetry(mesh, vertexMarkers, readVertexIndices(args.mirror_map), symmetry.layoutMarkerMirror(layout.positions(), args.symmetry_axis), axis=args.symmetry_axis)
+        symmetry.printSymmetryReport(meshSymmetry)
+
+    start = time.time()
+    manifest = farmqueue.publishQueue(args.queue, mesh, vertexMarkers, geodesicVertices, os.path.abspath(args.out), args.precision, args.item_columns, meshSymmetry)
+    print("Work items published: " + str(manifest["items"]) + " at " + args.queue + " (" + str(time.time() - start) + " s)")
+    print("Start workers with: python -m animface worker --queue " + args.queue)
+
+    return 0
+
+'''
+Run a worker node on a queue of distance matrix work items until it is done
+'''
+def runWorker(args):
+
+    from animface import farmqueue
+
+    context = createContext(args)
+
+    start = time.time()
+    calculated = farmqueue.runWorker(args.queue, args.worker_id, args.processes, args.heartbeat, args.lease_timeout, args.poll, context)
+    print("Items calculated by this worker: " + str(calculated) + " (" + str(time.time() - start) + " s)")
+
+    farmqueue.printQueueStatus(farmqueue.WorkQueue(args.queue).status())
+
+    return 0
+
+'''
+Merge the results of a finished queue into the matrix files. Returns 1 if the
+queue is not finished.
+'''
+def runMerge(args):
+
+    from animface import farmqueue
+
+    context = createContext(args)
+    status = farmqueue.WorkQueue(args.queue).status()
+
+    if status["done"] < status["items"]:
+        farmqueue.printQueueStatus(status)
+        print("The work queue is not finished")
+        return 1
+
+    start = time.time()
+    folder = farmqueue.mergeQueue(args.queue, args.out, args.precision, context)
+    print("Time for merging the dist. matrices: " + str(time.time() - start))
+    print("Matrix calculations completed. Files created at: " + folder)
+
+    return 0
+
+'''
+Run the whole pipeline: matrices (read or calculated), solver and bake of every take
+'''
+def runPipeline(args):
+
+    from animface import batch
+    from animface.layout import parseStiffnessString
+
+    totalStart = time.time()
+    context = createContext(args)
+
+    mesh, layout, vertexMarkers = loadInputs(args, context)
+
+    stiffnessValues = layout.stiffnessValues()
+    if args.stiffness:
+        stiffnessValues = parseStiffnessString(args.stiffness, layout)
+
+    matrixFolder = args.matrices or os.path.join(args.out, "matrices")
+
+    prepare = lambda tolerance, rank, regions=None: batch.prepareSolver(mesh, layout.positions(), args.method, stiffnessValues, matrixFolder, readVertexIndices(args.geodesic_vertices), args.solve_mode, vertexMarkers, args.processes, True, context, args.out_of_core, args.memory_budget, args.precision, tolerance, rank, args.gauss_tolerance, args.kernel_rank, args.kernel_tolerance, regions, args.region_overlap, args.region_workers)
+
+    solver, times = prepare(args.reduced_tolerance, args.reduced_rank, layoutRegions(args, layout))
+    print("Distance matrix: " + str(times["distances"]) + " s, kernel: " + str(times["kernel"]) + " s")
+    reportEvaluation(args, prepare, solver, times, lambda: sampleTakeDisplacements(args.take[0], layout, args.rest_frame))
+
+    frames = None
+    if args.last is not None:
+        frames = batch.getFrames(args.first, args.last, args.step)
+
+    meta = {"mesh": os.path.abspath(args.mesh), "method": args.method, "solveMode": args.solve_mode, "stiffness": list(stiffnessValues), "precision": args.precision}
+
+    batch.retargetTakes(solver, args.take, layout.mocapNames(), args.out, frames, args.step, args.rest_frame, meta, context)
+
+    print("Total running time: " + str(time.time() - totalStart) + " s")
+
+    return 0
+
+'''
+Report the accuracy of the reduced storage precisions on a mesh: the distance
+matrix of the technique in double precision against float32 and uint16, with
+the displacements of a take (or random ones)
+'''
+def runAccuracy(args):
+
+    import numpy as np
+    from animface import distances
+    from animface import precision as storage
+    from animface.layout import parseStiffnessString
+    from animface.mocap import readMoCapTake
+
+    context = createContext(args)
+
+    mesh, layout, vertexMarkers = loadInputs(args, context)
+
+    stiffnessValues = layout.stiffnessValues()
+    if args.stiffness:
+        stiffnessValues = parseStiffnessString(args.stiffness, layout)
+
+    matrix = None
+    if args.matrices:
+        matrix = storage.loadMatrix(args.matrices, args.method, mesh.nVert, len(vertexMarkers))
+    if matrix is None:
+        matrix = distances.distanceMatrix(mesh, vertexMarkers, args.method, readVertexIndices(args.geodesic_vertices), args.processes, context)
+
+    if args.take:
+        take = readMoCapTake(args.take)
+        first, last = take.frameRange()
+        frames = list(range(int(np.ceil(first)), int(np.floor(last)) + 1))[:args.frames]
+        displacements = take.displacements(frames, layout.mocapNames(), args.rest_frame)
+    else:
+        size = np.ptp(mesh.points, axis=0).max()
+        displacements = np.random.default_rng(0).normal(0.0, size * 0.01, (args.frames, len(vertexMarkers), 3))
+
+    rows = storage.accuracyReport(matrix, vertexMarkers, stiffnessValues, args.solve_mode, displacements)
+    storage.printAccuracyReport(rows)
+
+    return 0
+
+'''
+Sweep stiffness configurations of a mesh: the candidates (scales of the base
+configuration, random perturbations of it or a file) are scored on a sample of
+frames of a take and printed as a ranked table
+'''
+def runSweep(args):
+
+    import numpy as np
+    from animface import batch
+    from animface import sweep
+    from animface.layout import parseStiffnessString
+    from animface.mocap import readMoCapTake
+    from animface.bakecache import readBakeCache
+
+    context = createContext(args)
+
+    mesh, layout, vertexMarkers = loadInputs(args, context)
+
+    stiffnessValues = layout.stiffnessValues()
+    if args.stiffness:
+        stiffnessValues = parseStiffnessString(args.stiffness, layout)
+
+    if args.candidates:
+        candidates = sweep.readCandidates(args.candidates, len(vertexMarkers))
+    else:
+        scales = [float(s) for s in args.scales.split(",")] if args.scales else []
+        candidates = sweep.generateCandidates(stiffnessValues, scales, args.random, args.spread, args.seed, args.integer)
+
+    start = time.time()
+    matrix = batch.prepareMatrix(mesh, vertexMarkers, args.method, args.matrices, readVertexIndices(args.geodesic_vertices), args.processes, args.matrices is not None, context)
+    print("Distance matrix: " + str(time.time() - start) + " s")
+
+    take = readMoCapTake(args.take)
+
+    referenceBake = None
+    if args.reference_bake:
+        bakeFrames, bakeDisplacements, meta = readBakeCache(args.reference_bake)
+        indices = sweep.sampleFrameIndices(len(bakeFrames), args.frames)
+        frames = [bakeFrames[i] for i in indices]
+        referenceBake = (bakeDisplacements, indices)
+    else:
+        first, last = take.frameRange()
+        takeFrames = list(range(int(np.ceil(first)), int(np.floor(last)) + 1))
+        frames = [takeFrames[i] for i in sweep.sampleFrameIndices(len(takeFrames), args.frames)]
+
+    displacements = take.displacements(frames, layout.mocapNames(), args.rest_frame)
+
+    referenceStiffness = None
+    if args.reference_stiffness:
+        referenceStiffness = parseStiffnessString(args.reference_stiffness, layout)
+
+    weights = {sweep.kMarkerError: args.marker_weight, sweep.kSmoothness: args.smooth_weight, sweep.kReferenceError: args.reference_weight}
+
+    rows, elapsed = sweep.sweepStiffness(matrix, vertexMarkers, displacements, candidates, args.solve_mode, mesh, referenceStiffness, referenceBake, weights, args.sample_vertices, context=context)
+
+    sweep.printSweepTable(rows, args.top)
+    print(str(len(rows)) + " configurations on " + str(len(frames)) + " frames: " + str(elapsed) + " s")
+
+    if args.out:
+        meta = {"mesh": os.path.abspath(args.mesh), "method": args.method, "solveMode": args.solve_mode, "take": os.path.abspath(args.take), "frames": frames, "time": elapsed}
+        sweep.writeSweepResults(args.out, rows, meta)
+        print("Sweep results saved at: " + args.out)
+
+    return 0
+
+'''
+Serve live retargeting of a mesh: marker frames received on a local socket
+are solved and published to the subscribers until interrupted (Ctrl+C)
+'''
+def runServe(args):
+
+    import asyncio
+    from animface import batch
+    from animface import liveserver
+    from animface.layout import parseStiffnessString
+
+    context = createContext(args)
+
+    mesh, layout, vertexMarkers = loadInputs(args, context)
+
+    stiffnessValues = layout.stiffnessValues()
+    if args.stiffness:
+        stiffnessValues = parseStiffnessString(args.stiffness, layout)
+
+    prepare = lambda tolerance, rank, regions=None: batch.prepareSolver(mesh, layout.positions(), args.method, stiffnessValues, args.matrices, readVertexIndices(args.geodesic_vertices), args.solve_mode, vertexMarkers, args.processes, args.matrices is not None, context, reducedTolerance=tolerance, reducedRank=rank, gaussTolerance=args.gauss_tolerance, kernelRank=args.kernel_rank, kernelTolerance=args.kernel_tolerance, regions=regions, regionOverlap=args.region_overlap, regionWorkers=args.region_workers)
+
+    solver, times = prepare(args.reduced_tolerance, args.reduced_rank, layoutRegions(args, layout))
+    print("Distance matrix: " + str(times["distances"]) + " s, kernel: " + str(times["kernel"]) + " s")
+    if args.report_take:
+        reportEvaluation(args, prepare, solver, times, lambda: sampleTakeDisplacements(args.report_take, layout, args.rest_frame))
+    else:
+        reportEvaluation(args, prepare, solver, times, lambda: randomDisplacements(mesh, len(vertexMarkers)))
+
+    server = liveserver.RetargetServer(solver, args.queue, args.subscriber_queue)
+    print("Serving on " + (args.socket or (args.host + ":" + str(args.port))))
+
+    try:
+        asyncio.run(server.serve(args.host, args.port, args.socket, args.stats_interval))
+    except KeyboardInterrupt:
+        pass
+
+    liveserver.printServerStats(server.stats())
+
+    return 0
+
+'''
+Stream a MoCap take to a live server at capture rate, as a capture system
+would, optionally subscribing to the results to measure the end-to-end latency
+'''
+def runReplay(args):
+
+    import asyncio
+    from animface import liveserver
+    from animface.layout import loadLayout
+    from animface.mocap import readMoCapTake
+
+    take = readMoCapTake(args.take)
+    mocapNames = loadLayout(args.layout).mocapNames()
+    latency = liveserver.LatencyHistogram()
+
+    async def replay():
+
+        subscriber = None
+        if args.subscribe != "none":
+            subscriber = asyncio.ensure_future(liveserver.subscribe(lambda kind, frame, values, seconds: latency.add(seconds), args.subscribe, args.host, args.port, args.socket))
+            #Let the subscription reach the server before the first frame
+            await asyncio.sleep(0.1)
+
+        sent = await liveserver.replayTake(take, mocapNames, args.host, args.port, args.socket, args.scene_fps, args.rest_frame, args.loops)
+
+        if subscriber is not None:
+            await asyncio.sleep(0.5)
+            subscriber.cancel()
+
+        return sent
+
+    start = time.time()
+    sent = asyncio.run(replay())
+    print("Frames sent: " + str(sent) + " in " + str(time.time() - start) + " s")
+
+    if args.subscribe != "none":
+        row = latency.summary()
+        print("Messages received: " + str(row["count"]) + ", latency (ms) mean " + ("%.2f" % (row["mean"] * 1000)) + ", p50 " + ("%.2f" % (row["p50"] * 1000)) + ", p99 " + ("%.2f" % (row["p99"] * 1000)) + ", max " + ("%.2f" % (row["max"] * 1000)))
+
+    return 0
+
+'''
+Run the benchmark suite, optionally comparing it against a baseline. Returns 1
+if a stage is slower than the baseline.
+'''
+def runBench(args):
+
+    from animface import benchmark
+    from animface.layout import loadLayout
+
+    cases = benchmark.parseCases(args.case) if args.case else benchmark.kSuites[args.suite]
+
+    results = benchmark.runBenchmark(cases, args.take, args.frames, args.repeat, args.processes, loadLayout(args.layout), args.solve_mode, args.profile_memory)
+    benchmark.printResults(results)
+
+    if args.out:
+        benchmark.writeResults(args.out, results)
+        print("Benchmark results saved at: " + args.out)
+
+    if args.compare:
+        rows = benchmark.compareResults(results, benchmark.readResults(args.compare), args.tolerance, args.min_time)
+        if benchmark.printComparison(rows) > 0:
+            return 1
+
+    return 0
+
+'''
+Add the arguments shared by all the commands
+'''
+def addCommonArguments(parser):
+    parser.add_argument("--mesh", required=True, help="mesh file (.obj or binary .ply)")
+    parser.add_argument("--no-mesh-cache", action="store_true", help="always parse the mesh file (no binary mesh cache)")
+    parser.add_argument("--layout", default=None, help="marker layout (.json) with the rest pose of the markers")
+    parser.add_argument("--geodesic-vertices", default=None, help="text file with the vertex indices of the geodesic areas (Hybrid)")
+    parser.add_argument("--threads", type=int, default=0, help="threads of the numerical libraries (0: library default)")
+    parser.add_argument("--processes", type=int, default=1, help="worker processes for the geodesic distances")
+    parser.add_argument("--no-progress", action="store_true", help="do not show the progress line")
+    addProfileArguments(parser)
+
+'''
+Add the arguments of the stage profiler
+'''
+def addProfileArguments(parser):
+    parser.add_argument("--profile", default=None, help="JSON file of the stage profile (times, calls and peak memory)")
+    parser.add_argument("--trace", default=None, help="trace-event file of the stages (chrome://tracing, Perfetto)")
+    parser.add_argument("--profile-memory", action="store_true", help="track the peak memory of every stage (slower)")
+
+'''
+Add the arguments of the storage of the matrices (matrices and run commands)
+'''
+def addStorageArguments(parser):
+    parser.add_argument("--out-of-core", action="store_true", help="keep the matrices in .npy files and stream blocks of vertices (very large meshes)")
+    parser.add_argument("--memory-budget", type=float, default=None, help="memory budget (MB) of the out-of-core blocks (default: ANIMFACE_MEMORY_MB or 512)")
+    parser.add_argument("--precision", default="float64", choices=["float64", "float32", "uint16"], help="storage precision of the distance matrices (float64: .mtx files)")
+
+'''
+Add the arguments of the fast evaluations (run and serve commands)
+'''
+def addEvaluationArguments(parser):
+    parser.add_argument("--kernel-rank", type=int, default=None, help="exact mode: solve a low-rank approximation of the kernel of this rank")
+    parser.add_argument("--kernel-tolerance", type=float, default=None, help="exact mode: solve a low-rank approximation of the kernel within this tolerance, e.g. 1e-6")
+    parser.add_argument("--gauss-tolerance", type=float, default=None, help="Euclidean: sum the Gaussians above this bound (relative to the weights) found with a k-d tree, e.g. 1e-6")
+    parser.add_argument("--reduced-tolerance", type=float, default=None, help="evaluate a low-rank basis of the RBF, truncated at this spectral error (e.g. 1e-3)")
+    parser.add_argument("--reduced-rank", type=int, default=None, help="evaluate a low-rank basis of the RBF of this rank")
+    parser.add_argument("--regions", action="store_true", help="solve every marker group of the layout on its own and blend the groups over the vertices")
+    parser.add_argument("--region-overlap", type=float, default=None, help="markers of the other groups added to a region, in stiffness units (default 3)")
+    parser.add_argument("--region-workers", type=int, default=1, help="threads solving and evaluating the regions")
+
+'''
+Build the argument parser of the command line
+'''
+def buildParser():
+
+    parser = argparse.ArgumentParser(prog="animface", description="Headless AnimFace pipeline")
+    commands = parser.add_subparsers(dest="command")
+
+    matrices = commands.add_parser("matrices", help="calculate the Euclidean, Geodesic and Hybrid distance matrices")
+    addCommonArguments(matrices)
+    addStorageArguments(matrices)
+    matrices.add_argument("--out", required=True, help="output folder of the .mtx files (.npy files with --out-of-core)")
+    matrices.add_argument("--proxy-vertices", type=int, default=None, help="calculate the geodesics on a decimated proxy of about this many vertices and interpolate them")
+    matrices.add_argument("--proxy-samples", type=int, default=32, help="vertices sampled to compare the proxy geodesics with full-resolution ones (0: no report)")
+    matrices.add_argument("--symmetry", action="store_true", help="calculate the geodesics of one side of a symmetric mesh and mirror them (full calculation if the mesh is not symmetric)")
+    matrices.add_argument("--symmetry-axis", type=int, default=0, choices=[0, 1, 2], help="axis normal to the symmetry plane (0: x)")
+    matrices.add_argument("--mirror-map", default=None, help="file of the mirror vertex of every vertex, instead of detecting it (implies --symmetry)")
+    matrices.add_argument("--queue", default=None, help="publish the geodesic columns as work items of a queue folder on shared storage (worker and merge commands)")
+    matrices.add_argument("--item-columns", type=int, default=4, help="geodesic columns of every work item of the queue")
+    matrices.set_defaults(func=runMatrices)
+
+    worker = commands.add_parser("worker", help="calculate the work items of a distance matrix queue until it is done")
+    worker.add_argument("--queue", required=True, help="queue folder on shared storage")
+    worker.add_argument("--worker-id", default=None, help="name of the worker in the leases (default: host and process)")
+    worker.add_argument("--heartbeat", type=float, default=10.0, help="seconds between two touches of the lease of an item")
+    worker.add_argument("--lease-timeout", type=float, default=120.0, help="seconds after which a lease not touched is taken back")
+    worker.add_argument("--poll", type=float, default=2.0, help="seconds between two checks while the other workers finish")
+    worker.add_argument("--threads", type=int, default=0, help="threads of the numerical libraries (0: library default)")
+    worker.add_argument("--processes", type=int, default=1, help="worker processes for the geodesic distances of an item")
+    worker.add_argument("--no-progress", action="store_true", help="do not show the progress line")
+    addProfileArguments(worker)
+    worker.set_defaults(func=runWorker)
+
+    merge = commands.add_parser("merge", help="assemble the matrix files of a finished distance matrix queue")
+    merge.add_argument("--queue", required=True, help="queue folder on shared storage")
+    merge.add_argument("--out", default=None, help="output folder (default: the one given when the queue was published)")
+    merge.add_argument("--precision", default=None, choices=["float64", "float32", "uint16"], help="storage precision (default: the one of the queue)")
+    merge.add_argument("--no-progress", action="store_true", help="do not show the progress line")
+    addProfileArguments(merge)
+    merge.set_defaults(func=runMerge)
+
+    run = commands.add_parser("run", help="retarget MoCap takes onto a mesh and bake the result")
+    addCommonArguments(run)
+    addStorageArguments(run)
+    run.add_argument("--take", required=True, action="append", help="MoCap take (.ma), can be repeated")
+    run.add_argument("--method", default="Euclidean", choices=["Euclidean", "Geodesics", "Hybrid"])
+    run.add_argument("--stiffness", default=None, help="comma separated stiffness values (default: layout values)")
+    run.add_argument("--solve-mode", default="normalized", choices=["normalized", "exact"])
+    run.add_argument("--matrices", default=None, help="folder of the distance matrices (default: <out>/matrices)")
+    run.add_argument("--out", required=True, help="output folder of the bake caches")
+    run.add_argument("--first", type=int, default=0)
+    run.add_argument("--last", type=int, default=None, help="last frame (default: end of each take)")
+    run.add_argument("--step", type=int, default=1)
+    run.add_argument("--rest-frame", type=float, default=0)
+    addEvaluationArguments(run)
+    run.set_defaults(func=runPipeline)
+
+    accuracy = commands.add_parser("accuracy", help="report the accuracy of the reduced storage precisions on a mesh")
+    addCommonArguments(accuracy)
+    accuracy.add_argument("--method", default="Euclidean", choices=["Euclidean", "Geodesics", "Hybrid"])
+    accuracy.add_argument("--stiffness", default=None, help="comma separated stiffness values (default: layout values)")
+    accuracy.add_argument("--solve-mode", default="normalized", choices=["normalized", "exact"])
+    accuracy.add_argument("--matrices", default=None, help="folder of the distance matrices (default: calculated)")
+    accuracy.add_argument("--take", default=None, help="MoCap take (.ma) of the displacements (default: random displacements)")
+    accuracy.add_argument("--frames", type=int, default=100, help="frames of the displacements")
+    accuracy.add_argument("--rest-frame", type=float, default=0)
+    accuracy.set_defaults(func=runAccuracy)
+
+    stiffnessSweep = commands.add_parser("sweep", help="score many stiffness configurations of a mesh and rank them")
+    addCommonArguments(stiffnessSweep)
+    stiffnessSweep.add_argument("--take", required=True, help="MoCap take (.ma) of the displacements")
+    stiffnessSweep.add_argument("--method", default="Euclidean", choices=["Euclidean", "Geodesics", "Hybrid"])
+    stiffnessSweep.add_argument("--stiffness", default=None, help="comma separated base stiffness values (default: layout values)")
+    stiffnessSweep.add_argument("--solve-mode", default="normalized", choices=["normalized", "exact"])
+    stiffnessSweep.add_argument("--matrices", default=None, help="folder of the distance matrices (default: calculated)")
+    stiffnessSweep.add_argument("--frames", type=int, default=20, help="frames of the take the configurations are scored on")
+    stiffnessSweep.add_argument("--rest-frame", type=float, default=0)
+    stiffnessSweep.add_argument("--scales", default="0.5,0.75,1.25,1.5,2", help="comma separated scales of the base configuration")
+    stiffnessSweep.add_argument("--random", type=int, default=0, help="random perturbations of the base configuration")
+    stiffnessSweep.add_argument("--spread", type=float, default=0.25, help="log-normal spread of the random perturbations")
+    stiffnessSweep.add_argument("--seed", type=int, default=0)
+    stiffnessSweep.add_argument("--integer", action="store_true", help="round the candidates to integers (as the stiffness fields of the window)")
+    stiffnessSweep.add_argument("--candidates", default=None, help="text file of candidates, one comma separated configuration per line")
+    stiffnessSweep.add_argument("--reference-stiffness", default=None, help="comma separated stiffness values of the reference deformation")
+    stiffnessSweep.add_argument("--reference-bake", default=None, help="bake cache of the take used as the reference deformation")
+    stiffnessSweep.add_argument("--marker-weight", type=float, default=1.0, help="weight of the marker error in the score")
+    stiffnessSweep.add_argument("--smooth-weight", type=float, default=1.0, help="weight of the smoothness in the score")
+    stiffnessSweep.add_argument("--reference-weight", type=float, default=1.0, help="weight of the reference error in the score")
+    stiffnessSweep.add_argument("--sample-vertices", type=int, default=20000, help="vertices the configurations are evaluated on")
+    stiffnessSweep.add_argument("--top", type=int, default=20, help="rows of the printed table")
+    stiffnessSweep.add_argument("--out", default=None, help="JSON file of the ranked table")
+    stiffnessSweep.set_defaults(func=runSweep)
+
+    serve = commands.add_parser("serve", help="retarget live marker frames received on a local socket")
+    addCommonArguments(serve)
+    serve.add_argument("--method", default="Euclidean", choices=["Euclidean", "Geodesics", "Hybrid"])
+    serve.add_argument("--stiffness", default=None, help="comma separated stiffness values (default: layout values)")
+    serve.add_argument("--solve-mode", default="normalized", choices=["normalized", "exact"])
+    serve.add_argument("--matrices", default=None, help="folder of the distance matrices (default: calculated)")
+    serve.add_argument("--host", default="127.0.0.1")
+    serve.add_argument("--port", type=int, default=7655)
+    serve.add_argument("--socket", default=None, help="Unix socket path instead of a TCP port")
+    serve.add_argument("--queue", type=int, default=2, help="frames waiting for the solve (the oldest are dropped)")
+    serve.add_argument("--subscriber-queue", type=int, default=4, help="messages waiting for every subscriber (the oldest are dropped)")
+    serve.add_argument("--stats-interval", type=float, default=0, help="seconds between the printed statistics (0: only at the end)")
+    serve.add_argument("--rest-frame", type=float, default=0)
+    serve.add_argument("--report-take", default=None, help="MoCap take (.ma) of the low-rank kernel and reduced-basis reports (default: random displacements)")
+    addEvaluationArguments(serve)
+    serve.set_defaults(func=runServe)
+
+    replay = commands.add_parser("replay", help="stream a MoCap take to a live server at capture rate")
+    replay.add_argument("--take", required=True, help="MoCap take (.ma)")
+    replay.add_argument("--layout", default=None, help="marker layout (.json) with the MoCap names of the markers")
+    replay.add_argument("--host", default="127.0.0.1")
+    replay.add_argument("--port", type=int, default=7655)
+    replay.add_argument("--socket", default=None, help="Unix socket path instead of a TCP port")
+    replay.add_argument("--scene-fps", type=float, default=24.0, help="frames per second of the scene of the take")
+    replay.add_argument("--rest-frame", type=float, default=0)
+    replay.add_argument("--loops", type=int, default=1, help="times the take is streamed")
+    replay.add_argument("--subscribe", default="none", choices=["none", "displacements", "weights"], help="subscribe to the results and report their latency")
+    replay.set_defaults(func=runReplay)
+
+    bench = commands.add_parser("bench", help="time every stage of the pipeline on synthetic head meshes")
+    bench.add_argument("--suite", default="standard", choices=["quick", "standard", "full"])
+    bench.add_argument("--case", action="append", default=None, help="VERTICESxMARKERS case instead of a suite, can be repeated")
+    bench.add_argument("--take", action="append", default=None, help="MoCap take (.ma), can be repeated (default: MoCapData takes)")
+    bench.add_argument("--frames", type=int, default=100, help="frames of every take")
+    bench.add_argument("--repeat", type=int, default=3, help="runs of every stage (the best one is kept)")
+    bench.add_argument("--solve-mode", default="normalized", choices=["normalized", "exact"])
+    bench.add_argument("--layout", default=None, help="marker layout (.json) with the rest pose of the markers")
+    bench.add_argument("--threads", type=int, default=0, help="threads of the numerical libraries (0: library default)")
+    bench.add_argument("--processes", type=int, default=1, help="worker processes for the geodesic distances")
+    bench.add_argument("--profile-memory", action="store_true", help="add the stage profile with peak memory of every case to the results")
+    bench.add_argument("--out", default=None, help="JSON file of the results")
+    bench.add_argument("--compare", default=None, help="JSON file of a baseline, slower stages are flagged")
+    bench.add_argument("--tolerance", type=float, default=0.1, help="allowed slowdown ratio over the baseline")
+    bench.add_argument("--min-time", type=float, default=0.005, help="stages faster than this (s) are not flagged")
+    bench.set_defaults(func=runBench)
+
+    return parser
+
+'''
+Entry point of the command line
+'''
+def main(argv=None):
+
+    parser = buildParser()
+    args = parser.parse_args(argv)
+
+    if not getattr(args, "func", None):
+        parser.print_help()
+        return 1
+
+    #Without the geodesic areas the Hybrid matrix is the Euclidean one
+    if getattr(args, "method", None) == "Hybrid" and not args.geodesic_vertices:
+        matrixFolder = getattr(args, "matrices", None)
+        if args.command == "run" and not matrixFolder:
+            matrixFolder = os.path.join(args.out, "matrices")
+        if not hasStoredMatrix(matrixFolder, "Hybrid"):
+            parser.error("--method Hybrid needs --geodesic-vertices (or --matrices with a Hybrid matrix)")
+
+    if getattr(args, "command", None) == "matrices" and not args.geodesic_vertices:
+        sys.stderr.write("Warning: no --geodesic-vertices, the Hybrid matrix is the Euclidean one\n")
+
+    if getattr(args, "gauss_tolerance", None) is not None and args.method != "Euclidean":
+        parser.error("--gauss-tolerance needs the Euclidean method")
+
+    if (getattr(args, "kernel_rank", None) is not None or getattr(args, "kernel_tolerance", None) is not None) and args.solve_mode != "exact":
+        parser.error("--kernel-rank and --kernel-tolerance need the exact solve mode")
+
+    if getattr(args, "proxy_vertices", None) and args.out_of_core:
+        parser.error("--proxy-vertices needs the matrices in memory")
+
+    if (getattr(args, "symmetry", False) or getattr(args, "mirror_map", None)) and (args.out_of_core or args.proxy_vertices):
+        parser.error("--symmetry needs the matrices in memory and no proxy")
+
+    if getattr(args, "command", None) == "matrices" and args.queue and (args.out_of_core or args.proxy_vertices):
+        parser.error("--queue publishes full-resolution columns, without --out-of-core or --proxy-vertices")
+
+    if getattr(args, "regions", False):
+        approximations = [args.gauss_tolerance, args.kernel_rank, args.kernel_tolerance, args.reduced_tolerance, args.reduced_rank]
+        if getattr(args, "out_of_core", False) or any(value is not None for value in approximations):
+            parser.error("--regions needs the distance matrix in memory and no other approximation")
+
+    setThreadCount(getattr(args, "threads", 0))
+
+    if not (getattr(args, "profile", None) or getattr(args, "trace", None)):
+        return args.func(args)
+
+    from animface import profiler
+
+    runProfiler = profiler.enable(args.command, trackMemory=args.profile_memory)
+
+    try:
+        result = args.func(args)
+    finally:
+        profiler.disable()
+
+    profiler.printReport(runProfiler.report())
+
+    if args.profile:
+        runProfiler.writeReport(args.profile)
+        print("Profile saved at: " + args.profile)
+    if args.trace:
+        runProfiler.writeTrace(args.trace)
+        print("Trace saved at: " + args.trace)
+
+    return result
+
+if __name__ == "__main__":
+    sys.exit(main())
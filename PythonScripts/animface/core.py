@@ -0,0 +1,234 @@
+'''
+
+Miguel Ramos Carretero
+Bournemouth University 2018
+
+Maya/Python script:
+Scene helpers shared by all the AnimFace plugins (marker positions, distances
+between vertices, markers matching, RBF). Importing this module only needs
+maya.cmds; NumPy, SciPy and the engines are imported on first use, so loading
+a plugin stays instant.
+
+'''
+
+import sys
+import math
+import maya.cmds as cmds
+import maya.mel as mel
+
+'''
+Load a plugin of AnimFace if it is not loaded yet
+'''
+def requirePlugin(pluginFile):
+    if not cmds.pluginInfo(pluginFile, q=True, loaded=True):
+        cmds.loadPlugin(pluginFile, quiet=True)
+
+'''
+Python program to illustrate the intersection of two lists in most simple way
+'''
+def getIntersection(lst1, lst2):
+    lst3 = [value for value in lst1 if value in lst2]
+    return lst3
+
+'''
+Get the transform of a given object and returns it in a 3 element list
+'''
+def getObjectPoint(obj):
+    return list(cmds.getAttr(obj+".translate")[0])
+
+'''
+Get the absolute distance between two points
+'''
+def getEuclideanDistance(point1, point2):
+
+    vect = (point2[0] - point1[0], point2[1] - point1[1], point2[2] - point1[2])
+    dist = math.sqrt(vect[0]*vect[0] + vect[1]*vect[1] + vect[2]*vect[2])
+
+    return dist
+
+'''
+Get the mesh-based geodesic distance between two points (heuristic with recursive approach)
+Note: v1Name = mesh+".vtx["+str(v1)+"]"
+      v2Name = mesh+".vtx["+str(v2)+"]"
+'''
+def getGeodesicDistance(v1Name, v2Name, iterations=5):
+
+    distance = 0
+    selectionV1 = []
+    selectionV2 = []
+
+    for i in range(iterations):
+
+        #Grow the selection of v1
+        cmds.select(v1Name, r=True)
+        for j in range(i):
+            mel.eval("select `ls -sl`;PolySelectTraverse 1;select `ls -sl`")
+        selectionV1 = cmds.ls(selection=True, flatten=True)
+
+        #Grow the selection of v2
+        cmds.select(v2Name, r=True)
+        for j in range(i):
+            mel.eval("select `ls -sl`;PolySelectTraverse 1;select `ls -sl`")
+        selectionV2 = cmds.ls(selection=True, flatten=True)
+
+        #Check if there is intersection
+        intersection = getIntersection(selectionV1, selectionV2)
+
+        if (len(intersection) > 0):
+
+            #If intersection contains each other vertex, stop and return distance
+            if (v1Name in intersection) and (v2Name in intersection):
+                return getEuclideanDistance(cmds.pointPosition(v1Name), cmds.pointPosition(v2Name))
+
+            #Else find a middle point and apply recursivity
+            chosenVert = ""
+            tempDist = sys.float_info.max
+
+            for v in range(len(intersection)):
+
+                auxDist = getEuclideanDistance(cmds.pointPosition(intersection[v]), cmds.pointPosition(v1Name)) + getEuclideanDistance(cmds.pointPosition(intersection[v]), cmds.pointPosition(v2Name))
+
+                if (auxDist < tempDist):
+                    tempDist = auxDist
+                    chosenVert = intersection[v]
+
+            return distance + getGeodesicDistance(v1Name, chosenVert, iterations) + getGeodesicDistance(v2Name, chosenVert, iterations)
+
+    return getEuclideanDistance(cmds.pointPosition(v1Name), cmds.pointPosition(v2Name)) * 2 #Solution by default
+
+'''
+Get the aprox. of the mesh-based geodesic distance between two points (heuristic using edge path tool)
+'''
+def getGeodesicDistancev2(mesh, v1Index, v2Index):
+
+    #Catch special case
+    if (v1Index == v2Index):
+        return 0
+
+    #Get the shortest edge path
+    sel = cmds.polySelect(mesh, shortestEdgePath=(v1Index, v2Index), ass=True )
+
+    #Calculate the path length
+    dist = 0
+
+    for i in range(len(sel)):
+        conv = cmds.polyListComponentConversion(sel[i], fe=True, tv=True)
+        conv = cmds.filterExpand(conv, sm=31)
+        dist += getEuclideanDistance(cmds.pointPosition(conv[0]), cmds.pointPosition(conv[1]))
+
+    return dist
+
+'''
+Calculates the RBF between two points according to the distance and the
+given parameter gamma.
+'''
+def calculateGaussianRBF(dist, gamma):
+    return math.exp(-(dist**2/gamma**2))
+
+'''
+Get the weight of the geodesic distance of a vertex for the hybrid technique
+(1 inside the geodesic areas, decreasing with the distance to them)
+'''
+def getHybridWeight(geodesicVertices, vName):
+
+    if (vName in geodesicVertices):
+        return 1
+
+    vPoint = cmds.pointPosition(vName)
+
+    gdist = sys.float_info.max
+    for j in range (len(geodesicVertices)):
+        auxDist = getEuclideanDistance(vPoint, cmds.pointPosition(geodesicVertices[j]))
+        if (auxDist < gdist):
+            gdist = auxDist
+
+    return calculateGaussianRBF(gdist, 2)
+
+'''
+Get the hybrid distance between two points, given the Euclidean and the geodesic distance.
+'''
+def getHybridDistance(geodesicVertices, vName, eucDist, geoDist, averWeight=None):
+
+    if (averWeight == None):
+        averWeight = getHybridWeight(geodesicVertices, vName)
+
+    if (averWeight < 0.6):
+        dist = eucDist
+    else:
+        dist = geoDist*averWeight + eucDist*(1-averWeight)
+
+    return dist
+
+'''
+Get the vertices of the geodesic areas of the layout (for hybrid)
+'''
+def getGeodesicVertices(layout):
+
+    geodesicVertices = []
+
+    for area in layout.geodesicAreas:
+        geodesicVertices += cmds.ls(cmds.sets(area, q=True), flatten=True)
+
+    return geodesicVertices
+
+'''
+Get the MeshData of a mesh given by name (read from the scene) or as the
+MeshData a caller already holds (not read again)
+'''
+def getMeshData(mesh):
+
+    from animface.mesh import MeshData
+
+    if isinstance(mesh, MeshData):
+        return mesh
+
+    from animface import mayascene
+
+    return mayascene.getMeshData(mesh)
+
+'''
+Get a match between the markers and the vertices of a given mesh (closest
+vertex to the current position of every marker). The points of the mesh are
+read in one call, unless its MeshData is given, and matched with the engines.
+'''
+def matchMarkersWithMesh(markersList, mesh):
+
+    from animface import distances
+    from animface import mayascene
+
+    print("Calculating matches for markers and vertices...")
+
+    meshData = getMeshData(mesh)
+    markerPoints = mayascene.getObjectPoints(markersList)
+
+    return [int(v) for v in distances.matchMarkersWithMesh(meshData.points, markerPoints)]
+
+'''
+Get the signature of a mesh (hash of its points and connectivity), by name or
+as MeshData (whose signature is hashed once and kept)
+'''
+def getMeshSignature(mesh):
+    return getMeshData(mesh).signature()
+
+'''
+Get a distance matrix (nVert x nMarkers) of the session cache, None if the
+mesh, the matched vertices or the technique changed since it was kept. Pass
+the MeshData of the mesh when it is at hand, so the mesh is not read again.
+'''
+def getSessionMatrix(mesh, vertexMarkers, RBFTechnique):
+
+    from animface import session
+
+    return session.getSession().get(session.kMatrix, session.matrixKey(getMeshSignature(mesh), vertexMarkers, RBFTechnique))
+
+'''
+Keep a distance matrix (nVert x nMarkers, rows of values) in the session cache
+'''
+def putSessionMatrix(mesh, vertexMarkers, RBFTechnique, matrix):
+
+    import numpy as np
+    from animface import session
+
+    matrix = np.asarray(matrix, dtype=np.float64).reshape(-1, len(vertexMarkers))
+
+    return session.getSession().put(session.kMatrix, session.matrixKey(getMeshSignature(mesh), vertexMarkers, RBFTechnique), matrix)
@@ -0,0 +1,348 @@
+'''
+
+Miguel Ramos Carretero
+Bournemouth University 2018
+
+Python module:
+Maya-free calculation of the Euclidean, geodesic and hybrid distance matrices
+between the vertices of a mesh and the vertices matched with the markers.
+
+Distance matrices are V x M arrays (one row per vertex, one column per marker)
+and are stored in the .mtx files in the same order, one value per line.
+
+'''
+
+import os
+import heapq
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from animface.profiler import profiled
+from animface.tasks import TaskCancelled, getContext
+
+try:
+    import scipy.sparse
+    import scipy.sparse.csgraph
+    _hasScipy = True
+except ImportError:
+    _hasScipy = False
+
+kEuclidean = 0
+kGeodesics = 1
+kHybrid = 2
+
+kMethodNames = {"Euclidean": kEuclidean, "Geodesics": kGeodesics, "Hybrid": kHybrid}
+
+kMatrixFileNames = {kEuclidean: "eucMatrix.mtx", kGeodesics: "geoMatrix.mtx", kHybrid: "hybMatrix.mtx"}
+
+'''
+Get the RBF technique code from its name (Euclidean, Geodesics or Hybrid)
+'''
+def getMethodCode(method):
+
+    if method in kMethodNames:
+        return kMethodNames[method]
+
+    if method in kMatrixFileNames:
+        return method
+
+    raise ValueError("Unknown RBF technique: " + str(method))
+
+'''
+Get a match between the markers and the vertices of a given mesh (closest vertex)
+'''
+@profiled("snapping")
+def matchMarkersWithMesh(points, markerPoints, chunkSize=8192, context=None):
+
+    context = getContext(context)
+    context.stage("snapping", points.shape[0], "Matching markers with the mesh")
+
+    markerPoints = np.asarray(markerPoints, dtype=np.float64).reshape(-1, 3)
+
+    indexList = np.zeros(markerPoints.shape[0], dtype=np.int64)
+    distances = np.full(markerPoints.shape[0], np.inf)
+
+    for start in range(0, points.shape[0], chunkSize):
+
+        block = points[start:start+chunkSize]
+        dist = ((block[:, None, :] - markerPoints[None, :, :])**2).sum(axis=2)
+
+        closest = dist.argmin(axis=0)
+        closestDist = dist[closest, np.arange(markerPoints.shape[0])]
+
+        better = closestDist < distances
+        distances[better] = closestDist[better]
+        indexList[better] = closest[better] + start
+
+        context.advance(block.shape[0])
+
+    return indexList
+
+'''
+Euclidean distance between every vertex and every marker vertex
+'''
+@profiled("distances.euclidean")
+def euclideanDistanceMatrix(points, vertexMarkers, context=None):
+
+    context = getContext(context)
+
+    markerPoints = points[np.asarray(vertexMarkers)]
+    matrix = np.empty((points.shape[0], markerPoints.shape[0]))
+
+    context.stage("euclidean", markerPoints.shape[0], "Calculating Euclidean dist. matrix")
+
+    for c in range(markerPoints.shape[0]):
+        matrix[:, c] = np.linalg.norm(points - markerPoints[c], axis=1)
+        context.advance()
+
+    return matrix
+
+'''
+Build the (symmetric) edge graph of a mesh weighted by the edge lengths
+'''
+@profiled("distances.graph")
+def buildEdgeGraph(mesh):
+
+    edges = mesh.edges()
+    lengths = mesh.edgeLengths()
+
+    if _hasScipy:
+        rows = np.concatenate([edges[:, 0], edges[:, 1]])
+        cols = np.concatenate([edges[:, 1], edges[:, 0]])
+        data = np.concatenate([lengths, lengths])
+        return scipy.sparse.csr_matrix((data, (rows, cols)), shape=(mesh.nVert, mesh.nVert))
+
+    adjacency = [[] for i in range(mesh.nVert)]
+    for e in range(edges.shape[0]):
+        adjacency[edges[e, 0]].append((int(edges[e, 1]), float(lengths[e])))
+        adjacency[edges[e, 1]].append((int(edges[e, 0]), float(lengths[e])))
+
+    return adjacency
+
+'''
+Shortest edge path length from one vertex to all the others (Dijkstra)
+'''
+def _dijkstra(adjacency, source):
+
+    dist = np.full(len(adjacency), np.inf)
+    dist[source] = 0
+    heap = [(0.0, source)]
+
+    while heap:
+        d, v = heapq.heappop(heap)
+        if d > dist[v]:
+            continue
+        for w, length in adjacency[v]:
+            nd = d + length
+            if nd < dist[w]:
+                dist[w] = nd
+                heapq.heappush(heap, (nd, w))
+
+    return dist
+
+'''
+Geodesic distance columns (shortest edge path) for the given source vertices,
+split among several worker processes if processes > 1. The sources are
+processed in small groups so the progress and the cancellation are honoured.
+'''
+def geodesicColumns(graph, sources, processes=1, context=None, groupSize=8):
+
+    context = getContext(context)
+    sources = [int(s) for s in sources]
+    groups = [sources[start:start+groupSize] for start in range(0, len(sources), groupSize)]
+
+    if processes > 1 and len(groups) > 1:
+        with ProcessPoolExecutor(max_workers=min(processes, len(groups)), initializer=_initGeodesicWorker, initargs=(graph,)) as executor:
+            futures = [executor.submit(_geodesicColumnsWorker, group) for group in groups]
+            parts = []
+            try:
+                for g in range(len(groups)):
+                    parts.append(futures[g].result())
+                    context.advance(len(groups[g]))
+            except TaskCancelled:
+                for future in futures:
+                    future.cancel()
+                raise
+        return np.concatenate(parts, axis=1)
+
+    parts = []
+    for group in groups:
+        if _hasScipy:
+            parts.append(scipy.sparse.csgraph.dijkstra(graph, directed=False, indices=group).T)
+        else:
+            parts.append(np.stack([_dijkstra(graph, s) for s in group], axis=1))
+        context.advance(len(group))
+
+    if len(parts) == 0:
+        return np.zeros((graph.shape[0] if _hasScipy else len(graph), 0))
+
+    return np.concatenate(parts, axis=1)
+
+'''
+Edge graph of the worker processes of geodesicColumns (sent once per worker)
+'''
+_workerGraph = None
+
+def _initGeodesicWorker(graph):
+    global _workerGraph
+    _workerGraph = graph
+
+'''
+Entry of the worker processes of geodesicColumns
+'''
+def _geodesicColumnsWorker(sources):
+    return geodesicColumns(_workerGraph, sources)
+
+'''
+Geodesic distance (length of the shortest edge path) between every vertex and
+every marker vertex
+'''
+@profiled("distances.geodesic")
+def geodesicDistanceMatrix(mesh, vertexMarkers, graph=None, processes=1, context=None):
+
+    context = getContext(context)
+
+    if graph is None:
+        graph = buildEdgeGraph(mesh)
+
+    context.stage("geodesic", len(vertexMarkers), "Calculating Geodesic dist. matrix")
+    matrix = geodesicColumns(graph, vertexMarkers, processes, context)
+
+    #Vertices not connected to a marker fall back to twice the Euclidean distance
+    unreachable = np.isinf(matrix)
+    if unreachable.any():
+        euclidean = euclideanDistanceMatrix(mesh.points, vertexMarkers)
+        matrix[unreachable] = euclidean[unreachable] * 2
+
+    return matrix
+
+'''
+Weight of the geodesic distance of every vertex for the hybrid technique: 1 in
+the geodesic areas, Gaussian falloff of the distance to the areas outside.
+'''
+def hybridWeights(points, geodesicVertices, chunkSize=4096, context=None):
+
+    context = getContext(context)
+
+    geodesicVertices = np.asarray(geodesicVertices, dtype=np.int64)
+    weights = np.ones(points.shape[0])
+
+    if geodesicVertices.shape[0] == 0:
+        return np.zeros(points.shape[0])
+
+    areaPoints = points[geodesicVertices]
+    inArea = np.zeros(points.shape[0], dtype=bool)
+    inArea[geodesicVertices] = True
+
+    outside = np.nonzero(~inArea)[0]
+
+    context.stage("hybrid", outside.shape[0], "Calculating Hybrid dist. matrix")
+
+    for start in range(0, outside.shape[0], chunkSize):
+        block = outside[start:start+chunkSize]
+        dist = np.sqrt(((points[block][:, None, :] - areaPoints[None, :, :])**2).sum(axis=2).min(axis=1))
+        weights[block] = np.exp(-(dist**2 / 2.0**2))
+        context.advance(block.shape[0])
+
+    return weights
+
+'''
+Hybrid distance from the Euclidean and geodesic matrices
+'''
+@profiled("distances.hybrid")
+def hybridDistanceMatrix(points, eucMatrix, geoMatrix, geodesicVertices, weights=None, context=None):
+
+    if weights is None:
+        weights = hybridWeights(points, geodesicVertices, context=context)
+
+    w = weights[:, None]
+    matrix = geoMatrix * w + eucMatrix * (1 - w)
+
+    euclideanRows = weights < 0.6
+    matrix[euclideanRows] = eucMatrix[euclideanRows]
+
+    return matrix
+
+'''
+Calculate the distance matrix of the given RBF technique (the hybrid weights
+can be given to skip calculating them)
+'''
+def distanceMatrix(mesh, vertexMarkers, method, geodesicVertices=None, processes=1, context=None, weights=None):
+
+    method = getMethodCode(method)
+
+    if method == kEuclidean:
+        return euclideanDistanceMatrix(mesh.points, vertexMarkers, context)
+
+    if method == kGeodesics:
+        return geodesicDistanceMatrix(mesh, vertexMarkers, processes=processes, context=context)
+
+    euc = euclideanDistanceMatrix(mesh.points, vertexMarkers, context)
+    geo = geodesicDistanceMatrix(mesh, vertexMarkers, processes=processes, context=context)
+
+    return hybridDistanceMatrix(mesh.points, euc, geo, geodesicVertices if geodesicVertices is not None else [], weights, context)
+
+'''
+Distance of every vertex to one vertex with the given RBF technique (the
+column of a marker matched with that vertex). The edge graph and the hybrid
+weights can be given to skip building them.
+'''
+def distanceColumn(mesh, vertex, method, geodesicVertices=None, graph=None, weights=None):
+
+    method = getMethodCode(method)
+
+    euc = np.linalg.norm(mesh.points - mesh.points[int(vertex)], axis=1)
+    if method == kEuclidean:
+        return euc
+
+    if graph is None:
+        graph = buildEdgeGraph(mesh)
+
+    geo = geodesicColumns(graph, [vertex])[:, 0]
+    unreachable = np.isinf(geo)
+    geo[unreachable] = euc[unreachable] * 2
+
+    if method == kGeodesics:
+        return geo
+
+    return hybridDistanceMatrix(mesh.points, euc[:, None], geo[:, None], geodesicVertices if geodesicVertices is not None else [], weights)[:, 0]
+
+'''
+Read a distance matrix file (.mtx, one value per line, row by row)
+'''
+@profiled("distances.read")
+def readDistanceMatrix(path, nVert, nMarkers):
+
+    with open(path, 'r') as matrixFile:
+        values = np.array(matrixFile.read().split(), dtype=np.float64)
+
+    if values.shape[0] != nVert * nMarkers:
+        raise ValueError("Matrix file " + path + " has " + str(values.shape[0]) + " values, expected " + str(nVert) + "x" + str(nMarkers))
+
+    return values.reshape(nVert, nMarkers)
+
+'''
+Write a distance matrix file (.mtx, one value per line, row by row)
+'''
+@profiled("distances.write")
+def writeDistanceMatrix(path, matrix):
+
+    folder = os.path.dirname(path)
+    if folder and not os.path.exists(folder):
+        os.makedirs(folder)
+
+    np.savetxt(path, np.asarray(matrix).reshape(-1, 1), fmt="%.12g")
+
+'''
+Load the distance matrix of the RBF technique from a matrix folder, returns
+None if the file does not exist
+'''
+def loadDistanceMatrix(folder, method, nVert, nMarkers):
+
+    path = os.path.join(folder, kMatrixFileNames[getMethodCode(method)])
+
+    if not os.path.exists(path):
+        return None
+
+    return readDistanceMatrix(path, nVert, nMarkers)
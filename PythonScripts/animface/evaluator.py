@@ -0,0 +1,229 @@
+'''
+
+Miguel Ramos Carretero
+Bournemouth University 2018
+
+Python module:
+On-demand evaluation of the frames of a take (or of the marker trajectories of
+a scene) with a built solver, to review an animation before baking it. Any
+frame, also between two keys, is deformed when it is asked for. The deformed
+frames are kept in a bounded LRU cache, and the frames ahead in the direction
+the artist scrubs are deformed in advance on a worker thread.
+
+'''
+
+import threading
+from collections import OrderedDict
+import numpy as np
+
+#Memory of the deformed frames kept by an evaluator
+kDefaultCacheMB = 256
+
+#Frames deformed in advance in the scrub direction, and per solve
+kPrefetchFrames = 8
+kPrefetchBatch = 4
+
+#Frames closer than this are the same frame of the cache
+kFrameResolution = 1e-3
+
+'''
+Marker trajectories of a MoCap take, relative to its rest frame
+'''
+class TakeTrajectories(object):
+
+    def __init__(self, take, mocapNames, restFrame=0):
+        self.take = take
+        self.mocapNames = list(mocapNames)
+        self.rest = take.positions([restFrame], self.mocapNames)[0]
+
+    def frameRange(self):
+        return self.take.frameRange()
+
+    def displacements(self, frames):
+        ''' Displacement (F x M x 3) of the markers at the given frames. '''
+        return self.take.positions(frames, self.mocapNames) - self.rest[None, :, :]
+
+'''
+Marker displacements known at some frames (e.g. read from a scene), linearly
+interpolated in between
+'''
+class SampledTrajectories(object):
+
+    def __init__(self, frames, displacements):
+        self.frames = np.asarray(frames, dtype=np.float64)
+        self.values = np.asarray(displacements, dtype=np.float64)
+
+    def frameRange(self):
+        return self.frames[0], self.frames[-1]
+
+    def displacements(self, frames):
+        ''' Displacement (F x M x 3) of the markers at the given frames. '''
+
+        frames = np.clip(np.asarray(frames, dtype=np.float64), self.frames[0], self.frames[-1])
+
+        if self.frames.shape[0] == 1:
+            return np.repeat(self.values, frames.shape[0], axis=0)
+
+        upper = np.clip(np.searchsorted(self.frames, frames, side='right'), 1, self.frames.shape[0] - 1)
+        lower = upper - 1
+        t = ((frames - self.frames[lower]) / (self.frames[upper] - self.frames[lower]))[:, None, None]
+
+        return self.values[lower] * (1 - t) + self.values[upper] * t
+
+'''
+Deforms the frames of some trajectories with a solver on request. Frames are
+clamped to the range of the trajectories. The returned arrays (V x 3) are
+shared with the cache and read only.
+'''
+class FrameEvaluator(object):
+
+    def __init__(self, solver, trajectories, cacheBytes=None, prefetch=kPrefetchFrames, resolution=kFrameResolution):
+
+        self.solver = solver
+        self.trajectories = trajectories
+        self.first, self.last = trajectories.frameRange()
+        self.resolution = resolution
+        self.prefetch = prefetch
+
+        if cacheBytes is None:
+            cacheBytes = kDefaultCacheMB * 1024 * 1024
+        frameBytes = solver.nVert * 3 * np.dtype(solver.dtype).itemsize
+        self.capacity = max(prefetch + kPrefetchBatch + 1, int(cacheBytes // frameBytes))
+
+        self.frames = OrderedDict()
+        self.wanted = []
+        self.computing = set()
+        self.condition = threading.Condition()
+        self.closed = False
+
+        self.lastFrame = None
+        self.direction = 1.0
+        self.step = 1.0
+
+        self.hits = 0
+        self.misses = 0
+        self.prefetched = 0
+
+        self.worker = None
+        if prefetch > 0:
+            self.worker = threading.Thread(target=self._prefetchLoop, name="animface-prefetch")
+            self.worker.daemon = True
+            self.worker.start()
+
+    def frameKey(self, frame):
+        ''' Key of a frame in the cache (the frame clamped to the range, in units of the resolution). '''
+        return int(round(min(max(float(frame), self.first), self.last) / self.resolution))
+
+    def deformKeys(self, keys):
+        ''' Deformation of the frames of some keys in one solve (F x V x 3). '''
+        frames = np.array(keys, dtype=np.float64) * self.resolution
+        return self.solver.deform(self.trajectories.displacements(frames))
+
+    def _store(self, keys, deformations):
+        ''' Keeps deformed frames, dropping the least recently used ones. Called with the condition held. '''
+
+        for key, deformation in zip(keys, deformations):
+            deformation.flags.writeable = False
+            self.frames[key] = deformation
+            self.frames.move_to_end(key)
+
+        while len(self.frames) > self.capacity:
+            self.frames.popitem(last=False)
+
+    def evaluate(self, frame):
+        ''' Displacement of the vertices (V x 3) at a frame. '''
+
+        key = self.frameKey(frame)
+
+        with self.condition:
+
+            #Frame being deformed ahead: wait for it
+            while key in self.computing:
+                self.condition.wait()
+
+            deformation = self.frames.get(key)
+            if deformation is not None:
+                self.frames.move_to_end(key)
+                self.hits += 1
+            else:
+                self.misses += 1
+                if key in self.wanted:
+                    self.wanted.remove(key)
+
+        if deformation is None:
+            deformation = np.array(self.deformKeys([key])[0])
+            with self.condition:
+                self._store([key], [deformation])
+
+        self._schedule(key)
+
+        return deformation
+
+    def evaluateFrames(self, frames):
+        ''' Displacement of the vertices (F x V x 3) at some frames. '''
+        return np.stack([self.evaluate(frame) for frame in frames])
+
+    def _schedule(self, key):
+        ''' Frames ahead in the scrub direction, replacing the ones not deformed yet. '''
+
+        if self.worker is None:
+            return
+
+        if self.lastFrame is not None and key != self.lastFrame:
+            delta = (key - self.lastFrame) * self.resolution
+            self.direction = 1.0 if delta > 0 else -1.0
+            self.step = min(max(abs(delta), self.resolution), 1.0)
+        self.lastFrame = key
+
+        frame = key * self.resolution
+        ahead = [self.frameKey(frame + self.direction * self.step * k) for k in range(1, self.prefetch + 1)]
+
+        with self.condition:
+            wanted = []
+            for aheadKey in ahead:
+                if aheadKey not in self.frames and aheadKey not in self.computing and aheadKey not in wanted:
+                    wanted.append(aheadKey)
+            self.wanted = wanted
+            self.condition.notify_all()
+
+    def _prefetchLoop(self):
+        ''' Worker thread: deforms the wanted frames by small batches. '''
+
+        while True:
+
+            with self.condition:
+                while not self.wanted and not self.closed:
+                    self.condition.wait()
+                if self.closed:
+                    return
+                keys = self.wanted[:kPrefetchBatch]
+                self.wanted = self.wanted[kPrefetchBatch:]
+                self.computing.update(keys)
+
+            try:
+                deformations = [np.array(d) for d in self.deformKeys(keys)]
+            except Exception:
+                deformations = None
+
+            with self.condition:
+                self.computing.difference_update(keys)
+                if deformations is not None:
+                    self._store(keys, deformations)
+                    self.prefetched += len(keys)
+                self.condition.notify_all()
+
+    def stats(self):
+        with self.condition:
+            return {"frames": len(self.frames), "capacity": self.capacity, "hits": self.hits, "misses": self.misses, "prefetched": self.prefetched}
+
+    def close(self):
+        ''' Stops the worker thread. '''
+
+        with self.condition:
+            self.closed = True
+            self.wanted = []
+            self.condition.notify_all()
+
+        if self.worker is not None:
+            self.worker.join()
+            self.worker = None
@@ -0,0 +1,370 @@
+'''
+
+Miguel Ramos Carretero
+Bournemouth University 2018
+
+Python module:
+Distance matrices calculated by several farm nodes through a work queue kept
+in a folder of a shared file system. No server is needed: the state of every
+work item is the folder its file is in, and every change of state is an
+atomic rename, so only one node wins a claim.
+
+    manifest.json                  marker vertices, geodesic areas, items, output
+    mesh.points.npy ...            the mesh, so the nodes need no scene or mesh file
+    todo/item-00000.json           geodesic columns of a group of markers
+    leased/item-00000.json.<node>  claimed by a node, its time stamp is the heartbeat
+    results/item-00000.npy         V x k geodesic columns of the item
+    done/item-00000.json
+
+A worker claims an item by renaming it from todo into leased, touches the
+lease while it runs the Dijkstra searches, writes the result under a
+temporary name and renames it into results, then moves the lease into done.
+A lease not touched for longer than the timeout (a node that died) is renamed
+back into todo by any worker. A late result of an expired lease is the same
+as the new one, so it is kept. The merge step reads the columns in marker
+order, adds the Euclidean and hybrid matrices (cheap, calculated in full) and
+writes the matrix files. With a symmetric mesh only the columns of one side
+are published, and the merge mirrors the others (animface.symmetry).
+
+'''
+
+import os
+import time
+import json
+import socket
+import threading
+import numpy as np
+
+from animface import distances
+from animface import meshio
+from animface import symmetry
+from animface import precision as storage
+from animface.profiler import profiled
+from animface.tasks import getContext
+
+kManifestFile = "manifest.json"
+kMeshPrefix = "mesh"
+kMirrorFile = "mirror.npy"
+
+kTodo = "todo"
+kLeased = "leased"
+kResults = "results"
+kDone = "done"
+
+kStates = (kTodo, kLeased, kResults, kDone)
+
+#Markers per work item (one Dijkstra run each)
+kItemColumns = 4
+
+#Seconds between two touches of a lease, and age of a lease taken as dead
+kHeartbeat = 10.0
+kLeaseTimeout = 120.0
+
+#Seconds a worker waits for the leases of the other nodes before checking again
+kPollInterval = 2.0
+
+'''
+Name of a worker node: host and process
+'''
+def workerName():
+    return socket.gethostname().replace(".", "_") + "-" + str(os.getpid())
+
+'''
+Name of the file of a work item
+'''
+def itemName(index):
+    return "item-" + str(index).zfill(5) + ".json"
+
+'''
+Name of the file of the columns of a work item
+'''
+def resultName(index):
+    return "item-" + str(index).zfill(5) + ".npy"
+
+'''
+Write a file under a temporary name first and rename it, so the other nodes
+never see a partial file
+'''
+def _writeAtomic(path, write):
+
+    temporary = path + "." + workerName() + ".tmp"
+    with open(temporary, 'wb') as outFile:
+        write(outFile)
+    os.replace(temporary, path)
+
+'''
+Publish the geodesic columns of the markers of a mesh as work items of a new
+queue folder. The Euclidean and hybrid matrices are calculated by the merge.
+With a mesh symmetry, only its calculated markers are published.
+'''
+def publishQueue(folder, mesh, vertexMarkers, geodesicVertices=None, outputFolder=None, precision=storage.kFloat64, itemColumns=kItemColumns, meshSymmetry=None):
+
+    if os.path.exists(os.path.join(folder, kManifestFile)):
+        raise ValueError("The folder already has a work queue: " + folder)
+
+    for state in kStates:
+        stateFolder = os.path.join(folder, state)
+        if not os.path.exists(stateFolder):
+            os.makedirs(stateFolder)
+
+    meshio.writeMeshArrays(os.path.join(folder, kMeshPrefix), mesh)
+
+    vertexMarkers = [int(v) for v in vertexMarkers]
+    markers = list(range(len(vertexMarkers)))
+    markerMirror = None
+
+    if meshSymmetry is not None and meshSymmetry.symmetric:
+        markers = [int(m) for m in meshSymmetry.calculated]
+        markerMirror = [int(m) for m in meshSymmetry.markerMirror]
+        _writeAtomic(os.path.join(folder, kMirrorFile), lambda outFile: np.save(outFile, meshSymmetry.vertexMirror))
+
+    itemColumns = max(1, int(itemColumns))
+    items = [markers[start:start+itemColumns] for start in range(0, len(markers), itemColumns)]
+
+    for i in range(len(items)):
+        item = {"index": i, "markers": items[i], "sources": [vertexMarkers[m] for m in items[i]]}
+        _writeAtomic(os.path.join(folder, kTodo, itemName(i)), lambda outFile: outFile.write(json.dumps(item).encode("utf-8")))
+
+    manifest = {"signature": mesh.signature(), "name": mesh.name, "vertexMarkers": vertexMarkers,
+                "geodesicVertices": [int(v) for v in (geodesicVertices if geodesicVertices is not None else [])],
+                "items": len(items), "output": outputFolder, "precision": storage.getPrecision(precision),
+                "symmetric": meshSymmetry is not None and meshSymmetry.symmetric, "markerMirror": markerMirror, "created": time.time()}
+
+    #The manifest comes last: a queue without it is not published yet
+    _writeAtomic(os.path.join(folder, kManifestFile), lambda outFile: outFile.write(json.dumps(manifest, indent=4).encode("utf-8")))
+
+    return manifest
+
+'''
+Thread touching a lease file while its item is calculated. lost is set when
+the lease was taken back by another node.
+'''
+class Heartbeat(object):
+
+    def __init__(self, path, interval=kHeartbeat):
+        self.path = path
+        self.interval = interval
+        self.lost = False
+        self.stopEvent = threading.Event()
+        self.thread = threading.Thread(target=self._run)
+        self.thread.daemon = True
+
+    def _run(self):
+        while not self.stopEvent.wait(self.interval):
+            try:
+                os.utime(self.path, None)
+            except OSError:
+                self.lost = True
+                return
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stopEvent.set()
+        self.thread.join()
+
+'''
+Work queue in a shared folder (published by publishQueue)
+'''
+class WorkQueue(object):
+
+    def __init__(self, folder):
+
+        self.folder = folder
+
+        manifestPath = os.path.join(folder, kManifestFile)
+        if not os.path.exists(manifestPath):
+            raise ValueError("No work queue published in: " + folder)
+
+        with open(manifestPath, 'r') as manifestFile:
+            self.manifest = json.load(manifestFile)
+
+    def path(self, state, name=""):
+        return os.path.join(self.folder, state, name)
+
+    def items(self, state):
+        ''' File names of the items in a state, sorted. '''
+        return sorted([name for name in os.listdir(self.path(state)) if not name.endswith(".tmp")])
+
+    def readMesh(self):
+        ''' Mesh of the queue (memory mapped), checked against the manifest. '''
+
+        mesh = meshio.readMeshArrays(os.path.join(self.folder, kMeshPrefix), self.manifest["name"])
+        if mesh is None or mesh.signature() != self.manifest["signature"]:
+            raise ValueError("The mesh of the work queue is missing or does not match its manifest: " + self.folder)
+
+        return mesh
+
+    def claim(self, worker):
+        ''' Lease the first item left to do, None if there is none. Returns (item, lease path). '''
+
+        for name in self.items(kTodo):
+            leasePath = self.path(kLeased, name + "." + worker)
+            try:
+                os.rename(self.path(kTodo, name), leasePath)
+                os.utime(leasePath, None)
+                with open(leasePath, 'r') as itemFile:
+                    return json.load(itemFile), leasePath
+            except OSError:
+                #Taken by another node, or taken back before the first heartbeat
+                continue
+
+        return None
+
+    def release(self, leasePath):
+        ''' Put a leased item back into todo (its calculation failed). '''
+        try:
+            os.rename(leasePath, self.path(kTodo, self._leaseItem(leasePath)))
+        except OSError:
+            pass
+
+    def complete(self, item, leasePath, columns):
+        ''' Save the columns of an item and move its lease into done. '''
+
+        name = itemName(item["index"])
+        _writeAtomic(self.path(kResults, resultName(item["index"])), lambda outFile: np.save(outFile, columns))
+
+        #A lease taken back by another node is in todo again (or leased): the result is there already
+        for source in (leasePath, self.path(kTodo, name)):
+            try:
+                os.rename(source, self.path(kDone, name))
+                return
+            except OSError:
+                pass
+
+    def hasResult(self, item):
+        return os.path.exists(self.path(kResults, resultName(item["index"])))
+
+    def requeueExpired(self, timeout=kLeaseTimeout):
+        ''' Put back into todo the leases not touched for longer than timeout. Returns how many. '''
+
+        requeued = 0
+        now = time.time()
+
+        for name in self.items(kLeased):
+            leasePath = self.path(kLeased, name)
+            try:
+                if now - os.path.getmtime(leasePath) <= timeout:
+                    continue
+                os.rename(leasePath, self.path(kTodo, self._leaseItem(leasePath)))
+                requeued += 1
+            except OSError:
+                continue
+
+        return requeued
+
+    def status(self):
+        ''' Number of items in every state, and the nodes holding leases. '''
+
+        leased = self.items(kLeased)
+        return {"items": self.manifest["items"], "todo": len(self.items(kTodo)), "leased": len(leased),
+                "done": len(self.items(kDone)), "workers": sorted(set([name.split(".json.", 1)[1] for name in leased]))}
+
+    def finished(self):
+        return len(self.items(kDone)) >= self.manifest["items"]
+
+    def _leaseItem(self, leasePath):
+        return os.path.basename(leasePath).split(".json.", 1)[0] + ".json"
+
+'''
+Run a worker node on a queue until every item is done: claim an item, run
+its Dijkstra searches under a heartbeat, save the columns, repeat. Expired
+leases of dead nodes are taken back. Returns the number of items calculated.
+'''
+def runWorker(folder, worker=None, processes=1, heartbeat=kHeartbeat, leaseTimeout=kLeaseTimeout, pollInterval=kPollInterval, context=None):
+
+    context = getContext(context)
+    worker = worker or workerName()
+
+    queue = WorkQueue(folder)
+    mesh = queue.readMesh()
+    graph = distances.buildEdgeGraph(mesh)
+
+    calculated = 0
+
+    while True:
+
+        context.check()
+        queue.requeueExpired(leaseTimeout)
+
+        claimed = queue.claim(worker)
+        if claimed is None:
+            if queue.finished():
+                return calculated
+            time.sleep(pollInterval)
+            continue
+
+        item, leasePath = claimed
+
+        #A late result of an expired lease may be there already
+        if queue.hasResult(item):
+            queue.complete(item, leasePath, np.load(queue.path(kResults, resultName(item["index"]))))
+            continue
+
+        try:
+            with Heartbeat(leasePath, heartbeat) as beat:
+                columns = distances.geodesicDistanceMatrix(mesh, item["sources"], graph, processes, context)
+        except BaseException:
+            queue.release(leasePath)
+            raise
+
+        queue.complete(item, leasePath, columns)
+        calculated += 1
+
+        print("Worker " + worker + ": item " + str(item["index"]) + " (" + str(len(item["sources"])) + " columns)" + (" after its lease expired" if beat.lost else ""))
+
+'''
+Assemble the matrices of a finished queue: the geodesic columns of the items
+(mirrored for a symmetric mesh) and the Euclidean and hybrid matrices, saved
+into the output folder in the precision of the queue. Returns the folder.
+'''
+@profiled("farmqueue.merge")
+def mergeQueue(folder, outputFolder=None, precision=None, context=None):
+
+    queue = WorkQueue(folder)
+    manifest = queue.manifest
+
+    status = queue.status()
+    if status["done"] < status["items"]:
+        raise ValueError("The work queue is not finished: " + str(status["done"]) + " of " + str(status["items"]) + " items done")
+
+    outputFolder = outputFolder or manifest["output"]
+    if not outputFolder:
+        raise ValueError("No output folder for the matrices of the work queue")
+
+    precision = precision or manifest["precision"]
+
+    mesh = queue.readMesh()
+    vertexMarkers = manifest["vertexMarkers"]
+
+    parts = [np.load(queue.path(kResults, resultName(i))) for i in range(manifest["items"])]
+    columns = np.concatenate(parts, axis=1) if parts else np.zeros((mesh.nVert, 0))
+
+    if manifest["symmetric"]:
+        meshSymmetry = symmetry.MeshSymmetry(mesh, vertexMarkers, np.load(os.path.join(folder, kMirrorFile)), manifest.get("markerMirror"))
+        if not meshSymmetry.symmetric or columns.shape[1] != meshSymmetry.calculated.shape[0]:
+            raise ValueError("The mirror map of the work queue does not match its results: " + folder)
+        geo = meshSymmetry.fill(columns)
+    else:
+        geo = columns
+
+    euc = distances.euclideanDistanceMatrix(mesh.points, vertexMarkers, context)
+    hyb = distances.hybridDistanceMatrix(mesh.points, euc, geo, manifest["geodesicVertices"], context=context)
+
+    for method, matrix in ((distances.kEuclidean, euc), (distances.kGeodesics, geo), (distances.kHybrid, hyb)):
+        storage.saveMatrix(outputFolder, method, storage.storeMatrix(matrix, precision))
+
+    return outputFolder
+
+'''
+Print the state of a queue
+'''
+def printQueueStatus(status):
+
+    print("------------------------------")
+    print("Work items: " + str(status["items"]) + " (" + str(status["todo"]) + " to do, " + str(status["leased"]) + " leased, " + str(status["done"]) + " done)")
+    if status["workers"]:
+        print("Workers: " + ", ".join(status["workers"]))
+    print("------------------------------")
@@ -0,0 +1,228 @@
+'''
+
+Miguel Ramos Carretero
+Bournemouth University 2018
+
+Python module:
+Fast evaluation of the Gaussian RBF sums of the Euclidean technique. The
+Gaussian of a marker is below a tolerance past a radius:
+
+    exp(-d^2 / s^2) < tolerance    for    d > s * sqrt(-ln(tolerance))
+
+so a vertex only needs the markers within that radius. A k-d tree of the
+vertices finds them (a range query per marker), and the RBF of the vertices
+becomes a sparse matrix with the exact Gaussians of the pairs kept. Evaluating
+the sums of a frame then costs O(kept pairs) instead of O(V M), and no
+distance matrix is built. The error bound is the tolerance times the sum of
+the absolute weights: every dropped pair weighs less than tolerance times the
+weight of its marker.
+
+With few markers, with Gaussians wide enough to keep most of the pairs, or
+without SciPy, the RBF of the vertices is dense and calculated from the points
+(exact evaluation).
+
+'''
+
+import numpy as np
+
+from animface import precision as storage
+from animface.profiler import profiled
+from animface.rbf import RBFSolver, calculateGaussianRBF, buildKernel, kNormalized, kExact
+from animface.tasks import getContext
+
+try:
+    import scipy.sparse
+    import scipy.spatial
+    _hasScipy = True
+except ImportError:
+    _hasScipy = False
+
+#Default bound of a dropped Gaussian (relative to the weight of its marker)
+kDefaultTolerance = 1e-6
+
+#Fewer markers than this are evaluated dense
+kMinTreeMarkers = 64
+
+#Largest fraction of kept pairs evaluated sparse (a sparse product is slower per pair)
+kMaxTreeDensity = 0.1
+
+#Vertices of the dense RBF calculated per block
+kDenseRows = 16384
+
+'''
+Radius past which the Gaussian of every marker is below the tolerance
+'''
+def cutoffRadii(stiffnessValues, tolerance):
+    return np.asarray(stiffnessValues, dtype=np.float64) * np.sqrt(-np.log(tolerance))
+
+'''
+Dense RBF of the vertices (V x M) calculated from the points, by blocks of
+vertices
+'''
+def denseGaussians(points, markerPoints, stiffnessValues, dtype=np.float64):
+
+    scale = 1.0 / np.square(np.asarray(stiffnessValues, dtype=np.float64))[None, :]
+    markerSquares = np.square(markerPoints).sum(axis=1)[None, :]
+    phi = np.empty((points.shape[0], markerPoints.shape[0]), dtype=dtype)
+
+    for start in range(0, points.shape[0], kDenseRows):
+        block = points[start:start+kDenseRows]
+        #|p - m|^2 = |p|^2 + |m|^2 - 2 p.m, one matrix product per block
+        squared = np.square(block).sum(axis=1)[:, None] + markerSquares - 2.0 * block.dot(markerPoints.T)
+        phi[start:start+block.shape[0]] = np.exp(-np.maximum(squared, 0.0) * scale)
+
+    return phi
+
+'''
+Sparse RBF of the vertices (V x M, CSR) with the pairs closer than the radius
+of their marker, found with a k-d tree of the vertices
+'''
+def truncatedGaussians(tree, points, markerPoints, stiffnessValues, radii, dtype=np.float64):
+
+    stiffness = np.asarray(stiffnessValues, dtype=np.float64)
+    neighbours = tree.query_ball_point(markerPoints, radii, return_sorted=False)
+
+    counts = np.array([len(vertices) for vertices in neighbours], dtype=np.int64)
+    rows = np.concatenate([np.asarray(vertices, dtype=np.int64) for vertices in neighbours]) if counts.sum() else np.zeros(0, dtype=np.int64)
+    columns = np.repeat(np.arange(markerPoints.shape[0]), counts)
+
+    offsets = points[rows] - markerPoints[columns]
+    values = np.exp(-np.einsum('ij,ij->i', offsets, offsets) / np.square(stiffness[columns])).astype(dtype)
+
+    #The pairs come marker by marker: the columns of a CSC matrix
+    columnStarts = np.concatenate([[0], np.cumsum(counts)])
+    return scipy.sparse.csc_matrix((values, rows, columnStarts), shape=(points.shape[0], markerPoints.shape[0])).tocsr()
+
+'''
+RBF solver of the Euclidean technique evaluating truncated Gaussian sums. The
+points of the mesh replace the distance matrix; the kernel, its factorization
+and the solve are the ones of RBFSolver. The stiffness of a marker and the
+vertex of a marker can be changed afterwards (the RBF of the vertices is then
+calculated again, in near-linear time).
+'''
+class TreeSolver(RBFSolver):
+
+    @profiled("fastgauss.kernel")
+    def __init__(self, points, vertexMarkers, stiffnessValues, mode=kNormalized, tolerance=None, precision=storage.kFloat64, context=None):
+
+        if mode not in (kNormalized, kExact):
+            raise ValueError("Unknown solve mode: " + str(mode))
+
+        if tolerance is None:
+            tolerance = kDefaultTolerance
+        if not 0.0 < tolerance < 1.0:
+            raise ValueError("The tolerance of the Gaussian sums must be between 0 and 1, got " + str(tolerance))
+
+        self.mode = mode
+        self.precision = storage.getPrecision(precision)
+        self.tolerance = float(tolerance)
+        self.points = np.asarray(points, dtype=np.float64)
+        self.distances = None
+        self.vertexMarkers = np.asarray(vertexMarkers, dtype=np.int64)
+        self.stiffness = np.asarray(stiffnessValues, dtype=np.float64)
+
+        if self.stiffness.shape[0] != self.vertexMarkers.shape[0]:
+            raise ValueError("Expected " + str(self.vertexMarkers.shape[0]) + " stiffness values, got " + str(self.stiffness.shape[0]))
+
+        self.tree = None
+
+        self.markerDistances = self.euclideanMarkerDistances()
+        if mode == kNormalized:
+            self.kernel = buildKernel(self.markerDistances, self.stiffness)
+        else:
+            self.kernel = calculateGaussianRBF(self.markerDistances, self.stiffness[None, :])
+
+        self.dtype = self.evaluationDtype()
+        self.buildPhi(context)
+
+        self.factorize()
+
+    def euclideanMarkerDistances(self):
+        ''' Distances between the marker vertices (M x M). '''
+        markerPoints = self.points[self.vertexMarkers]
+        return np.linalg.norm(markerPoints[:, None, :] - markerPoints[None, :, :], axis=2)
+
+    @property
+    def nMarkers(self):
+        return self.vertexMarkers.shape[0]
+
+    def buildPhi(self, context=None):
+        ''' RBF of the vertices: sparse if the tree keeps few enough pairs, dense otherwise. '''
+
+        context = getContext(context)
+        context.stage("gaussians", 1, "Calculating RBF of the vertices")
+
+        markerPoints = self.points[self.vertexMarkers]
+        nPairs = float(self.points.shape[0] * self.nMarkers)
+
+        self.sparse = False
+        self.density = 1.0
+
+        if _hasScipy and self.nMarkers >= kMinTreeMarkers:
+            if self.tree is None:
+                self.tree = scipy.spatial.cKDTree(self.points)
+            radii = cutoffRadii(self.stiffness, self.tolerance)
+            kept = self.tree.query_ball_point(markerPoints, radii, return_length=True).sum()
+            self.density = kept / nPairs
+            if self.density <= kMaxTreeDensity:
+                self.phi = truncatedGaussians(self.tree, self.points, markerPoints, self.stiffness, radii, self.dtype)
+                self.sparse = True
+
+        if not self.sparse:
+            self.phi = denseGaussians(self.points, markerPoints, self.stiffness, self.dtype)
+
+        context.advance()
+
+    def updatePhi(self, marker):
+        ''' RBF of the vertices calculated again (the kept pairs of the marker change). '''
+        self.dtype = self.evaluationDtype()
+        self.buildPhi()
+
+    def moveMarker(self, marker, vertex, distances=None):
+        ''' Matches a marker with another vertex (the distances come from the points). '''
+
+        self.vertexMarkers[marker] = int(vertex)
+        self.markerDistances = self.euclideanMarkerDistances()
+
+        self.updateKernel(marker)
+        self.updatePhi(marker)
+
+    def errorBound(self, weights):
+        ''' Largest error of a displacement (per coordinate) for some weights (M x 3 or F x M x 3). '''
+
+        if not self.sparse:
+            return 0.0
+
+        return self.tolerance * float(np.abs(np.asarray(weights)).sum(axis=-2).max())
+
+    @profiled("fastgauss.evaluate")
+    def evaluate(self, weights):
+        ''' Displacement of the vertices, weights are M x 3 or F x M x 3. '''
+
+        if not self.sparse:
+            return RBFSolver.evaluate(self, weights)
+
+        weights = np.asarray(weights, dtype=self.dtype)
+
+        if weights.ndim == 2:
+            return np.asarray(self.phi.dot(weights))
+
+        #All the frames in a single sparse product: (V x M) . (M x 3F)
+        nFrames = weights.shape[0]
+        flat = weights.transpose(1, 0, 2).reshape(self.nMarkers, nFrames * 3)
+
+        return np.asarray(self.phi.dot(flat)).reshape(self.nVert, nFrames, 3).transpose(1, 0, 2)
+
+'''
+Print how a tree solver evaluates its sums
+'''
+def printTreeSolver(solver):
+
+    if solver.sparse:
+        print("Gaussian sums: k-d tree, " + ("%.1f" % (solver.density * 100.0)) + "% of the pairs kept, error bound " + ("%.0e" % solver.tolerance) + " of the weights")
+    elif not _hasScipy:
+        print("Gaussian sums: dense (SciPy is not available)")
+    elif solver.nMarkers < kMinTreeMarkers:
+        print("Gaussian sums: dense (fewer than " + str(kMinTreeMarkers) + " markers)")
+    else:
+        print("Gaussian sums: dense (" + ("%.1f" % (solver.density * 100.0)) + "% of the pairs within the radius of the tolerance)")
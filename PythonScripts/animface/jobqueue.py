@@ -0,0 +1,243 @@
+'''
+
+Miguel Ramos Carretero
+Bournemouth University 2018
+
+Python module:
+Queue of background jobs (distance matrices, animations, bakes). Every job is
+split in three parts:
+
+    gather:  reads the scene, runs on the main thread when the job is created
+    compute: runs on a worker thread, only talks to the engines
+    apply:   writes the results into the scene, runs on the main thread
+
+The compute part reports its progress (stage, steps, ETA) through a task
+context, so the window can show it while the artist keeps working.
+
+'''
+
+import time
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+from animface import tasks
+
+kQueued = "queued"
+kRunning = "running"
+kApplying = "applying"
+kDone = "done"
+kFailed = "failed"
+kCancelled = "cancelled"
+
+kFinishedStates = (kDone, kFailed, kCancelled)
+
+'''
+One job of the queue. compute(context) returns the result given to apply,
+which may return a generator: every step of it runs as a separate call on the
+main thread, so long scene writes do not freeze Maya.
+'''
+class Job(object):
+
+    _lastId = 0
+    _idLock = threading.Lock()
+
+    def __init__(self, name, compute, apply=None, applySteps=0):
+
+        with Job._idLock:
+            Job._lastId += 1
+            self.id = Job._lastId
+
+        self.name = name
+        self.compute = compute
+        self.apply = apply
+        self.applySteps = applySteps
+
+        self.status = kQueued
+        self.stage = None
+        self.stageStatus = None
+        self.done = 0
+        self.total = 0
+        self.eta = None
+        self.error = None
+        self.result = None
+
+        self.token = tasks.CancellationToken()
+        self.submitted = time.time()
+        self.started = None
+        self.finished = None
+
+    def progress(self):
+        ''' Fraction of the current stage (0 to 1), None if unknown. '''
+        if not self.total:
+            return None
+        return min(1.0, float(self.done) / float(self.total))
+
+    def describe(self):
+        ''' One line summary of the job for the window. '''
+
+        text = "#" + str(self.id) + " " + self.name + ": " + self.status
+
+        if self.status in (kRunning, kApplying):
+            text += " - " + (self.stageStatus or self.stage or "")
+            fraction = self.progress()
+            if fraction is not None:
+                text += " " + str(int(fraction * 100)) + "%"
+            if self.eta is not None:
+                text += " (ETA " + formatTime(self.eta) + ")"
+        elif self.status in kFinishedStates and self.started is not None:
+            text += " in " + formatTime(self.finished - self.started)
+
+        if self.error:
+            text += " - " + self.error
+
+        return text
+
+'''
+Format a time in seconds as 1h 02m 03s
+'''
+def formatTime(seconds):
+
+    seconds = int(round(seconds))
+    if seconds < 60:
+        return str(seconds) + "s"
+    if seconds < 3600:
+        return str(seconds // 60) + "m " + str(seconds % 60).zfill(2) + "s"
+
+    return str(seconds // 3600) + "h " + str((seconds % 3600) // 60).zfill(2) + "m"
+
+'''
+Progress sink of a job: keeps the progress in the job and notifies the queue
+'''
+class _JobProgressSink(tasks.NullProgressSink):
+
+    def __init__(self, queue, job, reporter=None):
+        self.queue = queue
+        self.job = job
+        self.reporter = reporter
+
+    def update(self, stage, done, total, status):
+        self.job.stage = stage
+        self.job.stageStatus = status
+        self.job.done = done
+        self.job.total = total
+        self.job.eta = self.reporter.eta() if self.reporter is not None else None
+        self.queue._notify(self.job)
+
+'''
+Background queue of jobs. Jobs run in submission order on the worker threads;
+onChange(job) is called (from any thread) when the state or the progress of a
+job changes.
+'''
+class JobQueue(object):
+
+    def __init__(self, workers=1, onChange=None, rate=tasks.kProgressRate):
+        self.executor = ThreadPoolExecutor(max_workers=max(1, workers))
+        self.onChange = onChange
+        self.rate = rate
+        self.jobList = []
+        self.lock = threading.Lock()
+
+    def submit(self, job):
+
+        with self.lock:
+            self.jobList.append(job)
+
+        self.executor.submit(self._run, job)
+        self._notify(job)
+
+        return job
+
+    def cancel(self, job):
+        ''' Cancels a queued or running job (a running job stops at its next progress report). '''
+
+        job.token.cancel()
+
+        if job.status == kQueued:
+            job.status = kCancelled
+            job.finished = time.time()
+            self._notify(job)
+
+    def jobs(self):
+        with self.lock:
+            return list(self.jobList)
+
+    def activeJobs(self):
+        return [job for job in self.jobs() if not job.status in kFinishedStates]
+
+    def clearFinished(self):
+        with self.lock:
+            self.jobList = [job for job in self.jobList if not job.status in kFinishedStates]
+
+    def shutdown(self, cancel=True):
+        if cancel:
+            for job in self.activeJobs():
+                self.cancel(job)
+        self.executor.shutdown(wait=False)
+
+    def _notify(self, job):
+        if self.onChange is not None:
+            self.onChange(job)
+
+    def _run(self, job):
+
+        if job.token.isCancelled():
+            return
+
+        job.status = kRunning
+        job.started = time.time()
+        self._notify(job)
+
+        reporter = tasks.ProgressReporter(None, self.rate)
+        reporter.sink = _JobProgressSink(self, job, reporter)
+        context = tasks.TaskContext(job.token, reporter)
+
+        try:
+            job.result = job.compute(context)
+
+            if job.apply is not None:
+                job.status = kApplying
+                self._notify(job)
+                self._apply(job, context)
+
+            job.status = kDone
+
+        except tasks.TaskCancelled:
+            job.status = kCancelled
+
+        except Exception as exc:
+            job.status = kFailed
+            job.error = str(exc)
+            traceback.print_exc()
+
+        job.finished = time.time()
+        job.eta = None
+        self._notify(job)
+
+    def _apply(self, job, context):
+        ''' Runs the apply part on the main thread, one call per step. '''
+
+        steps = tasks.applyOnMainThread(job.apply, job.result)
+
+        if steps is None or not hasattr(steps, "__next__"):
+            return
+
+        context.stage("apply", job.applySteps, "Applying results to the scene")
+
+        while True:
+            context.check()
+            if tasks.applyOnMainThread(_nextStep, steps) is _endOfSteps:
+                break
+            context.advance()
+
+_endOfSteps = object()
+
+'''
+Run the next step of a generator, returns _endOfSteps when it is exhausted
+'''
+def _nextStep(steps):
+    try:
+        next(steps)
+    except StopIteration:
+        return _endOfSteps
+    return None
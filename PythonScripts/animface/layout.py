@@ -0,0 +1,195 @@
+'''
+
+Miguel Ramos Carretero
+Bournemouth University 2018
+
+Python module:
+Data-driven marker layouts. A layout is a JSON file describing the markers
+(name, rest position, colour, default stiffness and MoCap name), the groups
+they belong to and the mesh sets used by the Hybrid technique. Every plugin
+reads the active layout instead of hardcoding the marker set.
+
+The order of the markers in the groups (group by group) is the order used by
+the solver and by the stiffness values.
+
+'''
+
+import os
+import json
+
+kDefaultLayoutPath = os.path.join(os.path.dirname(os.path.abspath(__file__)), "layouts", "default.json")
+
+kLayoutEnvVar = "ANIMFACE_LAYOUT"
+
+_activeLayout = None
+
+'''
+Marker layout loaded from a layout definition
+'''
+class MarkerLayout(object):
+
+    def __init__(self, data, path=None):
+
+        validateLayout(data)
+
+        self.path = path
+        self.name = data.get("name", "Unnamed layout")
+        self.rootGroup = data.get("rootGroup", "Markers")
+        self.jointSuffix = data.get("jointSuffix", "_JNT")
+        self.defaultStiffness = data.get("defaultStiffness", 2)
+        self.geodesicAreas = list(data.get("geodesicAreas", []))
+
+        markersByName = {}
+        for marker in data["markers"]:
+            markersByName[marker["name"]] = marker
+
+        #Arrange the markers in solver order (group by group)
+        self.groups = []
+        self.markers = []
+        self._groupOf = {}
+
+        for group in data["groups"]:
+            self.groups.append((group["name"], list(group["markers"])))
+            for name in group["markers"]:
+                self.markers.append(markersByName[name])
+                self._groupOf[name] = group["name"]
+
+        self._indexOf = {}
+        for i in range(len(self.markers)):
+            self._indexOf[self.markers[i]["name"]] = i
+
+    def __len__(self):
+        return len(self.markers)
+
+    def markerNames(self):
+        return [marker["name"] for marker in self.markers]
+
+    def jointName(self, markerName):
+        return markerName + self.jointSuffix
+
+    def jointNames(self):
+        return [self.jointName(marker["name"]) for marker in self.markers]
+
+    def markerFromJoint(self, jointName):
+        ''' Strips the joint suffix (and any DAG path) from a joint name. '''
+        name = jointName.split("|")[-1]
+        if self.jointSuffix and name.endswith(self.jointSuffix):
+            name = name[:-len(self.jointSuffix)]
+        return name
+
+    def indexOf(self, markerName):
+        return self._indexOf[markerName]
+
+    def groupNames(self):
+        return [group[0] for group in self.groups]
+
+    def groupOf(self, markerName):
+        return self._groupOf[markerName]
+
+    def groupIndices(self):
+        ''' Returns the marker indices (solver order) of every group. '''
+        return [[self._indexOf[name] for name in group[1]] for group in self.groups]
+
+    def positions(self):
+        return [list(marker["position"]) for marker in self.markers]
+
+    def colour(self, markerName):
+        return self.markers[self._indexOf[markerName]].get("colour", 17)
+
+    def stiffnessValues(self):
+        return [marker.get("stiffness", self.defaultStiffness) for marker in self.markers]
+
+    def stiffnessString(self):
+        return ",".join([str(s) for s in self.stiffnessValues()])
+
+    def mocapName(self, markerName):
+        return self.markers[self._indexOf[markerName]].get("mocap", markerName)
+
+    def mocapNames(self):
+        return [marker.get("mocap", marker["name"]) for marker in self.markers]
+
+    def hasUIPositions(self):
+        ''' True if every marker carries a position on the face image of the UI. '''
+        for marker in self.markers:
+            if not "ui" in marker:
+                return False
+        return True
+
+'''
+Check that a layout definition is complete and consistent, raises ValueError otherwise
+'''
+def validateLayout(data):
+
+    if not "markers" in data or not "groups" in data:
+        raise ValueError("A marker layout needs a 'markers' and a 'groups' list")
+
+    names = set()
+    for marker in data["markers"]:
+        if not "name" in marker or not "position" in marker:
+            raise ValueError("Every marker needs a 'name' and a 'position': " + str(marker))
+        if len(marker["position"]) != 3:
+            raise ValueError("Marker position must have 3 components: " + marker["name"])
+        if marker["name"] in names:
+            raise ValueError("Duplicated marker in layout: " + marker["name"])
+        names.add(marker["name"])
+
+    grouped = set()
+    for group in data["groups"]:
+        for name in group.get("markers", []):
+            if not name in names:
+                raise ValueError("Group " + group.get("name", "?") + " references an unknown marker: " + name)
+            if name in grouped:
+                raise ValueError("Marker " + name + " belongs to more than one group")
+            grouped.add(name)
+
+    if grouped != names:
+        raise ValueError("Markers not assigned to any group: " + ", ".join(sorted(names - grouped)))
+
+'''
+Load a marker layout from a JSON file (default layout if no path is given)
+'''
+def loadLayout(path=None):
+
+    if not path:
+        path = kDefaultLayoutPath
+
+    with open(path, 'r') as layoutFile:
+        data = json.load(layoutFile)
+
+    return MarkerLayout(data, path)
+
+'''
+Get the layout used in this session: the one set with setActiveLayout, then the
+one pointed by the ANIMFACE_LAYOUT environment variable, then the default one.
+'''
+def getActiveLayout():
+
+    global _activeLayout
+
+    if (_activeLayout == None):
+        _activeLayout = loadLayout(os.environ.get(kLayoutEnvVar))
+
+    return _activeLayout
+
+'''
+Set the layout used in this session by all the plugins
+'''
+def setActiveLayout(path):
+
+    global _activeLayout
+
+    _activeLayout = loadLayout(path)
+
+    return _activeLayout
+
+'''
+Parse a comma separated stiffness string and check it matches the layout
+'''
+def parseStiffnessString(stiffnessString, layout):
+
+    values = [int(x) for x in stiffnessString.split(",") if x.strip() != ""]
+
+    if (len(values) != len(layout)):
+        raise ValueError("Expected " + str(len(layout)) + " stiffness values for layout '" + layout.name + "', got " + str(len(values)))
+
+    return values
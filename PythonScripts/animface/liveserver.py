@@ -0,0 +1,390 @@
+'''
+
+Miguel Ramos Carretero
+Bournemouth University 2018
+
+Python module:
+Local real-time retargeting server (asyncio). A capture system (or the replay
+of a take, replayTake) publishes the marker positions of every capture frame
+over a local socket; the server solves the frame with the built solver and
+publishes the result to its subscribers, either the displacement of every
+vertex or the weights of the markers (M x 3, for subscribers holding the RBF
+of the vertices). With a reduced-basis solver (animface.reduced), the weights
+are the r x 3 coefficients of its basis.
+
+Messages are a header (kind, frame number, number of float32 values, capture
+time in seconds since the epoch) followed by the values:
+
+    REST    rest positions of the markers (M x 3), else the first frame is
+            the rest pose
+    MRKR    positions of the markers at a capture frame (M x 3)
+    SUBS    subscription, the frame number is the mode (0: displacements,
+            1: weights)
+    DISP    displacement of the vertices (V x 3), to the subscribers
+    WGHT    weights of the markers (M x 3), to the subscribers
+
+Queues are bounded: when the solve or a subscriber falls behind, the oldest
+frames are dropped, so the latency does not grow. The latency of every stage
+is kept in histograms.
+
+'''
+
+import time
+import struct
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+kHeader = struct.Struct("<4sIId")
+
+kRest = b"REST"
+kMarkers = b"MRKR"
+kSubscribe = b"SUBS"
+kDisplacements = b"DISP"
+kWeights = b"WGHT"
+
+kPublishModes = {"displacements": 0, "weights": 1}
+kModeKinds = {0: kDisplacements, 1: kWeights}
+
+kDefaultHost = "127.0.0.1"
+kDefaultPort = 7655
+
+#Frames waiting for the solve, and for every subscriber
+kQueueFrames = 2
+kSubscriberFrames = 4
+
+#Largest message accepted (float32 values)
+kMaxValues = 64 * 1024 * 1024
+
+#Rate of the scenes of the takes (film)
+kSceneRate = 24.0
+
+'''
+Bytes of a message
+'''
+def packMessage(kind, frame, values, captureTime):
+    values = np.ascontiguousarray(values, dtype=np.float32).reshape(-1)
+    return kHeader.pack(kind, int(frame), values.shape[0], captureTime) + values.tobytes()
+
+'''
+Read a message from a stream: kind, frame number, values and capture time
+'''
+async def readMessage(reader):
+
+    kind, frame, count, captureTime = kHeader.unpack(await reader.readexactly(kHeader.size))
+    if count > kMaxValues:
+        raise ValueError("Message of " + str(count) + " values is too big")
+
+    values = np.frombuffer(await reader.readexactly(count * 4), dtype=np.float32)
+
+    return kind, frame, values, captureTime
+
+'''
+Put an item into a bounded queue, dropping the oldest one if it is full.
+Returns whether an item was dropped.
+'''
+def putLatest(queue, item):
+
+    dropped = False
+    if queue.full():
+        queue.get_nowait()
+        dropped = True
+    queue.put_nowait(item)
+
+    return dropped
+
+'''
+Histogram of latencies in logarithmic buckets (10 us to 10 s)
+'''
+class LatencyHistogram(object):
+
+    def __init__(self, edges=None):
+        self.edges = edges if edges is not None else np.logspace(-5, 1, 49)
+        self.counts = np.zeros(self.edges.shape[0] + 1, dtype=np.int64)
+        self.total = 0.0
+        self.maximum = 0.0
+
+    @property
+    def count(self):
+        return int(self.counts.sum())
+
+    def add(self, seconds):
+        self.counts[np.searchsorted(self.edges, seconds)] += 1
+        self.total += seconds
+        self.maximum = max(self.maximum, seconds)
+
+    def percentile(self, q):
+        ''' Upper edge of the bucket holding the q-th percentile. '''
+
+        if self.count == 0:
+            return 0.0
+
+        bucket = int(np.searchsorted(np.cumsum(self.counts), q / 100.0 * self.count))
+        return min(float(self.edges[bucket]), self.maximum) if bucket < self.edges.shape[0] else self.maximum
+
+    def summary(self):
+        count = self.count
+        return {"count": count, "mean": self.total / count if count else 0.0, "p50": self.percentile(50), "p95": self.percentile(95), "p99": self.percentile(99), "max": self.maximum}
+
+'''
+Print the counters and latency histograms of a server
+'''
+def printServerStats(stats):
+
+    print("------------------------------")
+    print("Frames received: " + str(stats["received"]) + ", solved: " + str(stats["solved"]) + ", dropped: " + str(stats["dropped"]) + ", invalid: " + str(stats["invalid"]))
+    print("Messages published: " + str(stats["published"]) + ", dropped (slow subscribers): " + str(stats["subscriberDropped"]) + ", subscribers: " + str(stats["subscribers"]))
+    print("latency (ms)".ljust(14) + "count".rjust(8) + "mean".rjust(9) + "p50".rjust(9) + "p95".rjust(9) + "p99".rjust(9) + "max".rjust(9))
+
+    for name in ("receive", "queue", "solve", "total"):
+        row = stats["latency"][name]
+        print(name.ljust(14) + str(row["count"]).rjust(8) + "".join([("%.2f" % (row[key] * 1000)).rjust(9) for key in ("mean", "p50", "p95", "p99", "max")]))
+
+    print("------------------------------")
+
+'''
+Server solving the marker frames of a live stream with a built solver
+'''
+class RetargetServer(object):
+
+    def __init__(self, solver, queueFrames=kQueueFrames, subscriberFrames=kSubscriberFrames):
+
+        self.solver = solver
+        self.queueFrames = queueFrames
+        self.subscriberFrames = subscriberFrames
+
+        self.rest = None
+        self.frames = None
+        self.subscribers = []
+        self.executor = ThreadPoolExecutor(max_workers=1)
+
+        self.counters = {"received": 0, "solved": 0, "dropped": 0, "invalid": 0, "published": 0, "subscriberDropped": 0}
+        self.latency = dict((name, LatencyHistogram()) for name in ("receive", "queue", "solve", "total"))
+
+    def stats(self):
+        stats = dict(self.counters)
+        stats["subscribers"] = len(self.subscribers)
+        stats["latency"] = dict((name, histogram.summary()) for name, histogram in self.latency.items())
+        return stats
+
+    def solveFrame(self, positions, modes):
+        ''' Weights and displacement of the vertices (if a subscriber wants them) of a frame. '''
+
+        weights = self.solver.solve(positions - self.rest)
+        displacements = self.solver.evaluate(weights) if 0 in modes else None
+
+        return weights, displacements
+
+    async def handleConnection(self, reader, writer):
+        ''' A connection publishes marker frames, or subscribes to the results. '''
+
+        try:
+            while True:
+                kind, frame, values, captureTime = await readMessage(reader)
+
+                if kind == kSubscribe:
+                    await self.serveSubscriber(reader, writer, frame)
+                    return
+
+                if values.shape[0] != self.solver.nMarkers * 3:
+                    self.counters["invalid"] += 1
+                    continue
+
+                positions = values.reshape(-1, 3).astype(np.float64)
+
+                if kind == kRest:
+                    self.rest = positions
+                elif kind == kMarkers:
+                    self.receiveFrame(frame, positions, captureTime)
+                else:
+                    self.counters["invalid"] += 1
+
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        except asyncio.CancelledError:
+            #Server shutting down
+            pass
+        finally:
+            writer.close()
+
+    def receiveFrame(self, frame, positions, captureTime):
+
+        now = time.time()
+        self.counters["received"] += 1
+        self.latency["receive"].add(max(0.0, now - captureTime))
+
+        if self.rest is None:
+            self.rest = positions
+
+        if putLatest(self.frames, (frame, positions, captureTime, now)):
+            self.counters["dropped"] += 1
+
+    async def serveSubscriber(self, reader, writer, mode):
+
+        if mode not in kModeKinds:
+            return
+
+        queue = asyncio.Queue(self.subscriberFrames)
+        subscriber = (mode, queue)
+        self.subscribers.append(subscriber)
+
+        #The subscriber sends nothing else, reading only notices it closing
+        closed = asyncio.ensure_future(reader.read())
+
+        try:
+            while not closed.done():
+                getMessage = asyncio.ensure_future(queue.get())
+                await asyncio.wait([getMessage, closed], return_when=asyncio.FIRST_COMPLETED)
+                if not getMessage.done():
+                    getMessage.cancel()
+                    break
+                message, captureTime = getMessage.result()
+                writer.write(message)
+                await writer.drain()
+                self.counters["published"] += 1
+                self.latency["total"].add(max(0.0, time.time() - captureTime))
+        except ConnectionError:
+            pass
+        finally:
+            self.subscribers.remove(subscriber)
+            closed.cancel()
+
+    async def solveLoop(self):
+        ''' Solves the queued frames one after another and publishes them. '''
+
+        loop = asyncio.get_running_loop()
+
+        while True:
+            frame, positions, captureTime, receiveTime = await self.frames.get()
+
+            start = time.time()
+            self.latency["queue"].add(start - receiveTime)
+
+            modes = set(mode for mode, queue in self.subscribers)
+            weights, displacements = await loop.run_in_executor(self.executor, self.solveFrame, positions, modes)
+
+            self.latency["solve"].add(time.time() - start)
+            self.counters["solved"] += 1
+
+            messages = {}
+            if 1 in modes:
+                messages[1] = packMessage(kWeights, frame, weights, captureTime)
+            if displacements is not None:
+                messages[0] = packMessage(kDisplacements, frame, displacements, captureTime)
+
+            for mode, queue in list(self.subscribers):
+                #Subscribed while the frame was being solved
+                if mode not in messages:
+                    continue
+                if putLatest(queue, (messages[mode], captureTime)):
+                    self.counters["subscriberDropped"] += 1
+
+    async def statsLoop(self, interval):
+        while True:
+            await asyncio.sleep(interval)
+            printServerStats(self.stats())
+
+    async def serve(self, host=kDefaultHost, port=kDefaultPort, path=None, statsInterval=0, ready=None):
+        ''' Serves until cancelled, on a TCP port of the host or on a Unix socket path. '''
+
+        self.frames = asyncio.Queue(self.queueFrames)
+
+        if path:
+            server = await asyncio.start_unix_server(self.handleConnection, path=path)
+        else:
+            server = await asyncio.start_server(self.handleConnection, host, port)
+
+        tasks = [asyncio.ensure_future(self.solveLoop())]
+        if statsInterval > 0:
+            tasks.append(asyncio.ensure_future(self.statsLoop(statsInterval)))
+
+        if ready is not None:
+            ready.set_result(server)
+
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            for task in tasks:
+                task.cancel()
+            self.executor.shutdown(wait=False)
+
+'''
+Open a connection to a server, on a TCP port or a Unix socket path
+'''
+async def openConnection(host=kDefaultHost, port=kDefaultPort, path=None):
+
+    if path:
+        return await asyncio.open_unix_connection(path)
+
+    return await asyncio.open_connection(host, port)
+
+'''
+Capture frames of a take: its key times (every marker is keyed at the same
+rate by the capture system)
+'''
+def captureFrames(take):
+
+    first, last = take.frameRange()
+    times = [axes[0][0] for axes in take.curves.values() if axes[0][0].shape[0] > 1]
+    step = float(np.median(np.diff(times[0]))) if times else 1.0
+
+    return np.arange(first, last + step * 0.5, step)
+
+'''
+Stand-in of a capture system: stream the positions of the markers of a take
+at capture rate (the key times of the take, played at sceneRate frames per
+second). Returns the number of frames sent.
+'''
+async def replayTake(take, mocapNames, host=kDefaultHost, port=kDefaultPort, path=None, sceneRate=kSceneRate, restFrame=0, loops=1):
+
+    reader, writer = await openConnection(host, port, path)
+
+    frames = captureFrames(take)
+    positions = take.positions(frames, mocapNames)
+    period = frames[-1] - frames[0] + (frames[1] - frames[0] if frames.shape[0] > 1 else 1.0)
+
+    writer.write(packMessage(kRest, 0, take.positions([restFrame], mocapNames)[0], time.time()))
+
+    sent = 0
+    start = time.time()
+
+    try:
+        for loop in range(loops):
+            for f in range(frames.shape[0]):
+                delay = start + (frames[f] - frames[0] + loop * period) / sceneRate - time.time()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                writer.write(packMessage(kMarkers, sent, positions[f], time.time()))
+                await writer.drain()
+                sent += 1
+    except ConnectionError:
+        #Server gone
+        pass
+    finally:
+        writer.close()
+
+    return sent
+
+'''
+Subscribe to a server and call onMessage(kind, frame, values, latency) for
+every message received, until the server closes or count messages arrive
+'''
+async def subscribe(onMessage, mode="displacements", host=kDefaultHost, port=kDefaultPort, path=None, count=None):
+
+    reader, writer = await openConnection(host, port, path)
+    writer.write(packMessage(kSubscribe, kPublishModes[mode], [], time.time()))
+
+    received = 0
+
+    try:
+        while count is None or received < count:
+            kind, frame, values, captureTime = await readMessage(reader)
+            onMessage(kind, frame, values, time.time() - captureTime)
+            received += 1
+    except (asyncio.IncompleteReadError, ConnectionError):
+        pass
+    finally:
+        writer.close()
+
+    return received
@@ -0,0 +1,197 @@
+'''
+
+Miguel Ramos Carretero
+Bournemouth University 2018
+
+Python module:
+Low-rank approximation of the M x M RBF kernel of the exact solve mode for
+rigs of hundreds of markers (the normalized mode only needs the row sums of
+the kernel). The kernel is approximated by a cross approximation pivoted on
+its diagonal (r rows and r columns of the kernel, the Nystrom approximation or
+pivoted Cholesky when the kernel is symmetric):
+
+    K ~ U V^T + nugget I        U, V: M x r
+
+The nugget is the largest residual of the diagonal left out by the
+approximation, which keeps the approximated kernel invertible (and
+regularizes badly conditioned kernels). The solve of a frame then costs
+O(M r) with the Woodbury identity, and the factorization (and every update of
+a stiffness or a marker) O(M r^2) instead of O(M^3). The rank is given, or the
+smallest one whose residual diagonal is within a tolerance of the diagonal of
+the kernel. kernelReport measures the residuals of the approximated solve.
+
+'''
+
+import numpy as np
+
+from animface.profiler import timeBest
+
+#Default tolerance of the approximation (largest residual of the diagonal, relative)
+kDefaultTolerance = 1e-6
+
+#Largest rank of a tolerance, as a fraction of the markers (past it the exact solve is cheaper)
+kMaxRankFraction = 0.5
+
+#Frames of the displacements of the report
+kReportFrames = 20
+
+'''
+Cross approximation of an n x n kernel, pivoted on the largest residual of the
+diagonal (pivoted Cholesky when the kernel is symmetric positive definite):
+U, V (n x r) with kernel ~ U V^T, and the largest residual of the diagonal
+left, or None if it is not within tolerance times the largest diagonal entry
+after maxRank cross terms. Only the rows and columns of the pivots are read.
+'''
+def crossApproximation(kernel, maxRank, tolerance=0.0):
+
+    n = kernel.shape[0]
+    maxRank = max(1, min(int(maxRank), n))
+
+    #Cross terms by rows, so the products over the first k terms read contiguous memory
+    U = np.zeros((maxRank, n))
+    V = np.zeros((maxRank, n))
+    usedColumns = np.zeros(n, dtype=bool)
+
+    diagonal = np.array(np.diagonal(kernel), dtype=np.float64)
+    bound = tolerance * np.abs(diagonal).max()
+    k = 0
+
+    while k < maxRank:
+
+        row = int(np.argmax(np.abs(diagonal)))
+        if np.abs(diagonal[row]) <= bound:
+            break
+
+        residualRow = kernel[row] - U[:k, row].dot(V[:k])
+        column = int(np.argmax(np.where(usedColumns, 0.0, np.abs(residualRow))))
+        if residualRow[column] == 0.0:
+            break
+
+        usedColumns[column] = True
+        V[k] = residualRow / residualRow[column]
+        U[k] = kernel[:, column] - V[:k, column].dot(U[:k])
+        diagonal -= U[k] * V[k]
+        diagonal[row] = 0.0
+        k += 1
+
+    residual = float(np.abs(diagonal).max())
+
+    if residual > bound and tolerance > 0.0:
+        return None
+
+    return U[:k].T, V[:k].T, residual
+
+'''
+Low-rank factorization of a kernel, K ~ U V^T + nugget I, and its solve with
+the Woodbury identity. With a tolerance that needs more than kMaxRankFraction
+of the rank of the kernel, the kernel is solved with its pseudo-inverse
+(fullRank is True), without the singular values under the tolerance.
+'''
+class LowRankKernel(object):
+
+    def __init__(self, kernel, rank=None, tolerance=None):
+
+        self.size = kernel.shape[0]
+
+        if tolerance is None:
+            tolerance = kDefaultTolerance if rank is None else 0.0
+
+        if rank is not None:
+            factors = crossApproximation(kernel, rank)
+        else:
+            factors = crossApproximation(kernel, max(1, int(self.size * kMaxRankFraction)), tolerance)
+
+        self.fullRank = factors is None or factors[0].shape[1] >= self.size or factors[2] <= 0.0
+
+        if self.fullRank:
+            #Singular values under the tolerance are dropped, as the approximation would
+            self.U = self.V = np.zeros((self.size, 0))
+            self.nugget = 0.0
+            self.inverse = np.linalg.pinv(kernel, rcond=tolerance)
+            self.projection = None
+            return
+
+        self.U, self.V, self.nugget = factors
+
+        #(nugget I + U V^T)^-1 = (I - U (nugget I + V^T U)^-1 V^T) / nugget
+        capacitance = self.nugget * np.eye(self.rank) + self.V.T.dot(self.U)
+        self.inverse = None
+        self.projection = np.linalg.solve(capacitance, self.V.T)
+
+    @property
+    def rank(self):
+        return self.size if self.fullRank else self.U.shape[1]
+
+    def multiply(self, weights):
+        ''' Approximated kernel times some weights (M x k or F x M x k). '''
+        return np.matmul(self.U, np.matmul(self.V.T, weights)) + self.nugget * weights
+
+    def solve(self, displacements):
+        ''' Solve of the approximated kernel, displacements are M x k or F x M x k. '''
+
+        if self.fullRank:
+            return np.matmul(self.inverse, displacements)
+
+        return (displacements - np.matmul(self.U, np.matmul(self.projection, displacements))) / self.nugget
+
+'''
+Relative residual |K w - d| / |d| of some weights (F x M x 3) of a kernel
+'''
+def relativeResidual(kernel, weights, displacements):
+
+    size = kernel.shape[0]
+    flat = displacements.transpose(1, 0, 2).reshape(size, -1)
+    product = kernel.dot(weights.transpose(1, 0, 2).reshape(size, -1))
+
+    return float(np.linalg.norm(product - flat) / max(np.linalg.norm(flat), 1e-300))
+
+'''
+Residuals of the solve of an exact-mode solver with an approximated kernel, on
+some marker displacements (F x M x 3), against the exact solve of the kernel:
+rank, error of the kernel, relative residual |K w - d| / |d| of both solves,
+difference of the weights and of the deformation, time of both factorizations
+and solve time per frame. A badly conditioned kernel has a large residual in
+the exact solve too; the nugget of the approximation regularizes it.
+'''
+def kernelReport(solver, displacements, frames=kReportFrames):
+
+    displacements = np.asarray(displacements, dtype=np.float64)[:frames]
+    nFrames = max(displacements.shape[0], 1)
+    kernel = solver.kernel
+    size = kernel.shape[0]
+
+    factorTime, lowRank = timeBest(lambda: LowRankKernel(kernel, solver.kernelRank, solver.kernelTolerance))
+    exactFactorTime, inverse = timeBest(lambda: np.linalg.pinv(kernel) if np.linalg.matrix_rank(kernel) < size else np.linalg.solve(kernel, np.eye(size)), 1)
+
+    solveTime, weights = timeBest(lambda: lowRank.solve(displacements))
+    exactSolveTime, exactWeights = timeBest(lambda: np.matmul(inverse, displacements))
+
+    kernelError = 0.0
+    if not lowRank.fullRank:
+        kernelError = np.linalg.norm(lowRank.multiply(np.eye(size)) - kernel) / max(np.linalg.norm(kernel), 1e-300)
+
+    weightError = np.linalg.norm(weights - exactWeights) / max(np.linalg.norm(exactWeights), 1e-300)
+
+    #Deformation difference relative to the largest displacement of the exact solve
+    reference = np.asarray(solver.evaluate(exactWeights), dtype=np.float64)
+    deformError = np.abs(np.asarray(solver.evaluate(weights), dtype=np.float64) - reference).max() / max(np.abs(reference).max(), 1e-12)
+
+    return {"rank": lowRank.rank, "markers": size, "nugget": lowRank.nugget, "kernelError": float(kernelError),
+            "residual": relativeResidual(kernel, weights, displacements), "exactResidual": relativeResidual(kernel, exactWeights, displacements),
+            "weightError": float(weightError), "deformError": float(deformError),
+            "factorTime": factorTime, "exactFactorTime": exactFactorTime,
+            "solveTime": solveTime / nFrames, "exactSolveTime": exactSolveTime / nFrames}
+
+'''
+Print a kernel report
+'''
+def printKernelReport(report):
+
+    print("------------------------------")
+    print("Low-rank kernel: rank " + str(report["rank"]) + " of " + str(report["markers"]) + " markers, nugget " + ("%.2e" % report["nugget"]))
+    print("Kernel error: " + ("%.2e" % report["kernelError"]) + " (relative Frobenius norm)")
+    print("Residual |K w - d| / |d|: low rank " + ("%.2e" % report["residual"]) + ", exact " + ("%.2e" % report["exactResidual"]))
+    print("Difference with the exact solve: weights " + ("%.2e" % report["weightError"]) + ", deformation " + ("%.2e" % report["deformError"]) + " (relative)")
+    print("Factorization: low rank " + ("%.3f" % (report["factorTime"] * 1000.0)) + " ms, exact " + ("%.3f" % (report["exactFactorTime"] * 1000.0)) + " ms")
+    print("Solve time per frame: low rank " + ("%.4f" % (report["solveTime"] * 1000.0)) + " ms, exact " + ("%.4f" % (report["exactSolveTime"] * 1000.0)) + " ms")
+    print("------------------------------")
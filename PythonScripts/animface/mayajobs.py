@@ -0,0 +1,273 @@
+'''
+
+Miguel Ramos Carretero
+Bournemouth University 2018
+
+Maya/Python script:
+Jobs of the AnimFace window for the job queue. Each builder reads what it needs
+from the scene when it is called (main thread), and returns a job whose
+compute part only uses the engines, so it can run on a worker thread while
+the artist keeps working. Only the final scene writes (the keyframes of an
+animation) go back to the main thread.
+
+'''
+
+import os
+import time
+import shutil
+import tempfile
+import numpy as np
+
+from animface import batch
+from animface import distances
+from animface import session
+from animface import outofcore
+from animface import proxy
+from animface import sweep
+from animface.bakecache import BakeCacheWriter, readBakeBlock
+from animface.evaluator import FrameEvaluator, TakeTrajectories
+from animface.jobqueue import Job
+from animface.mayascene import MayaBackend
+from animface.mocap import readMoCapTake
+from animface.rbf import kNormalized
+
+#Vertices keyed per main thread call
+kKeyBlock = 2000
+
+'''
+Read the rest pose of a mesh and of the markers of the layout (frame 0)
+'''
+def _gatherRestPose(backend, meshName, layout):
+
+    mesh = backend.getMeshData(meshName, 0)
+    markerPoints = backend.getObjectPoints(layout.jointNames(), 0)
+
+    return mesh, markerPoints
+
+'''
+Job calculating the Euclidean, geodesic and hybrid distance matrices of a mesh
+into a matrix folder (the same files as pyCalculateDistMatrix)
+'''
+def distanceMatrixJob(meshName, matrixFolder, layout, processes=1):
+
+    backend = MayaBackend()
+    mesh, markerPoints = _gatherRestPose(backend, meshName, layout)
+    geodesicVertices = backend.getVertexSets(layout.geodesicAreas)
+
+    def compute(context):
+
+        times = {}
+
+        vertexMarkers = distances.matchMarkersWithMesh(mesh.points, markerPoints, context=context)
+        cache = session.getSession()
+
+        start = time.time()
+        euc = distances.euclideanDistanceMatrix(mesh.points, vertexMarkers, context)
+        distances.writeDistanceMatrix(os.path.join(matrixFolder, distances.kMatrixFileNames[distances.kEuclidean]), euc)
+        cache.put(session.kMatrix, session.matrixKey(mesh.signature(), vertexMarkers, distances.kEuclidean), euc)
+        times["Euclidean"] = time.time() - start
+
+        start = time.time()
+        geo = distances.geodesicDistanceMatrix(mesh, vertexMarkers, processes=processes, context=context)
+        distances.writeDistanceMatrix(os.path.join(matrixFolder, distances.kMatrixFileNames[distances.kGeodesics]), geo)
+        cache.put(session.kMatrix, session.matrixKey(mesh.signature(), vertexMarkers, distances.kGeodesics), geo)
+        times["Geodesic"] = time.time() - start
+
+        start = time.time()
+        hyb = distances.hybridDistanceMatrix(mesh.points, euc, geo, geodesicVertices, context=context)
+        distances.writeDistanceMatrix(os.path.join(matrixFolder, distances.kMatrixFileNames[distances.kHybrid]), hyb)
+        cache.put(session.kMatrix, session.matrixKey(mesh.signature(), vertexMarkers, distances.kHybrid), hyb)
+        times["Hybrid"] = time.time() - start
+
+        return times
+
+    def apply(times):
+        for name in ("Euclidean", "Geodesic", "Hybrid"):
+            print("Time for calculating " + name + " dist. matrix: " + str(times[name]))
+        print("Matrix calculations completed. Files created at: " + matrixFolder)
+
+    return Job("Distance matrices " + meshName, compute, apply)
+
+'''
+Job animating a mesh with the markers of the scene. The trajectories of the
+markers are read at submission; the animation curves of the vertices are
+written in blocks of vertices, one block per main thread call. When the
+animation would not fit in the memory budget (or with outOfCore), the
+deformation is streamed into a temporary bake cache and the blocks are read
+back from it to be keyed.
+'''
+def animateMeshJob(meshName, firstFrame, lastFrame, steps, method, stiffnessValues, matrixFolder, layout, mode=kNormalized, processes=1, outOfCore=None, memoryBudget=None, preview=None, proxyVertices=None):
+
+    backend = MayaBackend()
+
+    frames = batch.getFrames(firstFrame, lastFrame, steps)
+    geodesicSets = layout.geodesicAreas if distances.getMethodCode(method) == distances.kHybrid else None
+    inputs = batch.readSceneInputs(backend, meshName, layout.jointNames(), frames, geodesicSets)
+
+    nBlocks = (inputs.mesh.nVert + kKeyBlock - 1) // kKeyBlock
+
+    if preview is not None:
+        return _animatePreviewJob(meshName, method, stiffnessValues, mode, processes, preview, proxyVertices, backend, inputs, nBlocks)
+
+    if outOfCore is None:
+        outOfCore = outofcore.needsOutOfCore(inputs.mesh.nVert, len(layout), len(frames), outofcore.getMemoryBudget(memoryBudget))
+
+    if outOfCore:
+        return _animateMeshOutOfCoreJob(meshName, method, stiffnessValues, matrixFolder, mode, processes, memoryBudget, backend, inputs, nBlocks)
+
+    def compute(context):
+        solver, times = batch.prepareSolver(inputs.mesh, inputs.markerPoints, method, stiffnessValues, matrixFolder, inputs.geodesicVertices, mode, processes=processes, context=context)
+        return batch.animateVertices(solver, inputs, context=context)
+
+    def apply(vertexDisplacements):
+        for start in range(0, inputs.mesh.nVert, kKeyBlock):
+            vertices = np.arange(start, min(start + kKeyBlock, inputs.mesh.nVert))
+            backend.writeVertexAnimation(meshName, frames, vertexDisplacements[:, vertices, :], vertices)
+            yield start
+
+    return Job("Animate " + meshName + " (" + method + ")", compute, apply, nBlocks)
+
+'''
+Preview part of animateMeshJob: the solver runs on a proxy of the mesh, and
+its animation is upsampled to the mesh or keyed on a proxy mesh created next
+to it (created on the main thread, as the keys)
+'''
+def _animatePreviewJob(meshName, method, stiffnessValues, mode, processes, preview, proxyVertices, backend, inputs, nBlocks):
+
+    def compute(context):
+        solver, times = batch.preparePreviewSolver(inputs.mesh, inputs.markerPoints, method, stiffnessValues, proxyVertices, inputs.geodesicVertices, mode, processes=processes, context=context)
+        if preview == proxy.kPreviewProxy:
+            return solver.proxy.mesh, batch.animateVertices(solver.solver, inputs, context=context)
+        return None, batch.animateVertices(solver, inputs, context=context)
+
+    def apply(result):
+        proxyMesh, vertexDisplacements = result
+        targetName = meshName
+        if proxyMesh is not None:
+            targetName = backend.createMesh(meshName + proxy.kProxySuffix, proxyMesh)
+        nVert = vertexDisplacements.shape[1]
+        for start in range(0, nVert, kKeyBlock):
+            vertices = np.arange(start, min(start + kKeyBlock, nVert))
+            backend.writeVertexAnimation(targetName, inputs.frames, vertexDisplacements[:, vertices, :], vertices)
+            yield start
+
+    return Job("Preview " + meshName + " (" + method + ", " + preview + ")", compute, apply, nBlocks)
+
+'''
+Out-of-core part of animateMeshJob: the blocks of vertices go through a bake
+cache on disk, so neither the worker nor the main thread holds the whole
+animation
+'''
+def _animateMeshOutOfCoreJob(meshName, method, stiffnessValues, matrixFolder, mode, processes, memoryBudget, backend, inputs, nBlocks):
+
+    def compute(context):
+
+        solver, times = batch.prepareSolver(inputs.mesh, inputs.markerPoints, method, stiffnessValues, matrixFolder, inputs.geodesicVertices, mode, processes=processes, context=context, outOfCore=True, memoryBudget=memoryBudget)
+
+        folder = tempfile.mkdtemp(prefix="animface_")
+        writer = BakeCacheWriter(folder, inputs.frames, solver.nVert, {"mesh": meshName, "method": method})
+        try:
+            for vertexStart, block in batch.streamVertices(solver, inputs, context):
+                writer.writeBlock(0, vertexStart, block)
+        except BaseException:
+            writer.close()
+            shutil.rmtree(folder, ignore_errors=True)
+            raise
+        writer.close()
+
+        return folder
+
+    def apply(folder):
+        try:
+            for start in range(0, inputs.mesh.nVert, kKeyBlock):
+                stop = min(start + kKeyBlock, inputs.mesh.nVert)
+                backend.writeVertexAnimation(meshName, inputs.frames, readBakeBlock(folder, start, stop), np.arange(start, stop))
+                yield start
+        finally:
+            shutil.rmtree(folder, ignore_errors=True)
+
+    return Job("Animate " + meshName + " (" + method + ", out of core)", compute, apply, nBlocks)
+
+'''
+Job sweeping stiffness configurations around the given one on a sample of
+the frames of the scene. Candidates are rounded to the integer values of the
+stiffness fields (1 to maximum). The ranked table is printed and onBest is
+called with the best configuration on the main thread.
+'''
+def stiffnessSweepJob(meshName, firstFrame, lastFrame, steps, method, stiffnessValues, matrixFolder, layout, mode=kNormalized, processes=1, frameCount=20, randomCount=200, maximum=9, onBest=None):
+
+    backend = MayaBackend()
+
+    frames = batch.getFrames(firstFrame, lastFrame, steps)
+    frames = [frames[i] for i in sweep.sampleFrameIndices(len(frames), frameCount)]
+    geodesicSets = layout.geodesicAreas if distances.getMethodCode(method) == distances.kHybrid else None
+    inputs = batch.readSceneInputs(backend, meshName, layout.jointNames(), frames, geodesicSets)
+
+    candidates = sweep.generateCandidates(stiffnessValues, [0.5, 0.75, 1.25, 1.5, 2], randomCount, integer=True, minimum=1, maximum=maximum)
+
+    def compute(context):
+        vertexMarkers = distances.matchMarkersWithMesh(inputs.mesh.points, inputs.markerPoints, context=context)
+        matrix = batch.prepareMatrix(inputs.mesh, vertexMarkers, method, matrixFolder, inputs.geodesicVertices, processes, context=context)
+        return sweep.sweepStiffness(matrix, vertexMarkers, inputs.displacements(), candidates, mode, inputs.mesh, context=context)
+
+    def apply(result):
+        rows, elapsed = result
+        sweep.printSweepTable(rows)
+        print(str(len(rows)) + " stiffness configurations on " + str(len(frames)) + " frames: " + str(elapsed) + " s")
+        if onBest is not None and len(rows) > 0:
+            onBest([int(round(s)) for s in rows[0]["stiffness"]])
+
+    return Job("Stiffness sweep " + meshName + " (" + method + ")", compute, apply)
+
+'''
+Job baking MoCap takes onto a mesh into bake caches; nothing is written into
+the scene
+'''
+def takeBakeJob(meshName, takePaths, outputFolder, method, stiffnessValues, matrixFolder, layout, frames=None, steps=1, mode=kNormalized, processes=1):
+
+    backend = MayaBackend()
+    mesh, markerPoints = _gatherRestPose(backend, meshName, layout)
+
+    geodesicVertices = None
+    if (distances.getMethodCode(method) == distances.kHybrid):
+        geodesicVertices = backend.getVertexSets(layout.geodesicAreas)
+
+    meta = {"mesh": meshName, "method": method, "solveMode": mode, "stiffness": list(stiffnessValues)}
+
+    def compute(context):
+        solver, times = batch.prepareSolver(mesh, markerPoints, method, stiffnessValues, matrixFolder, geodesicVertices, mode, processes=processes, context=context)
+        return batch.retargetTakes(solver, takePaths, layout.mocapNames(), outputFolder, frames, steps, 0, meta, context)
+
+    def apply(results):
+        for result in results:
+            print("  " + result["take"] + ": " + str(result["frames"]) + " frames, " + str(result["time"]) + " s -> " + result["cache"])
+
+    return Job("Bake " + str(len(takePaths)) + " take(s) on " + meshName, compute, apply)
+
+'''
+Job building the solver of a mesh and the evaluator of a take for a scrub
+preview; the preview starts on the main thread, then onStart is called
+'''
+def takePreviewJob(meshName, takePath, method, stiffnessValues, matrixFolder, layout, mode=kNormalized, processes=1, restFrame=0, onStart=None):
+
+    from animface import mayapreview
+
+    backend = MayaBackend()
+    mesh, markerPoints = _gatherRestPose(backend, meshName, layout)
+
+    geodesicVertices = None
+    if (distances.getMethodCode(method) == distances.kHybrid):
+        geodesicVertices = backend.getVertexSets(layout.geodesicAreas)
+
+    def compute(context):
+        solver, times = batch.prepareSolver(mesh, markerPoints, method, stiffnessValues, matrixFolder, geodesicVertices, mode, processes=processes, context=context)
+        return FrameEvaluator(solver, TakeTrajectories(readMoCapTake(takePath), layout.mocapNames(), restFrame))
+
+    def apply(evaluator):
+        #The preview shown puts its rest points back before the new one deforms the mesh
+        mayapreview.stopPreview()
+        mayapreview.startPreview(mayapreview.ScrubPreview(evaluator, meshName, mesh.points, backend))
+        if onStart is not None:
+            onStart()
+
+    return Job("Preview " + os.path.basename(takePath) + " on " + meshName, compute, apply)
@@ -0,0 +1,77 @@
+'''
+
+Miguel Ramos Carretero
+Bournemouth University 2018
+
+Maya/Python script:
+Scrub preview of a take on a mesh: the frame of the time slider is deformed
+on demand by a FrameEvaluator and written into the points of the mesh,
+nothing is keyed. Stopping the preview puts the rest points back.
+
+'''
+
+import maya.api.OpenMaya as om
+import maya.api.OpenMayaAnim as oma
+
+from animface.mayascene import MayaBackend
+
+'''
+Preview shown in the scene, only one at a time
+'''
+_activePreview = None
+
+'''
+Preview of an evaluator on a mesh, following the time slider
+'''
+class ScrubPreview(object):
+
+    def __init__(self, evaluator, meshName, restPoints, backend=None):
+
+        self.evaluator = evaluator
+        self.meshName = meshName
+        self.restPoints = restPoints
+        self.backend = backend or MayaBackend()
+
+        self.callback = om.MEventMessage.addEventCallback("timeChanged", self.onTimeChanged)
+        self.onTimeChanged()
+
+    def onTimeChanged(self, *args):
+        frame = oma.MAnimControl.currentTime().asUnits(om.MTime.uiUnit())
+        self.backend.setPoints(self.meshName, self.restPoints + self.evaluator.evaluate(frame))
+
+    def stop(self):
+        ''' Removes the callback, puts the rest points back and stops the evaluator. '''
+
+        om.MMessage.removeCallback(self.callback)
+        self.evaluator.close()
+
+        if self.backend.meshExists(self.meshName):
+            self.backend.setPoints(self.meshName, self.restPoints)
+
+'''
+Show a preview, stopping the one shown before (stop it with stopPreview before
+building the new one: a ScrubPreview deforms the mesh when it is created)
+'''
+def startPreview(preview):
+
+    global _activePreview
+
+    stopPreview()
+    _activePreview = preview
+
+'''
+Stop the preview shown, if any
+'''
+def stopPreview():
+
+    global _activePreview
+
+    if _activePreview is not None:
+        _activePreview.stop()
+        _activePreview = None
+
+'''
+Whether a preview is shown
+'''
+def isPreviewActive():
+    return _activePreview is not None
@@ -0,0 +1,209 @@
+'''
+
+Miguel Ramos Carretero
+Bournemouth University 2018
+
+Maya/Python script:
+Bulk access to the scene data needed by the Maya-free engines (mesh points and
+connectivity, marker positions and trajectories, vertex sets and animation
+curves) through OpenMaya API 2.0, and the scene backend built on top of it.
+
+'''
+
+import re
+import numpy as np
+import maya.api.OpenMaya as om
+import maya.api.OpenMayaAnim as oma
+import maya.cmds as cmds
+
+from animface.mesh import MeshData
+from animface.core import getObjectPoint
+from animface.backend import SceneBackend
+
+_vertexIndex = re.compile(r"\.vtx\[(\d+)\]$")
+
+'''
+Get the DAG path of a node by name
+'''
+def getDagPath(name):
+    selection = om.MSelectionList()
+    selection.add(name)
+    return selection.getDagPath(0)
+
+'''
+Get the world space points and the connectivity of a mesh in one call each.
+With a frame, the points are read at that frame (e.g. the rest pose, whatever
+the time slider shows) and the current time is restored afterwards.
+'''
+def getMeshData(meshName, frame=None):
+
+    if frame is not None and cmds.currentTime(q=True) != frame:
+        currentFrame = cmds.currentTime(q=True)
+        cmds.currentTime(frame, update=True)
+        try:
+            return getMeshData(meshName)
+        finally:
+            cmds.currentTime(currentFrame, update=True)
+
+    fnMesh = om.MFnMesh(getDagPath(meshName))
+
+    points = np.array(fnMesh.getPoints(om.MSpace.kWorld), dtype=np.float64)[:, :3]
+    faceCounts, faceIndices = fnMesh.getVertices()
+
+    return MeshData(points, np.array(faceCounts, dtype=np.int32), np.array(faceIndices, dtype=np.int32), meshName)
+
+'''
+Get the translation of a list of objects (N x 3)
+'''
+def getObjectPoints(objs):
+    return np.array([getObjectPoint(obj) for obj in objs], dtype=np.float64).reshape(-1, 3)
+
+'''
+Get the vertex indices of a list of vertex components (mesh.vtx[i])
+'''
+def getVertexIndices(components):
+
+    indices = []
+
+    for component in cmds.ls(components, flatten=True) or []:
+        match = _vertexIndex.search(component)
+        if match:
+            indices.append(int(match.group(1)))
+
+    return np.array(indices, dtype=np.int64)
+
+'''
+Get the dependency node of a node by name
+'''
+def getDependNode(name):
+    selection = om.MSelectionList()
+    selection.add(name)
+    return selection.getDependNode(0)
+
+'''
+Get the animation curve driving a plug directly, None if the plug is not keyed
+'''
+def getAnimCurve(plug):
+
+    source = plug.source()
+    if source.isNull or not source.node().hasFn(om.MFn.kAnimCurve):
+        return None
+
+    return oma.MFnAnimCurve(source.node())
+
+'''
+Set the keys of a plug at the given times (internal units), creating its
+animation curve if the plug is not keyed yet. Keys at other times are kept.
+'''
+def setPlugKeys(plug, times, values):
+
+    curve = getAnimCurve(plug)
+    if curve is None:
+        curve = oma.MFnAnimCurve()
+        curve.create(plug, oma.MFnAnimCurve.kAnimCurveTL)
+
+    curve.addKeys(times, om.MDoubleArray(values), oma.MFnAnimCurve.kTangentGlobal, oma.MFnAnimCurve.kTangentGlobal, True)
+
+'''
+Scene backend of a Maya scene. Points are read and written with one MFnMesh
+call, the trajectories are evaluated from the animation curves of the
+objects, and the animation is written as whole animation curves (one addKeys
+call per channel) instead of setKeyframe per frame. The writes are not
+undoable, like the rest of the pipeline.
+'''
+class MayaBackend(SceneBackend):
+
+    kTranslateAttributes = ("translateX", "translateY", "translateZ")
+    kTweakAttributes = ("pntx", "pnty", "pntz")
+
+    def meshExists(self, meshName):
+        return cmds.objExists(meshName)
+
+    def getMeshData(self, meshName, frame=None):
+        if not cmds.objExists(meshName):
+            raise ValueError("Mesh name does not match any object: " + meshName)
+        return getMeshData(meshName, frame)
+
+    def getPoints(self, meshName):
+        fnMesh = om.MFnMesh(getDagPath(meshName))
+        return np.array(fnMesh.getPoints(om.MSpace.kWorld), dtype=np.float64)[:, :3]
+
+    def setPoints(self, meshName, points):
+        fnMesh = om.MFnMesh(getDagPath(meshName))
+        fnMesh.setPoints(om.MPointArray([om.MPoint(point[0], point[1], point[2]) for point in np.asarray(points).tolist()]), om.MSpace.kWorld)
+
+    def createMesh(self, meshName, mesh):
+
+        if cmds.objExists(meshName):
+            cmds.delete(meshName)
+
+        points = om.MPointArray([om.MPoint(point[0], point[1], point[2]) for point in mesh.points.tolist()])
+        transform = om.MFnMesh().create(points, mesh.faceCounts.tolist(), mesh.faceIndices.tolist())
+
+        name = cmds.rename(om.MFnDagNode(transform).partialPathName(), meshName)
+        cmds.sets(name, edit=True, forceElement="initialShadingGroup")
+
+        return name
+
+    def getObjectPoints(self, names, frame=None):
+        if frame is None:
+            return getObjectPoints(names)
+        return self.getTrajectories(names, [frame])[0]
+
+    def getTrajectories(self, names, frames):
+
+        times = [om.MTime(frame, om.MTime.uiUnit()) for frame in frames]
+        toUI = om.MDistance.internalToUI(1.0)
+
+        trajectories = np.empty((len(frames), len(names), 3), dtype=np.float64)
+
+        for i in range(len(names)):
+
+            fnNode = om.MFnDependencyNode(getDependNode(names[i]))
+
+            for axis in range(3):
+
+                attribute = self.kTranslateAttributes[axis]
+                plug = fnNode.findPlug(attribute, False)
+                curve = getAnimCurve(plug)
+
+                if curve is not None:
+                    trajectories[:, i, axis] = [curve.evaluate(time) * toUI for time in times]
+                elif not plug.isDestination:
+                    trajectories[:, i, axis] = cmds.getAttr(names[i] + "." + attribute)
+                else:
+                    #Driven by something else than a curve (constraint, expression...)
+                    trajectories[:, i, axis] = [cmds.getAttr(names[i] + "." + attribute, time=frame) for frame in frames]
+
+        return trajectories
+
+    def getVertexSet(self, setName):
+        if not cmds.objExists(setName):
+            return np.zeros(0, dtype=np.int64)
+        return getVertexIndices(cmds.sets(setName, q=True))
+
+    def writeObjectAnimation(self, names, frames, positions):
+
+        times = om.MTimeArray([om.MTime(frame, om.MTime.uiUnit()) for frame in frames])
+        positions = np.asarray(positions, dtype=np.float64) * om.MDistance.uiToInternal(1.0)
+
+        for i in range(len(names)):
+            fnNode = om.MFnDependencyNode(getDependNode(names[i]))
+            for axis in range(3):
+                setPlugKeys(fnNode.findPlug(self.kTranslateAttributes[axis], False), times, positions[:, i, axis].tolist())
+
+    def writeVertexAnimation(self, meshName, frames, displacements, vertices=None):
+
+        shape = cmds.listRelatives(meshName, shapes=True, fullPath=True, noIntermediate=True)[0]
+        tweaks = om.MFnDependencyNode(getDependNode(shape)).findPlug("pnts", False)
+
+        times = om.MTimeArray([om.MTime(frame, om.MTime.uiUnit()) for frame in frames])
+        displacements = np.asarray(displacements, dtype=np.float64) * om.MDistance.uiToInternal(1.0)
+
+        if vertices is None:
+            vertices = range(displacements.shape[1])
+
+        for column, vertex in enumerate(vertices):
+            tweak = tweaks.elementByLogicalIndex(int(vertex))
+            for axis in range(3):
+                setPlugKeys(tweak.child(axis), times, displacements[:, column, axis].tolist())
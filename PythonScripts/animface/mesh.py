@@ -0,0 +1,102 @@
+'''
+
+Miguel Ramos Carretero
+Bournemouth University 2018
+
+Python module:
+Maya-free container for the vertices and the connectivity of a mesh.
+
+'''
+
+import hashlib
+import numpy as np
+
+'''
+Vertex positions (V x 3) and polygon connectivity of a mesh. Faces are stored
+as in Maya: the number of vertices of every face and the flat list of indices.
+'''
+class MeshData(object):
+
+    def __init__(self, points, faceCounts=None, faceIndices=None, name=None):
+
+        self.name = name
+        self.points = np.asarray(points, dtype=np.float64).reshape(-1, 3)
+
+        if faceCounts is None:
+            faceCounts = np.zeros(0, dtype=np.int32)
+        if faceIndices is None:
+            faceIndices = np.zeros(0, dtype=np.int32)
+
+        self.faceCounts = np.ascontiguousarray(faceCounts, dtype=np.int32)
+        self.faceIndices = np.ascontiguousarray(faceIndices, dtype=np.int32)
+
+        self._edges = None
+        self._signature = None
+
+    @property
+    def nVert(self):
+        return self.points.shape[0]
+
+    @property
+    def nFaces(self):
+        return self.faceCounts.shape[0]
+
+    def signature(self):
+        ''' Hash of the points and the connectivity, used as the key of the session caches. '''
+
+        if self._signature is None:
+            digest = hashlib.sha1()
+            digest.update(str(self.points.shape).encode("ascii"))
+            digest.update(self.points.tobytes())
+            digest.update(self.faceCounts.tobytes())
+            digest.update(self.faceIndices.tobytes())
+            self._signature = digest.hexdigest()
+
+        return self._signature
+
+    def edges(self):
+        ''' Unique undirected edges (E x 2, smaller index first). '''
+
+        if self._edges is not None:
+            return self._edges
+
+        if self.faceIndices.shape[0] == 0:
+            self._edges = np.zeros((0, 2), dtype=np.int32)
+            return self._edges
+
+        #Every face vertex is joined to the next one of the same face
+        starts = np.cumsum(self.faceCounts) - self.faceCounts
+        nextIndex = np.arange(1, self.faceIndices.shape[0] + 1)
+        lastOfFace = starts + self.faceCounts - 1
+        nextIndex[lastOfFace] = starts
+
+        v1 = self.faceIndices
+        v2 = self.faceIndices[nextIndex]
+
+        edges = np.stack([np.minimum(v1, v2), np.maximum(v1, v2)], axis=1)
+        edges = edges[edges[:, 0] != edges[:, 1]]
+        self._edges = np.unique(edges, axis=0).astype(np.int32)
+
+        return self._edges
+
+    def edgeLengths(self):
+        edges = self.edges()
+        return np.linalg.norm(self.points[edges[:, 1]] - self.points[edges[:, 0]], axis=1)
+
+    def triangles(self):
+        ''' Fan triangulation of the faces (T x 3). '''
+
+        if self.faceIndices.shape[0] == 0:
+            return np.zeros((0, 3), dtype=np.int32)
+
+        starts = np.cumsum(self.faceCounts) - self.faceCounts
+        triangles = []
+
+        for k in range(3, int(self.faceCounts.max()) + 1):
+            faces = np.nonzero(self.faceCounts >= k)[0]
+            first = self.faceIndices[starts[faces]]
+            second = self.faceIndices[starts[faces] + k - 2]
+            third = self.faceIndices[starts[faces] + k - 1]
+            triangles.append(np.stack([first, second, third], axis=1))
+
+        return np.concatenate(triangles).astype(np.int32)
@@ -0,0 +1,398 @@
+'''
+
+Miguel Ramos Carretero
+Bournemouth University 2018
+
+Python module:
+Mesh readers for headless runs (no Maya). OBJ files are parsed in chunks and
+binary PLY files are memory mapped, both straight into contiguous NumPy arrays.
+The parsed mesh is cached in binary form (keyed by the hash of the file), so
+the next runs map the cached arrays instead of parsing the file again.
+
+'''
+
+import os
+import re
+import hashlib
+import numpy as np
+
+from animface.mesh import MeshData
+from animface.profiler import profiled
+from animface.session import getSession, kMesh
+
+kCacheVersion = 2
+
+kCacheEnvVar = "ANIMFACE_CACHE"
+
+kChunkSize = 32 * 1024 * 1024
+
+#Bytes of the mixed polygon faces of a PLY file scanned per block
+kFaceBlockSize = 64 * 1024
+
+_slashSuffix = re.compile(br"/[^\s]*")
+
+_plyTypes = {
+    "char": "i1", "int8": "i1", "uchar": "u1", "uint8": "u1",
+    "short": "i2", "int16": "i2", "ushort": "u2", "uint16": "u2",
+    "int": "i4", "int32": "i4", "uint": "u4", "uint32": "u4",
+    "float": "f4", "float32": "f4", "double": "f8", "float64": "f8"
+}
+
+'''
+Parse the vertex and face lines of a chunk of an OBJ file. The face indices
+are made zero-based; negative indices are relative to the vertices read
+before their face line (nVert before the chunk).
+'''
+def _parseObjLines(lines, points, faceCounts, faceIndices, nVert=0):
+
+    vertexLines = [line[2:] for line in lines if line.startswith(b"v ")]
+    faceLines = [line[2:] for line in lines if line.startswith(b"f ")]
+
+    #Vertices read before every face line
+    verticesBefore = []
+    count = nVert
+    for line in lines:
+        if line.startswith(b"v "):
+            count += 1
+        elif line.startswith(b"f "):
+            verticesBefore.append(count)
+
+    if len(vertexLines) > 0:
+        values = np.array(b" ".join(vertexLines).split(), dtype=np.float64)
+        if values.shape[0] == 3 * len(vertexLines):
+            points.append(values.reshape(-1, 3))
+        else:
+            #Vertices with colours or weights, keep the first three values
+            points.append(np.array([line.split()[:3] for line in vertexLines], dtype=np.float64))
+
+    if len(faceLines) > 0:
+        counts = np.array([len(line.split()) for line in faceLines], dtype=np.int32)
+        indices = np.array(_slashSuffix.sub(b"", b" ".join(faceLines)).split(), dtype=np.int64)
+        offsets = np.repeat(np.array(verticesBefore, dtype=np.int64), counts)
+        faceCounts.append(counts)
+        faceIndices.append(np.where(indices > 0, indices - 1, indices + offsets))
+
+    return count
+
+'''
+Read the vertices and faces of a Wavefront OBJ file, in chunks
+'''
+def readObj(path, chunkSize=kChunkSize):
+
+    points = []
+    faceCounts = []
+    faceIndices = []
+    remainder = b""
+    nVert = 0
+
+    with open(path, 'rb') as objFile:
+        while True:
+            chunk = objFile.read(chunkSize)
+            if not chunk:
+                break
+            lines = (remainder + chunk).split(b"\n")
+            remainder = lines.pop()
+            nVert = _parseObjLines(lines, points, faceCounts, faceIndices, nVert)
+
+    _parseObjLines([remainder], points, faceCounts, faceIndices, nVert)
+
+    points = np.concatenate(points) if points else np.zeros((0, 3))
+    faceCounts = np.concatenate(faceCounts) if faceCounts else np.zeros(0, dtype=np.int32)
+    faceIndices = np.concatenate(faceIndices) if faceIndices else np.zeros(0, dtype=np.int64)
+
+    return MeshData(points, faceCounts, faceIndices, _meshName(path))
+
+'''
+Parse the header of a PLY file, returns the format, the elements (name, count,
+properties) and the size of the header in bytes
+'''
+def _readPlyHeader(plyFile):
+
+    if plyFile.readline().strip() != b"ply":
+        raise ValueError("Not a PLY file")
+
+    fileFormat = None
+    elements = []
+
+    while True:
+        line = plyFile.readline()
+        if not line:
+            raise ValueError("PLY header without end_header")
+
+        tokens = line.decode("ascii").split()
+        if len(tokens) == 0 or tokens[0] in ("comment", "obj_info"):
+            continue
+
+        if tokens[0] == "format":
+            fileFormat = tokens[1]
+        elif tokens[0] == "element":
+            elements.append((tokens[1], int(tokens[2]), []))
+        elif tokens[0] == "property":
+            if tokens[1] == "list":
+                elements[-1][2].append((tokens[4], "list", tokens[2], tokens[3]))
+            else:
+                elements[-1][2].append((tokens[2], tokens[1]))
+        elif tokens[0] == "end_header":
+            return fileFormat, elements, plyFile.tell()
+
+'''
+Read the faces of a binary PLY face element with a single list property
+'''
+def _readPlyFaces(path, offset, count, countType, indexType, endian):
+
+    countDtype = np.dtype(endian + _plyTypes[countType])
+    indexDtype = np.dtype(endian + _plyTypes[indexType])
+
+    if count == 0:
+        return np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.int32), offset
+
+    #Try the common case first: all the faces have the same number of vertices
+    with open(path, 'rb') as plyFile:
+        plyFile.seek(offset)
+        firstCount = int(np.frombuffer(plyFile.read(countDtype.itemsize), dtype=countDtype)[0])
+
+    faceDtype = np.dtype([("n", countDtype), ("v", indexDtype, (firstCount,))])
+
+    if offset + count * faceDtype.itemsize <= os.path.getsize(path):
+        faces = np.memmap(path, dtype=faceDtype, mode='r', offset=offset, shape=(count,))
+        if (faces["n"] == firstCount).all():
+            faceCounts = np.full(count, firstCount, dtype=np.int32)
+            return faceCounts, np.ascontiguousarray(faces["v"], dtype=np.int32).reshape(-1), offset + count * faceDtype.itemsize
+
+    #Mixed polygons, scanned by blocks of bytes
+    data = np.memmap(path, dtype=np.uint8, mode='r', offset=offset)
+    faceCounts = []
+    faceIndices = []
+    position = 0
+    remaining = count
+
+    while remaining > 0:
+
+        blockCounts, blockIndices, parsed = _scanPlyFaces(data, position, remaining, countDtype, indexDtype, kFaceBlockSize)
+        if blockCounts is None:
+            raise ValueError("Truncated face element in PLY file: " + path)
+
+        faceCounts.append(blockCounts)
+        faceIndices.append(blockIndices)
+        position += parsed
+        remaining -= blockCounts.shape[0]
+
+    return np.concatenate(faceCounts).astype(np.int32), np.concatenate(faceIndices).astype(np.int32), offset + position
+
+'''
+Parse the mixed polygon faces (count, indices...) that fit in a block of bytes
+starting at a face, at most maxFaces. The start of the face after every byte
+(if a face started there) is read for the whole block at once, and the starts
+of the faces of the block are found by pointer doubling over it: the faces
+2^k further than the faces found so far, with log2(faces) passes. The indices
+are then gathered at the offsets given by the cumulative sums of the counts.
+Returns the counts, the indices and the bytes parsed (None if not even one
+face fits in the rest of the data).
+'''
+def _scanPlyFaces(data, start, maxFaces, countDtype, indexDtype, blockSize):
+
+    countSize = countDtype.itemsize
+    indexSize = indexDtype.itemsize
+
+    while True:
+
+        size = min(blockSize, data.shape[0] - start)
+        if size < countSize:
+            return None, None, 0
+
+        #Count at every byte of the block, as if a face started there (none in the last bytes)
+        counts = np.zeros(size, dtype=np.int64)
+        counts[:size-countSize+1] = np.ndarray((size - countSize + 1,), dtype=countDtype, buffer=data, offset=start, strides=(1,))
+        positions = np.arange(size, dtype=np.int64)
+        nextFace = positions + countSize + counts * indexSize
+
+        #Faces ending past the block (or with a negative count) lead to the sentinel
+        complete = (nextFace > positions) & (nextFace <= size)
+        jump = np.append(np.where(complete, nextFace, size), size)
+
+        starts = np.zeros(1, dtype=np.int64)
+        while starts.shape[0] < maxFaces and starts[-1] < size:
+            following = jump[starts]
+            following = following[:np.searchsorted(following, size)]
+            starts = np.concatenate([starts, following])
+            if following.shape[0] == 0:
+                break
+            jump = jump[jump]
+
+        starts = starts[:maxFaces]
+        starts = starts[starts < size]
+        starts = starts[complete[starts]]
+
+        if starts.shape[0] > 0:
+            break
+
+        #Not one whole face in the block
+        if size < blockSize or blockSize >= data.shape[0] - start:
+            return None, None, 0
+        blockSize *= 2
+
+    faceCounts = counts[starts]
+    firstIndex = np.repeat(starts + countSize, faceCounts)
+    corner = np.arange(firstIndex.shape[0], dtype=np.int64) - np.repeat(np.cumsum(faceCounts) - faceCounts, faceCounts)
+
+    indexBytes = data[start:start+size][(firstIndex + corner * indexSize)[:, None] + np.arange(indexSize)]
+    faceIndices = np.ascontiguousarray(indexBytes).view(indexDtype).reshape(-1)
+
+    return faceCounts, faceIndices, int(nextFace[starts[-1]])
+
+'''
+Points (V x 3) of a memory mapped PLY vertex element: a strided view of the
+file for native double precision x, y, z properties next to each other, else
+converted to double precision
+'''
+def _plyPoints(data, dtype, count):
+
+    fields = [dtype.fields[coordinate] for coordinate in ("x", "y", "z")]
+
+    if all([field[0] == np.dtype(np.float64) for field in fields]) and fields[1][1] == fields[0][1] + 8 and fields[2][1] == fields[0][1] + 16:
+        return np.ndarray((count, 3), dtype=np.float64, buffer=data, offset=fields[0][1], strides=(dtype.itemsize, 8))
+
+    points = np.empty((count, 3), dtype=np.float64)
+    for axis, coordinate in enumerate(("x", "y", "z")):
+        points[:, axis] = data[coordinate]
+
+    return points
+
+'''
+Read the vertices and faces of a binary PLY file, memory mapping its elements
+'''
+def readPly(path):
+
+    with open(path, 'rb') as plyFile:
+        fileFormat, elements, offset = _readPlyHeader(plyFile)
+
+    if fileFormat == "binary_little_endian":
+        endian = "<"
+    elif fileFormat == "binary_big_endian":
+        endian = ">"
+    else:
+        raise ValueError("Only binary PLY files are supported: " + path)
+
+    points = None
+    faceCounts = None
+    faceIndices = None
+
+    for name, count, properties in elements:
+
+        if any([prop[1] == "list" for prop in properties]):
+
+            if name != "face" or len(properties) != 1:
+                raise ValueError("Unsupported list element in PLY file: " + name)
+
+            faceCounts, faceIndices, offset = _readPlyFaces(path, offset, count, properties[0][2], properties[0][3], endian)
+            continue
+
+        dtype = np.dtype([(prop[0], endian + _plyTypes[prop[1]]) for prop in properties])
+        data = np.memmap(path, dtype=dtype, mode='r', offset=offset, shape=(count,))
+        offset += count * dtype.itemsize
+
+        if name == "vertex":
+            points = _plyPoints(data, dtype, count)
+
+    if points is None:
+        raise ValueError("PLY file without vertices: " + path)
+
+    return MeshData(points, faceCounts, faceIndices, _meshName(path))
+
+'''
+Name of a mesh from its file path
+'''
+def _meshName(path):
+    return os.path.splitext(os.path.basename(path))[0]
+
+'''
+Hash of the contents of a file
+'''
+def fileHash(path, chunkSize=kChunkSize):
+
+    digest = hashlib.sha1()
+
+    with open(path, 'rb') as meshFile:
+        while True:
+            chunk = meshFile.read(chunkSize)
+            if not chunk:
+                break
+            digest.update(chunk)
+
+    return digest.hexdigest()
+
+'''
+Folder of the preprocessed meshes (ANIMFACE_CACHE or ~/.animface/meshcache)
+'''
+def getCacheFolder():
+    return os.environ.get(kCacheEnvVar) or os.path.join(os.path.expanduser("~"), ".animface", "meshcache")
+
+'''
+Map the arrays of a mesh saved by writeMeshArrays under a path prefix (.npy
+files, e.g. the mesh cache or a farm queue folder), None if they are missing
+'''
+def readMeshArrays(prefix, name=None):
+
+    paths = [prefix + suffix for suffix in (".points.npy", ".counts.npy", ".indices.npy")]
+
+    if not all([os.path.exists(path) for path in paths]):
+        return None
+
+    points, faceCounts, faceIndices = [np.load(path, mmap_mode='r') for path in paths]
+
+    return MeshData(points, faceCounts, faceIndices, name)
+
+'''
+Save the arrays of a mesh as .npy files under a path prefix, written under a
+temporary name first so readers never see partial files
+'''
+def writeMeshArrays(prefix, mesh):
+
+    folder = os.path.dirname(prefix)
+    if not os.path.exists(folder):
+        os.makedirs(folder)
+
+    for suffix, array in ((".points.npy", mesh.points), (".counts.npy", mesh.faceCounts), (".indices.npy", mesh.faceIndices)):
+        temporary = prefix + suffix + "." + str(os.getpid()) + ".tmp"
+        with open(temporary, 'wb') as cacheFile:
+            np.save(cacheFile, array)
+        os.rename(temporary, prefix + suffix)
+
+'''
+Read a mesh file (.obj or binary .ply). With useCache, the mesh is loaded from
+the binary cache if the same file was read before.
+'''
+@profiled("mesh.read")
+def readMesh(path, useCache=True, cacheFolder=None):
+
+    extension = os.path.splitext(path)[1].lower()
+
+    if extension == ".obj":
+        reader = readObj
+    elif extension == ".ply":
+        reader = readPly
+    else:
+        raise ValueError("Unsupported mesh format: " + path)
+
+    if not useCache:
+        return reader(path)
+
+    #Meshes already read in this session are reused while the file is unchanged
+    fileStat = os.stat(path)
+    sessionKey = (os.path.abspath(path), fileStat.st_mtime, fileStat.st_size)
+
+    mesh = getSession().get(kMesh, sessionKey)
+    if mesh is not None:
+        return mesh
+
+    prefix = os.path.join(cacheFolder or getCacheFolder(), fileHash(path) + ".v" + str(kCacheVersion))
+
+    mesh = readMeshArrays(prefix, _meshName(path))
+    if mesh is None:
+        mesh = reader(path)
+        try:
+            writeMeshArrays(prefix, mesh)
+        except (IOError, OSError) as exc:
+            print("Could not cache mesh " + path + ": " + str(exc))
+
+    return getSession().put(kMesh, sessionKey, mesh)
@@ -0,0 +1,146 @@
+'''
+
+Miguel Ramos Carretero
+Bournemouth University 2018
+
+Python module:
+Maya-free reader for the MoCap takes (Maya ASCII files with one transform per
+marker animated by translate curves, as the ones in the MoCapData folder).
+
+'''
+
+import os
+import re
+import numpy as np
+
+from animface.profiler import profiled
+
+_createCurve = re.compile(r'^createNode animCurveT[LUA]\s.*-n\s+"([^"]+)"')
+_keyValues = re.compile(r'^\s*setAttr\s+"\.ktv\[[0-9:]+\]"\s*(.*)$')
+_connection = re.compile(r'^connectAttr\s+"([^"]+)\.o"\s+"([^"]+)\.(tx|ty|tz|translateX|translateY|translateZ)"')
+
+_axisIndex = {"tx": 0, "ty": 1, "tz": 2, "translateX": 0, "translateY": 1, "translateZ": 2}
+
+'''
+Marker trajectories of a MoCap take. Every marker has one (times, values) pair
+of key arrays per axis, sampled with linear interpolation.
+'''
+class MoCapTake(object):
+
+    def __init__(self, name, curves):
+        self.name = name
+        self.curves = curves
+
+    def markerNames(self):
+        return sorted(self.curves.keys())
+
+    def frameRange(self):
+        ''' First and last key time of the take. '''
+
+        first = None
+        last = None
+
+        for axes in self.curves.values():
+            for times, values in axes:
+                if times.shape[0] == 0:
+                    continue
+                first = times[0] if first is None else min(first, times[0])
+                last = times[-1] if last is None else max(last, times[-1])
+
+        return first, last
+
+    def positions(self, frames, markerNames):
+        ''' Positions (F x M x 3) of the given markers at the given frames. '''
+
+        frames = np.asarray(frames, dtype=np.float64)
+        result = np.zeros((frames.shape[0], len(markerNames), 3))
+
+        for m in range(len(markerNames)):
+
+            if not markerNames[m] in self.curves:
+                raise KeyError("Marker " + markerNames[m] + " not found in MoCap take " + self.name)
+
+            for axis in range(3):
+                times, values = self.curves[markerNames[m]][axis]
+                if times.shape[0] > 0:
+                    result[:, m, axis] = np.interp(frames, times, values)
+
+        return result
+
+    def displacements(self, frames, markerNames, restFrame=0):
+        ''' Displacement (F x M x 3) of the markers relative to the rest frame. '''
+
+        rest = self.positions([restFrame], markerNames)[0]
+
+        return self.positions(frames, markerNames) - rest[None, :, :]
+
+'''
+Read the translate curves of a MoCap take in Maya ASCII format
+'''
+@profiled("mocap.parse")
+def readMoCapTake(path):
+
+    keys = {}
+    connections = {}
+    currentCurve = None
+    buffer = None
+
+    with open(path, 'r') as takeFile:
+        for line in takeFile:
+
+            #Values of the keys of the current curve, may span several lines
+            if buffer is not None:
+                buffer.append(line)
+                if ";" in line:
+                    keys[currentCurve].append(" ".join(buffer))
+                    buffer = None
+                continue
+
+            match = _createCurve.match(line)
+            if match:
+                currentCurve = match.group(1)
+                keys[currentCurve] = []
+                continue
+
+            if line.startswith("createNode"):
+                currentCurve = None
+                continue
+
+            if currentCurve is not None:
+                match = _keyValues.match(line)
+                if match:
+                    if ";" in match.group(1):
+                        keys[currentCurve].append(match.group(1))
+                    else:
+                        buffer = [match.group(1)]
+                continue
+
+            match = _connection.match(line)
+            if match:
+                connections[match.group(1)] = (match.group(2).split("|")[-1], _axisIndex[match.group(3)])
+
+    curves = {}
+    empty = (np.zeros(0), np.zeros(0))
+
+    for curveName in keys:
+
+        values = np.array(" ".join(keys[curveName]).replace(";", " ").split(), dtype=np.float64)
+        times = values[0::2]
+        order = np.argsort(times, kind="mergesort")
+
+        if curveName in connections:
+            marker, axis = connections[curveName]
+        else:
+            #Fall back to the default name of the curves (<marker>_translateX)
+            marker, sep, attribute = curveName.rpartition("_")
+            if not attribute in _axisIndex:
+                continue
+            axis = _axisIndex[attribute]
+
+        if not marker in curves:
+            curves[marker] = [empty, empty, empty]
+        curves[marker][axis] = (times[order], values[1::2][order])
+
+    name = os.path.splitext(os.path.basename(path))[0]
+
+    return MoCapTake(name, curves)
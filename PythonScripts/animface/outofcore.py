@@ -0,0 +1,586 @@
+'''
+
+Miguel Ramos Carretero
+Bournemouth University 2018
+
+Python module:
+Out-of-core execution for meshes whose matrices do not fit in memory next to
+Maya (million-vertex scans with hundreds of markers). The distance matrices
+and the vertex side of the RBF (phi) live in .npy files and are read and
+written in blocks of vertex rows with plain file I/O, so only the blocks in
+use are in memory. Every vertex is deformed independently of the others (the
+vDisp loop of pyAnimMesh), so the evaluation streams blocks of vertices
+straight into the output writer. The size of the blocks follows a memory
+budget (ANIMFACE_MEMORY_MB, 512 MB by default), not the size of the mesh.
+The files can be stored in any precision of animface.precision; quantized
+files are decoded block by block.
+
+'''
+
+import os
+import hashlib
+import tempfile
+import itertools
+import threading
+import numpy as np
+
+from animface import distances
+from animface import precision as storage
+from animface.rbf import RBFSolver, calculateGaussianRBF, buildKernel, kNormalized, kExact
+from animface.profiler import profiled
+from animface.tasks import getContext
+
+kBudgetEnvVar = "ANIMFACE_MEMORY_MB"
+kDefaultBudgetMB = 512
+
+#Smallest block of rows, whatever the budget
+kMinBlockRows = 256
+
+#Bytes of a value of a .mtx file while it is parsed (line string and float)
+kTextValueBytes = 96
+
+'''
+Memory budget in bytes: the given one in MB, or ANIMFACE_MEMORY_MB
+'''
+def getMemoryBudget(budgetMB=None):
+
+    if budgetMB is None:
+        budgetMB = float(os.environ.get(kBudgetEnvVar, kDefaultBudgetMB))
+
+    return int(float(budgetMB) * 1024 * 1024)
+
+'''
+Rows of a block that fit in the budget, given the bytes needed per row
+'''
+def blockRows(rowBytes, budgetBytes, nRows=None):
+
+    rows = max(kMinBlockRows, int(budgetBytes // max(1, rowBytes)))
+
+    if nRows is not None:
+        rows = min(rows, max(1, nRows))
+
+    return rows
+
+'''
+Estimated peak memory of the in-memory pipeline: distance matrix, phi, the
+displacements of every vertex at every frame (single precision) and those of
+a chunk of frames being deformed (double precision)
+'''
+def inCoreBytes(nVert, nMarkers, nFrames, chunkSize=64):
+    return nVert * nMarkers * 8 * 2 + nVert * nFrames * 3 * 4 + nVert * min(nFrames, chunkSize) * 3 * 8
+
+'''
+Whether animating a mesh in memory would go over the budget
+'''
+def needsOutOfCore(nVert, nMarkers, nFrames, budgetBytes=None):
+
+    if budgetBytes is None:
+        budgetBytes = getMemoryBudget()
+
+    return inCoreBytes(nVert, nMarkers, nFrames) > budgetBytes
+
+'''
+Folder of the out-of-core files of a mesh when no matrix folder is given
+'''
+def workFolder(mesh):
+
+    folder = os.path.join(tempfile.gettempdir(), "animface_outofcore", mesh.signature()[:16])
+
+    if not os.path.exists(folder):
+        os.makedirs(folder)
+
+    return folder
+
+'''
+Array stored in a .npy file (C order) read and written in blocks along its
+first two axes. Nothing is mapped: a block is read into a new array and
+written from the given one, so the memory used is the size of the blocks.
+The files are regular .npy files (np.load can open them).
+'''
+class ArrayFile(object):
+
+    def __init__(self, path, shape=None, dtype=np.float64, writable=False):
+
+        self.path = path
+        self.lock = threading.Lock()
+
+        created = shape is not None
+
+        if not created:
+            self.file = open(path, 'r+b' if writable else 'rb')
+            version = np.lib.format.read_magic(self.file)
+            if version == (1, 0):
+                shape, fortranOrder, dtype = np.lib.format.read_array_header_1_0(self.file)
+            else:
+                shape, fortranOrder, dtype = np.lib.format.read_array_header_2_0(self.file)
+            if fortranOrder:
+                raise ValueError("Fortran ordered arrays are not supported: " + path)
+        else:
+            folder = os.path.dirname(path)
+            if folder and not os.path.exists(folder):
+                os.makedirs(folder)
+            self.file = open(path, 'w+b')
+            header = {"descr": np.lib.format.dtype_to_descr(np.dtype(dtype)), "fortran_order": False, "shape": tuple(int(s) for s in shape)}
+            np.lib.format.write_array_header_1_0(self.file, header)
+
+        self.dataOffset = self.file.tell()
+        self.shape = tuple(int(s) for s in shape)
+        self.dtype = np.dtype(dtype)
+
+        #Bytes of a row (axis 0) and of a column inside a row (axis 1)
+        self.columnBytes = int(np.prod(self.shape[2:], dtype=np.int64)) * self.dtype.itemsize
+        self.rowBytes = (self.shape[1] if len(self.shape) > 1 else 1) * self.columnBytes
+
+        if created:
+            self.file.truncate(self.dataOffset + self.shape[0] * self.rowBytes)
+
+    def readRows(self, start, stop):
+        ''' Rows start to stop (the whole rows). '''
+
+        stop = min(stop, self.shape[0])
+        rows = np.empty((stop - start,) + self.shape[1:], dtype=self.dtype)
+
+        with self.lock:
+            self.file.seek(self.dataOffset + start * self.rowBytes)
+            self.file.readinto(memoryview(rows).cast('B'))
+
+        return rows
+
+    def readRowsAt(self, indices):
+        ''' The given rows, in the given order. '''
+
+        if len(indices) == 0:
+            return self.readRows(0, 0)
+
+        return np.concatenate([self.readRows(int(i), int(i) + 1) for i in indices])
+
+    def readBlock(self, rowStart, rowStop, columnStart, columnStop):
+        ''' Columns columnStart to columnStop of the rows rowStart to rowStop. '''
+
+        rowStop = min(rowStop, self.shape[0])
+        columnStop = min(columnStop, self.shape[1])
+        block = np.empty((rowStop - rowStart, columnStop - columnStart) + self.shape[2:], dtype=self.dtype)
+
+        with self.lock:
+            for row in range(rowStart, rowStop):
+                self.file.seek(self.dataOffset + row * self.rowBytes + columnStart * self.columnBytes)
+                self.file.readinto(memoryview(block[row - rowStart]).cast('B'))
+
+        return block
+
+    def writeRows(self, start, rows):
+        ''' Writes whole rows from row start. '''
+
+        rows = np.ascontiguousarray(rows, dtype=self.dtype)
+
+        with self.lock:
+            self.file.seek(self.dataOffset + start * self.rowBytes)
+            self.file.write(memoryview(rows).cast('B'))
+
+    def writeBlock(self, rowStart, columnStart, block):
+        ''' Writes a block of columns of some rows (rows x columns x ...). '''
+
+        block = np.ascontiguousarray(block, dtype=self.dtype)
+
+        with self.lock:
+            for row in range(block.shape[0]):
+                self.file.seek(self.dataOffset + (rowStart + row) * self.rowBytes + columnStart * self.columnBytes)
+                self.file.write(memoryview(block[row]).cast('B'))
+
+    def flush(self):
+        with self.lock:
+            self.file.flush()
+
+    def close(self):
+        with self.lock:
+            if not self.file.closed:
+                self.file.close()
+
+'''
+Quantized matrix file: uint16 codes, and the scale and offset of the columns
+in a second file (the format of animface.precision). Rows are read decoded
+(single precision) and written encoded.
+'''
+class QuantizedArrayFile(ArrayFile):
+
+    def __init__(self, path, shape=None, scale=None, offset=None, writable=False):
+
+        ArrayFile.__init__(self, path, shape, np.uint16, writable)
+
+        if shape is None:
+            scaleOffset = np.load(storage.scaleFilePath(path))
+            self.scale, self.offset = scaleOffset[0], scaleOffset[1]
+        else:
+            self.scale = np.asarray(scale, dtype=np.float64)
+            self.offset = np.asarray(offset, dtype=np.float64)
+            np.save(storage.scaleFilePath(path), np.stack([self.scale, self.offset]))
+
+    def readRows(self, start, stop):
+        return storage.decodeValues(ArrayFile.readRows(self, start, stop), self.scale, self.offset)
+
+    def readBlock(self, rowStart, rowStop, columnStart, columnStop):
+        codes = ArrayFile.readBlock(self, rowStart, rowStop, columnStart, columnStop)
+        return storage.decodeValues(codes, self.scale[columnStart:columnStop], self.offset[columnStart:columnStop])
+
+    def writeRows(self, start, rows):
+        ArrayFile.writeRows(self, start, storage.encodeValues(rows, self.scale, self.offset))
+
+'''
+Path of the out-of-core distance matrix of an RBF technique in a folder
+'''
+def distanceFilePath(folder, method, precision=storage.kFloat64):
+    return storage.matrixFilePath(folder, method, precision)
+
+'''
+Euclidean distance matrix into a file, by blocks of vertices
+'''
+@profiled("outofcore.euclidean")
+def euclideanDistanceFile(points, vertexMarkers, path, budgetBytes=None, context=None, dtype=np.float64):
+
+    context = getContext(context)
+    budgetBytes = budgetBytes or getMemoryBudget()
+
+    markerPoints = points[np.asarray(vertexMarkers)]
+    nVert, nMarkers = points.shape[0], markerPoints.shape[0]
+
+    output = ArrayFile(path, (nVert, nMarkers), dtype)
+    rows = blockRows(nMarkers * 8 * 5, budgetBytes, nVert)
+
+    context.stage("euclidean", nVert, "Calculating Euclidean dist. matrix")
+
+    for start in range(0, nVert, rows):
+        block = points[start:start+rows]
+        output.writeRows(start, np.sqrt(((block[:, None, :] - markerPoints[None, :, :])**2).sum(axis=2)))
+        context.advance(block.shape[0])
+
+    output.flush()
+    return output
+
+'''
+Geodesic distance matrix into a file. The columns are calculated in groups of
+markers into a scratch file (one row per marker), which is then transposed by
+blocks of vertices.
+'''
+@profiled("outofcore.geodesic")
+def geodesicDistanceFile(mesh, vertexMarkers, path, budgetBytes=None, processes=1, graph=None, context=None, dtype=np.float64):
+
+    context = getContext(context)
+    budgetBytes = budgetBytes or getMemoryBudget()
+
+    if graph is None:
+        graph = distances.buildEdgeGraph(mesh)
+
+    vertexMarkers = np.asarray(vertexMarkers, dtype=np.int64)
+    nVert, nMarkers = mesh.nVert, vertexMarkers.shape[0]
+
+    columns = ArrayFile(path + ".columns", (nMarkers, nVert), dtype)
+    groupSize = max(1, min(nMarkers, int(budgetBytes // (nVert * 8 * 3))))
+
+    context.stage("geodesic", nMarkers, "Calculating Geodesic dist. matrix")
+
+    for start in range(0, nMarkers, groupSize):
+
+        group = vertexMarkers[start:start+groupSize]
+        matrix = distances.geodesicColumns(graph, group, processes, context)
+
+        #Vertices not connected to a marker fall back to twice the Euclidean distance
+        for c in range(group.shape[0]):
+            unreachable = np.isinf(matrix[:, c])
+            if unreachable.any():
+                matrix[unreachable, c] = np.linalg.norm(mesh.points[unreachable] - mesh.points[group[c]], axis=1) * 2
+
+        columns.writeRows(start, matrix.T)
+
+    output = ArrayFile(path, (nVert, nMarkers), dtype)
+    rows = blockRows(nMarkers * 8 * 2, budgetBytes, nVert)
+
+    for start in range(0, nVert, rows):
+        output.writeRows(start, columns.readBlock(0, nMarkers, start, start + rows).T)
+
+    columns.close()
+    os.remove(path + ".columns")
+
+    output.flush()
+    return output
+
+'''
+Hybrid distance matrix into a file from the Euclidean and geodesic files
+'''
+@profiled("outofcore.hybrid")
+def hybridDistanceFile(points, eucFile, geoFile, geodesicVertices, path, budgetBytes=None, context=None, dtype=np.float64):
+
+    budgetBytes = budgetBytes or getMemoryBudget()
+
+    nVert, nMarkers = eucFile.shape
+    weights = distances.hybridWeights(points, geodesicVertices if geodesicVertices is not None else [], context=context)
+
+    output = ArrayFile(path, (nVert, nMarkers), dtype)
+    rows = blockRows(nMarkers * 8 * 4, budgetBytes, nVert)
+
+    for start in range(0, nVert, rows):
+        stop = min(start + rows, nVert)
+        block = distances.hybridDistanceMatrix(None, eucFile.readRows(start, stop), geoFile.readRows(start, stop), None, weights[start:stop])
+        output.writeRows(start, block)
+
+    output.flush()
+    return output
+
+'''
+Convert a distance matrix file (.mtx) into an out-of-core file, by blocks of
+lines
+'''
+@profiled("outofcore.convert")
+def convertMatrixFile(mtxPath, path, nVert, nMarkers, budgetBytes=None, dtype=np.float64):
+
+    budgetBytes = budgetBytes or getMemoryBudget()
+
+    output = ArrayFile(path, (nVert, nMarkers), dtype)
+    rows = blockRows(nMarkers * kTextValueBytes, budgetBytes, nVert)
+    read = 0
+
+    with open(mtxPath, 'r') as matrixFile:
+        while read < nVert:
+            values = np.array([float(line) for line in itertools.islice(matrixFile, rows * nMarkers) if line.strip()], dtype=np.float64)
+            if values.shape[0] == 0 or values.shape[0] % nMarkers != 0:
+                break
+            output.writeRows(read, values.reshape(-1, nMarkers))
+            read += values.shape[0] // nMarkers
+
+    if read != nVert:
+        output.close()
+        os.remove(path)
+        raise ValueError("Matrix file " + mtxPath + " has " + str(read) + " complete rows, expected " + str(nVert) + "x" + str(nMarkers))
+
+    output.flush()
+    return output
+
+'''
+Convert a matrix file into another one of the same shape, by blocks of rows
+(the output is given already open, e.g. a QuantizedArrayFile)
+'''
+def convertArrayFile(source, output, budgetBytes=None):
+
+    rows = blockRows(source.shape[1] * 8 * 3, budgetBytes or getMemoryBudget(), source.shape[0])
+
+    for start in range(0, source.shape[0], rows):
+        output.writeRows(start, source.readRows(start, start + rows))
+
+    output.flush()
+    return output
+
+'''
+Quantize a matrix file: the range of every column is found in a first pass,
+the codes are written in a second one
+'''
+@profiled("outofcore.quantize")
+def quantizeArrayFile(source, path, budgetBytes=None):
+
+    nVert, nMarkers = source.shape
+    rows = blockRows(nMarkers * 8 * 3, budgetBytes or getMemoryBudget(), nVert)
+
+    minimum = np.full(nMarkers, np.inf)
+    maximum = np.full(nMarkers, -np.inf)
+
+    for start in range(0, nVert, rows):
+        block = source.readRows(start, start + rows)
+        minimum = np.minimum(minimum, block.min(axis=0))
+        maximum = np.maximum(maximum, block.max(axis=0))
+
+    scale, offset = storage.quantizationParameters(minimum, maximum)
+
+    return convertArrayFile(source, QuantizedArrayFile(path, source.shape, scale, offset), budgetBytes)
+
+'''
+Open an out-of-core matrix file if it exists and matches the shape, None
+otherwise
+'''
+def openDistanceFile(path, nVert, nMarkers):
+
+    if not os.path.exists(path):
+        return None
+
+    matrix = ArrayFile(path)
+    if matrix.dtype == np.uint16:
+        matrix.close()
+        matrix = QuantizedArrayFile(path)
+
+    if matrix.shape != (nVert, nMarkers):
+        matrix.close()
+        return None
+
+    return matrix
+
+'''
+Out-of-core distance matrix of an RBF technique in a folder, in the given
+precision: the .npy file if it is there, else converted from a more precise
+file (.npy or .mtx), else calculated (for Hybrid, the Euclidean and geodesic
+files are made first and kept). Quantized files are made from a single
+precision one, removed afterwards if it was not there before.
+'''
+def distanceFile(mesh, vertexMarkers, method, folder, geodesicVertices=None, processes=1, budgetBytes=None, context=None, precision=storage.kFloat64):
+
+    method = distances.getMethodCode(method)
+    precision = storage.getPrecision(precision)
+    path = distanceFilePath(folder, method, precision)
+    nVert, nMarkers = mesh.nVert, len(vertexMarkers)
+
+    matrix = openDistanceFile(path, nVert, nMarkers)
+    if matrix is not None:
+        return matrix
+
+    if precision == storage.kUint16:
+        sourcePath = distanceFilePath(folder, method, storage.kFloat32)
+        existed = os.path.exists(sourcePath)
+        source = distanceFile(mesh, vertexMarkers, method, folder, geodesicVertices, processes, budgetBytes, context, storage.kFloat32)
+        matrix = quantizeArrayFile(source, path, budgetBytes)
+        source.close()
+        if not existed:
+            os.remove(sourcePath)
+        return matrix
+
+    dtype = storage.storageDtype(precision)
+
+    if precision == storage.kFloat32:
+        source = openDistanceFile(distanceFilePath(folder, method, storage.kFloat64), nVert, nMarkers)
+        if source is not None:
+            matrix = convertArrayFile(source, ArrayFile(path, (nVert, nMarkers), dtype), budgetBytes)
+            source.close()
+            return matrix
+
+    mtxPath = os.path.join(folder, distances.kMatrixFileNames[method])
+    if os.path.exists(mtxPath):
+        return convertMatrixFile(mtxPath, path, nVert, nMarkers, budgetBytes, dtype)
+
+    if method == distances.kEuclidean:
+        return euclideanDistanceFile(mesh.points, vertexMarkers, path, budgetBytes, context, dtype)
+
+    if method == distances.kGeodesics:
+        return geodesicDistanceFile(mesh, vertexMarkers, path, budgetBytes, processes, context=context, dtype=dtype)
+
+    euc = distanceFile(mesh, vertexMarkers, distances.kEuclidean, folder, None, processes, budgetBytes, context, precision)
+    geo = distanceFile(mesh, vertexMarkers, distances.kGeodesics, folder, None, processes, budgetBytes, context, precision)
+
+    return hybridDistanceFile(mesh.points, euc, geo, geodesicVertices, path, budgetBytes, context, dtype)
+
+'''
+Path of the phi file of a distance file, a stiffness configuration and a
+storage precision
+'''
+def phiFilePath(folder, distancePath, stiffnessValues, precision=storage.kFloat64):
+
+    digest = hashlib.sha1(os.path.basename(distancePath).encode("utf-8"))
+    digest.update(np.asarray(stiffnessValues, dtype=np.float64).tobytes())
+    digest.update(storage.getPrecision(precision).encode("utf-8"))
+
+    return os.path.join(folder, "phi_" + digest.hexdigest()[:16] + ".npy")
+
+'''
+RBF solver whose vertex side (phi) is a file. The marker side (the M x M
+kernel and its factorization) is small and stays in memory, so the solve is
+the one of RBFSolver; the evaluation reads phi by blocks of vertices. Quantized
+phi files have a fixed range (phi is between 0 and 1).
+'''
+class OutOfCoreSolver(RBFSolver):
+
+    @profiled("outofcore.kernel")
+    def __init__(self, distanceFile, vertexMarkers, stiffnessValues, mode=kNormalized, folder=None, budgetBytes=None, context=None, precision=storage.kFloat64):
+
+        if mode not in (kNormalized, kExact):
+            raise ValueError("Unknown solve mode: " + str(mode))
+
+        self.mode = mode
+        self.precision = storage.getPrecision(precision)
+        self.distances = distanceFile
+        self.vertexMarkers = np.asarray(vertexMarkers, dtype=np.int64)
+        self.stiffness = np.asarray(stiffnessValues, dtype=np.float64)
+        self.budget = budgetBytes or getMemoryBudget()
+
+        if self.stiffness.shape[0] != self.vertexMarkers.shape[0]:
+            raise ValueError("Expected " + str(self.vertexMarkers.shape[0]) + " stiffness values, got " + str(self.stiffness.shape[0]))
+
+        #Rows of the markers, the only part of the matrix the kernel needs
+        markerDistances = distanceFile.readRowsAt(self.vertexMarkers).astype(np.float64)
+
+        if mode == kNormalized:
+            self.kernel = buildKernel(markerDistances, self.stiffness)
+        else:
+            self.kernel = calculateGaussianRBF(markerDistances, self.stiffness[None, :])
+
+        #phi is stored in double precision when it cannot be evaluated in single
+        self.dtype = self.evaluationDtype()
+        phiPrecision = self.precision if self.dtype == np.float32 else storage.kFloat64
+
+        folder = folder or os.path.dirname(os.path.abspath(distanceFile.path))
+        self.phi = self.buildPhi(phiFilePath(folder, distanceFile.path, self.stiffness, phiPrecision), phiPrecision, context)
+
+        self.factorize()
+
+    def buildPhi(self, path, precision, context=None):
+        ''' Writes phi by blocks of rows of the distances, reused if newer than them. '''
+
+        nVert, nMarkers = self.distances.shape
+
+        if os.path.exists(path) and os.path.getmtime(path) >= os.path.getmtime(self.distances.path):
+            phi = openDistanceFile(path, nVert, nMarkers)
+            if phi is not None:
+                return phi
+
+        context = getContext(context)
+        context.stage("phi", nVert, "Calculating RBF of the vertices")
+
+        if precision == storage.kUint16:
+            phi = QuantizedArrayFile(path, (nVert, nMarkers), np.full(nMarkers, 1.0 / storage.kMaxCode), np.zeros(nMarkers))
+        else:
+            phi = ArrayFile(path, (nVert, nMarkers), storage.storageDtype(precision))
+
+        dtype = self.dtype
+        stiffness = self.stiffness[None, :].astype(dtype)
+        rows = blockRows(nMarkers * 8 * 3, self.budget, nVert)
+
+        for start in range(0, nVert, rows):
+            block = calculateGaussianRBF(self.distances.readRows(start, start + rows).astype(dtype, copy=False), stiffness)
+            phi.writeRows(start, block)
+            context.advance(block.shape[0])
+
+        phi.flush()
+        return phi
+
+    def frameChunk(self, chunkSize):
+        ''' Frames deformed per pass over phi: as many as a block of kMinBlockRows rows allows. '''
+        return max(chunkSize, int(self.budget // (kMinBlockRows * 3 * 8 * 3)))
+
+    def blockRows(self, nFrames):
+        ''' Vertices per block: a block of phi plus its displacements (double and single). '''
+        return blockRows(self.nMarkers * 8 + nFrames * 3 * (8 * 2 + 4), self.budget, self.nVert)
+
+    @profiled("outofcore.evaluate")
+    def evaluateBlocks(self, weights):
+        ''' Displacement of the vertices by blocks, (start, stop, block) tuples. '''
+
+        weights = np.asarray(weights, dtype=self.dtype)
+        single = weights.ndim == 2
+        if single:
+            weights = weights[None]
+
+        nFrames = weights.shape[0]
+        flat = weights.transpose(1, 0, 2).reshape(self.nMarkers, nFrames * 3)
+        rows = self.blockRows(nFrames)
+
+        for start in range(0, self.nVert, rows):
+            stop = min(start + rows, self.nVert)
+            block = self.phi.readRows(start, stop).astype(self.dtype, copy=False).dot(flat).reshape(stop - start, nFrames, 3).transpose(1, 0, 2)
+            yield start, stop, (block[0] if single else block)
+
+    def evaluate(self, weights):
+        ''' Displacement of all the vertices in memory (small meshes, tests). '''
+
+        weights = np.asarray(weights, dtype=np.float64)
+        result = np.empty((self.nVert, 3) if weights.ndim == 2 else (weights.shape[0], self.nVert, 3), dtype=self.dtype)
+
+        for start, stop, block in self.evaluateBlocks(weights):
+            result[..., start:stop, :] = block
+
+        return result
+
+    def deformBlocks(self, displacements):
+        return self.evaluateBlocks(self.solve(displacements))
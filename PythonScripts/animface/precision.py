@@ -0,0 +1,360 @@
+'''
+
+Miguel Ramos Carretero
+Bournemouth University 2018
+
+Python module:
+Storage precision of the distance matrices and of the RBF of the vertices.
+The RBF only needs the distances to about 1e-4 relative precision, so they
+can be kept (on disk and in memory) in less than the double precision of the
+.mtx files:
+
+    float64     double precision (.mtx text files, as the Maya plugins)
+    float32     single precision (.float32.npy files), half the size
+    uint16      quantized (.uint16.npy files), a quarter of the size. Every
+                column (marker) keeps a scale and an offset:
+                value = offset + code * scale
+
+Out of float64, the products of the evaluation run in single precision when
+that is safe (see animface.rbf); the small M x M kernel and its factorization
+always run in double precision. accuracyReport measures what a precision
+costs on a given mesh.
+
+'''
+
+import os
+import numpy as np
+
+from animface import distances
+from animface.profiler import timeBest
+
+kFloat64 = "float64"
+kFloat32 = "float32"
+kUint16 = "uint16"
+
+kPrecisions = (kFloat64, kFloat32, kUint16)
+
+#Largest code of the quantized storage
+kMaxCode = 65535
+
+#Rows encoded per step, bounds the temporary arrays of the quantization
+kEncodeRows = 65536
+
+#Runs of the evaluation timed by the accuracy report (the best one is kept)
+kReportRepeat = 3
+
+'''
+Get the storage precision from its name (float64 if None)
+'''
+def getPrecision(precision):
+
+    if precision is None:
+        return kFloat64
+
+    if precision not in kPrecisions:
+        raise ValueError("Unknown storage precision: " + str(precision))
+
+    return precision
+
+'''
+Type of the stored values of a precision
+'''
+def storageDtype(precision):
+    return {kFloat64: np.float64, kFloat32: np.float32, kUint16: np.uint16}[getPrecision(precision)]
+
+'''
+Type the values of a precision are computed in
+'''
+def computeDtype(precision):
+    return np.float64 if getPrecision(precision) == kFloat64 else np.float32
+
+'''
+Scale and offset of every column of a matrix for the quantized storage
+'''
+def quantizationParameters(minimum, maximum):
+
+    minimum = np.asarray(minimum, dtype=np.float64)
+    maximum = np.asarray(maximum, dtype=np.float64)
+
+    scale = (maximum - minimum) / kMaxCode
+    scale[scale <= 0] = 1.0
+
+    return scale, minimum
+
+'''
+Quantized codes of some values (rows x M) given the scale and offset of the
+columns
+'''
+def encodeValues(values, scale, offset):
+    codes = np.rint((np.asarray(values, dtype=np.float64) - offset[None, :]) / scale[None, :])
+    return np.clip(codes, 0, kMaxCode).astype(np.uint16)
+
+'''
+Values of quantized codes (rows x M) given the scale and offset of the columns
+'''
+def decodeValues(codes, scale, offset, dtype=np.float32):
+    return codes.astype(dtype) * scale.astype(dtype)[None, :] + offset.astype(dtype)[None, :]
+
+'''
+Matrix stored as uint16 codes with a scale and an offset per column
+'''
+class QuantizedMatrix(object):
+
+    def __init__(self, codes, scale, offset):
+        self.codes = codes
+        self.scale = np.asarray(scale, dtype=np.float64)
+        self.offset = np.asarray(offset, dtype=np.float64)
+
+    @property
+    def shape(self):
+        return self.codes.shape
+
+    @property
+    def nbytes(self):
+        return self.codes.nbytes + self.scale.nbytes + self.offset.nbytes
+
+    def decode(self, start=0, stop=None, dtype=np.float32):
+        ''' Values of the rows start to stop. '''
+        return decodeValues(self.codes[start:stop], self.scale, self.offset, dtype)
+
+    def rows(self, indices, dtype=np.float64):
+        ''' Values of the given rows, in the given order. '''
+        return decodeValues(self.codes[np.asarray(indices, dtype=np.int64)], self.scale, self.offset, dtype)
+
+'''
+Quantize a matrix (V x M) by blocks of rows
+'''
+def quantizeMatrix(matrix):
+
+    matrix = np.asarray(matrix)
+    scale, offset = quantizationParameters(matrix.min(axis=0), matrix.max(axis=0))
+
+    codes = np.empty(matrix.shape, dtype=np.uint16)
+    for start in range(0, matrix.shape[0], kEncodeRows):
+        codes[start:start+kEncodeRows] = encodeValues(matrix[start:start+kEncodeRows], scale, offset)
+
+    return QuantizedMatrix(codes, scale, offset)
+
+'''
+Store a matrix in the given precision (an array, or a QuantizedMatrix)
+'''
+def storeMatrix(matrix, precision):
+
+    precision = getPrecision(precision)
+
+    if isinstance(matrix, QuantizedMatrix):
+        if precision == kUint16:
+            return matrix
+        matrix = matrix.decode(dtype=storageDtype(precision))
+
+    if precision == kUint16:
+        return quantizeMatrix(matrix)
+
+    return np.asarray(matrix, dtype=storageDtype(precision))
+
+'''
+Values of a stored matrix in the given type (no copy if it already is)
+'''
+def decodeMatrix(matrix, dtype=np.float64):
+
+    if isinstance(matrix, QuantizedMatrix):
+        return matrix.decode(dtype=dtype)
+
+    return np.asarray(matrix, dtype=dtype)
+
+'''
+Rows of a stored matrix in double precision (the rows of the markers, for the
+kernel)
+'''
+def matrixRows(matrix, indices):
+
+    if isinstance(matrix, QuantizedMatrix):
+        return matrix.rows(indices)
+
+    return np.asarray(matrix)[np.asarray(indices, dtype=np.int64)].astype(np.float64)
+
+'''
+Column of a stored matrix in the given type
+'''
+def matrixColumn(matrix, column, dtype=np.float64):
+
+    if isinstance(matrix, QuantizedMatrix):
+        return decodeValues(matrix.codes[:, column:column+1], matrix.scale[column:column+1], matrix.offset[column:column+1], dtype)[:, 0]
+
+    return np.asarray(matrix)[:, column].astype(dtype)
+
+'''
+Columns of a stored matrix (V x k) in the given type
+'''
+def matrixColumns(matrix, columns, dtype=np.float64):
+
+    columns = np.asarray(columns, dtype=np.int64)
+
+    if isinstance(matrix, QuantizedMatrix):
+        return decodeValues(matrix.codes[:, columns], matrix.scale[columns], matrix.offset[columns], dtype)
+
+    return np.asarray(matrix)[:, columns].astype(dtype)
+
+'''
+Copy of a stored matrix with some columns replaced (values are V x k, in
+double precision). Quantized columns get a new scale and offset.
+'''
+def replaceColumns(matrix, columns, values):
+
+    columns = np.asarray(columns, dtype=np.int64)
+    values = np.asarray(values, dtype=np.float64).reshape(-1, columns.shape[0])
+
+    if isinstance(matrix, QuantizedMatrix):
+        scale, offset = quantizationParameters(values.min(axis=0), values.max(axis=0))
+        replaced = QuantizedMatrix(matrix.codes.copy(), matrix.scale.copy(), matrix.offset.copy())
+        replaced.codes[:, columns] = encodeValues(values, scale, offset)
+        replaced.scale[columns] = scale
+        replaced.offset[columns] = offset
+        return replaced
+
+    replaced = np.array(matrix, copy=True)
+    replaced[:, columns] = values
+
+    return replaced
+
+'''
+Precision of a stored matrix
+'''
+def matrixPrecision(matrix):
+
+    if isinstance(matrix, QuantizedMatrix):
+        return kUint16
+
+    return kFloat32 if np.asarray(matrix).dtype == np.float32 else kFloat64
+
+'''
+Path of the file of a distance matrix in a precision. Double precision
+matrices are .npy files next to the .mtx files.
+'''
+def matrixFilePath(folder, method, precision=kFloat64):
+
+    name = os.path.splitext(distances.kMatrixFileNames[distances.getMethodCode(method)])[0]
+    precision = getPrecision(precision)
+
+    if precision == kFloat64:
+        return os.path.join(folder, name + ".npy")
+
+    return os.path.join(folder, name + "." + precision + ".npy")
+
+'''
+Path of the scale and offset (2 x M) of a quantized matrix file
+'''
+def scaleFilePath(path):
+    return os.path.splitext(path)[0] + ".scale.npy"
+
+'''
+Write a stored matrix into a matrix folder: .mtx text for double precision
+(readable by the Maya plugins), .npy files otherwise
+'''
+def saveMatrix(folder, method, matrix):
+
+    precision = matrixPrecision(matrix)
+
+    if precision == kFloat64:
+        distances.writeDistanceMatrix(os.path.join(folder, distances.kMatrixFileNames[distances.getMethodCode(method)]), matrix)
+        return
+
+    if not os.path.exists(folder):
+        os.makedirs(folder)
+
+    path = matrixFilePath(folder, method, precision)
+
+    if precision == kUint16:
+        np.save(path, matrix.codes)
+        np.save(scaleFilePath(path), np.stack([matrix.scale, matrix.offset]))
+    else:
+        np.save(path, matrix)
+
+'''
+Read the matrix file of a precision, None if it does not exist or does not
+match the shape
+'''
+def readMatrixFile(path, precision, nVert, nMarkers):
+
+    if not os.path.exists(path):
+        return None
+
+    values = np.load(path)
+    if values.shape != (nVert, nMarkers) or values.dtype != storageDtype(precision):
+        return None
+
+    if precision == kUint16:
+        scaleOffset = np.load(scaleFilePath(path))
+        return QuantizedMatrix(values, scaleOffset[0], scaleOffset[1])
+
+    return values
+
+'''
+Load the distance matrix of the RBF technique from a matrix folder in the
+given precision. If there is no file of that precision, a more precise one
+(.npy or .mtx) is converted. Returns None if there is none.
+'''
+def loadMatrix(folder, method, nVert, nMarkers, precision=kFloat64):
+
+    precision = getPrecision(precision)
+    order = kPrecisions[:kPrecisions.index(precision) + 1][::-1]
+
+    for source in order:
+        matrix = readMatrixFile(matrixFilePath(folder, method, source), source, nVert, nMarkers)
+        if matrix is not None:
+            return storeMatrix(matrix, precision)
+
+    matrix = distances.loadDistanceMatrix(folder, method, nVert, nMarkers)
+    if matrix is None:
+        return None
+
+    return storeMatrix(matrix, precision)
+
+'''
+Accuracy of the reduced precisions against double precision for a distance
+matrix, a stiffness configuration and some marker displacements (F x M x 3):
+storage size, error of the distances, error of the deformation (relative to
+the largest displacement) and time of the evaluation
+'''
+def accuracyReport(matrix, vertexMarkers, stiffnessValues, mode, displacements, precisions=(kFloat32, kUint16)):
+
+    from animface.rbf import RBFSolver
+
+    matrix = decodeMatrix(matrix, np.float64)
+    displacements = np.asarray(displacements, dtype=np.float64)
+
+    reference = RBFSolver(matrix, vertexMarkers, stiffnessValues, mode)
+
+    referenceTime, referenceDeform = timeBest(lambda: reference.deform(displacements), kReportRepeat)
+
+    magnitude = max(np.abs(referenceDeform).max(), 1e-12)
+    distanceScale = max(np.abs(matrix).max(), 1e-12)
+
+    rows = [{"precision": kFloat64, "bytes": matrix.nbytes, "distanceError": 0.0, "distanceRelError": 0.0, "deformError": 0.0, "deformRelError": 0.0, "evaluateTime": referenceTime}]
+
+    for precision in precisions:
+
+        stored = storeMatrix(matrix, precision)
+        solver = RBFSolver(stored, vertexMarkers, stiffnessValues, mode, precision)
+
+        distanceError = np.abs(decodeMatrix(stored, np.float64) - matrix).max()
+
+        evaluateTime, deform = timeBest(lambda: solver.deform(displacements), kReportRepeat)
+        deformError = np.abs(deform - referenceDeform).max()
+
+        rows.append({"precision": precision, "bytes": stored.nbytes, "distanceError": float(distanceError), "distanceRelError": float(distanceError / distanceScale), "deformError": float(deformError), "deformRelError": float(deformError / magnitude), "evaluateTime": evaluateTime})
+
+    return rows
+
+'''
+Print an accuracy report
+'''
+def printAccuracyReport(rows):
+
+    print("------------------------------")
+    print("precision".ljust(12) + "MB".rjust(10) + "dist. err".rjust(12) + "rel.".rjust(10) + "deform err".rjust(12) + "rel.".rjust(10) + "eval (s)".rjust(10))
+
+    for row in rows:
+        print(row["precision"].ljust(12) + ("%.1f" % (row["bytes"] / 1048576.0)).rjust(10) + ("%.2e" % row["distanceError"]).rjust(12) + ("%.1e" % row["distanceRelError"]).rjust(10) + ("%.2e" % row["deformError"]).rjust(12) + ("%.1e" % row["deformRelError"]).rjust(10) + ("%.4f" % row["evaluateTime"]).rjust(10))
+
+    print("------------------------------")
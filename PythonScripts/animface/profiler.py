@@ -0,0 +1,383 @@
+'''
+
+Miguel Ramos Carretero
+Bournemouth University 2018
+
+Python module:
+Stage profiler of the pipeline. Stages are nested, named spans:
+
+    with profiler.span("distances.geodesic"):
+        ...
+
+Every stage aggregates its wall time, number of calls and (optionally) peak
+memory. When no profiler is active a span is a shared no-op object, so the
+engines can be instrumented at no cost. The report can be saved as JSON or as
+a trace-event file (chrome://tracing, Perfetto), and printed as a summary.
+
+'''
+
+import os
+import sys
+import json
+import time
+import threading
+import functools
+import tracemalloc
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+kMaxEvents = 200000
+
+#Runs of a function timed by timeBest
+kTimeRepeat = 3
+
+kProfileEnvVar = "ANIMFACE_PROFILE"
+
+#Peaks of nested stages need tracemalloc.reset_peak (Python 3.9+), without it
+#every stage reports the peak since the start of the run
+_canResetPeak = hasattr(tracemalloc, "reset_peak")
+
+'''
+Span used when profiling is disabled
+'''
+class _NullSpan(object):
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        return False
+
+_nullSpan = _NullSpan()
+
+'''
+Span of an active profiler, one per entered stage
+'''
+class _Span(object):
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.profiler._enter(self)
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        self.profiler._exit(self)
+        return False
+
+'''
+Aggregated values of one stage (a path of nested span names)
+'''
+class StageStats(object):
+
+    def __init__(self, path):
+        self.path = path
+        self.calls = 0
+        self.time = 0.0
+        self.childTime = 0.0
+        self.peakMemory = 0
+
+    def toDict(self):
+        return {"path": "/".join(self.path), "name": self.path[-1], "depth": len(self.path) - 1, "calls": self.calls, "time": self.time, "selfTime": self.time - self.childTime, "peakMemory": self.peakMemory}
+
+'''
+Collects the spans of a run. With trackMemory, the peak of the memory
+allocated (tracemalloc, includes NumPy arrays) is recorded for every stage.
+'''
+class Profiler(object):
+
+    def __init__(self, name="animface", trackMemory=False, recordEvents=True):
+
+        self.name = name
+        self.trackMemory = trackMemory
+        self.recordEvents = recordEvents
+
+        self.stages = {}
+        self.order = []
+        self.events = []
+        self.droppedEvents = 0
+
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._origin = time.perf_counter()
+        self._startedTracing = False
+
+        if trackMemory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._startedTracing = True
+
+    def span(self, name):
+        return _Span(self, name)
+
+    def stop(self):
+        ''' Stops the memory tracing started by this profiler. '''
+        if self._startedTracing:
+            tracemalloc.stop()
+            self._startedTracing = False
+
+    def _stack(self):
+        stack = getattr(self._local, "stack", None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    def _enter(self, span):
+
+        stack = self._stack()
+        span.path = (stack[-1].path if stack else ()) + (span.name,)
+        span.childTime = 0.0
+
+        if self.trackMemory:
+            current, peak = tracemalloc.get_traced_memory()
+            if stack:
+                stack[-1].absolutePeak = max(stack[-1].absolutePeak, peak)
+            if _canResetPeak:
+                tracemalloc.reset_peak()
+            span.startMemory = current
+            span.absolutePeak = current
+
+        stack.append(span)
+        span.start = time.perf_counter()
+
+    def _exit(self, span):
+
+        end = time.perf_counter()
+        elapsed = end - span.start
+
+        stack = self._stack()
+        stack.pop()
+        parent = stack[-1] if stack else None
+
+        if parent is not None:
+            parent.childTime += elapsed
+
+        peakMemory = 0
+        if self.trackMemory:
+            current, peak = tracemalloc.get_traced_memory()
+            span.absolutePeak = max(span.absolutePeak, peak)
+            peakMemory = span.absolutePeak - span.startMemory
+            if parent is not None:
+                parent.absolutePeak = max(parent.absolutePeak, span.absolutePeak)
+            if _canResetPeak:
+                tracemalloc.reset_peak()
+
+        with self._lock:
+
+            stats = self.stages.get(span.path)
+            if stats is None:
+                stats = self.stages[span.path] = StageStats(span.path)
+                self.order.append(span.path)
+
+            stats.calls += 1
+            stats.time += elapsed
+            stats.childTime += span.childTime
+            stats.peakMemory = max(stats.peakMemory, peakMemory)
+
+            if self.recordEvents:
+                if len(self.events) < kMaxEvents:
+                    self.events.append((span.name, span.start - self._origin, elapsed, threading.current_thread().ident))
+                else:
+                    self.droppedEvents += 1
+
+    def stage(self, *path):
+        ''' Stats of a stage given by its path, None if it never ran. '''
+        return self.stages.get(tuple(path))
+
+    def stageTime(self, *path):
+        stats = self.stage(*path)
+        return stats.time if stats is not None else 0.0
+
+    def stageCalls(self, *path):
+        stats = self.stage(*path)
+        return stats.calls if stats is not None else 0
+
+    def report(self):
+        ''' Report of the run (JSON serializable). '''
+
+        with self._lock:
+            stages = [self.stages[path].toDict() for path in self.order]
+
+        report = {"name": self.name, "pid": os.getpid(), "date": time.strftime("%Y-%m-%d %H:%M:%S"), "stages": stages, "droppedEvents": self.droppedEvents}
+
+        if resource is not None:
+            #Linux reports kilobytes, macOS bytes
+            maxRSS = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            report["maxRSS"] = maxRSS if sys.platform == "darwin" else maxRSS * 1024
+
+        return report
+
+    def traceEvents(self):
+        ''' Spans as complete events of the trace-event format (microseconds). '''
+
+        pid = os.getpid()
+
+        with self._lock:
+            events = list(self.events)
+
+        return {"traceEvents": [{"name": name, "ph": "X", "ts": start * 1e6, "dur": elapsed * 1e6, "pid": pid, "tid": tid} for name, start, elapsed, tid in events], "displayTimeUnit": "ms"}
+
+    def writeReport(self, path):
+        _writeJson(path, self.report())
+
+    def writeTrace(self, path):
+        _writeJson(path, self.traceEvents())
+
+'''
+Write an object into a JSON file, creating its folder
+'''
+def _writeJson(path, data):
+
+    folder = os.path.dirname(path)
+    if folder and not os.path.exists(folder):
+        os.makedirs(folder)
+
+    with open(path, 'w') as jsonFile:
+        json.dump(data, jsonFile, indent=4)
+
+'''
+Profiler used by the engines, None when profiling is disabled
+'''
+_activeProfiler = None
+
+'''
+Get a span of the active profiler (a no-op span if there is none)
+'''
+def span(name):
+
+    profiler = _activeProfiler
+    if profiler is None:
+        return _nullSpan
+
+    return profiler.span(name)
+
+'''
+Decorator running a function inside a span of the active profiler
+'''
+def profiled(name):
+
+    def decorator(function):
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if _activeProfiler is None:
+                return function(*args, **kwargs)
+            with _activeProfiler.span(name):
+                return function(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+'''
+Get the active profiler (None if profiling is disabled)
+'''
+def getProfiler():
+    return _activeProfiler
+
+'''
+Make a profiler the active one (None disables profiling), returns the
+previous one
+'''
+def setProfiler(profiler):
+
+    global _activeProfiler
+
+    previous = _activeProfiler
+    _activeProfiler = profiler
+
+    return previous
+
+'''
+Create a profiler and make it the active one
+'''
+def enable(name="animface", trackMemory=False, recordEvents=True):
+
+    profiler = Profiler(name, trackMemory, recordEvents)
+    setProfiler(profiler)
+
+    return profiler
+
+'''
+Disable profiling, returns the profiler that was active
+'''
+def disable():
+
+    profiler = setProfiler(None)
+    if profiler is not None:
+        profiler.stop()
+
+    return profiler
+
+'''
+Save the report and the trace of a profiler into a folder (by default the one
+given by ANIMFACE_PROFILE, nothing is saved if it is not set). Returns the
+path of the report.
+'''
+def saveProfile(profiler, folder=None):
+
+    folder = folder or os.environ.get(kProfileEnvVar)
+    if not folder:
+        return None
+
+    prefix = os.path.join(folder, profiler.name + "_" + time.strftime("%Y%m%d_%H%M%S") + "_" + str(os.getpid()))
+
+    profiler.writeReport(prefix + ".json")
+    profiler.writeTrace(prefix + ".trace.json")
+
+    return prefix + ".json"
+
+'''
+Best wall time of a few runs of a function, and its last result (for the
+reports that compare an approximation with the exact calculation)
+'''
+def timeBest(function, repeat=kTimeRepeat):
+
+    best = None
+    for r in range(repeat):
+        start = time.time()
+        result = function()
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    return best, result
+
+'''
+Format a memory size in MB
+'''
+def formatMemory(nBytes):
+    return "%.1f MB" % (nBytes / (1024.0 * 1024.0))
+
+'''
+Text view of a report: one line per stage, indented by nesting
+'''
+def formatReport(report, title="PROFILE"):
+
+    lines = [title + ": " + "-" * max(3, 44 - len(title) - 2)]
+
+    for stage in report["stages"]:
+        line = "  " * stage["depth"] + stage["name"] + ": " + str(stage["time"]) + " s"
+        if stage["calls"] > 1:
+            line += " (" + str(stage["calls"]) + " calls, " + str(stage["time"] / stage["calls"]) + " s/call)"
+        if stage["peakMemory"] > 0:
+            line += ", peak " + formatMemory(stage["peakMemory"])
+        lines.append(line)
+
+    if "maxRSS" in report:
+        lines.append("Max. resident memory: " + formatMemory(report["maxRSS"]))
+
+    lines.append("-" * 45)
+
+    return "\n".join(lines)
+
+'''
+Print the text view of a report
+'''
+def printReport(report, title="PROFILE"):
+    print("")
+    print(formatReport(report, title))
+    print("")
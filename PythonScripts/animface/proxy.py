@@ -0,0 +1,421 @@
+'''
+
+Miguel Ramos Carretero
+Bournemouth University 2018
+
+Python module:
+Decimated proxy of a mesh for multi-resolution distance calculations. The
+proxy keeps a subset of the vertices of the mesh (one per cell of a grid sized
+for the target count, plus the required vertices such as the marker
+vertices). Every vertex of the mesh belongs to the cluster of its closest proxy
+vertex along the edges, and the faces spanning three clusters are the faces of
+the proxy. The correspondence map has two parts: the vertex of the mesh of
+every proxy vertex, and for every vertex of the mesh the proxy triangle it
+projects onto with its barycentric weights.
+
+The geodesic columns are then calculated on the proxy (a Dijkstra run costs
+O(P log P) instead of O(V log V)) and interpolated back to the vertices of the
+mesh with the barycentric weights. The marker vertices are proxy vertices, so
+their distances are exact, and no distance is shorter than the Euclidean one.
+proxyReport compares the result with full-resolution geodesics on sampled
+vertices.
+
+The same interpolation is the sparse upsampling operator (V x P, three
+weights per row) of the preview bakes: the RBF is solved and evaluated on the
+proxy (ProxySolver) and the displacements are upsampled to the mesh, or the
+proxy itself is animated.
+
+'''
+
+import time
+import numpy as np
+
+from animface import distances
+from animface.mesh import MeshData
+from animface.profiler import profiled
+from animface.tasks import getContext
+
+try:
+    import scipy.sparse
+    import scipy.sparse.csgraph
+    _hasScipy = True
+except ImportError:
+    _hasScipy = False
+
+#Default number of vertices of a proxy
+kDefaultProxyVertices = 20000
+
+#Vertices of the mesh projected onto the proxy per block
+kProjectionRows = 65536
+
+#Vertices sampled by the error report (one full-resolution Dijkstra run each)
+kReportSamples = 32
+
+#Preview bakes: displacements upsampled to the mesh, or the proxy animated
+kPreviewUpsampled = "upsampled"
+kPreviewProxy = "proxy"
+
+kPreviewModes = (kPreviewUpsampled, kPreviewProxy)
+
+#Suffix of the name of a proxy mesh in a scene
+kProxySuffix = "_proxy"
+
+'''
+Total area of the faces of a mesh
+'''
+def surfaceArea(mesh):
+
+    triangles = mesh.triangles()
+    if triangles.shape[0] == 0:
+        return 0.0
+
+    a, b, c = mesh.points[triangles[:, 0]], mesh.points[triangles[:, 1]], mesh.points[triangles[:, 2]]
+    return float(0.5 * np.linalg.norm(np.cross(b - a, c - a), axis=1).sum())
+
+'''
+Vertices kept by a proxy (sorted indices): the vertex closest to the centre of
+every occupied cell of a grid sized for the target count, and the required
+vertices
+'''
+def proxySeeds(mesh, targetVertices, requiredVertices=None):
+
+    points = mesh.points
+    area = surfaceArea(mesh)
+
+    if area <= 0.0 or targetVertices >= mesh.nVert:
+        seeds = np.arange(mesh.nVert)
+    else:
+        #A surface of area A fills about A / cell^2 cells of a grid
+        cell = np.sqrt(area / float(max(targetVertices, 1)))
+        origin = points.min(axis=0)
+        cells = np.floor((points - origin) / cell).astype(np.int64)
+        size = cells.max(axis=0) + 1
+        inverse = np.unique((cells[:, 0] * size[1] + cells[:, 1]) * size[2] + cells[:, 2], return_inverse=True)[1].reshape(-1)
+
+        offsets = np.linalg.norm(points - (origin + (cells + 0.5) * cell), axis=1)
+        order = np.lexsort((offsets, inverse))
+        first = np.concatenate([[True], inverse[order][1:] != inverse[order][:-1]])
+        seeds = order[first]
+
+    if requiredVertices is not None:
+        seeds = np.concatenate([seeds, np.asarray(requiredVertices, dtype=np.int64)])
+
+    return np.unique(seeds)
+
+'''
+Cluster of every vertex of a mesh (index of the closest seed along the edges
+of the mesh, or in space for the vertices not connected to a seed and without
+SciPy)
+'''
+def clusterVertices(mesh, seeds, graph=None, chunkSize=8192):
+
+    clusters = np.full(mesh.nVert, -1, dtype=np.int64)
+    seedIndex = np.full(mesh.nVert, -1, dtype=np.int64)
+    seedIndex[seeds] = np.arange(seeds.shape[0])
+
+    if _hasScipy:
+        if graph is None:
+            graph = distances.buildEdgeGraph(mesh)
+        sources = scipy.sparse.csgraph.dijkstra(graph, directed=False, indices=seeds, min_only=True, return_predecessors=True)[2]
+        reached = sources >= 0
+        clusters[reached] = seedIndex[sources[reached]]
+
+    unreached = np.flatnonzero(clusters < 0)
+    seedPoints = mesh.points[seeds]
+
+    for start in range(0, unreached.shape[0], chunkSize):
+        block = unreached[start:start+chunkSize]
+        squared = np.square(mesh.points[block][:, None, :] - seedPoints[None, :, :]).sum(axis=2)
+        clusters[block] = squared.argmin(axis=1)
+
+    return clusters
+
+'''
+Proxy triangle and barycentric weights of every vertex of a mesh (V x 3 proxy
+vertices, V x 3 weights): the closest of the proxy triangles around the
+cluster of the vertex, projected onto its plane and clamped to the triangle.
+A cluster without triangles keeps its vertices on its proxy vertex.
+'''
+def barycentricWeights(points, proxyPoints, triangles, clusters, rows=kProjectionRows):
+
+    nVert = points.shape[0]
+    corners = np.repeat(clusters[:, None], 3, axis=1)
+    weights = np.zeros((nVert, 3))
+    weights[:, 0] = 1.0
+
+    if triangles.shape[0] == 0:
+        return corners, weights
+
+    #Triangles around every proxy vertex (CSR)
+    cornerVertices = triangles.reshape(-1)
+    order = np.argsort(cornerVertices, kind="stable")
+    incident = np.repeat(np.arange(triangles.shape[0]), 3)[order]
+    starts = np.searchsorted(cornerVertices[order], np.arange(proxyPoints.shape[0] + 1))
+    counts = np.diff(starts)
+
+    for start in range(0, nVert, rows):
+        block = np.arange(start, min(start + rows, nVert))
+        blockCounts = counts[clusters[block]]
+        if blockCounts.sum() == 0:
+            continue
+
+        #Every (vertex, triangle) pair of the block
+        pairVertex = np.repeat(block, blockCounts)
+        firstPair = np.repeat(np.cumsum(blockCounts) - blockCounts, blockCounts)
+        pairTriangle = incident[np.repeat(starts[clusters[block]], blockCounts) + np.arange(pairVertex.shape[0]) - firstPair]
+
+        a = proxyPoints[triangles[pairTriangle, 0]]
+        edge1 = proxyPoints[triangles[pairTriangle, 1]] - a
+        edge2 = proxyPoints[triangles[pairTriangle, 2]] - a
+        offset = points[pairVertex] - a
+
+        d11 = np.einsum('ij,ij->i', edge1, edge1)
+        d12 = np.einsum('ij,ij->i', edge1, edge2)
+        d22 = np.einsum('ij,ij->i', edge2, edge2)
+        o1 = np.einsum('ij,ij->i', offset, edge1)
+        o2 = np.einsum('ij,ij->i', offset, edge2)
+
+        denominator = d11 * d22 - d12 * d12
+        degenerate = denominator <= 1e-300
+        denominator[degenerate] = 1.0
+
+        v = (d22 * o1 - d12 * o2) / denominator
+        w = (d11 * o2 - d12 * o1) / denominator
+        v[degenerate] = 0.0
+        w[degenerate] = 0.0
+
+        #Clamped to the triangle: no negative weight, the weights add up to 1
+        pairWeights = np.maximum(np.stack([1.0 - v - w, v, w], axis=1), 0.0)
+        pairWeights /= pairWeights.sum(axis=1)[:, None]
+
+        projected = a + pairWeights[:, 1:2] * edge1 + pairWeights[:, 2:3] * edge2
+        squared = np.square(points[pairVertex] - projected).sum(axis=1)
+
+        #Closest triangle of every vertex: first pair of the vertex by distance
+        best = np.lexsort((squared, pairVertex))
+        best = best[np.concatenate([[True], pairVertex[best][1:] != pairVertex[best][:-1]])]
+
+        corners[pairVertex[best]] = triangles[pairTriangle[best]]
+        weights[pairVertex[best]] = pairWeights[best]
+
+    return corners, weights
+
+'''
+Decimated proxy of a mesh with its correspondence map: vertices (the vertex of
+the mesh of every proxy vertex), clusters (the proxy vertex of every vertex of
+the mesh), corners and weights (the barycentric interpolation of every vertex
+of the mesh from three proxy vertices). The required vertices are kept.
+'''
+class ProxyMesh(object):
+
+    @profiled("proxy.build")
+    def __init__(self, mesh, targetVertices=None, requiredVertices=None, graph=None, context=None):
+
+        context = getContext(context)
+        context.stage("proxy", 3, "Decimating the mesh")
+
+        if targetVertices is None:
+            targetVertices = kDefaultProxyVertices
+
+        self.vertices = proxySeeds(mesh, int(targetVertices), requiredVertices)
+        self.proxyIndex = np.full(mesh.nVert, -1, dtype=np.int64)
+        self.proxyIndex[self.vertices] = np.arange(self.vertices.shape[0])
+        context.advance()
+
+        self.clusters = clusterVertices(mesh, self.vertices, graph)
+        context.advance()
+
+        #Faces of the mesh spanning three clusters, once per set of clusters
+        triangles = self.clusters[mesh.triangles()]
+        distinct = (triangles[:, 0] != triangles[:, 1]) & (triangles[:, 1] != triangles[:, 2]) & (triangles[:, 0] != triangles[:, 2])
+        triangles = triangles[distinct]
+        triangles = triangles[np.unique(np.sort(triangles, axis=1), axis=0, return_index=True)[1]] if triangles.shape[0] else triangles.reshape(0, 3)
+
+        name = (mesh.name + "Proxy") if mesh.name else None
+        self.mesh = MeshData(mesh.points[self.vertices], np.full(triangles.shape[0], 3, dtype=np.int32), triangles.reshape(-1), name)
+        self.corners, self.weights = barycentricWeights(mesh.points, self.mesh.points, triangles, self.clusters)
+        self.operator = None
+        context.advance()
+
+    @property
+    def nVert(self):
+        return self.clusters.shape[0]
+
+    @property
+    def nProxyVert(self):
+        return self.vertices.shape[0]
+
+    def proxyIndices(self, vertices):
+        ''' Proxy vertex of some vertices of the mesh, which must be kept by the proxy. '''
+
+        indices = self.proxyIndex[np.asarray(vertices, dtype=np.int64)]
+        if np.any(indices < 0):
+            raise ValueError("Vertices not kept by the proxy: " + str(np.asarray(vertices)[indices < 0].tolist()))
+
+        return indices
+
+    def upsamplingOperator(self):
+        ''' Sparse V x P matrix of the barycentric weights (CSR), None without SciPy. '''
+
+        if self.operator is None and _hasScipy:
+            rows = np.repeat(np.arange(self.nVert), 3)
+            self.operator = scipy.sparse.csr_matrix((self.weights.reshape(-1), (rows, self.corners.reshape(-1))), shape=(self.nVert, self.nProxyVert))
+
+        return self.operator
+
+    def interpolate(self, values):
+        ''' Values of the vertices of the mesh from values of the proxy vertices (P or P x k), with the barycentric weights. '''
+
+        values = np.asarray(values)
+        operator = self.upsamplingOperator()
+
+        if operator is not None:
+            return operator.dot(values)
+
+        if values.ndim == 1:
+            return np.einsum('ij,ij->i', values[self.corners], self.weights)
+
+        return np.einsum('ijk,ij->ik', values[self.corners], self.weights)
+
+    def upsample(self, displacements):
+        ''' Displacement of the vertices of the mesh from the displacement of the proxy vertices (P x 3 or F x P x 3). '''
+
+        displacements = np.asarray(displacements)
+
+        if displacements.ndim == 2:
+            return self.interpolate(displacements)
+
+        #All the frames in a single product: (V x P) . (P x 3F)
+        nFrames = displacements.shape[0]
+        flat = displacements.transpose(1, 0, 2).reshape(self.nProxyVert, nFrames * 3)
+
+        return self.interpolate(flat).reshape(self.nVert, nFrames, 3).transpose(1, 0, 2)
+
+'''
+Solver of a mesh evaluating a solver of its proxy (built on proxy.mesh with
+the proxy vertices of the markers): the weights are the ones of the proxy
+solver, and the displacements of the proxy are upsampled to the mesh
+'''
+class ProxySolver(object):
+
+    def __init__(self, solver, proxy):
+        self.solver = solver
+        self.proxy = proxy
+        self.mode = solver.mode
+        self.dtype = solver.dtype
+
+    @property
+    def nVert(self):
+        return self.proxy.nVert
+
+    @property
+    def nMarkers(self):
+        return self.solver.nMarkers
+
+    def solve(self, displacements):
+        ''' Weights of the markers, displacements are M x 3 or F x M x 3. '''
+        return self.solver.solve(displacements)
+
+    @profiled("proxy.evaluate")
+    def evaluate(self, weights):
+        ''' Displacement of the vertices of the mesh, weights are M x 3 or F x M x 3. '''
+        return self.proxy.upsample(self.solver.evaluate(weights)).astype(self.dtype, copy=False)
+
+    def deform(self, displacements):
+        ''' Displacement of the vertices for the given marker displacements. '''
+        return self.evaluate(self.solve(displacements))
+
+    def deformBlocks(self, displacements):
+        ''' deform by blocks of vertices; the proxy is in memory, so the mesh is one block. '''
+        yield 0, self.nVert, self.deform(displacements)
+
+    def frameChunk(self, chunkSize):
+        return chunkSize
+
+'''
+Geodesic distance matrix calculated on a proxy of the mesh (built for the
+marker vertices if not given) and interpolated to the vertices of the mesh.
+The Euclidean matrix can be given to skip calculating it.
+'''
+@profiled("proxy.geodesic")
+def proxyGeodesicMatrix(mesh, vertexMarkers, proxy=None, processes=1, context=None, euclidean=None, proxyVertices=None):
+
+    if proxy is None:
+        proxy = ProxyMesh(mesh, proxyVertices, vertexMarkers, context=context)
+
+    if euclidean is None:
+        euclidean = distances.euclideanDistanceMatrix(mesh.points, vertexMarkers)
+
+    proxyGeo = distances.geodesicDistanceMatrix(proxy.mesh, proxy.proxyIndices(vertexMarkers), processes=processes, context=context)
+
+    return np.maximum(proxy.interpolate(proxyGeo), euclidean)
+
+'''
+Distance matrix of the given RBF technique with the geodesics of a proxy of
+the mesh (proxyGeodesicMatrix). The Euclidean distances are exact.
+'''
+def proxyDistanceMatrix(mesh, vertexMarkers, method, proxy=None, geodesicVertices=None, processes=1, context=None, weights=None, proxyVertices=None):
+
+    method = distances.getMethodCode(method)
+    euc = distances.euclideanDistanceMatrix(mesh.points, vertexMarkers, context)
+
+    if method == distances.kEuclidean:
+        return euc
+
+    geo = proxyGeodesicMatrix(mesh, vertexMarkers, proxy, processes, context, euc, proxyVertices)
+
+    if method == distances.kGeodesics:
+        return geo
+
+    return distances.hybridDistanceMatrix(mesh.points, euc, geo, geodesicVertices if geodesicVertices is not None else [], weights, context)
+
+'''
+Error of a distance matrix calculated on a proxy (V x M, geodesic or hybrid)
+against the full-resolution one on sampled vertices: the geodesic rows of the
+samples come from one Dijkstra run per sample on the mesh (the edge graph is
+symmetric). Largest, mean and RMS absolute errors, the mean relative error
+and the estimated time of the full-resolution geodesics.
+'''
+def proxyReport(mesh, vertexMarkers, matrix, method, proxy=None, geodesicVertices=None, samples=kReportSamples, seed=0):
+
+    method = distances.getMethodCode(method)
+    vertexMarkers = np.asarray(vertexMarkers, dtype=np.int64)
+    sampled = np.sort(np.random.default_rng(seed).choice(mesh.nVert, min(samples, mesh.nVert), replace=False))
+
+    start = time.time()
+    graph = distances.buildEdgeGraph(mesh)
+    geo = distances.geodesicColumns(graph, sampled).T[:, vertexMarkers]
+    columnTime = (time.time() - start) / max(sampled.shape[0], 1)
+
+    euc = np.linalg.norm(mesh.points[sampled][:, None, :] - mesh.points[vertexMarkers][None, :, :], axis=2)
+    unreachable = np.isinf(geo)
+    geo[unreachable] = euc[unreachable] * 2
+
+    reference = geo
+    if method == distances.kHybrid:
+        weights = distances.hybridWeights(mesh.points, geodesicVertices if geodesicVertices is not None else [])
+        reference = distances.hybridDistanceMatrix(None, euc, geo, None, weights[sampled])
+
+    error = np.abs(np.asarray(matrix)[sampled] - reference)
+    relative = error[reference > 0] / reference[reference > 0]
+
+    return {"vertices": mesh.nVert, "proxyVertices": proxy.nProxyVert if proxy is not None else None, "samples": int(sampled.shape[0]),
+            "maxError": float(error.max()), "meanError": float(error.mean()), "rmsError": float(np.sqrt(np.mean(np.square(error)))),
+            "meanRelError": float(relative.mean()) if relative.shape[0] else 0.0, "maxDistance": float(reference.max()),
+            "fullTime": columnTime * vertexMarkers.shape[0]}
+
+'''
+Print a proxy report
+'''
+def printProxyReport(report, proxyTime=None):
+
+    print("------------------------------")
+    if report["proxyVertices"] is not None:
+        print("Proxy: " + str(report["proxyVertices"]) + " of " + str(report["vertices"]) + " vertices")
+    print("Error against full-resolution geodesics (" + str(report["samples"]) + " sampled vertices): max " + ("%.3e" % report["maxError"]) + ", mean " + ("%.3e" % report["meanError"]) + ", RMS " + ("%.3e" % report["rmsError"]))
+    print("Mean relative error: " + ("%.2e" % report["meanRelError"]) + " (largest distance " + ("%.3e" % report["maxDistance"]) + ")")
+    if proxyTime is not None:
+        print("Geodesics: proxy " + ("%.2f" % proxyTime) + " s, full resolution about " + ("%.2f" % report["fullTime"]) + " s")
+    else:
+        print("Full-resolution geodesics: about " + ("%.2f" % report["fullTime"]) + " s")
+    print("------------------------------")
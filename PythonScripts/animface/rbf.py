@@ -0,0 +1,329 @@
+'''
+
+Miguel Ramos Carretero
+Bournemouth University 2018
+
+Python module:
+Maya-free Gaussian RBF solver. The kernel only depends on the distances, the
+marker vertices and the stiffness, so it is built once and reused for every
+frame (and every take) of the same mesh.
+
+Two solve modes are available:
+    normalized: weights are the marker displacements divided by the row sums
+                of the kernel (the technique used by pyAnimMesh).
+    exact:      weights interpolate the marker displacements exactly at the
+                marker vertices (K * weights = displacements).
+
+For rigs of hundreds of markers, the kernel of the exact mode can be
+approximated by a low-rank factorization (setKernelApproximation,
+animface.lowrank), which makes its factorization and updates O(M r^2) instead
+of O(M^3) and the solve of a frame O(M r).
+
+The distances can be given in any storage precision (animface.precision);
+the vertex side of the RBF and the evaluation then run in single precision,
+the kernel and its factorization in double precision. The exact mode with a
+badly conditioned kernel keeps double precision: its weights are large and
+cancel out, which single precision cannot resolve.
+
+'''
+
+import copy
+import numpy as np
+
+from animface.profiler import profiled
+from animface.lowrank import LowRankKernel
+from animface.precision import kFloat64, getPrecision, computeDtype, decodeMatrix, matrixRows, matrixColumn
+
+kNormalized = "normalized"
+kExact = "exact"
+
+#Largest kernel condition number of the exact mode evaluated in single precision
+kMaxSingleCondition = 1e3
+
+#Low-rank updates of the inverse kernel before it is computed again (round-off)
+kMaxKernelUpdates = 32
+
+#Largest condition number of the small system of a low-rank update
+kMaxUpdateCondition = 1e10
+
+'''
+Calculates the RBF between two points according to the distance and the
+given parameter gamma.
+'''
+def calculateGaussianRBF(dist, gamma):
+    return np.exp(-(np.square(dist) / np.square(gamma)))
+
+'''
+Distances between the marker vertices: entry [i][j] is the distance from the
+vertex of marker i to marker j.
+'''
+def markerDistanceMatrix(distances, vertexMarkers):
+    return np.asarray(distances)[np.asarray(vertexMarkers)]
+
+'''
+Build the M x M RBF kernel. As in pyAnimMesh, entry [i][j] (i <= j) uses the
+stiffness of marker i and the lower triangle mirrors the upper one. A stack of
+stiffness configurations (C x M) gives a stack of kernels (C x M x M).
+'''
+def buildKernel(markerDistances, stiffnessValues):
+
+    stiffness = np.asarray(stiffnessValues, dtype=np.float64)
+    upper = calculateGaussianRBF(np.asarray(markerDistances, dtype=np.float64), stiffness[..., :, None])
+
+    return np.triu(upper) + np.swapaxes(np.triu(upper, 1), -1, -2)
+
+'''
+Inverse of A + U V^T from the inverse of A (Woodbury identity), U and V are
+M x k. Returns None if the update is singular or badly conditioned.
+'''
+def woodburyUpdate(inverse, U, V):
+
+    inverseU = inverse.dot(U)
+    capacitance = np.eye(U.shape[1]) + V.T.dot(inverseU)
+
+    if np.linalg.cond(capacitance) > kMaxUpdateCondition:
+        return None
+
+    return inverse - inverseU.dot(np.linalg.solve(capacitance, V.T.dot(inverse)))
+
+'''
+RBF solver for one mesh, one set of marker vertices, one distance technique
+and one stiffness configuration. The stiffness of a marker and the vertex of a
+marker can be changed afterwards (setStiffness, moveMarker): only one column
+of phi and one row and column of the kernel change, and the solve is updated
+with low-rank updates instead of being built again.
+'''
+class RBFSolver(object):
+
+    #Low-rank approximation of the kernel (setKernelApproximation), none by default
+    kernelRank = None
+    kernelTolerance = None
+    lowRank = None
+
+    @profiled("rbf.kernel")
+    def __init__(self, distances, vertexMarkers, stiffnessValues, mode=kNormalized, precision=kFloat64):
+
+        if mode not in (kNormalized, kExact):
+            raise ValueError("Unknown solve mode: " + str(mode))
+
+        self.mode = mode
+        self.precision = getPrecision(precision)
+        self.distances = distances
+        self.vertexMarkers = np.asarray(vertexMarkers, dtype=np.int64)
+        self.stiffness = np.asarray(stiffnessValues, dtype=np.float64)
+
+        if self.stiffness.shape[0] != self.vertexMarkers.shape[0]:
+            raise ValueError("Expected " + str(self.vertexMarkers.shape[0]) + " stiffness values, got " + str(self.stiffness.shape[0]))
+
+        #Marker side of the RBF (M x M), in double precision. The exact mode
+        #interpolates, so its kernel is the vertex side at the marker vertices
+        self.markerDistances = matrixRows(distances, self.vertexMarkers)
+        if mode == kNormalized:
+            self.kernel = buildKernel(self.markerDistances, self.stiffness)
+        else:
+            self.kernel = calculateGaussianRBF(self.markerDistances, self.stiffness[None, :])
+
+        #Vertex side of the RBF (V x M), frame independent
+        self.dtype = self.evaluationDtype()
+        self.phi = calculateGaussianRBF(decodeMatrix(distances, self.dtype), self.stiffness[None, :].astype(self.dtype))
+
+        self.factorize()
+
+    def evaluationDtype(self):
+        ''' Type of the vertex side of the RBF and of the evaluation products. '''
+
+        dtype = computeDtype(self.precision)
+
+        if dtype == np.float64 or self.mode != kExact:
+            return dtype
+
+        if self.lowRank is not None and not self.lowRank.fullRank:
+            #Bound of the condition number of U V^T + nugget I, without an O(M^3) SVD
+            condition = (np.linalg.norm(self.lowRank.U, 2) * np.linalg.norm(self.lowRank.V, 2) + self.lowRank.nugget) / self.lowRank.nugget
+        else:
+            condition = np.linalg.cond(self.kernel)
+
+        if condition > kMaxSingleCondition:
+            return np.float64
+
+        return dtype
+
+    @property
+    def nVert(self):
+        return self.phi.shape[0]
+
+    @property
+    def nMarkers(self):
+        return self.phi.shape[1]
+
+    def factorize(self):
+        ''' Precomputes what the solve needs from the kernel. '''
+
+        self.kernelUpdates = 0
+
+        #The normalized solve only needs the row sums, O(M^2) once
+        if self.mode == kExact and (self.kernelRank is not None or self.kernelTolerance is not None):
+            self.lowRank = LowRankKernel(self.kernel, self.kernelRank, self.kernelTolerance)
+            self.rowSums = None
+            self.kernelInverse = None
+            return
+
+        self.lowRank = None
+
+        if self.mode == kNormalized:
+            self.rowSums = self.kernel.sum(axis=1)
+            self.kernelInverse = None
+        else:
+            self.rowSums = None
+            try:
+                self.kernelInverse = np.linalg.solve(self.kernel, np.eye(self.nMarkers))
+            except np.linalg.LinAlgError:
+                #Several markers matched with the same vertex
+                self.kernelInverse = np.linalg.pinv(self.kernel)
+
+    def setKernelApproximation(self, rank=None, tolerance=None):
+        ''' Exact mode: solves with a low-rank approximation of the kernel of the given rank or tolerance (animface.lowrank), exactly without. '''
+
+        self.kernelRank = rank
+        self.kernelTolerance = tolerance
+        self.factorize()
+
+    def copy(self):
+        ''' Copy that can be updated without touching this solver (the distances are shared until a marker moves). '''
+
+        solver = copy.copy(self)
+        solver.vertexMarkers = self.vertexMarkers.copy()
+        solver.stiffness = self.stiffness.copy()
+        solver.markerDistances = self.markerDistances.copy()
+        solver.kernel = self.kernel.copy()
+        solver.phi = self.phi.copy()
+
+        return solver
+
+    def kernelRowAndColumn(self, marker):
+        ''' Row and column of the kernel of a marker from the marker distances and the stiffness. '''
+
+        distances = self.markerDistances
+        stiffness = self.stiffness
+
+        if self.mode == kNormalized:
+            #Symmetric: entry [i][j] (i <= j) uses the stiffness of marker i
+            row = np.concatenate([calculateGaussianRBF(distances[:marker, marker], stiffness[:marker]), calculateGaussianRBF(distances[marker, marker:], stiffness[marker])])
+            return row, row.copy()
+
+        return calculateGaussianRBF(distances[marker], stiffness), calculateGaussianRBF(distances[:, marker], stiffness[marker])
+
+    @profiled("rbf.update")
+    def updateKernel(self, marker):
+        ''' Sets the row and column of a marker in the kernel and updates the solve (row sums or inverse kernel). '''
+
+        row, column = self.kernelRowAndColumn(marker)
+
+        rowDelta = row - self.kernel[marker]
+        columnDelta = column - self.kernel[:, marker]
+        rowDelta[marker] = 0.0
+
+        self.kernel[marker] = row
+        self.kernel[:, marker] = column
+
+        #The low-rank approximation is built again, in O(M r^2)
+        if self.lowRank is not None:
+            self.factorize()
+            return
+
+        if self.mode == kNormalized:
+            self.rowSums = self.rowSums + columnDelta
+            self.rowSums[marker] += rowDelta.sum()
+            return
+
+        #K' = K + columnDelta e^T + e rowDelta^T, rank 1 when only the column changes
+        unit = np.zeros((self.nMarkers, 1))
+        unit[marker] = 1.0
+
+        if np.any(rowDelta != 0.0):
+            U = np.concatenate([columnDelta[:, None], unit], axis=1)
+            V = np.concatenate([unit, rowDelta[:, None]], axis=1)
+        else:
+            U, V = columnDelta[:, None], unit
+
+        inverse = None
+        if self.kernelUpdates < kMaxKernelUpdates:
+            inverse = woodburyUpdate(self.kernelInverse, U, V)
+
+        if inverse is None:
+            self.factorize()
+        else:
+            self.kernelInverse = inverse
+            self.kernelUpdates += 1
+
+    def updatePhi(self, marker):
+        ''' Column of phi of a marker; all of phi if the kernel no longer allows single precision. '''
+
+        dtype = self.evaluationDtype()
+        if dtype != self.dtype:
+            self.dtype = dtype
+            self.phi = calculateGaussianRBF(decodeMatrix(self.distances, dtype), self.stiffness[None, :].astype(dtype))
+            return
+
+        self.phi[:, marker] = calculateGaussianRBF(matrixColumn(self.distances, marker, self.dtype), self.dtype(self.stiffness[marker]))
+
+    def setStiffness(self, marker, value):
+        ''' Changes the stiffness of one marker. '''
+
+        if float(value) == self.stiffness[marker]:
+            return
+
+        self.stiffness[marker] = float(value)
+        self.updateKernel(marker)
+        self.updatePhi(marker)
+
+    def moveMarker(self, marker, vertex, distances):
+        ''' Matches a marker with another vertex, distances is the matrix with the column of the new vertex. '''
+
+        self.distances = distances
+        self.vertexMarkers[marker] = int(vertex)
+        self.markerDistances = matrixRows(distances, self.vertexMarkers)
+
+        self.updateKernel(marker)
+        self.updatePhi(marker)
+
+    @profiled("rbf.solve")
+    def solve(self, displacements):
+        ''' Weights of the markers, displacements are M x 3 or F x M x 3. '''
+
+        displacements = np.asarray(displacements, dtype=np.float64)
+
+        if self.mode == kNormalized:
+            return displacements / self.rowSums[:, None]
+
+        if self.lowRank is not None:
+            return self.lowRank.solve(displacements)
+
+        return np.matmul(self.kernelInverse, displacements)
+
+    @profiled("rbf.evaluate")
+    def evaluate(self, weights):
+        ''' Displacement of the vertices, weights are M x 3 or F x M x 3. '''
+
+        weights = np.asarray(weights, dtype=self.dtype)
+
+        if weights.ndim == 2:
+            return self.phi.dot(weights)
+
+        #All the frames in a single product: (V x M) . (M x 3F)
+        nFrames = weights.shape[0]
+        flat = weights.transpose(1, 0, 2).reshape(self.nMarkers, nFrames * 3)
+
+        return self.phi.dot(flat).reshape(self.nVert, nFrames, 3).transpose(1, 0, 2)
+
+    def deform(self, displacements):
+        ''' Displacement of the vertices for the given marker displacements. '''
+        return self.evaluate(self.solve(displacements))
+
+    def deformBlocks(self, displacements):
+        ''' deform by blocks of vertices, (start, stop, block) tuples. phi is in memory, so the mesh is one block. '''
+        yield 0, self.nVert, self.deform(displacements)
+
+    def frameChunk(self, chunkSize):
+        ''' Frames to deform per call, given the default chunk of the caller. '''
+        return chunkSize
@@ -0,0 +1,217 @@
+'''
+
+Miguel Ramos Carretero
+Bournemouth University 2018
+
+Python module:
+Reduced-basis evaluation for latency-budgeted playback. A built solver maps the
+marker displacements to the vertex displacements with a fixed V x M operator,
+phi times the solve of the kernel (K^-1 in the exact mode, the inverse row sums
+in the normalized one). That operator is compressed into a truncated low-rank
+basis (its top singular vectors):
+
+    deformation = B . (P . displacements)
+
+with B the V x r basis of the vertices and P the r x M projection of the
+markers, so each frame costs O((V + M) r) instead of O(V M). The rank is the
+smallest one whose spectral error (the first dropped singular value over the
+largest one) is within a tolerance, or a given rank.
+
+The operator is read by blocks of vertices (the R of a thin QR is updated block
+after block), so the reduction also works on out-of-core solvers: only the
+V x r basis is kept in memory. reductionReport measures the error against the full evaluation.
+
+'''
+
+import numpy as np
+
+from animface.profiler import profiled, timeBest
+from animface.tasks import getContext
+
+#Default spectral error tolerance (relative to the largest singular value)
+kDefaultTolerance = 1e-3
+
+#Vertices of the operator read per block
+kOperatorRows = 65536
+
+#Frames of the displacements of the report
+kReportFrames = 20
+
+'''
+Rank of a truncated basis: the given rank (at most the number of singular
+values), else the singular values above tolerance times the largest one
+'''
+def truncationRank(singularValues, tolerance=None, rank=None):
+
+    singularValues = np.asarray(singularValues, dtype=np.float64)
+
+    if rank is not None:
+        return max(1, min(int(rank), singularValues.shape[0]))
+
+    if tolerance is None:
+        tolerance = kDefaultTolerance
+
+    if singularValues.shape[0] == 0 or singularValues[0] <= 0:
+        return 1
+
+    return max(1, int(np.count_nonzero(singularValues > tolerance * singularValues[0])))
+
+'''
+Relative spectral and Frobenius errors of the truncation of singular values to
+a rank
+'''
+def truncationErrors(singularValues, rank):
+
+    singularValues = np.asarray(singularValues, dtype=np.float64)
+    largest = max(singularValues[0], 1e-300)
+    total = max(np.sqrt(np.square(singularValues).sum()), 1e-300)
+
+    spectral = singularValues[rank] / largest if rank < singularValues.shape[0] else 0.0
+    frobenius = np.sqrt(np.square(singularValues[rank:]).sum()) / total
+
+    return float(spectral), float(frobenius)
+
+'''
+Operator of a solver by blocks of vertices, (start, stop, block) tuples in
+double precision: phi times the solve of the kernel. phi is read from its file
+for out-of-core solvers, and made dense for the sparse ones (animface.fastgauss).
+'''
+def operatorBlocks(solver, rows=kOperatorRows):
+
+    #The solve is linear: applied to the identity it is the M x M matrix
+    solve = solver.solve(np.eye(solver.nMarkers))
+
+    for start in range(0, solver.nVert, rows):
+        stop = min(start + rows, solver.nVert)
+        if hasattr(solver.phi, "readRows"):
+            phi = solver.phi.readRows(start, stop)
+        elif hasattr(solver.phi, "toarray"):
+            phi = solver.phi[start:stop].toarray()
+        else:
+            phi = solver.phi[start:stop]
+        yield start, stop, np.asarray(phi, dtype=np.float64).dot(solve)
+
+'''
+Solver evaluating a truncated low-rank basis of the operator of a built solver
+(RBFSolver or OutOfCoreSolver). The weights it solves and evaluates are the r
+coefficients of the basis (r x 3, or F x r x 3).
+'''
+class ReducedSolver(object):
+
+    @profiled("reduced.basis")
+    def __init__(self, solver, tolerance=None, rank=None, context=None):
+
+        context = getContext(context)
+
+        self.mode = solver.mode
+        self.dtype = solver.dtype
+        self.markerCount = solver.nMarkers
+
+        #First pass: R of a thin QR of the operator, by blocks (its singular
+        #values and right singular vectors are the ones of the operator)
+        context.stage("reduction", 2 * solver.nVert, "Compressing the RBF of the vertices")
+
+        R = np.zeros((0, self.markerCount))
+        for start, stop, block in operatorBlocks(solver):
+            R = np.linalg.qr(np.concatenate([R, block]), mode='r')
+            context.advance(stop - start)
+
+        singularValues, rightVectors = np.linalg.svd(R)[1:]
+        self.singularValues = singularValues
+        self.rank = truncationRank(singularValues, tolerance, rank)
+        self.tolerance = tolerance
+        self.spectralError, self.frobeniusError = truncationErrors(singularValues, self.rank)
+
+        #Second pass: basis of the vertices, the operator on the kept directions
+        self.projection = rightVectors[:self.rank].copy()
+        self.basis = np.empty((solver.nVert, self.rank), dtype=self.dtype)
+
+        for start, stop, block in operatorBlocks(solver):
+            self.basis[start:stop] = block.dot(self.projection.T)
+            context.advance(stop - start)
+
+    @property
+    def nVert(self):
+        return self.basis.shape[0]
+
+    @property
+    def nMarkers(self):
+        return self.markerCount
+
+    @profiled("reduced.solve")
+    def solve(self, displacements):
+        ''' Coefficients of the basis, displacements are M x 3 or F x M x 3. '''
+        return np.matmul(self.projection, np.asarray(displacements, dtype=np.float64))
+
+    @profiled("reduced.evaluate")
+    def evaluate(self, coefficients):
+        ''' Displacement of the vertices, coefficients are r x 3 or F x r x 3. '''
+
+        coefficients = np.asarray(coefficients, dtype=self.dtype)
+
+        if coefficients.ndim == 2:
+            return self.basis.dot(coefficients)
+
+        #All the frames in a single product: (V x r) . (r x 3F)
+        nFrames = coefficients.shape[0]
+        flat = coefficients.transpose(1, 0, 2).reshape(self.rank, nFrames * 3)
+
+        return self.basis.dot(flat).reshape(self.nVert, nFrames, 3).transpose(1, 0, 2)
+
+    def deform(self, displacements):
+        ''' Displacement of the vertices for the given marker displacements. '''
+        return self.evaluate(self.solve(displacements))
+
+    def deformBlocks(self, displacements):
+        ''' deform by blocks of vertices; the basis is in memory, so the mesh is one block. '''
+        yield 0, self.nVert, self.deform(displacements)
+
+    def frameChunk(self, chunkSize):
+        return chunkSize
+
+'''
+Error of a reduced solver against the full solver it was built from, on some
+marker displacements (F x M x 3): rank, spectral and Frobenius error of the
+truncation, largest and RMS deformation error (also relative to the largest
+displacement), time per frame of both evaluations and size of what they keep
+in memory
+'''
+def reductionReport(solver, reduced, displacements, frames=kReportFrames):
+
+    displacements = np.asarray(displacements, dtype=np.float64)[:frames]
+    nFrames = displacements.shape[0]
+
+    fullTime, reference = timeBest(lambda: solver.deform(displacements))
+    reducedTime, deform = timeBest(lambda: reduced.deform(displacements))
+
+    error = np.linalg.norm(np.asarray(deform, dtype=np.float64) - reference, axis=-1)
+    magnitude = max(np.linalg.norm(reference, axis=-1).max(), 1e-12)
+
+    fullBytes = 0
+    if hasattr(solver.phi, "toarray"):
+        fullBytes = int(solver.phi.data.nbytes + solver.phi.indices.nbytes + solver.phi.indptr.nbytes)
+    elif not hasattr(solver.phi, "readRows"):
+        fullBytes = int(solver.phi.nbytes)
+
+    return {"rank": reduced.rank, "markers": reduced.nMarkers, "vertices": reduced.nVert, "frames": nFrames,
+            "spectralError": reduced.spectralError, "frobeniusError": reduced.frobeniusError,
+            "maxError": float(error.max()), "maxRelError": float(error.max() / magnitude),
+            "rmsError": float(np.sqrt(np.mean(np.square(error)))), "rmsRelError": float(np.sqrt(np.mean(np.square(error))) / magnitude),
+            "fullFrameTime": fullTime / max(nFrames, 1), "reducedFrameTime": reducedTime / max(nFrames, 1),
+            "fullBytes": fullBytes, "reducedBytes": int(reduced.basis.nbytes + reduced.projection.nbytes)}
+
+'''
+Print a reduction report
+'''
+def printReductionReport(report):
+
+    print("------------------------------")
+    print("Reduced basis: rank " + str(report["rank"]) + " of " + str(report["markers"]) + " markers, " + str(report["vertices"]) + " vertices")
+    print("Truncation error: spectral " + ("%.2e" % report["spectralError"]) + ", Frobenius " + ("%.2e" % report["frobeniusError"]))
+    print("Deformation error (" + str(report["frames"]) + " frames): max " + ("%.3e" % report["maxError"]) + " (rel. " + ("%.1e" % report["maxRelError"]) + "), RMS " + ("%.3e" % report["rmsError"]) + " (rel. " + ("%.1e" % report["rmsRelError"]) + ")")
+    print("Time per frame: full " + ("%.3f" % (report["fullFrameTime"] * 1000.0)) + " ms, reduced " + ("%.3f" % (report["reducedFrameTime"] * 1000.0)) + " ms")
+    if report["fullBytes"]:
+        print("Memory: full " + ("%.1f" % (report["fullBytes"] / 1048576.0)) + " MB, reduced " + ("%.1f" % (report["reducedBytes"] / 1048576.0)) + " MB")
+    else:
+        print("Memory: reduced " + ("%.1f" % (report["reducedBytes"] / 1048576.0)) + " MB (full: out of core)")
+    print("------------------------------")
@@ -0,0 +1,324 @@
+'''
+
+Miguel Ramos Carretero
+Bournemouth University 2018
+
+Python module:
+Region-decomposed RBF solves. Instead of one global system of all the markers,
+every group of markers of the layout (Top, TopMiddle, Middle, MiddleBottom and
+Bottom in the default layout) is a region solved on its own:
+
+    - the markers of a region are the markers of its group and, as overlap,
+      the markers of the other groups whose Gaussian reaches the group (closer
+      than overlap times their stiffness to one of its markers)
+    - every region has its own kernel (M_r x M_r) and solve
+    - the regions are blended with a partition of unity over the vertices:
+      a vertex belongs to the region of its closest marker, and is blended
+      with the regions whose closest marker is barely further (within a
+      width of the stiffness)
+
+A vertex only evaluates the markers of the regions it is blended with, so each
+frame costs the sum of V_r M_r over the regions instead of V M, and the
+factorization the sum of the M_r^3 instead of M^3. The regions are independent
+and can be solved and evaluated by a pool of threads. regionReport measures
+the difference with the global solve.
+
+'''
+
+import numpy as np
+
+from concurrent.futures import ThreadPoolExecutor
+
+from animface.precision import kFloat64, getPrecision, computeDtype, matrixRows, matrixColumns
+from animface.profiler import profiled, timeBest
+from animface.rbf import calculateGaussianRBF, buildKernel, kNormalized, kExact, kMaxSingleCondition
+from animface.tasks import getContext
+
+#Default overlap of the regions, in stiffness units of the markers of the other groups
+#(past it, the Gaussian of a marker weighs less than exp(-9) at the group)
+kDefaultOverlap = 3.0
+
+#Width of the blend between two regions, in stiffness units of the closest marker
+kBlendWidth = 0.5
+
+#Frames of the displacements of the report
+kReportFrames = 20
+
+'''
+Markers of every region (sorted indices): the markers of the group and the
+markers of the other groups closer than overlap times their stiffness to one
+of the markers of the group. Entry [i][j] of the marker distances is the
+distance from the vertex of marker i to marker j.
+'''
+def regionMarkers(markerDistances, stiffnessValues, groups, overlap=kDefaultOverlap):
+
+    markerDistances = np.asarray(markerDistances, dtype=np.float64)
+    stiffness = np.asarray(stiffnessValues, dtype=np.float64)
+    regions = []
+
+    for group in groups:
+        group = np.asarray(group, dtype=np.int64)
+        reach = markerDistances[group].min(axis=0) <= overlap * stiffness
+        reach[group] = True
+        regions.append(np.flatnonzero(reach))
+
+    return regions
+
+'''
+Partition of unity of the regions over the vertices (V x R). A vertex is in
+the region of its closest marker, and blended with the regions whose closest
+marker is less than width times the stiffness of its closest marker further:
+
+    w_r = (1 - (d_r - d) / (width s))^2
+
+with d_r the distance to the closest marker of the group of region r and d
+(stiffness s) the distance to the closest marker. The weights of a vertex are
+normalized over the regions.
+'''
+def partitionOfUnity(distances, stiffnessValues, groups, width=kBlendWidth):
+
+    stiffness = np.asarray(stiffnessValues, dtype=np.float64)
+    nVert = distances.shape[0]
+
+    closest = np.empty((nVert, len(groups)))
+    closestMarker = np.empty((nVert, len(groups)), dtype=np.int64)
+
+    for r in range(len(groups)):
+        columns = matrixColumns(distances, groups[r])
+        nearest = np.argmin(columns, axis=1)
+        closest[:, r] = columns[np.arange(nVert), nearest]
+        closestMarker[:, r] = np.asarray(groups[r])[nearest]
+
+    own = np.argmin(closest, axis=1)
+    offsets = closest - closest[np.arange(nVert), own][:, None]
+    widths = max(width, 1e-12) * stiffness[closestMarker[np.arange(nVert), own]]
+
+    blend = np.square(np.maximum(1.0 - offsets / widths[:, None], 0.0))
+
+    return blend / blend.sum(axis=1)[:, None]
+
+'''
+One region of a RegionSolver: its markers, the vertices it is blended with,
+the RBF of those vertices times their blend weight (V_r x M_r) and the solve
+of its kernel
+'''
+class Region(object):
+
+    def __init__(self, name, markers, vertices, phi, kernel, mode):
+
+        self.name = name
+        self.markers = markers
+        self.vertices = vertices
+        self.phi = phi
+        self.kernel = kernel
+
+        if mode == kNormalized:
+            self.rowSums = kernel.sum(axis=1)
+            self.kernelInverse = None
+        else:
+            self.rowSums = None
+            try:
+                self.kernelInverse = np.linalg.solve(kernel, np.eye(kernel.shape[0]))
+            except np.linalg.LinAlgError:
+                #Several markers matched with the same vertex
+                self.kernelInverse = np.linalg.pinv(kernel)
+
+    def solve(self, displacements):
+        ''' Weights of the markers of the region, displacements are M_r x 3 or F x M_r x 3. '''
+
+        if self.kernelInverse is None:
+            return displacements / self.rowSums[:, None]
+
+        return np.matmul(self.kernelInverse, displacements)
+
+    def evaluate(self, flatWeights):
+        ''' Blended displacement of the vertices of the region, weights are M_r x 3F. '''
+        return self.phi.dot(flatWeights.astype(self.phi.dtype, copy=False))
+
+'''
+RBF solver of a mesh decomposed in regions of markers (the groups of the
+layout, as marker indices in solver order). The weights it solves and
+evaluates are the weights of every region one after the other
+(sum of M_r x 3, or F x sum of M_r x 3); with workers, the regions are solved
+and evaluated by a pool of threads.
+'''
+class RegionSolver(object):
+
+    @profiled("regions.kernel")
+    def __init__(self, distances, vertexMarkers, stiffnessValues, groups, mode=kNormalized, overlap=None, precision=kFloat64, workers=1, names=None, context=None):
+
+        if mode not in (kNormalized, kExact):
+            raise ValueError("Unknown solve mode: " + str(mode))
+
+        if overlap is None:
+            overlap = kDefaultOverlap
+        if overlap < 0.0:
+            raise ValueError("The overlap of the regions cannot be negative, got " + str(overlap))
+
+        self.mode = mode
+        self.precision = getPrecision(precision)
+        self.overlap = float(overlap)
+        self.vertexMarkers = np.asarray(vertexMarkers, dtype=np.int64)
+        self.stiffness = np.asarray(stiffnessValues, dtype=np.float64)
+        self.vertexCount = distances.shape[0]
+
+        if self.stiffness.shape[0] != self.vertexMarkers.shape[0]:
+            raise ValueError("Expected " + str(self.vertexMarkers.shape[0]) + " stiffness values, got " + str(self.stiffness.shape[0]))
+
+        groups = [np.asarray(group, dtype=np.int64) for group in groups if len(group)]
+        if names is None:
+            names = ["Region" + str(r) for r in range(len(groups))]
+
+        grouped = np.concatenate(groups) if groups else np.zeros(0, dtype=np.int64)
+        if grouped.shape[0] != self.nMarkers or np.unique(grouped).shape[0] != self.nMarkers:
+            raise ValueError("Every marker must be in exactly one region")
+
+        context = getContext(context)
+        context.stage("regions", len(groups) + 1, "Blending the regions of the markers")
+
+        markerDistances = matrixRows(distances, self.vertexMarkers)
+        markers = regionMarkers(markerDistances, self.stiffness, groups, self.overlap)
+
+        blend = partitionOfUnity(distances, self.stiffness, groups)
+        context.advance()
+
+        kernels = []
+        for r in range(len(groups)):
+            local = markerDistances[np.ix_(markers[r], markers[r])]
+            if mode == kNormalized:
+                kernels.append(buildKernel(local, self.stiffness[markers[r]]))
+            else:
+                kernels.append(calculateGaussianRBF(local, self.stiffness[markers[r]][None, :]))
+
+        self.dtype = self.evaluationDtype(kernels)
+
+        self.regions = []
+        for r in range(len(groups)):
+            vertices = np.flatnonzero(blend[:, r])
+            columns = matrixColumns(distances, markers[r], self.dtype)[vertices]
+            phi = calculateGaussianRBF(columns, self.stiffness[markers[r]][None, :].astype(self.dtype))
+            phi *= blend[vertices, r][:, None].astype(self.dtype)
+            self.regions.append(Region(names[r], markers[r], vertices, phi, kernels[r], mode))
+            context.advance()
+
+        self.offsets = np.concatenate([[0], np.cumsum([region.markers.shape[0] for region in self.regions])])
+        self.workers = max(1, int(workers))
+        self.executor = ThreadPoolExecutor(max_workers=self.workers) if self.workers > 1 else None
+
+    def evaluationDtype(self, kernels):
+        ''' Type of the vertex side of the RBF: double precision if a kernel of the exact mode is badly conditioned. '''
+
+        dtype = computeDtype(self.precision)
+
+        if dtype == np.float64 or self.mode != kExact:
+            return dtype
+
+        for kernel in kernels:
+            if np.linalg.cond(kernel) > kMaxSingleCondition:
+                return np.float64
+
+        return dtype
+
+    @property
+    def nVert(self):
+        return self.vertexCount
+
+    @property
+    def nMarkers(self):
+        return self.vertexMarkers.shape[0]
+
+    @property
+    def nWeights(self):
+        return int(self.offsets[-1])
+
+    def evaluatedPairs(self):
+        ''' Vertex and marker pairs evaluated per frame (V M for the global solve). '''
+        return int(sum(region.vertices.shape[0] * region.markers.shape[0] for region in self.regions))
+
+    def _map(self, function, items):
+        if self.executor is None:
+            return [function(item) for item in items]
+        return list(self.executor.map(function, items))
+
+    @profiled("regions.solve")
+    def solve(self, displacements):
+        ''' Weights of every region, displacements are M x 3 or F x M x 3. '''
+
+        displacements = np.asarray(displacements, dtype=np.float64)
+        weights = self._map(lambda region: region.solve(displacements[..., region.markers, :]), self.regions)
+
+        return np.concatenate(weights, axis=-2)
+
+    @profiled("regions.evaluate")
+    def evaluate(self, weights):
+        ''' Displacement of the vertices, weights are (sum of M_r) x 3 or F x (sum of M_r) x 3. '''
+
+        weights = np.asarray(weights)
+        single = weights.ndim == 2
+        if single:
+            weights = weights[None]
+
+        #Every region in a single product: (V_r x M_r) . (M_r x 3F)
+        nFrames = weights.shape[0]
+        flat = weights.transpose(1, 0, 2).reshape(self.nWeights, nFrames * 3)
+
+        indices = range(len(self.regions))
+        blocks = self._map(lambda r: self.regions[r].evaluate(flat[self.offsets[r]:self.offsets[r+1]]), indices)
+
+        #The vertices of a region are unique, the blocks are added one after the other
+        result = np.zeros((self.nVert, nFrames * 3), dtype=self.dtype)
+        for r in indices:
+            result[self.regions[r].vertices] += blocks[r]
+
+        result = result.reshape(self.nVert, nFrames, 3).transpose(1, 0, 2)
+
+        return result[0] if single else result
+
+    def deform(self, displacements):
+        ''' Displacement of the vertices for the given marker displacements. '''
+        return self.evaluate(self.solve(displacements))
+
+    def deformBlocks(self, displacements):
+        ''' deform by blocks of vertices; the regions are in memory, so the mesh is one block. '''
+        yield 0, self.nVert, self.deform(displacements)
+
+    def frameChunk(self, chunkSize):
+        return chunkSize
+
+'''
+Difference of a region solver with the global solver of the same mesh, on
+some marker displacements (F x M x 3): markers and vertices of every region,
+evaluated pairs, largest and RMS deformation difference (also relative to the
+largest displacement) and time per frame of both solves
+'''
+def regionReport(solver, regional, displacements, frames=kReportFrames):
+
+    displacements = np.asarray(displacements, dtype=np.float64)[:frames]
+    nFrames = displacements.shape[0]
+
+    globalTime, reference = timeBest(lambda: solver.deform(displacements))
+    regionTime, deform = timeBest(lambda: regional.deform(displacements))
+
+    error = np.linalg.norm(np.asarray(deform, dtype=np.float64) - reference, axis=-1)
+    magnitude = max(np.linalg.norm(reference, axis=-1).max(), 1e-12)
+
+    return {"regions": [(region.name, region.markers.shape[0], region.vertices.shape[0]) for region in regional.regions],
+            "markers": regional.nMarkers, "vertices": regional.nVert, "frames": nFrames, "overlap": regional.overlap,
+            "pairs": regional.evaluatedPairs(), "globalPairs": regional.nVert * regional.nMarkers,
+            "maxError": float(error.max()), "maxRelError": float(error.max() / magnitude),
+            "rmsError": float(np.sqrt(np.mean(np.square(error)))), "rmsRelError": float(np.sqrt(np.mean(np.square(error))) / magnitude),
+            "globalFrameTime": globalTime / max(nFrames, 1), "regionFrameTime": regionTime / max(nFrames, 1)}
+
+'''
+Print a region report
+'''
+def printRegionReport(report):
+
+    print("------------------------------")
+    print("Regions: " + str(len(report["regions"])) + " of " + str(report["markers"]) + " markers, overlap " + ("%.2f" % report["overlap"]) + " stiffness")
+    for name, markers, vertices in report["regions"]:
+        print("    " + name + ": " + str(markers) + " markers, " + str(vertices) + " vertices")
+    print("Evaluated pairs: " + ("%.1f" % (100.0 * report["pairs"] / max(report["globalPairs"], 1))) + "% of the global solve")
+    print("Difference with the global solve (" + str(report["frames"]) + " frames): max " + ("%.3e" % report["maxError"]) + " (rel. " + ("%.1e" % report["maxRelError"]) + "), RMS " + ("%.3e" % report["rmsError"]) + " (rel. " + ("%.1e" % report["rmsRelError"]) + ")")
+    print("Time per frame: global " + ("%.3f" % (report["globalFrameTime"] * 1000.0)) + " ms, regions " + ("%.3f" % (report["regionFrameTime"] * 1000.0)) + " ms")
+    print("------------------------------")
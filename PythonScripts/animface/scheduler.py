@@ -0,0 +1,174 @@
+'''
+
+Miguel Ramos Carretero
+Bournemouth University 2018
+
+Python module:
+Retarget one MoCap take onto many meshes (e.g. the realistic and stylized
+variants of a character). The take is parsed and resampled once, then every
+mesh runs its own matching, matrix and solve stages in a pool of workers. The
+memory used by the meshes being processed at the same time is bounded.
+
+'''
+
+import os
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from animface import distances
+from animface.rbf import kNormalized
+from animface.mocap import readMoCapTake
+from animface.bakecache import BakeCacheWriter
+from animface.tasks import TaskCancelled, TaskContext, getContext
+from animface.batch import prepareSolver
+from animface.session import clearSession, kSolver
+
+kFrameChunk = 64
+
+'''
+Marker displacements of a take resampled at the frames to bake, shared (read
+only) by all the meshes.
+'''
+class ResampledTake(object):
+
+    def __init__(self, path, mocapNames, frames, restFrame=0):
+
+        take = readMoCapTake(path)
+
+        self.name = take.name
+        self.path = os.path.abspath(path)
+        self.frames = list(frames)
+        self.restFrame = restFrame
+        self.displacements = take.displacements(self.frames, mocapNames, restFrame)
+
+'''
+Everything needed to retarget a take onto one mesh. The matrix folder holds
+the distance matrices of the mesh; missing matrices are calculated and saved
+there so the next runs reuse them.
+'''
+class MeshJob(object):
+
+    def __init__(self, mesh, markerPoints, method, stiffnessValues, outputFolder, matrixFolder=None, geodesicVertices=None, mode=kNormalized):
+        self.mesh = mesh
+        self.name = mesh.name
+        self.markerPoints = markerPoints
+        self.method = distances.getMethodCode(method)
+        self.stiffnessValues = list(stiffnessValues)
+        self.outputFolder = outputFolder
+        self.matrixFolder = matrixFolder
+        self.geodesicVertices = geodesicVertices
+        self.mode = mode
+
+    def estimateMemory(self, nFrames):
+        ''' Peak bytes used by the job: distances, kernel and a chunk of frames. '''
+        nMarkers = len(self.markerPoints)
+        matrices = 3 * self.mesh.nVert * nMarkers * 8
+        frames = 2 * min(nFrames, kFrameChunk) * self.mesh.nVert * 3 * 8
+        return matrices + frames
+
+'''
+Counting semaphore over bytes. A request bigger than the budget is granted
+when nothing else is running, so a single huge mesh never blocks forever.
+'''
+class MemoryBudget(object):
+
+    def __init__(self, budgetBytes):
+        self.budget = budgetBytes
+        self.used = 0
+        self.condition = threading.Condition()
+
+    def acquire(self, nBytes):
+        with self.condition:
+            while self.used > 0 and self.used + nBytes > self.budget:
+                self.condition.wait()
+            self.used += nBytes
+
+    def release(self, nBytes):
+        with self.condition:
+            self.used -= nBytes
+            self.condition.notify_all()
+
+'''
+Get the solver of a mesh job, from the session cache or building it (the
+distance matrix is loaded from, or saved into, the matrix folder of the mesh)
+'''
+def getMeshSolver(job, context=None):
+    solver, times = prepareSolver(job.mesh, job.markerPoints, job.method, job.stiffnessValues, job.matrixFolder, job.geodesicVertices, job.mode, saveMatrix=True, context=context)
+    return solver
+
+'''
+Forget the solvers kept in this session
+'''
+def clearSolverCache():
+    clearSession(kSolver)
+
+'''
+Retarget the take onto one mesh, writing its bake cache. The stages of the
+mesh (matching, distances, solve, chunks of frames) are cancelled with the
+context; their progress is not reported, the context counts whole meshes.
+'''
+def runMeshJob(job, take, budget, context=None):
+
+    meshContext = TaskContext(getContext(context).token)
+    meshContext.check()
+
+    nBytes = job.estimateMemory(len(take.frames))
+    budget.acquire(nBytes)
+
+    try:
+        meshContext.check()
+        start = time.time()
+
+        solver = getMeshSolver(job, meshContext)
+        solverTime = time.time() - start
+
+        folder = os.path.join(job.outputFolder, job.name, take.name)
+        meta = {"mesh": job.name, "method": job.method, "solveMode": job.mode, "stiffness": job.stiffnessValues, "take": take.path, "restFrame": take.restFrame}
+
+        writer = BakeCacheWriter(folder, take.frames, solver.nVert, meta)
+        try:
+            for chunk in range(0, len(take.frames), kFrameChunk):
+                meshContext.check()
+                writer.writeFrames(chunk, solver.deform(take.displacements[chunk:chunk+kFrameChunk]))
+        finally:
+            writer.close()
+
+    finally:
+        budget.release(nBytes)
+
+    return {"mesh": job.name, "cache": folder, "frames": len(take.frames), "solverTime": solverTime, "time": time.time() - start}
+
+'''
+Retarget one take onto all the mesh jobs using a pool of workers. The take is
+parsed and resampled once; memoryBudget (bytes) bounds the memory of the jobs
+running at the same time.
+'''
+def retargetMeshes(jobs, takePath, mocapNames, frames, restFrame=0, workers=2, memoryBudget=2*1024**3, context=None):
+
+    context = getContext(context)
+
+    start = time.time()
+    take = ResampledTake(takePath, mocapNames, frames, restFrame)
+    print("Take " + take.name + " resampled (" + str(len(take.frames)) + " frames) in " + str(time.time() - start) + " s")
+
+    budget = MemoryBudget(memoryBudget)
+    results = []
+
+    context.stage("meshes", len(jobs), "Retargeting " + take.name + " onto " + str(len(jobs)) + " meshes")
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        futures = [executor.submit(runMeshJob, job, take, budget, context) for job in jobs]
+        try:
+            for future in futures:
+                result = future.result()
+                results.append(result)
+                print("Mesh " + result["mesh"] + ": " + str(result["frames"]) + " frames in " + str(result["time"]) + " s -> " + result["cache"])
+                context.advance()
+        except TaskCancelled:
+            #Jobs already running stop at their next check, the queued ones are dropped
+            for future in futures:
+                future.cancel()
+            raise
+
+    return results
@@ -0,0 +1,194 @@
+'''
+
+Miguel Ramos Carretero
+Bournemouth University 2018
+
+Python module:
+Cache of the results kept in memory during a session (a Maya session or a
+headless run): meshes, distance matrices, RBF solvers and the edge graphs of
+the geodesic distances. A distance matrix
+calculated by pyCalculateDistMatrix is then reused by pyAnimMesh, the batch
+commands and the job queue without going through the matrix files.
+
+Entries are grouped by kind and dropped in least recently used order when the
+cache goes over its budget (ANIMFACE_SESSION_MB, 2048 MB by default).
+
+'''
+
+import os
+import threading
+from collections import OrderedDict
+
+kSessionBudgetEnvVar = "ANIMFACE_SESSION_MB"
+kDefaultBudgetMB = 2048
+
+kMesh = "mesh"
+kMatrix = "matrix"
+kSolver = "solver"
+kGraph = "graph"
+kTuning = "tuning"
+
+'''
+Estimate the bytes held by a cached value (NumPy arrays, sparse matrices,
+objects holding them, lists and tuples of them)
+'''
+def estimateBytes(value):
+
+    #NumPy scalar types (the dtype of a solver) have nbytes too, as a descriptor
+    if isinstance(value, type):
+        return 0
+
+    if hasattr(value, "nbytes"):
+        return int(value.nbytes)
+
+    #SciPy sparse matrices (the RBF of the vertices of a tree solver)
+    if hasattr(value, "indptr"):
+        return int(value.data.nbytes + value.indices.nbytes + value.indptr.nbytes)
+
+    if isinstance(value, (list, tuple)):
+        return sum(estimateBytes(item) for item in value)
+
+    if hasattr(value, "__dict__"):
+        #Lists of objects too (the regions of a region solver)
+        return sum(estimateBytes(item) for item in value.__dict__.values() if (hasattr(item, "nbytes") or hasattr(item, "indptr") or isinstance(item, list)) and not isinstance(item, type))
+
+    return 0
+
+'''
+LRU cache of a session, shared by all the threads
+'''
+class SessionCache(object):
+
+    def __init__(self, budgetBytes=None):
+
+        if budgetBytes is None:
+            budgetBytes = int(float(os.environ.get(kSessionBudgetEnvVar, kDefaultBudgetMB)) * 1024 * 1024)
+
+        self.budget = budgetBytes
+        self.used = 0
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, kind, key):
+        ''' Cached value, None if it is not in the cache. '''
+
+        with self.lock:
+            entry = self.entries.get((kind, key))
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end((kind, key))
+            self.hits += 1
+            return entry[0]
+
+    def put(self, kind, key, value, nBytes=None):
+        ''' Keeps a value; values bigger than the whole budget are not kept. '''
+
+        if nBytes is None:
+            nBytes = estimateBytes(value)
+
+        if nBytes > self.budget:
+            return value
+
+        with self.lock:
+            previous = self.entries.pop((kind, key), None)
+            if previous is not None:
+                self.used -= previous[1]
+
+            self.entries[(kind, key)] = (value, nBytes)
+            self.used += nBytes
+
+            while self.used > self.budget and self.entries:
+                oldKey, (oldValue, oldBytes) = self.entries.popitem(last=False)
+                self.used -= oldBytes
+
+        return value
+
+    def getOrCreate(self, kind, key, factory):
+        ''' Cached value, calling factory() to create (and keep) it if missing. '''
+
+        value = self.get(kind, key)
+        if value is None:
+            value = self.put(kind, key, factory())
+
+        return value
+
+    def remove(self, kind, key):
+        with self.lock:
+            entry = self.entries.pop((kind, key), None)
+            if entry is not None:
+                self.used -= entry[1]
+
+    def clear(self, kind=None):
+        ''' Drops every entry, or only the entries of a kind. '''
+
+        with self.lock:
+            if kind is None:
+                self.entries.clear()
+                self.used = 0
+                return
+            for entryKey in [entryKey for entryKey in self.entries if entryKey[0] == kind]:
+                self.used -= self.entries.pop(entryKey)[1]
+
+    def stats(self):
+        with self.lock:
+            kinds = {}
+            for (kind, key), (value, nBytes) in self.entries.items():
+                count, total = kinds.get(kind, (0, 0))
+                kinds[kind] = (count + 1, total + nBytes)
+            return {"entries": len(self.entries), "bytes": self.used, "budget": self.budget, "hits": self.hits, "misses": self.misses, "kinds": kinds}
+
+'''
+Cache of the current session, created on first use
+'''
+_session = None
+_sessionLock = threading.Lock()
+
+'''
+Get the cache of the current session
+'''
+def getSession():
+
+    global _session
+
+    with _sessionLock:
+        if _session is None:
+            _session = SessionCache()
+        return _session
+
+'''
+Drop everything kept in the session (e.g. after editing a mesh in place)
+'''
+def clearSession(kind=None):
+    getSession().clear(kind)
+
+'''
+Key of a distance matrix: the mesh (by its content), the vertices matched
+with the markers, the RBF technique code and the storage precision (if it is
+not double precision)
+'''
+def matrixKey(meshSignature, vertexMarkers, method, precision=None):
+
+    key = (meshSignature, tuple(int(v) for v in vertexMarkers), method)
+
+    if precision and precision != "float64":
+        key += (precision,)
+
+    return key
+
+'''
+Key of a solver: the key of its distance matrix plus the stiffness values and
+the solve mode
+'''
+def solverKey(matrixKey, stiffnessValues, mode):
+    return matrixKey + (tuple(float(s) for s in stiffnessValues), mode)
+
+'''
+Key of the last solver built for a mesh with a technique, a solve mode and a
+precision. Its entry holds the key of that solver, the base of the
+incremental updates when only a few stiffness values or markers change.
+'''
+def tuningKey(meshSignature, method, mode, precision=None):
+    return (meshSignature, method, mode, precision or "float64")
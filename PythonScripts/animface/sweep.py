@@ -0,0 +1,373 @@
+'''
+
+Miguel Ramos Carretero
+Bournemouth University 2018
+
+Python module:
+Stiffness sweep: evaluates many stiffness configurations of the same mesh at
+once. The distances are fixed and only the widths of the Gaussians change, so
+the distances of a sample of vertices are read once and every batch of
+configurations is built, solved and evaluated with stacked arrays (C kernels
+of M x M, C x V x M RBFs) on a sample of frames. Every configuration is scored
+and the table is ranked:
+
+    markerError     RMS distance between the displacement of the marker
+                    vertices and the displacement of their markers
+    smoothness      RMS difference of displacement per unit length along the
+                    edges of the mesh (lower is smoother)
+    referenceError  RMS distance to a reference deformation (a bake cache or
+                    a reference stiffness configuration), if there is one
+
+The score adds the metrics, each divided by its median over the sweep, with
+the given weights.
+
+'''
+
+import json
+import time
+import numpy as np
+
+from animface import precision as storage
+from animface.rbf import calculateGaussianRBF, buildKernel, kNormalized, kExact
+from animface.outofcore import getMemoryBudget
+from animface.profiler import profiled
+from animface.tasks import getContext
+
+kMarkerError = "markerError"
+kSmoothness = "smoothness"
+kReferenceError = "referenceError"
+
+kMetrics = (kMarkerError, kSmoothness, kReferenceError)
+
+kDefaultWeights = {kMarkerError: 1.0, kSmoothness: 1.0, kReferenceError: 1.0}
+
+#Metrics below this fraction of the RMS marker displacement are round-off
+kRoundOff = 1e-9
+
+#Vertices and edges of the sample the configurations are evaluated on
+kSampleVertices = 5000
+kSampleEdges = 2000
+
+'''
+Indices of count frames evenly spread over nFrames frames
+'''
+def sampleFrameIndices(nFrames, count):
+
+    if count is None or count >= nFrames:
+        return np.arange(nFrames)
+
+    return np.unique(np.linspace(0, nFrames - 1, max(1, int(count))).round().astype(np.int64))
+
+'''
+Candidate stiffness configurations around a base one: the base scaled by
+every scale, and count random configurations (every value scaled by a
+log-normal factor of the given spread). With integer, values are rounded like
+the stiffness fields of the window. Values are kept between minimum and
+maximum; duplicates are dropped.
+'''
+def generateCandidates(base, scales=None, count=0, spread=0.25, seed=0, integer=False, minimum=1e-3, maximum=None):
+
+    base = np.asarray(base, dtype=np.float64)
+    candidates = [base]
+
+    for scale in (scales or []):
+        candidates.append(base * float(scale))
+
+    rng = np.random.default_rng(seed)
+    for c in range(int(count)):
+        candidates.append(base * np.exp(rng.normal(0.0, spread, base.shape[0])))
+
+    candidates = np.array(candidates)
+    if integer:
+        candidates = np.rint(candidates)
+    candidates = np.clip(candidates, minimum, maximum if maximum is not None else np.inf)
+
+    unique, first = np.unique(candidates, axis=0, return_index=True)
+
+    return unique[np.argsort(first)]
+
+'''
+Read candidate configurations from a text file, one comma separated
+configuration per line
+'''
+def readCandidates(path, nMarkers):
+
+    candidates = []
+
+    with open(path, 'r') as candidatesFile:
+        for line in candidatesFile:
+            values = [float(x) for x in line.replace(";", ",").split(",") if x.strip() != ""]
+            if len(values) == 0:
+                continue
+            if len(values) != nMarkers:
+                raise ValueError("Expected " + str(nMarkers) + " stiffness values per line in " + path + ", got " + str(len(values)))
+            candidates.append(values)
+
+    return np.array(candidates, dtype=np.float64).reshape(-1, nMarkers)
+
+'''
+Root mean square of the norms of the displacement differences of a batch
+(C x rows x 3F), given the number of displacements in a row of the batch
+'''
+def _rootMeanSquare(differences, count):
+    return np.sqrt(np.einsum('cij,cij->c', differences, differences) / count)
+
+'''
+Rows of a distance matrix (any storage, or an out-of-core file) in double
+precision
+'''
+def _distanceRows(distances, indices):
+
+    if hasattr(distances, "readRowsAt"):
+        return distances.readRowsAt(indices).astype(np.float64)
+
+    return storage.matrixRows(distances, indices)
+
+'''
+Sweep of stiffness configurations for one mesh, one distance matrix and one
+set of marker displacements (F x M x 3, the frames to score). The sample of
+vertices holds the marker vertices, both ends of a sample of edges and random
+vertices.
+'''
+class StiffnessSweep(object):
+
+    def __init__(self, distances, vertexMarkers, displacements, mode=kNormalized, edges=None, edgeLengths=None, sampleVertices=kSampleVertices, sampleEdges=kSampleEdges, seed=0):
+
+        if mode not in (kNormalized, kExact):
+            raise ValueError("Unknown solve mode: " + str(mode))
+
+        self.mode = mode
+        self.vertexMarkers = np.asarray(vertexMarkers, dtype=np.int64)
+        self.displacements = np.asarray(displacements, dtype=np.float64).reshape(-1, self.vertexMarkers.shape[0], 3)
+
+        nVert = distances.shape[0]
+        rng = np.random.default_rng(seed)
+
+        #Sample of edges, and the vertices they touch
+        if edges is None or len(edges) == 0:
+            edges = np.zeros((0, 2), dtype=np.int64)
+            edgeLengths = np.zeros(0)
+        edges = np.asarray(edges, dtype=np.int64)
+        edgeLengths = np.asarray(edgeLengths, dtype=np.float64)
+
+        if edges.shape[0] > sampleEdges:
+            chosen = rng.choice(edges.shape[0], sampleEdges, replace=False)
+            edges, edgeLengths = edges[chosen], edgeLengths[chosen]
+
+        #Degenerate edges say nothing about the smoothness
+        valid = edgeLengths > 0
+        edges, edgeLengths = edges[valid], edgeLengths[valid]
+
+        vertices = np.unique(np.concatenate([self.vertexMarkers, edges.reshape(-1)]))
+        if vertices.shape[0] < min(sampleVertices, nVert):
+            others = np.setdiff1d(np.arange(nVert), vertices)
+            extra = rng.choice(others.shape[0], min(others.shape[0], sampleVertices - vertices.shape[0]), replace=False)
+            vertices = np.union1d(vertices, others[extra])
+
+        self.vertices = vertices
+        self.markerRows = np.searchsorted(vertices, self.vertexMarkers)
+        self.edgeRows = np.searchsorted(vertices, edges)
+        self.edgeLengths = edgeLengths
+
+        #The only distances the sweep needs
+        self.sampleDistances = _distanceRows(distances, vertices)
+        self.squaredDistances = np.square(self.sampleDistances)
+        self.markerDistances = self.sampleDistances[self.markerRows]
+
+        #Displacements of the markers as the weights take them (M x 3F)
+        self.markerDisplacements = self.displacements.transpose(1, 0, 2).reshape(self.nMarkers, self.nFrames * 3)
+
+        #Reference displacement of the sample vertices (V x 3F)
+        self.reference = None
+
+    @property
+    def nMarkers(self):
+        return self.vertexMarkers.shape[0]
+
+    @property
+    def nFrames(self):
+        return self.displacements.shape[0]
+
+    def kernels(self, stiffness):
+        ''' Kernels of a batch of configurations (C x M x M). '''
+
+        if self.mode == kNormalized:
+            return buildKernel(self.markerDistances, stiffness)
+
+        return calculateGaussianRBF(self.markerDistances[None, :, :], stiffness[:, None, :])
+
+    def weights(self, stiffness):
+        ''' Weights of the markers of a batch of configurations (C x M x 3F). '''
+
+        kernels = self.kernels(stiffness)
+        flat = self.markerDisplacements
+
+        if self.mode == kNormalized:
+            return flat[None, :, :] / kernels.sum(axis=2)[:, :, None]
+
+        try:
+            return np.linalg.solve(kernels, np.broadcast_to(flat, (kernels.shape[0],) + flat.shape))
+        except np.linalg.LinAlgError:
+            #Several markers matched with the same vertex
+            return np.matmul(np.linalg.pinv(kernels), flat)
+
+    def deformSample(self, stiffness):
+        ''' Displacement of the sample vertices for a batch of configurations, as the products give it (C x V x 3F). '''
+
+        stiffness = np.asarray(stiffness, dtype=np.float64).reshape(-1, self.nMarkers)
+
+        phi = np.exp(-self.squaredDistances[None, :, :] / np.square(stiffness)[:, None, :])
+
+        return np.matmul(phi, self.weights(stiffness))
+
+    def deform(self, stiffness):
+        ''' Displacement of the sample vertices for a batch of configurations (C x F x V x 3). '''
+
+        deformation = self.deformSample(stiffness)
+        nConfigs, nVert = deformation.shape[0], self.vertices.shape[0]
+
+        return deformation.reshape(nConfigs, nVert, self.nFrames, 3).transpose(0, 2, 1, 3)
+
+    def setReference(self, deformation):
+        ''' Reference displacement of the sample vertices (F x V x 3). '''
+        deformation = np.asarray(deformation, dtype=np.float64)
+        self.reference = deformation.transpose(1, 0, 2).reshape(self.vertices.shape[0], self.nFrames * 3)
+
+    def setReferenceStiffness(self, stiffness):
+        ''' The reference is the deformation of a stiffness configuration. '''
+        self.reference = self.deformSample(stiffness)[0]
+
+    def setReferenceBake(self, bakeDisplacements, frameIndices):
+        ''' The reference is a bake cache (F x V x 3, e.g. readBakeCache) at the given frames. '''
+        self.setReference(bakeDisplacements[np.asarray(frameIndices)][:, self.vertices])
+
+    def metrics(self, stiffness):
+        ''' Metrics of a batch of configurations, one array (C) per metric. '''
+
+        deformation = self.deformSample(stiffness)
+
+        #Rows are vertices and columns frames x axes, so every metric is a sum of
+        #squares over rows of the same batch
+        markerDiff = deformation[:, self.markerRows, :] - self.markerDisplacements[None]
+        metrics = {kMarkerError: _rootMeanSquare(markerDiff, self.nMarkers * self.nFrames)}
+
+        if self.edgeRows.shape[0] > 0:
+            gradient = (deformation[:, self.edgeRows[:, 1], :] - deformation[:, self.edgeRows[:, 0], :]) / self.edgeLengths[None, :, None]
+            metrics[kSmoothness] = _rootMeanSquare(gradient, self.edgeRows.shape[0] * self.nFrames)
+
+        if self.reference is not None:
+            metrics[kReferenceError] = _rootMeanSquare(deformation - self.reference[None], self.vertices.shape[0] * self.nFrames)
+
+        return metrics
+
+    def batchSize(self, budgetBytes=None):
+        ''' Configurations per batch: RBF of the sample and deformation (and its differences). '''
+
+        budgetBytes = budgetBytes or getMemoryBudget()
+        configBytes = self.vertices.shape[0] * (self.nMarkers + self.nFrames * 3 * 3) * 8
+
+        return max(1, int(budgetBytes // max(1, configBytes)))
+
+    @profiled("sweep.run")
+    def run(self, candidates, weights=None, budgetBytes=None, context=None):
+        ''' Score every candidate (C x M), returns the rows of the ranked table. '''
+
+        context = getContext(context)
+        candidates = np.asarray(candidates, dtype=np.float64).reshape(-1, self.nMarkers)
+        batchSize = self.batchSize(budgetBytes)
+
+        metrics = {}
+
+        context.stage("sweep", candidates.shape[0], "Evaluating stiffness configurations")
+
+        for start in range(0, candidates.shape[0], batchSize):
+            batch = candidates[start:start+batchSize]
+            for name, values in self.metrics(batch).items():
+                metrics.setdefault(name, []).append(values)
+            context.advance(batch.shape[0])
+
+        metrics = dict((name, np.concatenate(values)) for name, values in metrics.items())
+
+        tolerance = kRoundOff * np.sqrt(np.square(self.displacements).sum(axis=2).mean())
+
+        return rankCandidates(candidates, metrics, weights, tolerance)
+
+'''
+Score and rank candidates from their metrics. Every metric is divided by its
+median over the candidates, so the weights do not depend on the units.
+Metrics whose median is below tolerance (round-off, e.g. the marker error of
+the exact mode) do not count.
+'''
+def rankCandidates(candidates, metrics, weights=None, tolerance=0.0):
+
+    weights = dict(kDefaultWeights, **(weights or {}))
+
+    score = np.zeros(candidates.shape[0])
+    for name, values in metrics.items():
+        median = np.median(values)
+        if weights.get(name, 0.0) != 0.0 and median > tolerance:
+            score += weights[name] * values / median
+
+    rows = []
+    for c in range(candidates.shape[0]):
+        row = {"index": c, "stiffness": [float(s) for s in candidates[c]], "score": float(score[c])}
+        for name in kMetrics:
+            if name in metrics:
+                row[name] = float(metrics[name][c])
+        rows.append(row)
+
+    rows.sort(key=lambda row: row["score"])
+    for rank in range(len(rows)):
+        rows[rank]["rank"] = rank + 1
+
+    return rows
+
+'''
+Sweep of a mesh: build the sweep from the distance matrix, set the reference
+and run it over the candidates. Returns the ranked rows and the time spent.
+'''
+def sweepStiffness(distances, vertexMarkers, displacements, candidates, mode=kNormalized, mesh=None, referenceStiffness=None, referenceBake=None, weights=None, sampleVertices=kSampleVertices, budgetBytes=None, context=None):
+
+    start = time.time()
+
+    edges, edgeLengths = None, None
+    if mesh is not None:
+        edges, edgeLengths = mesh.edges(), mesh.edgeLengths()
+
+    sweep = StiffnessSweep(distances, vertexMarkers, displacements, mode, edges, edgeLengths, sampleVertices)
+
+    if referenceStiffness is not None:
+        sweep.setReferenceStiffness(referenceStiffness)
+    elif referenceBake is not None:
+        sweep.setReferenceBake(referenceBake[0], referenceBake[1])
+
+    rows = sweep.run(candidates, weights, budgetBytes, context)
+
+    return rows, time.time() - start
+
+'''
+Print the first rows of a ranked sweep table
+'''
+def printSweepTable(rows, top=20):
+
+    names = [name for name in kMetrics if len(rows) > 0 and name in rows[0]]
+
+    print("------------------------------")
+    print("rank".rjust(5) + "#".rjust(6) + "".join([name.rjust(16) for name in names]) + "score".rjust(10) + "  stiffness")
+
+    for row in rows[:top]:
+        stiffness = ",".join([("%g" % s) for s in row["stiffness"]])
+        print(str(row["rank"]).rjust(5) + str(row["index"]).rjust(6) + "".join([("%.6g" % row[name]).rjust(16) for name in names]) + ("%.4f" % row["score"]).rjust(10) + "  " + stiffness)
+
+    print("------------------------------")
+
+'''
+Write a ranked sweep table into a JSON file
+'''
+def writeSweepResults(path, rows, meta=None):
+
+    results = dict(meta or {})
+    results["rows"] = rows
+
+    with open(path, 'w') as resultsFile:
+        json.dump(results, resultsFile, indent=4)
@@ -0,0 +1,274 @@
+'''
+
+Miguel Ramos Carretero
+Bournemouth University 2018
+
+Python module:
+Bilateral symmetry of a mesh for the geodesic distance calculations. Most
+heads are modelled symmetric, and the marker layouts are mirrored (_L/_R).
+On a symmetric mesh, the vertex mirror map (for every vertex, the vertex
+mirrored across the symmetry plane) maps the edges onto edges of the same
+length, so the geodesic column of a marker is the column of its mirror marker
+read through the map:
+
+    geo[v, mirror(m)] = geo[vertexMirror[v], m]
+
+Only the columns of one side and of the centre-line markers are calculated
+(one Dijkstra run each), the other side is filled in by permutation. The
+vertex map is detected (mirrored points matched on a k-d tree, then the edges
+checked) or given, and the marker map follows from the marker vertices (or
+from the mirrored positions of the layout, kept where they agree). A
+mesh that is not symmetric within the tolerance falls back to the full
+calculation, and so does every marker whose mirrored vertex is not the vertex
+of another marker.
+
+'''
+
+import numpy as np
+
+from animface import distances
+from animface.profiler import profiled
+
+try:
+    import scipy.spatial
+    _hasScipy = True
+except ImportError:
+    _hasScipy = False
+
+#Axis normal to the symmetry plane (x, the axis of the _L/_R markers)
+kDefaultAxis = 0
+
+#Largest distance between a mirrored vertex and its mirror vertex (and between mirrored edge lengths), relative to the bounding box diagonal
+kDefaultTolerance = 1e-4
+
+#Largest distance between a mirrored layout position and its mirror marker, relative to the diagonal of the layout
+kLayoutTolerance = 1e-2
+
+'''
+Vertex mirror map of a mesh across the plane normal to the given axis through
+the middle of its bounding box: the mirror vertex of every vertex, or None and
+the reason if some vertex has no mirror vertex within the tolerance (or two
+vertices share one)
+'''
+@profiled("symmetry.detect")
+def detectVertexMirror(points, axis=kDefaultAxis, tolerance=kDefaultTolerance):
+
+    if not _hasScipy:
+        return None, "SciPy is needed to detect the mirror map"
+
+    points = np.asarray(points, dtype=np.float64)
+
+    low = points[:, axis].min()
+    high = points[:, axis].max()
+    diagonal = max(float(np.linalg.norm(points.max(axis=0) - points.min(axis=0))), 1e-12)
+
+    mirrored = points.copy()
+    mirrored[:, axis] = (low + high) - points[:, axis]
+
+    dist, mirror = scipy.spatial.cKDTree(points).query(mirrored, distance_upper_bound=tolerance * diagonal)
+
+    unmatched = int(np.count_nonzero(np.isinf(dist)))
+    if unmatched > 0:
+        return None, str(unmatched) + " vertices without a mirror vertex"
+
+    mirror = mirror.astype(np.int64)
+    if np.any(mirror[mirror] != np.arange(points.shape[0])):
+        return None, "the mirror map is not one to one"
+
+    return mirror, None
+
+'''
+Check that a vertex mirror map is an involution that maps the edges of a mesh
+onto edges of the same length (within the tolerance). Returns None if it
+does, else the reason.
+'''
+def checkVertexMirror(mesh, mirror, tolerance=kDefaultTolerance):
+
+    mirror = np.asarray(mirror, dtype=np.int64)
+    nVert = mesh.nVert
+
+    if mirror.shape != (nVert,) or mirror.min() < 0 or mirror.max() >= nVert:
+        return "the mirror map does not have one vertex per vertex of the mesh"
+
+    if np.any(mirror[mirror] != np.arange(nVert)):
+        return "the mirror map is not one to one"
+
+    edges = mesh.edges().astype(np.int64)
+    lengths = mesh.edgeLengths()
+
+    #Edges as sorted pairs in one key, looked up for the mirrored edges
+    keys = np.minimum(edges[:, 0], edges[:, 1]) * nVert + np.maximum(edges[:, 0], edges[:, 1])
+    order = np.argsort(keys)
+    keys = keys[order]
+
+    mirrored = mirror[edges]
+    mirroredKeys = np.minimum(mirrored[:, 0], mirrored[:, 1]) * nVert + np.maximum(mirrored[:, 0], mirrored[:, 1])
+    found = np.minimum(np.searchsorted(keys, mirroredKeys), keys.shape[0] - 1)
+
+    missing = int(np.count_nonzero(keys[found] != mirroredKeys))
+    if missing > 0:
+        return str(missing) + " edges without a mirror edge"
+
+    diagonal = max(float(np.linalg.norm(np.ptp(mesh.points, axis=0))), 1e-12)
+    if lengths.shape[0] > 0 and np.abs(lengths[order[found]] - lengths).max() > tolerance * diagonal:
+        return "the mirror edges have different lengths"
+
+    return None
+
+'''
+Marker mirror map from a vertex mirror map: for every marker, the marker
+whose vertex is the mirror of its vertex (itself on the centre line), -1 if
+there is none
+'''
+def markerMirrorMap(vertexMarkers, vertexMirror):
+
+    vertexMarkers = np.asarray(vertexMarkers, dtype=np.int64)
+    markerOf = {}
+    for m in range(vertexMarkers.shape[0]):
+        markerOf.setdefault(int(vertexMarkers[m]), m)
+
+    return np.array([markerOf.get(int(vertexMirror[v]), -1) for v in vertexMarkers], dtype=np.int64)
+
+'''
+Marker mirror map from the rest positions of a layout (solver order): for
+every marker, the marker nearest to its position mirrored across the plane
+through the middle of the layout (itself on the centre line), -1 if there is
+none within the tolerance or the pair is not mutual
+'''
+def layoutMarkerMirror(positions, axis=kDefaultAxis, tolerance=kLayoutTolerance):
+
+    positions = np.asarray(positions, dtype=np.float64).reshape(-1, 3)
+    nMarkers = positions.shape[0]
+    if nMarkers == 0:
+        return np.zeros(0, dtype=np.int64)
+
+    diagonal = max(float(np.linalg.norm(positions.max(axis=0) - positions.min(axis=0))), 1e-12)
+
+    mirrored = positions.copy()
+    mirrored[:, axis] = (positions[:, axis].min() + positions[:, axis].max()) - positions[:, axis]
+
+    #A layout has tens of markers: all the distances at once
+    dist = np.linalg.norm(mirrored[:, np.newaxis, :] - positions[np.newaxis, :, :], axis=2)
+    nearest = dist.argmin(axis=1)
+
+    mirror = np.where(dist[np.arange(nMarkers), nearest] <= tolerance * diagonal, nearest, -1).astype(np.int64)
+    mutual = (mirror >= 0) & (mirror[np.maximum(mirror, 0)] == np.arange(nMarkers))
+
+    return np.where(mutual, mirror, -1)
+
+'''
+Symmetry of a mesh for a set of marker vertices: the vertex mirror map (None
+if the mesh is not symmetric, with the reason), the marker mirror map and the
+markers whose columns are calculated. A given marker mirror map (e.g. from the
+layout, layoutMarkerMirror) is kept only where it agrees with the vertex map,
+which tells apart markers matched with the same vertex.
+'''
+class MeshSymmetry(object):
+
+    def __init__(self, mesh, vertexMarkers, vertexMirror=None, markerMirror=None, axis=kDefaultAxis, tolerance=kDefaultTolerance):
+
+        self.vertexMarkers = np.asarray(vertexMarkers, dtype=np.int64)
+        self.nMarkers = self.vertexMarkers.shape[0]
+
+        if vertexMirror is None:
+            vertexMirror, self.reason = detectVertexMirror(mesh.points, axis, tolerance)
+        else:
+            vertexMirror = np.asarray(vertexMirror, dtype=np.int64)
+            self.reason = None
+
+        if vertexMirror is not None:
+            self.reason = checkVertexMirror(mesh, vertexMirror, tolerance)
+
+        self.vertexMirror = vertexMirror if self.reason is None else None
+
+        if self.vertexMirror is None:
+            self.markerMirror = np.full(self.nMarkers, -1, dtype=np.int64)
+        elif markerMirror is None:
+            self.markerMirror = markerMirrorMap(self.vertexMarkers, self.vertexMirror)
+        else:
+            markerMirror = np.asarray(markerMirror, dtype=np.int64)
+            if markerMirror.shape != (self.nMarkers,):
+                raise ValueError("The marker mirror map does not have one marker per marker vertex")
+            agrees = (markerMirror >= 0) & (self.vertexMirror[self.vertexMarkers] == self.vertexMarkers[np.maximum(markerMirror, 0)])
+            self.markerMirror = np.where(agrees, markerMirror, -1)
+
+        #A marker is filled in from its mirror marker if that one is calculated, else calculated
+        isCalculated = np.zeros(self.nMarkers, dtype=bool)
+        for m in range(self.nMarkers):
+            partner = self.markerMirror[m]
+            isCalculated[m] = partner < 0 or partner == m or not isCalculated[partner]
+        self.calculated = np.flatnonzero(isCalculated)
+
+    @property
+    def symmetric(self):
+        return self.vertexMirror is not None
+
+    def centreMarkers(self):
+        ''' Markers on the symmetry plane (their own mirror). '''
+        return np.flatnonzero(self.markerMirror == np.arange(self.nMarkers))
+
+    def fill(self, columns):
+        ''' Full V x M matrix from the columns of the calculated markers (V x C). '''
+
+        matrix = np.empty((columns.shape[0], self.nMarkers), dtype=columns.dtype)
+        matrix[:, self.calculated] = columns
+
+        mirrored = np.setdiff1d(np.arange(self.nMarkers), self.calculated)
+        if mirrored.shape[0] > 0:
+            matrix[:, mirrored] = matrix[:, self.markerMirror[mirrored]][self.vertexMirror]
+
+        return matrix
+
+'''
+Geodesic distance matrix of the marker vertices calculated for one side of a
+symmetric mesh and filled in by permutation (the full calculation if the mesh
+is not symmetric)
+'''
+@profiled("symmetry.geodesic")
+def symmetricGeodesicMatrix(mesh, vertexMarkers, symmetry=None, processes=1, context=None):
+
+    if symmetry is None:
+        symmetry = MeshSymmetry(mesh, vertexMarkers)
+
+    if not symmetry.symmetric:
+        return distances.geodesicDistanceMatrix(mesh, vertexMarkers, processes=processes, context=context)
+
+    columns = distances.geodesicDistanceMatrix(mesh, symmetry.vertexMarkers[symmetry.calculated], processes=processes, context=context)
+
+    return symmetry.fill(columns)
+
+'''
+Distance matrix of the given RBF technique with the geodesics of
+symmetricGeodesicMatrix. The Euclidean distances and the hybrid weights are
+calculated in full (they are cheap, and the geodesic areas need not be
+symmetric).
+'''
+def symmetricDistanceMatrix(mesh, vertexMarkers, method, symmetry=None, geodesicVertices=None, processes=1, context=None, weights=None):
+
+    method = distances.getMethodCode(method)
+    euc = distances.euclideanDistanceMatrix(mesh.points, vertexMarkers, context)
+
+    if method == distances.kEuclidean:
+        return euc
+
+    geo = symmetricGeodesicMatrix(mesh, vertexMarkers, symmetry, processes, context)
+
+    if method == distances.kGeodesics:
+        return geo
+
+    return distances.hybridDistanceMatrix(mesh.points, euc, geo, geodesicVertices if geodesicVertices is not None else [], weights, context)
+
+'''
+Print the symmetry of a mesh: the geodesic columns calculated, or why the
+full calculation is needed
+'''
+def printSymmetryReport(symmetry):
+
+    print("------------------------------")
+    if symmetry.symmetric:
+        unpaired = int(np.count_nonzero(symmetry.markerMirror < 0))
+        print("Symmetric mesh: " + str(symmetry.calculated.shape[0]) + " of " + str(symmetry.nMarkers) + " geodesic columns calculated")
+        print("Centre-line markers: " + str(symmetry.centreMarkers().shape[0]) + ", markers without a mirror marker: " + str(unpaired))
+    else:
+        print("Asymmetric mesh (" + symmetry.reason + "): all " + str(symmetry.nMarkers) + " geodesic columns calculated")
+    print("------------------------------")
@@ -0,0 +1,415 @@
+'''
+
+Miguel Ramos Carretero
+Bournemouth University 2018
+
+Python module:
+Long computations (distance matrices, solves, bakes) as cancellable tasks.
+
+The engines only see a TaskContext: they call context.check() to honour a
+cancellation and context.advance() to report progress. Progress is throttled
+to a fixed rate before it reaches a sink (the Maya progress bar, a CLI
+progress line or nothing), so the inner loops can report every iteration.
+Tasks run inline, on a worker thread or on a worker process, and the results
+that touch the scene are applied on the main thread with applyOnMainThread.
+
+'''
+
+import sys
+import time
+import threading
+import multiprocessing
+from concurrent.futures import Future, CancelledError, ThreadPoolExecutor, ProcessPoolExecutor
+
+kProgressRate = 10.0
+
+'''
+Raised inside a task when its cancellation token is cancelled
+'''
+class TaskCancelled(Exception):
+    pass
+
+'''
+Cancellation flag shared by a task and whoever started it
+'''
+class CancellationToken(object):
+
+    def __init__(self, event=None):
+        self._event = event if event is not None else threading.Event()
+
+    def cancel(self):
+        self._event.set()
+
+    def isCancelled(self):
+        return self._event.is_set()
+
+    def check(self):
+        ''' Raises TaskCancelled if the task was cancelled. '''
+        if self._event.is_set():
+            raise TaskCancelled()
+
+'''
+Sinks receive the throttled progress: update(stage, done, total, status)
+'''
+class NullProgressSink(object):
+
+    def begin(self, status):
+        pass
+
+    def update(self, stage, done, total, status):
+        pass
+
+    def end(self):
+        pass
+
+'''
+Progress line on a terminal (rewritten in place)
+'''
+class ConsoleProgressSink(NullProgressSink):
+
+    def __init__(self, stream=None, width=30):
+        self.stream = stream or sys.stderr
+        self.width = width
+        self.length = 0
+
+    def _write(self, text):
+        self.stream.write("\r" + text.ljust(self.length))
+        self.stream.flush()
+        self.length = len(text)
+
+    def begin(self, status):
+        self._write(status)
+
+    def update(self, stage, done, total, status):
+
+        if total:
+            fraction = min(1.0, float(done) / float(total))
+            bar = "#" * int(fraction * self.width)
+            text = "[" + bar.ljust(self.width) + "] " + ("%5.1f%%" % (fraction * 100))
+        else:
+            text = str(done)
+
+        self._write(text + " " + (status or stage or ""))
+
+        #Finished stages are cleared, so the line never mixes with other output
+        if total and done >= total:
+            self._write("")
+            self.stream.write("\r")
+            self.stream.flush()
+
+    def end(self):
+        if self.length > 0:
+            self.stream.write("\n")
+            self.stream.flush()
+        self.length = 0
+
+'''
+Sink calling a function, e.g. to forward the progress to a window or a queue
+'''
+class CallbackProgressSink(NullProgressSink):
+
+    def __init__(self, callback):
+        self.callback = callback
+
+    def update(self, stage, done, total, status):
+        self.callback(stage, done, total, status)
+
+'''
+Maya main progress bar. Must be used from the main thread; the Esc key of the
+progress bar cancels the token.
+'''
+class MayaProgressSink(NullProgressSink):
+
+    def __init__(self, token=None):
+        import maya.mel as mel
+        self.cmds = __import__("maya.cmds", fromlist=["cmds"])
+        self.progressBar = mel.eval('$tmp = $gMainProgressBar')
+        self.token = token
+
+    def begin(self, status):
+        self.cmds.progressBar(self.progressBar, edit=True, progress=0, status=status, isInterruptable=True, bp=True)
+
+    def update(self, stage, done, total, status):
+
+        progress = int(100 * float(done) / float(total)) if total else 0
+        self.cmds.progressBar(self.progressBar, edit=True, progress=progress, status=status or stage)
+
+        if self.token is not None and self.cmds.progressBar(self.progressBar, q=True, ic=True):
+            self.token.cancel()
+
+    def end(self):
+        self.cmds.progressBar(self.progressBar, edit=True, ep=True)
+
+'''
+Progress of a task split in stages. Calls to advance and update are cheap; the
+sink is called at most rate times per second (and always on a stage change).
+'''
+class ProgressReporter(object):
+
+    def __init__(self, sink=None, rate=kProgressRate):
+        self.sink = sink or NullProgressSink()
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self.stageName = None
+        self.status = None
+        self.done = 0
+        self.total = 0
+        self.lastUpdate = 0.0
+        self.stageStart = time.time()
+
+    def begin(self, status=""):
+        self.sink.begin(status)
+
+    def stage(self, name, total=0, status=None):
+        ''' Starts a new stage of total steps. '''
+        self.stageName = name
+        self.total = total
+        self.done = 0
+        self.status = status or name
+        self.stageStart = time.time()
+        self._emit()
+
+    def advance(self, steps=1, status=None):
+        self.update(self.done + steps, status)
+
+    def update(self, done, status=None):
+        self.done = done
+        if status is not None:
+            self.status = status
+        #The end of a stage is always reported
+        if time.time() - self.lastUpdate >= self.interval or (self.total and done >= self.total):
+            self._emit()
+
+    def eta(self):
+        ''' Estimated seconds left in the current stage, None if unknown. '''
+        if self.done <= 0 or not self.total:
+            return None
+        elapsed = time.time() - self.stageStart
+        return elapsed * (self.total - self.done) / float(self.done)
+
+    def end(self):
+        self._emit()
+        self.sink.end()
+
+    def _emit(self):
+        self.lastUpdate = time.time()
+        self.sink.update(self.stageName, self.done, self.total, self.status)
+
+'''
+What an engine sees of the task running it: its cancellation token and its
+progress reporter.
+'''
+class TaskContext(object):
+
+    def __init__(self, token=None, progress=None):
+        self.token = token or CancellationToken()
+        self.progress = progress or ProgressReporter()
+
+    def check(self):
+        self.token.check()
+
+    def stage(self, name, total=0, status=None):
+        self.token.check()
+        self.progress.stage(name, total, status)
+
+    def advance(self, steps=1, status=None):
+        self.token.check()
+        self.progress.advance(steps, status)
+
+'''
+Context used when an engine is called without one: never cancelled and the
+progress goes nowhere.
+'''
+_nullContext = TaskContext()
+
+'''
+Get the context to use in an engine (the null context if None)
+'''
+def getContext(context):
+    return context if context is not None else _nullContext
+
+'''
+Context of a computation running on the Maya main thread, reporting to the
+main progress bar (Esc cancels it)
+'''
+def createMayaContext(rate=kProgressRate):
+    token = CancellationToken()
+    return TaskContext(token, ProgressReporter(MayaProgressSink(token), rate))
+
+'''
+Handle of a submitted task
+'''
+class TaskHandle(object):
+
+    def __init__(self, future, token, progress):
+        self.future = future
+        self.token = token
+        self.progress = progress
+
+    def cancel(self):
+        if self.future.done():
+            return
+        self.token.cancel()
+        self.future.cancel()
+
+    def isCancelled(self):
+        return self.token.isCancelled()
+
+    def done(self):
+        return self.future.done()
+
+    def result(self, timeout=None):
+        ''' Result of the task; raises TaskCancelled if it was cancelled. '''
+        try:
+            return self.future.result(timeout)
+        except CancelledError:
+            raise TaskCancelled()
+
+    def addDoneCallback(self, callback):
+        ''' Calls callback(handle) when the task finishes (from the worker). '''
+        self.future.add_done_callback(lambda future: callback(self))
+
+'''
+Run a function as a task: function(context, *args). Mode is "inline" (runs
+now, in the calling thread), "thread" or "process".
+'''
+def runTask(function, args=(), sink=None, mode="thread", rate=kProgressRate, executor=None):
+
+    if mode == "process":
+        return _runProcessTask(function, args, sink, rate, executor)
+
+    token = CancellationToken()
+    progress = ProgressReporter(sink, rate)
+    context = TaskContext(token, progress)
+
+    if mode == "inline":
+        future = Future()
+        try:
+            future.set_result(function(context, *args))
+        except BaseException as exc:
+            future.set_exception(exc)
+        return TaskHandle(future, token, progress)
+
+    ownExecutor = executor is None
+    if ownExecutor:
+        executor = ThreadPoolExecutor(max_workers=1)
+
+    future = executor.submit(function, context, *args)
+
+    if ownExecutor:
+        executor.shutdown(wait=False)
+
+    return TaskHandle(future, token, progress)
+
+'''
+Progress sink of a worker process: sends the updates through a queue
+'''
+class _QueueProgressSink(NullProgressSink):
+
+    def __init__(self, queue):
+        self.queue = queue
+
+    def update(self, stage, done, total, status):
+        self.queue.put((stage, done, total, status))
+
+'''
+Entry point of a task in a worker process
+'''
+def _processTaskWorker(function, args, event, queue, rate):
+    context = TaskContext(CancellationToken(event), ProgressReporter(_QueueProgressSink(queue), rate))
+    try:
+        return function(context, *args)
+    finally:
+        queue.put(None)
+
+'''
+Run a task in a worker process. The function and its arguments must be
+picklable; the token and the progress go through a multiprocessing manager.
+'''
+def _runProcessTask(function, args, sink, rate, executor):
+
+    manager = multiprocessing.Manager()
+    event = manager.Event()
+    queue = manager.Queue()
+
+    token = CancellationToken(event)
+    progress = ProgressReporter(sink, rate)
+
+    ownExecutor = executor is None
+    if ownExecutor:
+        executor = ProcessPoolExecutor(max_workers=1)
+
+    future = executor.submit(_processTaskWorker, function, args, event, queue, rate)
+
+    #Forward the progress of the worker to the sink of this process
+    def relay():
+        while True:
+            message = queue.get()
+            if message is None:
+                break
+            progress.stageName, progress.done, progress.total, progress.status = message
+            progress._emit()
+
+    relayThread = threading.Thread(target=relay)
+    relayThread.daemon = True
+    relayThread.start()
+
+    def cleanup(finished):
+        relayThread.join(1.0)
+        manager.shutdown()
+        if ownExecutor:
+            executor.shutdown(wait=False)
+
+    future.add_done_callback(cleanup)
+
+    return TaskHandle(future, token, progress)
+
+'''
+Run a function on the main thread. Inside Maya it is deferred to the idle
+queue of the main thread; outside Maya (or from the main thread) it runs now.
+'''
+def applyOnMainThread(function, *args, **kwargs):
+
+    if threading.current_thread() is threading.main_thread():
+        return function(*args, **kwargs)
+
+    try:
+        import maya.utils
+    except ImportError:
+        return function(*args, **kwargs)
+
+    return maya.utils.executeInMainThreadWithResult(function, *args, **kwargs)
+
+'''
+Queue a function to run on the main thread without waiting for it. Inside Maya
+it runs when the main thread is idle; outside Maya it runs now.
+'''
+def deferToMainThread(function, *args, **kwargs):
+
+    try:
+        import maya.utils
+    except ImportError:
+        return function(*args, **kwargs)
+
+    maya.utils.executeDeferred(function, *args, **kwargs)
+
+'''
+Wait for a task on the main thread, pumping the progress of the task into a
+sink that can only be used from the main thread (e.g. the Maya progress bar).
+Returns the result of the task; raises TaskCancelled if it was cancelled.
+'''
+def waitTask(handle, sink=None, status="", interval=0.1):
+
+    if sink is not None:
+        sink.begin(status)
+
+    try:
+        while not handle.done():
+            if sink is not None:
+                progress = handle.progress
+                sink.update(progress.stageName, progress.done, progress.total, progress.status)
+            time.sleep(interval)
+    finally:
+        if sink is not None:
+            sink.end()
+
+    return handle.result()
@@ -0,0 +1,229 @@
+'''
+
+Miguel Ramos Carretero
+Bournemouth University 2018
+
+Maya/Python script:
+Retarget a list of MoCap takes onto the same mesh. The markers matching, the
+distance matrix and the RBF kernel are built once for the mesh and every take
+is streamed through the same solver into its own bake cache.
+
+Plugin version for Maya.
+
+'''
+
+import sys
+import os
+import time
+import maya.api.OpenMaya as om
+import maya.cmds as cmds
+from animface.layout import getActiveLayout, parseStiffnessString
+
+kPluginCmdName = "pyAnimMeshBatch"
+
+kShortFlag1Name = "-ff"
+kLongFlag1Name = "-firstFrame"
+
+kShortFlag2Name = "-lf"
+kLongFlag2Name = "-lastFrame"
+
+kShortFlag3Name = "-st"
+kLongFlag3Name = "-steps"
+
+kShortFlag4Name = "-mn"
+kLongFlag4Name = "-meshname"
+
+kShortFlag5Name = "-ss"
+kLongFlag5Name = "-stiffnessstring"
+
+kShortFlag6Name = "-of"
+kLongFlag6Name = "-distMatrixFolderPath"
+
+kShortFlag7Name = "-mt"
+kLongFlag7Name = "-method"
+
+kShortFlag8Name = "-tk"
+kLongFlag8Name = "-takes"
+
+kShortFlag9Name = "-od"
+kLongFlag9Name = "-outputFolder"
+
+kShortFlag10Name = "-sm"
+kLongFlag10Name = "-solveMode"
+
+'''
+Entry point of the program
+
+    takes: list of MoCap take files (.ma)
+    firstFrame, lastFrame: range to bake, None to bake every take entirely
+
+'''
+def main(meshName, takes, outputFolder, matrixFolderPath, stiffnessValues, method, firstFrame, lastFrame, steps, solveMode):
+
+    from animface import batch
+    from animface import distances
+    from animface import tasks
+    from animface.mayascene import MayaBackend
+
+    #Check if the mesh exists in the DAG
+    if not cmds.objExists(meshName):
+        print("Mesh name does not match any object")
+        return
+
+    if (len(takes) == 0):
+        print("No MoCap takes given")
+        return
+
+    layout = getActiveLayout()
+    methodCode = distances.getMethodCode(method)
+
+    totalStart = time.time()
+
+    #Take the rest pose of the mesh and the markers from frame 0
+    backend = MayaBackend()
+
+    mesh = backend.getMeshData(meshName, 0)
+    markerPoints = backend.getObjectPoints(layout.jointNames(), 0)
+
+    geodesicVertices = None
+    if (methodCode == distances.kHybrid):
+        geodesicVertices = backend.getVertexSets(layout.geodesicAreas)
+
+    print("Building the RBF solver for " + meshName + " (" + str(mesh.nVert) + " vertices, " + str(len(layout)) + " markers)...")
+
+    frames = None
+    if (lastFrame != None):
+        frames = batch.getFrames(firstFrame, lastFrame, steps)
+
+    meta = {"mesh": meshName, "method": method, "solveMode": solveMode, "stiffness": list(stiffnessValues)}
+
+    #The engines run on a worker thread, the progress bar is updated from here
+    def batchTask(context):
+        solver, times = batch.prepareSolver(mesh, markerPoints, methodCode, stiffnessValues, matrixFolderPath, geodesicVertices, solveMode, context=context)
+        results = batch.retargetTakes(solver, takes, layout.mocapNames(), outputFolder, frames, steps, 0, meta, context)
+        return times, results
+
+    handle = tasks.runTask(batchTask)
+
+    try:
+        times, results = tasks.waitTask(handle, tasks.MayaProgressSink(handle.token), "Batch retargeting...")
+    except tasks.TaskCancelled:
+        print("Batch retargeting cancelled")
+        return
+
+    #Print times
+    print("")
+    print("BATCH: --------------------------------------")
+    print("Markers matching time: " + str(times["matching"]) + " s")
+    print("Distance matrix time: " + str(times["distances"]) + " s")
+    print("Kernel time: " + str(times["kernel"]) + " s")
+    for result in results:
+        print("  " + result["take"] + ": " + str(result["frames"]) + " frames, " + str(result["time"]) + " s -> " + result["cache"])
+    print("Total running time: " + str(time.time() - totalStart) + " s")
+    print("---------------------------------------------")
+    print("")
+
+###
+
+'''
+Plugin functionality
+'''
+def maya_useNewAPI():
+    '''
+    The presence of this function tells Maya that the plugin produces, and expects to be passed, objects created using the Maya Python API 2.0.
+    '''
+    pass
+
+# command
+class PyAnimMeshBatchCmd(om.MPxCommand):
+
+    def __init__(self):
+        om.MPxCommand.__init__(self)
+
+    def doIt(self, args):
+
+        layout = getActiveLayout()
+
+        parsedArgs = self.parseArguments( args )
+
+        firstFrame = parsedArgs.get(kShortFlag1Name, 0)
+        lastFrame = parsedArgs.get(kShortFlag2Name, None)
+        steps = parsedArgs.get(kShortFlag3Name, 1)
+        meshName = parsedArgs.get(kShortFlag4Name, "Head")
+        stiffnessString = parsedArgs.get(kShortFlag5Name, layout.stiffnessString())
+        matrixFolderPath = parsedArgs.get(kShortFlag6Name, None)
+        method = parsedArgs.get(kShortFlag7Name, "Euclidean")
+        takesString = parsedArgs.get(kShortFlag8Name, "")
+        outputFolder = parsedArgs.get(kShortFlag9Name, os.path.join(cmds.workspace(q=True, rd=True), "cache", "animface"))
+        solveMode = parsedArgs.get(kShortFlag10Name, "normalized")
+
+        #Takes are separated by semicolons
+        takes = [take.strip() for take in takesString.split(";") if take.strip() != ""]
+
+        try:
+            stiffnessValues = parseStiffnessString(stiffnessString, layout)
+        except ValueError as exc:
+            print(str(exc))
+            return
+
+        main(meshName, takes, outputFolder, matrixFolderPath, stiffnessValues, method, firstFrame, lastFrame, steps, solveMode)
+
+    def parseArguments(self, args):
+
+        parsedArgs = {}
+
+        argData = om.MArgParser( self.syntax(), args )
+
+        for flag in (kShortFlag1Name, kShortFlag2Name, kShortFlag3Name):
+            if argData.isFlagSet( flag ):
+                parsedArgs[flag] = argData.flagArgumentInt( flag, 0 )
+
+        for flag in (kShortFlag4Name, kShortFlag5Name, kShortFlag6Name, kShortFlag7Name, kShortFlag8Name, kShortFlag9Name, kShortFlag10Name):
+            if argData.isFlagSet( flag ):
+                parsedArgs[flag] = argData.flagArgumentString( flag, 0 )
+
+        return parsedArgs
+
+def cmdCreator():
+    return PyAnimMeshBatchCmd()
+
+def syntaxCreator():
+    ''' Defines the argument and flag syntax for this command. '''
+    syntax = om.MSyntax()
+
+    syntax.addFlag( kShortFlag1Name, kLongFlag1Name, om.MSyntax.kDouble )
+    syntax.addFlag( kShortFlag2Name, kLongFlag2Name, om.MSyntax.kDouble )
+    syntax.addFlag( kShortFlag3Name, kLongFlag3Name, om.MSyntax.kDouble )
+    syntax.addFlag( kShortFlag4Name, kLongFlag4Name, om.MSyntax.kString )
+    syntax.addFlag( kShortFlag5Name, kLongFlag5Name, om.MSyntax.kString )
+    syntax.addFlag( kShortFlag6Name, kLongFlag6Name, om.MSyntax.kString )
+    syntax.addFlag( kShortFlag7Name, kLongFlag7Name, om.MSyntax.kString )
+    syntax.addFlag( kShortFlag8Name, kLongFlag8Name, om.MSyntax.kString )
+    syntax.addFlag( kShortFlag9Name, kLongFlag9Name, om.MSyntax.kString )
+    syntax.addFlag( kShortFlag10Name, kLongFlag10Name, om.MSyntax.kString )
+
+    return syntax
+
+# Initialize the plug-in
+def initializePlugin(plugin):
+    pluginFn = om.MFnPlugin(plugin)
+    try:
+        pluginFn.registerCommand(
+            kPluginCmdName, cmdCreator, syntaxCreator
+        )
+    except:
+        sys.stderr.write(
+            "Failed to register command: %s\n" % kPluginCmdName
+        )
+        raise
+
+# Uninitialize the plug-in
+def uninitializePlugin(plugin):
+    pluginFn = om.MFnPlugin(plugin)
+    try:
+        pluginFn.deregisterCommand(kPluginCmdName)
+    except:
+        sys.stderr.write(
+            "Failed to unregister command: %s\n" % kPluginCmdName
+        )
+        raise
@@ -10,11 +10,13 @@ This script calculates the distance matrix of a given mesh using geodesics.
 
 import sys
 import os
-import errno
 import maya.api.OpenMaya as om
 import maya.mel as mel
 import maya.cmds as cmds
-import math
+from animface.layout import getActiveLayout
+from animface.core import getGeodesicVertices, matchMarkersWithMesh, putSessionMatrix
+from animface.profiler import Profiler, saveProfile
+from animface.tasks import TaskCancelled, createMayaContext
 
 kPluginCmdName = "pyCalculateDistMatrix"
 
@@ -24,315 +26,182 @@ kLongFlag1Name = "-meshname"
 kShortFlag2Name = "-of"
 kLongFlag2Name = "-outputfolder"
 
-'''
-Illustrate the intersection of two lists in most simple way
-'''
-def getIntersection(lst1, lst2):
-    lst3 = [value for value in lst1 if value in lst2]
-    return lst3
-    
-'''
-Get the transform of a given object and returns it in a 3 element list
-'''
-def getObjectPoint(obj):
-    
-    x = cmds.getAttr(obj+".translateX")
-    y = cmds.getAttr(obj+".translateY")
-    z = cmds.getAttr(obj+".translateZ")
-    
-    point = [x,y,z]
-    
-    return point
-    
-'''
-Calculates the RBF between two points according to the distance and the 
-given parameter gamma. 
-'''
-def calculateGaussianRBF(dist, gamma):
-    return math.exp(-(dist**2/gamma**2))
-    
-'''
-Get the absolute distance between two points
-'''
-def getEuclideanDistance(point1, point2):
-    
-    vect = (point2[0] - point1[0], point2[1] - point1[1], point2[2] - point1[2])
-    dist = math.sqrt(vect[0]*vect[0] + vect[1]*vect[1] + vect[2]*vect[2])
-    
-    return dist 
+kShortFlag3Name = "-pv"
+kLongFlag3Name = "-proxyvertices"
+
+kShortFlag4Name = "-sy"
+kLongFlag4Name = "-symmetry"
+
+kShortFlag5Name = "-qf"
+kLongFlag5Name = "-queuefolder"
+
+#Geodesic strategies of calculateDistanceMatrixToFile
+kFullGeodesics = "full"
+kProxyGeodesics = "proxy"
+kSymmetricGeodesics = "symmetric"
 
 '''
-Get the mesh-based geodesic distance between two points (heuristic based on recursivity)
-Note: v1Name = mesh+".vtx["+str(v1)+"]"
-      v2Name = mesh+".vtx["+str(v2)+"]"
+Calculate the distance matrix of a given mesh and writes it into a file. The
+geodesic strategy gives how the geodesic columns are calculated: in full, on
+a decimated proxy of the mesh (about proxyVertices vertices) interpolated to
+every vertex, or for one side of a symmetric mesh and mirrored onto the other
+side (all the columns if the mesh is not symmetric).
 '''
-def getGeodesicDistance(v1Name, v2Name, iterations=5):
+def calculateDistanceMatrixToFile(meshName, outputFolder, markersList, geodesicVertices, calculateEuclideanMatrix=True, calculateGeodesicMatrix=True, profiler=None, context=None, geodesicStrategy=kFullGeodesics, proxyVertices=None):
+
+    from animface import distances
+    from animface import mayascene
+    from animface import proxy
+    from animface import symmetry
+
+    if (profiler == None):
+        profiler = Profiler(kPluginCmdName)
     
-    distance = 0
-    selectionV1 = []
-    selectionV2 = []
+    #Progress and cancellation (Maya progress bar by default)
+    if (context == None):
+        context = createMayaContext()
+    context.progress.begin('Calculating...')
+
+    euc = None
+    proxyMesh = None
+    meshSymmetry = None
     
-    for i in range(iterations):
-        
-        #Grow the selection of v1
-        cmds.select(v1Name, r=True)
-        for j in range(i):
-            mel.eval("select `ls -sl`;PolySelectTraverse 1;select `ls -sl`")
-        selectionV1 = cmds.ls(selection=True, flatten=True)
+    try:
         
-        #Grow the selection of v2
-        cmds.select(v2Name, r=True)
-        for j in range(i):
-            mel.eval("select `ls -sl`;PolySelectTraverse 1;select `ls -sl`")
-        selectionV2 = cmds.ls(selection=True, flatten=True)
+        #Go to frame 0 (reference frame)
+        cmds.currentTime(0)
+
+        mesh = mayascene.getMeshData(meshName)
+        geodesicIndices = mayascene.getVertexIndices(geodesicVertices)
         
-        #Check if there is intersection
-        intersection = getIntersection(selectionV1, selectionV2)
+        #Create a list with the closest vertices to the markers
+        with profiler.span("matching"):
+            vertexMarkers = matchMarkersWithMesh(markersList, mesh)
+
+        matrices = []
         
-        if (len(intersection) > 0):
-            
-            #If intersection contains each other vertex, stop and return distance
-            if (v1Name in intersection) and (v2Name in intersection):
-                return getEuclideanDistance(cmds.pointPosition(v1Name), cmds.pointPosition(v2Name))
+        if (calculateEuclideanMatrix):
+            with profiler.span("euclidean"):
+                euc = distances.euclideanDistanceMatrix(mesh.points, vertexMarkers, context)
+            matrices.append((distances.kEuclidean, euc))
                 
-            #Else find a middle point and apply recursivity
-            chosenVert = ""
-            tempDist = sys.float_info.max
-            
-            for v in range(len(intersection)):
-            
-                auxDist = getEuclideanDistance(cmds.pointPosition(intersection[v]), cmds.pointPosition(v1Name)) + getEuclideanDistance(cmds.pointPosition(intersection[v]), cmds.pointPosition(v2Name))
-                
-                if (auxDist < tempDist):
-                    tempDist = auxDist
-                    chosenVert = intersection[v]
-                
-            return distance + getGeodesicDistance(v1Name, chosenVert, iterations) + getGeodesicDistance(v2Name, chosenVert, iterations) 
+        if (calculateGeodesicMatrix):
+            with profiler.span("geodesic"):
+                if (geodesicStrategy == kProxyGeodesics):
+                    proxyMesh = proxy.ProxyMesh(mesh, proxyVertices, vertexMarkers, context=context)
+                    geo = proxy.proxyGeodesicMatrix(mesh, vertexMarkers, proxyMesh, context=context, euclidean=euc)
+                elif (geodesicStrategy == kSymmetricGeodesics):
+                    meshSymmetry = symmetry.MeshSymmetry(mesh, vertexMarkers, markerMirror=symmetry.layoutMarkerMirror(getActiveLayout().positions()))
+                    geo = symmetry.symmetricGeodesicMatrix(mesh, vertexMarkers, meshSymmetry, context=context)
+                else:
+                    geo = distances.geodesicDistanceMatrix(mesh, vertexMarkers, context=context)
+            matrices.append((distances.kGeodesics, geo))
         
-    return getEuclideanDistance(cmds.pointPosition(v1Name), cmds.pointPosition(v2Name)) * 2 #Solution by default
-
-'''
-Get the aprox. of the mesh-based geodesic distance between two points (heuristic based on the edge path tool)
-Note: v1Name = mesh+".vtx["+str(v1)+"]"
-      v2Name = mesh+".vtx["+str(v2)+"]"
-'''
-def getGeodesicDistancev2(mesh, v1Index, v2Index):
+        if (calculateEuclideanMatrix and calculateGeodesicMatrix):
+            with profiler.span("hybrid"):
+                hyb = distances.hybridDistanceMatrix(mesh.points, euc, geo, geodesicIndices, context=context)
+            matrices.append((distances.kHybrid, hyb))
 
-    #Catch special case
-    if (v1Index == v2Index):
-        return 0
+        #Write the matrix files and keep the matrices in this session, so pyAnimMesh does not read them back from disk
+        for method, matrix in matrices:
+            distances.writeDistanceMatrix(os.path.join(outputFolder, distances.kMatrixFileNames[method]), matrix)
+            putSessionMatrix(mesh, vertexMarkers, method, matrix)
+    
+    except TaskCancelled:
+        print("Calculation of the distance matrices cancelled")
+        return
+    
+    finally:
         
-    #Get the shortest edge path
-    sel = cmds.polySelect(mesh, shortestEdgePath=(v1Index, v2Index), ass=True )
+        #Close the progress bar
+        context.progress.end()
     
-    #Calculate the path length
-    dist = 0
+    #Print the time results
+    print("Time for calculating Euclidean dist. matrix: " + str(profiler.stageTime("euclidean")))
+    print("Time for calculating Geodesic dist. matrix: " + str(profiler.stageTime("geodesic")) + ("" if proxyMesh == None else " (proxy of " + str(proxyMesh.nProxyVert) + " vertices)"))
+    print("Time for calculating Hybrid dist. matrix: " + str(profiler.stageTime("hybrid")))
 
-    for i in range(len(sel)):
-        conv = cmds.polyListComponentConversion(sel[i], fe=True, tv=True)
-        conv = cmds.filterExpand(conv, sm=31)
-        dist += getEuclideanDistance(cmds.pointPosition(conv[0]), cmds.pointPosition(conv[1]))
-        
-    return dist
+    if (proxyMesh != None):
+        proxy.printProxyReport(proxy.proxyReport(mesh, vertexMarkers, geo, distances.kGeodesics, proxyMesh), profiler.stageTime("geodesic"))
+    if (meshSymmetry != None):
+        symmetry.printSymmetryReport(meshSymmetry)
 
 '''
-Get the hybrid distance between two points, given the Euclidean and the geodesic distance.
+Publish the geodesic columns of a given mesh as work items of a queue folder
+on shared storage, so farm nodes calculate them (python -m animface worker)
+and the merge writes the matrix files into the output folder
 '''
-def getHybridDistance(geodesicVertices, vName, eucDist, geoDist):
-    
-    averWeight = 1
-    
-    vPoint = cmds.pointPosition(vName)
-    if (not(vName in geodesicVertices)):
-        gdist = sys.float_info.max
-        for j in range (len(geodesicVertices)):
-            auxDist = getEuclideanDistance(vPoint, cmds.pointPosition(geodesicVertices[j]))
-            if (auxDist < gdist):
-                gdist = auxDist
-        averWeight = calculateGaussianRBF(gdist, 2)
-
-    if (averWeight < 0.6):
-        dist = eucDist
-    else:
-        dist = geoDist*averWeight + eucDist*(1-averWeight)  
+def publishDistanceMatrixQueue(meshName, outputFolder, markersList, geodesicVertices, queueFolder, useSymmetry=False):
 
-    return dist
-    
-'''
-Get a match between the markers and the vertices of a given mesh
-'''
-def matchMarkersWithMesh(markersList, mesh):
-    
-    nVert = cmds.polyEvaluate(mesh, v=True)
-    
-    indexList = []
-    distances = []
-    
-    for i in range (len(markersList)):
-        
-        indexList.append(0)
-        distances.append(sys.float_info.max)
-    
-    print("Calculating matches for markers and vertices...")
-    
-    for i in range (nVert):
-        
-        vertexPoint = cmds.pointPosition(mesh + ".vtx[" + str(i) + "]")
-        
-        for j in range (len(markersList)):
-            
-            markerPoint = getObjectPoint(markersList[j])
-     
-            dist = getEuclideanDistance(vertexPoint, markerPoint)
-            
-            if (dist < distances[j]):
-                distances[j] = dist
-                indexList[j] = i
-    
-    return indexList
+    from animface import farmqueue
+    from animface import mayascene
+    from animface import symmetry
 
-'''
-Calculate the distance matrix of a given mesh and writes it into a file
-'''
-def calculateDistanceMatrixToFile(meshName, outputFolder, markersList, geodesicVertices, calculateEuclideanMatrix=True, calculateGeodesicMatrix=True):
-    
-    #Start progress bar 
-    progressAmount = 0;
-    gMainProgressBar = mel.eval('$tmp = $gMainProgressBar')
-    cmds.progressBar(gMainProgressBar, edit=True, progress=progressAmount, status='Calculating...', isInterruptable=True, bp=True )
-    
-    nVert = cmds.polyEvaluate(meshName, v=True)
-    
-    outFileEuclidean = None
-    outFileGeodesics = None
-    outFileHybrid = None
-    
-    #Open the output files
-    if (calculateEuclideanMatrix):
-        if not os.path.exists(outputFolder):
-            try:
-                os.makedirs(outputFolder)
-            except OSError as exc:
-                if exc.errno != errno.EEXIST:
-                    raise
-        path = outputFolder+"/eucMatrix.mtx"
-        outFileEuclidean = open(path, 'w')
-        
-    if (calculateGeodesicMatrix):
-        if not os.path.exists(outputFolder):
-            try:
-                os.makedirs(outputFolder)
-            except OSError as exc:
-                if exc.errno != errno.EEXIST:
-                    raise
-        path = outputFolder+"/geoMatrix.mtx"
-        outFileGeodesics = open(path, 'w')
-    
-    if (calculateEuclideanMatrix and calculateGeodesicMatrix):
-        if not os.path.exists(outputFolder):
-            try:
-                os.makedirs(outputFolder)
-            except OSError as exc:
-                if exc.errno != errno.EEXIST:
-                    raise
-        path = outputFolder+"/hybMatrix.mtx"
-        outFileHybrid = open(path, 'w')
-    
-    #Go to frame 0 (reference frame)
     cmds.currentTime(0)
-    
-    #Create a list with the closest vertices to the markers
-    vertexMarkers = matchMarkersWithMesh(markersList, meshName)
-    
-    #Progress control
-    progressStep = float(100) / float(nVert)
-    euclideanTime = 0
-    geodesicTime = 0
-    hybridTime = 0
-    
-    #Calculate distance matrix values for every vertex
-    if (calculateEuclideanMatrix or calculateGeodesicMatrix):
-        for i in range (0, nVert):
-        
-            progressAmount += progressStep
-            cmds.progressBar(gMainProgressBar, edit=True, status="Calculating distance matrices for row " + str(i) + " of " + str(nVert), progress=progressAmount)
 
-            for j in range (0, len(vertexMarkers)):
-                v1Name = meshName + ".vtx[" + str(i) + "]"
-                v2Name = meshName + ".vtx[" + str(vertexMarkers[j]) + "]"
-                
-                eucDist = 0
-                geoDist = 0
-                
-                if (calculateEuclideanMatrix):
-                    cmds.timer(s=True, name="euclideanTimer")
-                    v1 = cmds.pointPosition(v1Name)
-                    v2 = cmds.pointPosition(v2Name)
-                    eucDist = getEuclideanDistance(v1, v2)
-                    outFileEuclidean.write(str(eucDist)+"\n")
-                    euclideanTime += cmds.timer(e=True, name="euclideanTimer")
-                    
-                if (calculateGeodesicMatrix):
-                    cmds.timer(s=True, name="geodesicTimer")
-                    geoDist = getGeodesicDistancev2(meshName, i, vertexMarkers[j])
-                    outFileGeodesics.write(str(geoDist)+"\n")
-                    geodesicTime += cmds.timer(e=True, name="geodesicTimer")
-                
-                if (calculateEuclideanMatrix and calculateGeodesicMatrix):
-                    cmds.timer(s=True, name="hybridTimer")
-                    hybDist = getHybridDistance(geodesicVertices, v1Name, eucDist, geoDist)
-                    outFileHybrid.write(str(hybDist)+"\n")
-                    hybridTime += cmds.timer(e=True, name="hybridTimer")
-                
-                #Progress control
-                if cmds.progressBar(gMainProgressBar, q=True, ic=True):
-                    cmds.progressBar(gMainProgressBar, edit=1, ep=1)
-                    if (outFileEuclidean != None):
-                        outFileEuclidean.close()
-                    if (outFileGeodesics != None):
-                        outFileGeodesics.close()
-                    if (outFileHybrid != None):
-                        outFileHybrid.close()
-                    return
-    
-    #Close the file descriptors
-    if (outFileEuclidean != None):
-        outFileEuclidean.close()
-    if (outFileGeodesics != None):
-        outFileGeodesics.close()
-    if (outFileHybrid != None):
-        outFileHybrid.close()
-    
-    #Close the progress bar
-    cmds.progressBar(gMainProgressBar, edit=1, ep=1)
-    
-    #Print the time results
-    print("Time for calculating Euclidean dist. matrix: " + str(euclideanTime))
-    print("Time for calculating Geodesic dist. matrix: " + str(geodesicTime))
-    print("Time for calculating Hybrid dist. matrix: " + str(hybridTime))
+    mesh = mayascene.getMeshData(meshName)
+    vertexMarkers = matchMarkersWithMesh(markersList, mesh)
+
+    meshSymmetry = None
+    if (useSymmetry):
+        meshSymmetry = symmetry.MeshSymmetry(mesh, vertexMarkers, markerMirror=symmetry.layoutMarkerMirror(getActiveLayout().positions()))
+        symmetry.printSymmetryReport(meshSymmetry)
+
+    try:
+        manifest = farmqueue.publishQueue(queueFolder, mesh, vertexMarkers, mayascene.getVertexIndices(geodesicVertices), os.path.abspath(outputFolder), meshSymmetry=meshSymmetry)
+    except ValueError as exc:
+        print(str(exc))
+        return
+
+    print("Work items published: " + str(manifest["items"]) + " at " + queueFolder)
+    print("Start workers with: python -m animface worker --queue " + queueFolder)
+    print("Merge the matrices with: python -m animface merge --queue " + queueFolder)
 
 '''
 Entry of the program
 '''
-def main(meshName, outputFolder):
+def main(meshName, outputFolder, proxyVertices=None, useSymmetry=False, queueFolder=None):
+
+    #The symmetric geodesics and the queue need full-resolution columns
+    if (proxyVertices and useSymmetry):
+        print("The symmetry needs the geodesics of the full mesh, it cannot be used with a proxy")
+        return
+    if (proxyVertices and queueFolder):
+        print("The queue publishes full-resolution columns, it cannot be used with a proxy")
+        return
 
     cmds.timer(s=True)
     cmds.undoInfo( state=False)
     mel.eval("paneLayout -e -manage false $gMainPane")
     
     #Take the markers arranged in groups
-    markersSelection = sorted(cmds.listRelatives("TopMarkers")) + sorted(cmds.listRelatives("TopMiddleMarkers")) + sorted(cmds.listRelatives("MiddleMarkers")) + sorted(cmds.listRelatives("MiddleBottomMarkers")) + sorted(cmds.listRelatives("BottomMarkers"))
+    layout = getActiveLayout()
+    markersSelection = layout.jointNames()
     
     #Take the geodesic vertices
-    geodesicVertices = cmds.ls(cmds.sets("MouthArea", q=True), flatten=True) + cmds.ls(cmds.sets("REyeArea", q=True), flatten=True) + cmds.ls(cmds.sets("LEyeArea", q=True), flatten=True)
+    geodesicVertices = getGeodesicVertices(layout)
+    
+    profiler = Profiler(kPluginCmdName)
+    
+    if (queueFolder):
+        publishDistanceMatrixQueue(meshName, outputFolder, markersSelection, geodesicVertices, queueFolder, useSymmetry)
+    else:
+        geodesicStrategy = kFullGeodesics
+        if (proxyVertices):
+            geodesicStrategy = kProxyGeodesics
+        elif (useSymmetry):
+            geodesicStrategy = kSymmetricGeodesics
+        calculateDistanceMatrixToFile(meshName, outputFolder, markersSelection, geodesicVertices, calculateEuclideanMatrix = True, calculateGeodesicMatrix=True, profiler=profiler, geodesicStrategy=geodesicStrategy, proxyVertices=proxyVertices)
     
-    matrix = calculateDistanceMatrixToFile(meshName, outputFolder, markersSelection, geodesicVertices, calculateEuclideanMatrix = True, calculateGeodesicMatrix=True)
+    #Save the profile for the farm logs (if ANIMFACE_PROFILE is set)
+    saveProfile(profiler)
     
     mel.eval("paneLayout -e -manage true $gMainPane")
     cmds.undoInfo( state=True)
     time = cmds.timer(e=True)
 
-    print("Matrix calculations completed. Files created at: " + outputFolder)
+    if (not queueFolder):
+        print("Matrix calculations completed. Files created at: " + outputFolder)
     print("Running time: " + str(time) + "s")
 
 ###
@@ -357,13 +226,30 @@ class PyCalculateDistMatrixCmd(om.MPxCommand):
         meshName = "Head"
         outputFolder = "D:/Matrix"
 
+        proxyVertices = None
+        useSymmetry = False
+        queueFolder = None
+
         parsedArgs = self.parseArguments( args )
         
-        if (len(parsedArgs) == 2):
+        if (len(parsedArgs) >= 2):
             meshName = parsedArgs[0]
             outputFolder = parsedArgs[1]
+
+        #Geodesics on a decimated proxy of the mesh
+        argData = om.MArgParser( self.syntax(), args )
+        if argData.isFlagSet( kShortFlag3Name ):
+            proxyVertices = argData.flagArgumentInt( kShortFlag3Name, 0 )
+
+        #Geodesics of one side of a symmetric mesh, mirrored
+        if argData.isFlagSet( kShortFlag4Name ):
+            useSymmetry = argData.flagArgumentBool( kShortFlag4Name, 0 )
+
+        #Work items for the farm nodes instead of calculating here
+        if argData.isFlagSet( kShortFlag5Name ):
+            queueFolder = argData.flagArgumentString( kShortFlag5Name, 0 )
             
-        main(meshName, outputFolder)
+        main(meshName, outputFolder, proxyVertices, useSymmetry, queueFolder)
         
         pass
         
@@ -392,6 +278,9 @@ def syntaxCreator():
 
     syntax.addFlag( kShortFlag1Name, kLongFlag1Name, om.MSyntax.kString )
     syntax.addFlag( kShortFlag2Name, kLongFlag2Name, om.MSyntax.kString )
+    syntax.addFlag( kShortFlag3Name, kLongFlag3Name, om.MSyntax.kLong )
+    syntax.addFlag( kShortFlag4Name, kLongFlag4Name, om.MSyntax.kBoolean )
+    syntax.addFlag( kShortFlag5Name, kLongFlag5Name, om.MSyntax.kString )
 
     # ... Add more flags here ...
         
@@ -4,7 +4,7 @@ Miguel Ramos Carretero
 Bournemouth University 2018
 
 Maya/Python script:
-Group the markers created in five groups.
+Group the markers created in the groups given by the marker layout.
 
 Plugin version for Maya. 
 
@@ -13,94 +13,25 @@ Plugin version for Maya.
 import sys
 import maya.api.OpenMaya as om
 import maya.cmds as cmds
+from animface.layout import getActiveLayout
 
 '''
-Create a floating joint (not parented)
+Parent a set of markers under a new group
 '''
-def parentMarker(name, groupname):
-    cmds.parent(name+"_JNT",groupname)
-    
-'''
-Create the forehead markers
-'''
-def parentTopMarkers():
-    cmds.group(em=True, name="TopMarkers", parent="Markers")
-    parentMarker("Eyebrow_Center", "TopMarkers")
-    parentMarker("ForeHead_L", "TopMarkers")
-    parentMarker("ForeHead_M", "TopMarkers")
-    parentMarker("ForeHead_R", "TopMarkers")
-    parentMarker("Leye_Up", "TopMarkers")
-    parentMarker("Leyebrow_Inside", "TopMarkers")
-    parentMarker("Leyebrow_M", "TopMarkers")
-    parentMarker("Leyebrow_Outside", "TopMarkers")
-    parentMarker("Reye_Up", "TopMarkers")
-    parentMarker("Reyebrow_Inside", "TopMarkers")
-    parentMarker("Reyebrow_M", "TopMarkers")
-    parentMarker("Reyebrow_Outside", "TopMarkers")
-
-'''
-Create the eyebrows markers
-'''  
-def parentTopMiddleMarkers():
-    cmds.group(em=True, name="TopMiddleMarkers", parent="Markers")
-    parentMarker("Leye_Inside","TopMiddleMarkers")
-    parentMarker("Leye_Outside","TopMiddleMarkers")
-    parentMarker("Reye_Inside","TopMiddleMarkers")
-    parentMarker("Reye_Outside","TopMiddleMarkers")
-
-'''
-Create the eyes markers
-'''
-def parentMiddleMarkers():
-    cmds.group(em=True, name="MiddleMarkers", parent="Markers")
-    parentMarker("Lcheek_Up","MiddleMarkers")
-    parentMarker("Leye_Down","MiddleMarkers")
-    parentMarker("Mouth_Up","MiddleMarkers")
-    parentMarker("Mouth_UpL1","MiddleMarkers")
-    parentMarker("Mouth_UpR1","MiddleMarkers")
-    parentMarker("NoseHead","MiddleMarkers")
-    parentMarker("NoseHead_L","MiddleMarkers")
-    parentMarker("NoseHead_R","MiddleMarkers")
-    parentMarker("NoseTop","MiddleMarkers")
-    parentMarker("Rcheek_Up","MiddleMarkers")
-    parentMarker("Reye_Down","MiddleMarkers")
-
-'''
-Create the nose markers
-'''
-def parentMiddleBottomMarkers():
-    
-    cmds.group(em=True, name="MiddleBottomMarkers", parent="Markers")
-    parentMarker("Lcheek_Down","MiddleBottomMarkers")
-    parentMarker("Lcheek_Outside","MiddleBottomMarkers")
-    parentMarker("Mouth_Lend","MiddleBottomMarkers")
-    parentMarker("Mouth_Rend","MiddleBottomMarkers")
-    parentMarker("Rcheek_Down","MiddleBottomMarkers")
-    parentMarker("Rcheek_Outside","MiddleBottomMarkers")
-
-'''
-Create the mouth markers
-'''
-def parentBottomMarkers():
-    cmds.group(em=True, name="BottomMarkers", parent="Markers")
-    parentMarker("Chin","BottomMarkers")
-    parentMarker("Chin_L1","BottomMarkers")
-    parentMarker("Chin_L2","BottomMarkers")
-    parentMarker("Chin_R1","BottomMarkers")
-    parentMarker("Chin_R2","BottomMarkers")
-    parentMarker("Mouth_Down","BottomMarkers")
-    parentMarker("Mouth_DownL","BottomMarkers")
-    parentMarker("Mouth_DownR","BottomMarkers")
+def parentMarkers(names, groupname, layout):
+    cmds.group(em=True, name=groupname, parent=layout.rootGroup)
+    if (len(names) > 0):
+        cmds.parent([layout.jointName(name) for name in names], groupname)
 
 '''
 Entry point of the program
 '''
 def main():
-    parentTopMarkers()
-    parentTopMiddleMarkers()
-    parentMiddleMarkers()
-    parentMiddleBottomMarkers()
-    parentBottomMarkers()
+    
+    layout = getActiveLayout()
+    
+    for groupName, names in layout.groups:
+        parentMarkers(names, groupName, layout)
 
 '''
 Plugin functionality
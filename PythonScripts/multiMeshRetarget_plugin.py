@@ -0,0 +1,234 @@
+'''
+
+Miguel Ramos Carretero
+Bournemouth University 2018
+
+Maya/Python script:
+Retarget one MoCap take onto several meshes (e.g. realistic and stylized
+variants of a head). The take is parsed and resampled once and the meshes are
+solved in a pool of workers, each one into its own bake cache.
+
+Plugin version for Maya.
+
+'''
+
+import sys
+import os
+import time
+import maya.api.OpenMaya as om
+import maya.cmds as cmds
+from animface.layout import getActiveLayout, parseStiffnessString
+
+kPluginCmdName = "pyAnimMeshMulti"
+
+kShortFlag1Name = "-ff"
+kLongFlag1Name = "-firstFrame"
+
+kShortFlag2Name = "-lf"
+kLongFlag2Name = "-lastFrame"
+
+kShortFlag3Name = "-st"
+kLongFlag3Name = "-steps"
+
+kShortFlag4Name = "-mn"
+kLongFlag4Name = "-meshnames"
+
+kShortFlag5Name = "-ss"
+kLongFlag5Name = "-stiffnessstring"
+
+kShortFlag6Name = "-of"
+kLongFlag6Name = "-distMatrixFolderPath"
+
+kShortFlag7Name = "-mt"
+kLongFlag7Name = "-method"
+
+kShortFlag8Name = "-tk"
+kLongFlag8Name = "-take"
+
+kShortFlag9Name = "-od"
+kLongFlag9Name = "-outputFolder"
+
+kShortFlag10Name = "-sm"
+kLongFlag10Name = "-solveMode"
+
+kShortFlag11Name = "-wk"
+kLongFlag11Name = "-workers"
+
+kShortFlag12Name = "-mb"
+kLongFlag12Name = "-memoryBudget"
+
+'''
+Entry point of the program
+
+    meshNames: meshes to animate, the distance matrices of every mesh are kept
+               in a subfolder (named as the mesh) of matrixFolderPath
+    memoryBudget: MB that the meshes solved at the same time can use
+
+'''
+def main(meshNames, take, outputFolder, matrixFolderPath, stiffnessValues, method, firstFrame, lastFrame, steps, solveMode, workers, memoryBudget):
+
+    from animface import batch
+    from animface import distances
+    from animface import scheduler
+    from animface import tasks
+    from animface.mayascene import MayaBackend
+
+    for meshName in meshNames:
+        if not cmds.objExists(meshName):
+            print("Mesh name does not match any object: " + meshName)
+            return
+
+    layout = getActiveLayout()
+    methodCode = distances.getMethodCode(method)
+
+    totalStart = time.time()
+
+    #Gather the scene data of every mesh from frame 0 (Maya is only used here)
+    backend = MayaBackend()
+
+    markerPoints = backend.getObjectPoints(layout.jointNames(), 0)
+
+    geodesicVertices = None
+    if (methodCode == distances.kHybrid):
+        geodesicVertices = backend.getVertexSets(layout.geodesicAreas)
+
+    jobs = []
+    for meshName in meshNames:
+        mesh = backend.getMeshData(meshName, 0)
+        matrixFolder = None
+        if (matrixFolderPath):
+            matrixFolder = os.path.join(matrixFolderPath, meshName)
+        jobs.append(scheduler.MeshJob(mesh, markerPoints, methodCode, stiffnessValues, outputFolder, matrixFolder, geodesicVertices, solveMode))
+
+    frames = batch.getFrames(firstFrame, lastFrame, steps)
+
+    #The engines run on worker threads, the progress bar is updated from here
+    handle = tasks.runTask(lambda context: scheduler.retargetMeshes(jobs, take, layout.mocapNames(), frames, 0, workers, memoryBudget*1024*1024, context))
+
+    try:
+        results = tasks.waitTask(handle, tasks.MayaProgressSink(handle.token), "Retargeting " + str(len(jobs)) + " meshes...")
+    except tasks.TaskCancelled:
+        print("Multi-mesh retargeting cancelled")
+        return
+
+    #Print times
+    print("")
+    print("MULTI-MESH: ---------------------------------")
+    for result in results:
+        print("  " + result["mesh"] + ": solver " + str(result["solverTime"]) + " s, total " + str(result["time"]) + " s -> " + result["cache"])
+    print("Total running time: " + str(time.time() - totalStart) + " s")
+    print("---------------------------------------------")
+    print("")
+
+###
+
+'''
+Plugin functionality
+'''
+def maya_useNewAPI():
+    '''
+    The presence of this function tells Maya that the plugin produces, and expects to be passed, objects created using the Maya Python API 2.0.
+    '''
+    pass
+
+# command
+class PyAnimMeshMultiCmd(om.MPxCommand):
+
+    def __init__(self):
+        om.MPxCommand.__init__(self)
+
+    def doIt(self, args):
+
+        layout = getActiveLayout()
+
+        parsedArgs = self.parseArguments( args )
+
+        firstFrame = parsedArgs.get(kShortFlag1Name, 0)
+        lastFrame = parsedArgs.get(kShortFlag2Name, 600)
+        steps = parsedArgs.get(kShortFlag3Name, 5)
+        meshNamesString = parsedArgs.get(kShortFlag4Name, "Head")
+        stiffnessString = parsedArgs.get(kShortFlag5Name, layout.stiffnessString())
+        matrixFolderPath = parsedArgs.get(kShortFlag6Name, None)
+        method = parsedArgs.get(kShortFlag7Name, "Euclidean")
+        take = parsedArgs.get(kShortFlag8Name, "")
+        outputFolder = parsedArgs.get(kShortFlag9Name, os.path.join(cmds.workspace(q=True, rd=True), "cache", "animface"))
+        solveMode = parsedArgs.get(kShortFlag10Name, "normalized")
+        workers = parsedArgs.get(kShortFlag11Name, 2)
+        memoryBudget = parsedArgs.get(kShortFlag12Name, 2048)
+
+        #Meshes are separated by semicolons
+        meshNames = [name.strip() for name in meshNamesString.split(";") if name.strip() != ""]
+
+        if (take == ""):
+            print("No MoCap take given")
+            return
+
+        try:
+            stiffnessValues = parseStiffnessString(stiffnessString, layout)
+        except ValueError as exc:
+            print(str(exc))
+            return
+
+        main(meshNames, take, outputFolder, matrixFolderPath, stiffnessValues, method, firstFrame, lastFrame, steps, solveMode, workers, memoryBudget)
+
+    def parseArguments(self, args):
+
+        parsedArgs = {}
+
+        argData = om.MArgParser( self.syntax(), args )
+
+        for flag in (kShortFlag1Name, kShortFlag2Name, kShortFlag3Name, kShortFlag11Name, kShortFlag12Name):
+            if argData.isFlagSet( flag ):
+                parsedArgs[flag] = argData.flagArgumentInt( flag, 0 )
+
+        for flag in (kShortFlag4Name, kShortFlag5Name, kShortFlag6Name, kShortFlag7Name, kShortFlag8Name, kShortFlag9Name, kShortFlag10Name):
+            if argData.isFlagSet( flag ):
+                parsedArgs[flag] = argData.flagArgumentString( flag, 0 )
+
+        return parsedArgs
+
+def cmdCreator():
+    return PyAnimMeshMultiCmd()
+
+def syntaxCreator():
+    ''' Defines the argument and flag syntax for this command. '''
+    syntax = om.MSyntax()
+
+    syntax.addFlag( kShortFlag1Name, kLongFlag1Name, om.MSyntax.kDouble )
+    syntax.addFlag( kShortFlag2Name, kLongFlag2Name, om.MSyntax.kDouble )
+    syntax.addFlag( kShortFlag3Name, kLongFlag3Name, om.MSyntax.kDouble )
+    syntax.addFlag( kShortFlag4Name, kLongFlag4Name, om.MSyntax.kString )
+    syntax.addFlag( kShortFlag5Name, kLongFlag5Name, om.MSyntax.kString )
+    syntax.addFlag( kShortFlag6Name, kLongFlag6Name, om.MSyntax.kString )
+    syntax.addFlag( kShortFlag7Name, kLongFlag7Name, om.MSyntax.kString )
+    syntax.addFlag( kShortFlag8Name, kLongFlag8Name, om.MSyntax.kString )
+    syntax.addFlag( kShortFlag9Name, kLongFlag9Name, om.MSyntax.kString )
+    syntax.addFlag( kShortFlag10Name, kLongFlag10Name, om.MSyntax.kString )
+    syntax.addFlag( kShortFlag11Name, kLongFlag11Name, om.MSyntax.kDouble )
+    syntax.addFlag( kShortFlag12Name, kLongFlag12Name, om.MSyntax.kDouble )
+
+    return syntax
+
+# Initialize the plug-in
+def initializePlugin(plugin):
+    pluginFn = om.MFnPlugin(plugin)
+    try:
+        pluginFn.registerCommand(
+            kPluginCmdName, cmdCreator, syntaxCreator
+        )
+    except:
+        sys.stderr.write(
+            "Failed to register command: %s\n" % kPluginCmdName
+        )
+        raise
+
+# Uninitialize the plug-in
+def uninitializePlugin(plugin):
+    pluginFn = om.MFnPlugin(plugin)
+    try:
+        pluginFn.deregisterCommand(kPluginCmdName)
+    except:
+        sys.stderr.write(
+            "Failed to unregister command: %s\n" % kPluginCmdName
+        )
+        raise
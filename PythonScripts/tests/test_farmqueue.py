@@ -0,0 +1,49 @@
+'''
+
+Miguel Ramos Carretero
+Bournemouth University 2018
+
+Python tests:
+Farm queue of the geodesic columns (animface.farmqueue).
+
+'''
+
+import multiprocessing
+
+import numpy as np
+
+from animface import distances
+from animface import farmqueue
+from animface.benchmark import createHeadMesh
+
+'''
+A queue published into a temporary folder, calculated by three worker
+processes and merged gives the geodesic matrix of the single-machine
+calculation
+'''
+def test_workers_merge_the_geodesic_matrix(tmp_path):
+
+    mesh = createHeadMesh(2000)
+    vertexMarkers = np.linspace(0, mesh.nVert - 1, 12).astype(np.int64)
+
+    queueFolder = str(tmp_path / "queue")
+    outputFolder = str(tmp_path / "matrices")
+
+    manifest = farmqueue.publishQueue(queueFolder, mesh, vertexMarkers, outputFolder=outputFolder, itemColumns=2)
+    assert manifest["items"] == 6
+
+    workers = [multiprocessing.Process(target=farmqueue.runWorker, args=(queueFolder, "worker" + str(i)), kwargs={"pollInterval": 0.05}) for i in range(3)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join(60)
+
+    assert all([worker.exitcode == 0 for worker in workers])
+    assert farmqueue.WorkQueue(queueFolder).finished()
+
+    farmqueue.mergeQueue(queueFolder)
+
+    merged = distances.loadDistanceMatrix(outputFolder, distances.kGeodesics, mesh.nVert, len(vertexMarkers))
+    expected = distances.geodesicDistanceMatrix(mesh, vertexMarkers)
+
+    np.testing.assert_allclose(merged, expected, rtol=1e-9, atol=1e-12)
@@ -13,6 +13,8 @@ Plugin version for Maya.
 import sys
 import maya.api.OpenMaya as om 
 import maya.cmds as cmds
+from animface.layout import getActiveLayout
+from animface.core import getObjectPoint
 
 kPluginCmdName = "pyTransferMoCap"
 
@@ -23,18 +25,14 @@ kShortFlag2Name = "-lf"
 kLongFlag2Name = "-lastFrame"
 
 '''
-Get the transform of a given object and returns it in a 3 element list
-TODO: Find a way to import it from animateMesh.py directly.
+Get the list of marker joints, in layout order if the markers are divided in groups
 '''
-def getObjectPoint(obj):
+def getMarkersList(markers, areDividedMarkers, layout):
     
-    x = cmds.getAttr(obj+".translateX")
-    y = cmds.getAttr(obj+".translateY")
-    z = cmds.getAttr(obj+".translateZ")
-    
-    point = [x,y,z]
+    if (areDividedMarkers):
+        return layout.jointNames()
     
-    return point
+    return cmds.listRelatives(markers)
 
 '''
 Calculates the offset vector for each marker according to the mocap points
@@ -44,14 +42,8 @@ def calibrateMarkers(markers, mocap, areDividedMarkers):
     markerGroupOffset = getObjectPoint(markers)
     mocapGroupOffset = getObjectPoint(mocap)
     
-    markersList = []
-    if (areDividedMarkers == True):
-        markersParents = cmds.listRelatives(markers)
-        for i in range (len(markersParents)):
-            markersList += cmds.listRelatives(markersParents[i])
-        markersList = sorted(markersList)
-    else:
-        markersList = cmds.listRelatives(markers)
+    layout = getActiveLayout()
+    markersList = getMarkersList(markers, areDividedMarkers, layout)
     
     print(markersList)
     offsets = []
@@ -59,7 +51,7 @@ def calibrateMarkers(markers, mocap, areDividedMarkers):
     for i in range (len(markersList)):
         
         markerPoint = getObjectPoint(markersList[i])
-        mocapPoint = getObjectPoint(markersList[i][:-4])
+        mocapPoint = getObjectPoint(layout.mocapName(layout.markerFromJoint(markersList[i])))
         offset = [markerGroupOffset[0]+markerPoint[0]-
                         (mocapGroupOffset[0]+mocapPoint[0]),
                   markerGroupOffset[1]+markerPoint[1]-
@@ -72,56 +64,41 @@ def calibrateMarkers(markers, mocap, areDividedMarkers):
     return offsets
 
 '''
-Transfers the mocap animation into the markers for the given frame number
+Transfers the mocap animation into the markers for the given frames. The
+trajectories of the MoCap nodes are read and the curves of the markers are
+written in bulk through the scene backend.
 '''
-def transferAnimation(markers, mocap, offsets, frameNumber, areDividedMarkers):
+def transferAnimation(markers, mocap, offsets, frames, areDividedMarkers, backend):
     
-    cmds.autoKeyframe( state=True )
-
-    markerGroupOffset = getObjectPoint(markers)
-    mocapGroupOffset = getObjectPoint(mocap)
+    import numpy as np
     
-    markersList = []
-    if (areDividedMarkers):
-        markersParents = cmds.listRelatives(markers)
-        for i in range (len(markersParents)):
-            markersList += cmds.listRelatives(markersParents[i])
-        markersList = sorted(markersList)
-    else:
-        markersList = cmds.listRelatives(markers)
+    layout = getActiveLayout()
+    markersList = getMarkersList(markers, areDividedMarkers, layout)
+    mocapList = [layout.mocapName(layout.markerFromJoint(marker)) for marker in markersList]
     
-    cmds.currentTime(frameNumber)
+    #Trajectories of the groups (F x 1 x 3) and of the MoCap nodes (F x M x 3)
+    markerGroupOffset = backend.getTrajectories([markers], frames)
+    mocapGroupOffset = backend.getTrajectories([mocap], frames)
+    mocapPoints = backend.getTrajectories(mocapList, frames)
     
-    for i in range (len(markersList)):
-        
-        mocapPoint = getObjectPoint(markersList[i][:-4])
-                
-        newMarkerPoint = [mocapPoint[0]+mocapGroupOffset[0]+offsets[i][0],
-                          mocapPoint[1]+mocapGroupOffset[1]+offsets[i][1],
-                          mocapPoint[2]+mocapGroupOffset[2]+offsets[i][2]]
-        
-        cmds.setAttr(markersList[i]+".translateX",
-                        newMarkerPoint[0]-markerGroupOffset[0]);
-        cmds.setAttr(markersList[i]+".translateY",
-                        newMarkerPoint[1]-markerGroupOffset[1]);
-        cmds.setAttr(markersList[i]+".translateZ",
-                        newMarkerPoint[2]-markerGroupOffset[2]);
-        
-        cmds.setKeyframe(markersList[i])
+    newMarkerPoints = mocapPoints + mocapGroupOffset + np.asarray(offsets)[None, :, :]
+    
+    backend.writeObjectAnimation(markersList, frames, newMarkerPoints - markerGroupOffset)
 
 '''
 Entry point of the program
 '''
 def main(range1, range2):
 
-    markersGroup = "Markers"
+    from animface.mayascene import MayaBackend
+
+    markersGroup = getActiveLayout().rootGroup
     mocapGroup = "MoCapData"
 
     offsets = calibrateMarkers(markersGroup, mocapGroup, True)
-    print str(offsets)
+    print(str(offsets))
     
-    for i in range(range1,range2+1):
-        transferAnimation(markersGroup, mocapGroup, offsets, i, True)
+    transferAnimation(markersGroup, mocapGroup, offsets, list(range(range1,range2+1)), True, MayaBackend())
 
 '''
 Plugin functionality